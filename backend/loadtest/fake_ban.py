@@ -0,0 +1,159 @@
+# backend/loadtest/fake_ban.py
+# Deterministic stand-in for api-adresse.data.gouv.fr (/search and /search/csv)
+#
+# uvicorn fake_ban:app --port 7878
+# BAN_API_URL=http://localhost:7878 for the backend
+
+import asyncio
+import csv
+import hashlib
+import io
+import os
+import random
+import time
+
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import JSONResponse, Response
+
+FAKE_BAN_LATENCY_MS = float(os.getenv("FAKE_BAN_LATENCY_MS", "40"))
+FAKE_BAN_JITTER_MS = float(os.getenv("FAKE_BAN_JITTER_MS", "20"))
+# Par ligne du CSV, en plus de la latence de base
+FAKE_BAN_CSV_ROW_LATENCY_MS = float(os.getenv("FAKE_BAN_CSV_ROW_LATENCY_MS", "0.5"))
+# Limite de l'API réelle : 50 requêtes/s par IP (0 = illimité)
+FAKE_BAN_RATE_LIMIT = float(os.getenv("FAKE_BAN_RATE_LIMIT", "50"))
+# Part des adresses sans résultat
+FAKE_BAN_MISS_RATE = float(os.getenv("FAKE_BAN_MISS_RATE", "0.05"))
+FAKE_BAN_SEED = int(os.getenv("FAKE_BAN_SEED", "42"))
+
+# Emprise approximative de la France métropolitaine
+LAT_RANGE = (42.3, 51.0)
+LON_RANGE = (-4.8, 8.2)
+
+CSV_RESULT_COLUMNS = [
+    "latitude", "longitude", "result_label", "result_score", "result_type",
+    "result_id", "result_postcode", "result_city", "result_citycode", "result_status"
+]
+
+app = FastAPI(title="Fake BAN")
+rng = random.Random(FAKE_BAN_SEED)
+
+
+class TokenBucket:
+    """Per-client rate limit (requests per second, burst = one second)"""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.buckets: dict[str, tuple[float, float]] = {}
+
+    def allow(self, client: str) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        tokens, updated = self.buckets.get(client, (self.rate, now))
+        tokens = min(self.rate, tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            self.buckets[client] = (tokens, now)
+            return False
+        self.buckets[client] = (tokens - 1, now)
+        return True
+
+
+limiter = TokenBucket(FAKE_BAN_RATE_LIMIT)
+stats = {"search": 0, "csv": 0, "csv_rows": 0, "rate_limited": 0}
+
+
+def geocode(query: str, citycode: str | None):
+    """Same input -> same result: coordinates and score derived from a hash of the query"""
+    digest = hashlib.sha256(f"{query.strip().lower()}|{citycode or ''}".encode("utf-8")).digest()
+    unit = [int.from_bytes(digest[i:i + 4], "big") / 2 ** 32 for i in (0, 4, 8, 12)]
+    if not query.strip() or unit[3] < FAKE_BAN_MISS_RATE:
+        return None
+    return {
+        "latitude": round(LAT_RANGE[0] + unit[0] * (LAT_RANGE[1] - LAT_RANGE[0]), 6),
+        "longitude": round(LON_RANGE[0] + unit[1] * (LON_RANGE[1] - LON_RANGE[0]), 6),
+        "score": round(0.4 + unit[2] * 0.6, 4),
+        "citycode": citycode or f"{int(unit[2] * 95000) + 1000:05d}",
+        "label": query.strip()
+    }
+
+
+async def simulate_latency(extra_ms: float = 0.0):
+    await asyncio.sleep(max(0.0, FAKE_BAN_LATENCY_MS + rng.uniform(-1, 1) * FAKE_BAN_JITTER_MS + extra_ms) / 1000)
+
+
+def rate_limited(request: Request):
+    if limiter.allow(request.client.host if request.client else "local"):
+        return None
+    stats["rate_limited"] += 1
+    return JSONResponse(status_code=429, content={"code": 429, "message": "Too many requests"})
+
+
+@app.get("/search/")
+@app.get("/search")
+async def search(request: Request, q: str = "", citycode: str | None = None, limit: int = 5):
+    refused = rate_limited(request)
+    if refused:
+        return refused
+    stats["search"] += 1
+    await simulate_latency()
+
+    result = geocode(q, citycode)
+    features = []
+    if result and limit > 0:
+        features.append({
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [result["longitude"], result["latitude"]]},
+            "properties": {
+                "label": result["label"],
+                "score": result["score"],
+                "citycode": result["citycode"],
+                "type": "housenumber"
+            }
+        })
+    return {"type": "FeatureCollection", "version": "draft", "features": features, "query": q}
+
+
+@app.post("/search/csv/")
+@app.post("/search/csv")
+async def search_csv(
+    request: Request,
+    data: UploadFile = File(...),
+    columns: list[str] = Form(default=[]),
+    citycode: str | None = Form(default=None)
+):
+    refused = rate_limited(request)
+    if refused:
+        return refused
+
+    content = (await data.read()).decode("utf-8-sig")
+    reader = csv.DictReader(io.StringIO(content))
+    rows = list(reader)
+    stats["csv"] += 1
+    stats["csv_rows"] += len(rows)
+    await simulate_latency(len(rows) * FAKE_BAN_CSV_ROW_LATENCY_MS)
+
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=list(reader.fieldnames or []) + CSV_RESULT_COLUMNS)
+    writer.writeheader()
+    for row in rows:
+        query = " ".join(row.get(column) or "" for column in (columns or list(row)))
+        result = geocode(query, row.get(citycode) if citycode else None)
+        writer.writerow({
+            **row,
+            "latitude": result["latitude"] if result else "",
+            "longitude": result["longitude"] if result else "",
+            "result_label": result["label"] if result else "",
+            "result_score": result["score"] if result else "",
+            "result_type": "housenumber" if result else "",
+            "result_id": hashlib.md5(query.encode("utf-8")).hexdigest()[:12] if result else "",
+            "result_postcode": "",
+            "result_city": "",
+            "result_citycode": result["citycode"] if result else "",
+            "result_status": "ok" if result else "not-found"
+        })
+    return Response(content=output.getvalue(), media_type="text/csv; charset=utf-8")
+
+
+@app.get("/_stats")
+async def get_stats():
+    return stats
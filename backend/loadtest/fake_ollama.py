@@ -0,0 +1,164 @@
+# backend/loadtest/fake_ollama.py
+# Deterministic stand-in for Ollama (/api/chat, /api/generate, /api/tags) with a token-rate model
+#
+# uvicorn fake_ollama:app --port 11434
+# OLLAMA_BASE_URL=http://localhost:11434 for the extraction service
+
+import asyncio
+import json
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+# Débits d'un 7B quantifié sur CPU
+FAKE_OLLAMA_PROMPT_TOKENS_PER_SECOND = float(os.getenv("FAKE_OLLAMA_PROMPT_TOKENS_PER_SECOND", "150"))
+FAKE_OLLAMA_TOKENS_PER_SECOND = float(os.getenv("FAKE_OLLAMA_TOKENS_PER_SECOND", "12"))
+FAKE_OLLAMA_LOAD_MS = float(os.getenv("FAKE_OLLAMA_LOAD_MS", "3000"))
+# Requêtes traitées en parallèle (OLLAMA_NUM_PARALLEL), les autres attendent
+FAKE_OLLAMA_PARALLEL = int(os.getenv("FAKE_OLLAMA_PARALLEL", "1"))
+# Facteur appliqué à toutes les durées (0 = réponses immédiates)
+FAKE_OLLAMA_TIME_SCALE = float(os.getenv("FAKE_OLLAMA_TIME_SCALE", "1"))
+
+app = FastAPI(title="Fake Ollama")
+slots = asyncio.Semaphore(FAKE_OLLAMA_PARALLEL)
+loaded_models: set[str] = set()
+stats = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0, "queued": 0}
+
+
+def count_tokens(text: str) -> int:
+    # ~4 caractères par token pour du français
+    return max(1, len(text) // 4)
+
+
+def invoice_answer(prompt: str) -> str:
+    """Plausible InvoiceData JSON built from what the prompt's OCR text contains"""
+    answer = {}
+    pdl = re.search(r"\b(\d{14})\b", prompt)
+    if pdl:
+        answer["pdl"] = pdl.group(1)
+    dates = re.findall(r"\b(\d{2})/(\d{2})/(\d{4})\b", prompt)
+    if len(dates) >= 2:
+        answer["periode_debut"] = f"{dates[0][2]}-{dates[0][1]}-{dates[0][0]}"
+        answer["periode_fin"] = f"{dates[1][2]}-{dates[1][1]}-{dates[1][0]}"
+    kwh = re.search(r"(?<!\d)(\d{1,3}(?: \d{3})*(?:[.,]\d+)?)\s*kWh", prompt)
+    if kwh:
+        answer["conso"] = {"conso_totale": float(kwh.group(1).replace(" ", "").replace(",", "."))}
+    for supplier in ("EDF", "Engie", "TotalEnergies", "Ekwateur", "Vattenfall"):
+        if supplier.lower() in prompt.lower():
+            answer["fournisseur"] = supplier
+            break
+    return json.dumps(answer, ensure_ascii=False)
+
+
+def prompt_text(payload: dict) -> str:
+    if "messages" in payload:
+        return "\n".join(message.get("content", "") for message in payload["messages"])
+    return payload.get("prompt", "")
+
+
+async def load_model(model: str) -> float:
+    """First use of a model pays the load time"""
+    if model in loaded_models:
+        return 0.0
+    seconds = FAKE_OLLAMA_LOAD_MS / 1000 * FAKE_OLLAMA_TIME_SCALE
+    await asyncio.sleep(seconds)
+    loaded_models.add(model)
+    return seconds
+
+
+def durations(prompt_tokens: int, completion_tokens: int) -> tuple[float, float]:
+    return (
+        prompt_tokens / FAKE_OLLAMA_PROMPT_TOKENS_PER_SECOND * FAKE_OLLAMA_TIME_SCALE,
+        completion_tokens / FAKE_OLLAMA_TOKENS_PER_SECOND * FAKE_OLLAMA_TIME_SCALE
+    )
+
+
+def final_fields(model, load_seconds, prompt_tokens, prompt_seconds, completion_tokens, eval_seconds, started):
+    return {
+        "model": model,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "done": True,
+        "total_duration": int((time.perf_counter() - started) * 1e9),
+        "load_duration": int(load_seconds * 1e9),
+        "prompt_eval_count": prompt_tokens,
+        "prompt_eval_duration": int(prompt_seconds * 1e9),
+        "eval_count": completion_tokens,
+        "eval_duration": int(eval_seconds * 1e9)
+    }
+
+
+@asynccontextmanager
+async def processing_slot():
+    """Wait for one of the FAKE_OLLAMA_PARALLEL slots, like Ollama's request queue"""
+    stats["queued"] += 1
+    try:
+        await slots.acquire()
+    finally:
+        stats["queued"] -= 1
+    try:
+        yield
+    finally:
+        slots.release()
+
+
+async def generate(payload: dict, chat: bool):
+    model = payload.get("model", "fake")
+    prompt = prompt_text(payload)
+    content = invoice_answer(prompt) if prompt else ""
+    prompt_tokens, completion_tokens = count_tokens(prompt), count_tokens(content) if content else 0
+    prompt_seconds, eval_seconds = durations(prompt_tokens, completion_tokens)
+    stats["requests"] += 1
+    stats["prompt_tokens"] += prompt_tokens
+    stats["completion_tokens"] += completion_tokens
+    started = time.perf_counter()
+
+    def chunk(text: str) -> dict:
+        return {"message": {"role": "assistant", "content": text}} if chat else {"response": text}
+
+    def final(load_seconds: float) -> dict:
+        return {**chunk(""), **final_fields(
+            model, load_seconds, prompt_tokens, prompt_seconds, completion_tokens, eval_seconds, started
+        )}
+
+    if not payload.get("stream", True):
+        async with processing_slot():
+            load_seconds = await load_model(model)
+            await asyncio.sleep(prompt_seconds + eval_seconds)
+        return {**final(load_seconds), **chunk(content)}
+
+    async def stream():
+        async with processing_slot():
+            load_seconds = await load_model(model)
+            await asyncio.sleep(prompt_seconds)
+            # Un morceau par token, au débit de génération
+            pieces = [content[i:i + 4] for i in range(0, len(content), 4)]
+            for piece in pieces:
+                await asyncio.sleep(eval_seconds / len(pieces))
+                yield json.dumps({"model": model, **chunk(piece), "done": False}, ensure_ascii=False) + "\n"
+            yield json.dumps(final(load_seconds)) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@app.post("/api/chat")
+async def api_chat(request: Request):
+    return await generate(await request.json(), chat=True)
+
+
+@app.post("/api/generate")
+async def api_generate(request: Request):
+    return await generate(await request.json(), chat=False)
+
+
+@app.get("/api/tags")
+async def api_tags():
+    return {"models": [{"name": model, "model": model} for model in sorted(loaded_models)]}
+
+
+@app.get("/_stats")
+async def get_stats():
+    return {**stats, "loaded_models": sorted(loaded_models)}
@@ -0,0 +1,288 @@
+# backend/loadtest/fake_postgrest.py
+# In-memory stand-in for Supabase: PostgREST (/rest/v1) and Storage (/storage/v1)
+#
+# FAKE_POSTGREST_SEED=seed.json FAKE_STORAGE_ROOT=./storage uvicorn fake_postgrest:app --port 54321
+# SUPABASE_URL=http://localhost:54321 (any non-empty key) for both services
+#
+# Covers the subset of PostgREST used by supabase-py here: select with column list,
+# eq/neq/gt/gte/lt/lte/in/is/like/ilike filters, or=(...) with nested and(...),
+# order, limit/offset, insert, upsert (on_conflict), update, delete and rpc.
+
+import asyncio
+import fnmatch
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, Response
+
+FAKE_POSTGREST_LATENCY_MS = float(os.getenv("FAKE_POSTGREST_LATENCY_MS", "5"))
+FAKE_POSTGREST_SEED = os.getenv("FAKE_POSTGREST_SEED")
+FAKE_STORAGE_ROOT = os.getenv("FAKE_STORAGE_ROOT", "./storage")
+
+app = FastAPI(title="Fake PostgREST")
+tables: dict[str, list[dict]] = {}
+stats = {"requests": 0}
+
+if FAKE_POSTGREST_SEED:
+    with open(FAKE_POSTGREST_SEED, encoding="utf-8") as seed:
+        tables.update(json.load(seed))
+
+# Paramètres de requête qui ne sont pas des filtres
+RESERVED_PARAMS = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+
+
+def now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def coerce(stored, raw: str):
+    """Query-string value in the type of the stored value"""
+    if isinstance(stored, bool):
+        return raw.lower() == "true"
+    if isinstance(stored, (int, float)):
+        try:
+            return float(raw)
+        except ValueError:
+            return raw
+    return raw
+
+
+def split_top_level(text: str) -> list[str]:
+    """'a.eq.1,and(b.eq.2,c.eq.3)' -> ['a.eq.1', 'and(b.eq.2,c.eq.3)']"""
+    parts, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            parts.append(current)
+            current = ""
+            continue
+        depth += (char == "(") - (char == ")")
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+def matches(row: dict, column: str, operator: str, value: str) -> bool:
+    """operator: eq, gt, in, is... optionally prefixed with 'not.'"""
+    negate = operator.startswith("not.")
+    op = operator[4:] if negate else operator
+    stored = row.get(column)
+
+    if op == "is":
+        expected = {"null": None, "true": True, "false": False}.get(value.lower(), value)
+        result = stored is expected if expected in (None, True, False) else stored == expected
+    elif op == "in":
+        options = [option.strip().strip('"') for option in split_top_level(value.strip("()"))]
+        result = stored is not None and any(stored == coerce(stored, option) for option in options)
+    elif stored is None:
+        result = False
+    elif op in ("like", "ilike"):
+        pattern = value.replace("*", "%").replace("%", "*")
+        if op == "ilike":
+            result = fnmatch.fnmatchcase(str(stored).lower(), pattern.lower())
+        else:
+            result = fnmatch.fnmatchcase(str(stored), pattern)
+    else:
+        target = coerce(stored, value)
+        result = {
+            "eq": stored == target,
+            "neq": stored != target,
+            "gt": stored > target,
+            "gte": stored >= target,
+            "lt": stored < target,
+            "lte": stored <= target,
+        }.get(op, False)
+    return not result if negate else result
+
+
+def condition(row: dict, expression: str) -> bool:
+    """One element of an or=(...) list: 'col.op.value' or a nested and(...)/or(...)"""
+    for group, combine in (("and(", all), ("or(", any)):
+        if expression.startswith(group):
+            return combine(condition(row, part) for part in split_top_level(expression[len(group):-1]))
+    column, _, rest = expression.partition(".")
+    operator, _, value = rest.partition(".")
+    if operator == "not":
+        inner_operator, _, value = value.partition(".")
+        return matches(row, column, f"not.{inner_operator}", value)
+    return matches(row, column, operator, value)
+
+
+def row_filter(params: list[tuple[str, str]]):
+    filters = []
+    for key, raw in params:
+        if key in RESERVED_PARAMS:
+            continue
+        if key in ("or", "and"):
+            combine = any if key == "or" else all
+            parts = split_top_level(raw[1:-1] if raw.startswith("(") else raw)
+            filters.append(lambda row, parts=parts, combine=combine: combine(condition(row, part) for part in parts))
+            continue
+        operator, _, value = raw.partition(".")
+        if operator == "not":
+            inner_operator, _, value = value.partition(".")
+            operator = f"not.{inner_operator}"
+        filters.append(lambda row, key=key, operator=operator, value=value: matches(row, key, operator, value))
+    return lambda row: all(check(row) for check in filters)
+
+
+def project(rows: list[dict], select: str | None) -> list[dict]:
+    if not select or select.strip() == "*":
+        return [dict(row) for row in rows]
+    columns = [column.strip() for column in select.split(",") if column.strip()]
+    return [{column: row.get(column) for column in columns} for row in rows]
+
+
+def order_rows(rows: list[dict], order: str | None) -> list[dict]:
+    for clause in reversed((order or "").split(",")):
+        if not clause:
+            continue
+        column, *modifiers = clause.split(".")
+        descending = "desc" in modifiers
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        present.sort(key=lambda row: row[column], reverse=descending)
+        rows = present + missing
+    return rows
+
+
+def with_defaults(row: dict) -> dict:
+    return {"id": str(uuid.uuid4()), "created_at": now(), **row}
+
+
+def respond(request: Request, rows: list[dict], status_code: int = 200):
+    prefer = request.headers.get("prefer", "")
+    if "return=minimal" in prefer:
+        return Response(status_code=204 if status_code == 200 else status_code)
+    if "vnd.pgrst.object" in request.headers.get("accept", ""):
+        if len(rows) != 1:
+            return JSONResponse(status_code=406, content={"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned"})
+        return JSONResponse(status_code=status_code, content=rows[0])
+    headers = {"Content-Range": f"0-{max(0, len(rows) - 1)}/{len(rows) if 'count=' in prefer else '*'}"}
+    return JSONResponse(status_code=status_code, content=rows, headers=headers)
+
+
+@app.middleware("http")
+async def simulate_latency(request: Request, call_next):
+    stats["requests"] += 1
+    await asyncio.sleep(FAKE_POSTGREST_LATENCY_MS / 1000)
+    return await call_next(request)
+
+
+@app.get("/rest/v1/{table}")
+async def select_rows(request: Request, table: str):
+    params = list(request.query_params.multi_items())
+    keep = row_filter(params)
+    rows = order_rows([row for row in tables.get(table, []) if keep(row)], request.query_params.get("order"))
+    offset = int(request.query_params.get("offset", 0))
+    limit = request.query_params.get("limit")
+    rows = rows[offset:offset + int(limit) if limit else None]
+    return respond(request, project(rows, request.query_params.get("select")))
+
+
+@app.post("/rest/v1/rpc/{function}")
+async def call_rpc(request: Request, function: str):
+    handler = RPC_FUNCTIONS.get(function)
+    if handler is None:
+        return JSONResponse(status_code=404, content={"code": "PGRST202", "message": f"Could not find the function {function}"})
+    body = await request.body()
+    return JSONResponse(content=handler(json.loads(body) if body else {}))
+
+
+@app.post("/rest/v1/{table}")
+async def insert_rows(request: Request, table: str):
+    payload = await request.json()
+    incoming = payload if isinstance(payload, list) else [payload]
+    rows = tables.setdefault(table, [])
+    prefer = request.headers.get("prefer", "")
+    conflict_columns = [
+        column for column in (request.query_params.get("on_conflict") or "id").split(",") if column
+    ]
+
+    written = []
+    for item in incoming:
+        existing = None
+        if "resolution=merge-duplicates" in prefer or "resolution=ignore-duplicates" in prefer:
+            existing = next(
+                (row for row in rows if all(row.get(c) == item.get(c) for c in conflict_columns)),
+                None
+            )
+        if existing is not None:
+            if "resolution=merge-duplicates" in prefer:
+                existing.update(item)
+            written.append(dict(existing))
+        else:
+            row = with_defaults(item)
+            rows.append(row)
+            written.append(dict(row))
+    return respond(request, project(written, request.query_params.get("select")), status_code=201)
+
+
+@app.patch("/rest/v1/{table}")
+async def update_rows(request: Request, table: str):
+    changes = await request.json()
+    keep = row_filter(list(request.query_params.multi_items()))
+    updated = []
+    for row in tables.get(table, []):
+        if keep(row):
+            row.update(changes)
+            updated.append(dict(row))
+    return respond(request, project(updated, request.query_params.get("select")))
+
+
+@app.delete("/rest/v1/{table}")
+async def delete_rows(request: Request, table: str):
+    keep = row_filter(list(request.query_params.multi_items()))
+    rows = tables.get(table, [])
+    deleted = [row for row in rows if keep(row)]
+    tables[table] = [row for row in rows if not keep(row)]
+    return respond(request, deleted)
+
+
+def increment_pattern_sample_counts(args: dict) -> int:
+    updated = 0
+    for increment in args.get("p_increments") or []:
+        for pattern in tables.get("patterns_fournisseurs", []):
+            if pattern.get("nom_fournisseur") == increment.get("nom_fournisseur") \
+                    and pattern.get("field_name") == increment.get("field_name"):
+                pattern["sample_count"] = (pattern.get("sample_count") or 0) + int(increment.get("count") or 0)
+                pattern["last_updated"] = now()
+                updated += 1
+    return updated
+
+
+RPC_FUNCTIONS = {
+    "increment_pattern_sample_counts": increment_pattern_sample_counts,
+}
+
+
+# --- Storage ---
+def storage_file(bucket: str, path: str):
+    root = os.path.realpath(FAKE_STORAGE_ROOT)
+    candidate = os.path.realpath(os.path.join(root, bucket, path))
+    if not candidate.startswith(root + os.sep) or not os.path.isfile(candidate):
+        return None
+    return candidate
+
+
+@app.post("/storage/v1/object/sign/{bucket}/{path:path}")
+async def create_signed_url(bucket: str, path: str):
+    if storage_file(bucket, path) is None:
+        return JSONResponse(status_code=404, content={"statusCode": "404", "error": "not_found", "message": "Object not found"})
+    return {"signedURL": f"/object/sign/{bucket}/{path}?token=fake-{uuid.uuid4().hex}"}
+
+
+@app.get("/storage/v1/object/{access}/{bucket}/{path:path}")
+async def download_object(access: str, bucket: str, path: str):
+    file_path = storage_file(bucket, path)
+    if access not in ("sign", "public", "authenticated") or file_path is None:
+        return JSONResponse(status_code=404, content={"statusCode": "404", "error": "not_found", "message": "Object not found"})
+    return FileResponse(file_path)
+
+
+@app.get("/_stats")
+async def get_stats():
+    return {**stats, "tables": {name: len(rows) for name, rows in tables.items()}}
@@ -0,0 +1,168 @@
+# backend/loadtest/loadgen.py
+# Open-loop load generator for /geocode_consommateurs and /extract
+#
+# Requests are sent at a fixed arrival rate whatever the response times (open loop),
+# one step per target RPS; the saturation point is the first step where the service
+# no longer keeps up (throughput below target, p95 above the SLO or errors).
+#
+# python loadgen.py geocode --base-url http://localhost:8001 --rps 5 10 20 --duration 30
+# python loadgen.py extract --base-url http://localhost:8000 --rps 0.5 1 2 \
+#     --file-url http://localhost:54321/storage/v1/object/public/factures-temporaires/f1.pdf
+
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import statistics
+import time
+
+import httpx
+
+ADDRESS_STREETS = ["rue de la République", "avenue Jean Jaurès", "boulevard Victor Hugo", "place de la Mairie", "chemin des Vignes"]
+COMMUNE_CODES = ["75056", "69123", "13055", "31555", "33063", "44109", "59350", "67482"]
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))]
+
+
+def geocode_payloads(batch_size, seed):
+    rng = random.Random(seed)
+    ids = itertools.count(1)
+    while True:
+        yield [
+            {
+                "id": next(ids),
+                "adresse": f"{rng.randint(1, 200)} {rng.choice(ADDRESS_STREETS)}",
+                "code_commune": rng.choice(COMMUNE_CODES)
+            }
+            for _ in range(batch_size)
+        ]
+
+
+def extract_payloads(file_urls):
+    for index in itertools.count(1):
+        yield {"facture_id": f"loadtest-{index}", "file_url": file_urls[index % len(file_urls)]}
+
+
+async def run_step(client, url, payloads, rps, duration, timeout):
+    """Send requests at `rps` for `duration` seconds, wait for all of them"""
+    results = []
+
+    async def send(payload):
+        start = time.perf_counter()
+        try:
+            response = await client.post(url, json=payload, timeout=timeout)
+            status = response.status_code
+        except httpx.TimeoutException:
+            status = "timeout"
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append({"status": status, "latency_ms": (time.perf_counter() - start) * 1000, "end": time.perf_counter()})
+
+    tasks = []
+    started = time.perf_counter()
+    total = max(1, int(rps * duration))
+    for index in range(total):
+        # Arrivées à intervalle fixe : le retard du service ne ralentit pas l'envoi
+        delay = started + index / rps - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(send(next(payloads))))
+    await asyncio.gather(*tasks)
+
+    elapsed = max(result["end"] for result in results) - started
+    ok = [result for result in results if result["status"] == 200]
+    latencies = [result["latency_ms"] for result in ok]
+    statuses = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    return {
+        "target_rps": rps,
+        "sent": len(results),
+        "achieved_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "error_rate": round(1 - len(ok) / len(results), 4),
+        "latency_ms_p50": round(percentile(latencies, 0.5), 1) if latencies else None,
+        "latency_ms_p95": round(percentile(latencies, 0.95), 1) if latencies else None,
+        "latency_ms_p99": round(percentile(latencies, 0.99), 1) if latencies else None,
+        "latency_ms_mean": round(statistics.mean(latencies), 1) if latencies else None,
+        "statuses": statuses
+    }
+
+
+def saturated(step, slo_ms, max_error_rate):
+    return (
+        step["achieved_rps"] < 0.95 * step["target_rps"]
+        or step["error_rate"] > max_error_rate
+        or (slo_ms is not None and (step["latency_ms_p95"] or float("inf")) > slo_ms)
+    )
+
+
+async def run(args):
+    if args.target == "geocode":
+        url = f"{args.base_url.rstrip('/')}/geocode_consommateurs"
+        payloads = geocode_payloads(args.batch_size, args.seed)
+    else:
+        if not args.file_url:
+            raise SystemExit("--file-url est requis pour extract")
+        url = f"{args.base_url.rstrip('/')}/extract"
+        payloads = extract_payloads(args.file_url)
+
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    steps = []
+    saturation = None
+    async with httpx.AsyncClient(limits=limits) as client:
+        for rps in args.rps:
+            step = await run_step(client, url, payloads, rps, args.duration, args.timeout)
+            step["saturated"] = saturated(step, args.slo_ms, args.max_error_rate)
+            steps.append(step)
+            print(
+                f"cible={rps:>7} req/s  atteint={step['achieved_rps']:>7}  erreurs={step['error_rate']:.1%}  "
+                f"p50={step['latency_ms_p50']} ms  p95={step['latency_ms_p95']} ms  {'SATURÉ' if step['saturated'] else ''}"
+            )
+            if step["saturated"] and saturation is None:
+                saturation = rps
+                if not args.continue_after_saturation:
+                    break
+
+    sustained = [step["target_rps"] for step in steps if not step["saturated"]]
+    report = {
+        "target": args.target,
+        "url": url,
+        "steps": steps,
+        "max_sustained_rps": max(sustained) if sustained else None,
+        "saturation_rps": saturation
+    }
+    print(f"\nDébit soutenu max : {report['max_sustained_rps']} req/s, saturation à {saturation} req/s")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load generator with saturation detection")
+    parser.add_argument("target", choices=["geocode", "extract"])
+    parser.add_argument("--base-url", required=True)
+    parser.add_argument("--rps", nargs="+", type=float, default=[1, 2, 5, 10])
+    parser.add_argument("--duration", type=float, default=30, help="Durée de chaque palier (s)")
+    parser.add_argument("--batch-size", type=int, default=10, help="Adresses par requête geocode")
+    parser.add_argument("--file-url", nargs="+", default=[], help="URL(s) de factures pour extract")
+    parser.add_argument("--slo-ms", type=float, default=None, help="p95 maximal avant saturation")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=300)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--continue-after-saturation", action="store_true")
+    parser.add_argument("--output", default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
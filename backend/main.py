@@ -2,12 +2,35 @@
 # Main application entry point
 
 from fastapi import FastAPI
-from routes import geocode
+from routes import communes, consommateurs, enedis, geocode, profiling, stations
+from utils.consommateur_repository import close_consommateur_repository
+from utils.consumer_index import start_consumer_index_refresh, stop_consumer_index_refresh
+from utils.consumer_stats import start_consumer_stats_refresh, stop_consumer_stats_refresh
+from utils.geocode_scheduler import start_geocode_scheduler, stop_geocode_scheduler
+from utils.geocode_utils import close_geocode_client
+from utils.profiling import ProfilingMiddleware, install_profiling_hooks
 
 app = FastAPI()
+# Profilage d'une requête à la demande (en-têtes X-Profile / X-Profiling-Token)
+app.add_middleware(ProfilingMiddleware, trace_paths=["/geocode_consommateurs"])
+
+app.add_event_handler("startup", install_profiling_hooks)
+app.add_event_handler("startup", start_consumer_index_refresh)
+app.add_event_handler("startup", start_consumer_stats_refresh)
+app.add_event_handler("startup", start_geocode_scheduler)
+app.add_event_handler("shutdown", stop_consumer_index_refresh)
+app.add_event_handler("shutdown", stop_consumer_stats_refresh)
+app.add_event_handler("shutdown", stop_geocode_scheduler)
+app.add_event_handler("shutdown", close_consommateur_repository)
+app.add_event_handler("shutdown", close_geocode_client)
 
 @app.get("/health")
 def health():
     return {"status": "healthy"}
 
 app.include_router(geocode.router)
+app.include_router(communes.router)
+app.include_router(consommateurs.router)
+app.include_router(enedis.router)
+app.include_router(stations.router)
+app.include_router(profiling.router)
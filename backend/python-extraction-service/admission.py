@@ -0,0 +1,219 @@
+"""
+Contrôle d'admission et contre-pression pour /extract
+Chaque étape coûteuse (OCR, LLM) a un nombre de places limité et une file d'attente bornée,
+ordonnée par classe de priorité ; au-delà, la requête est refusée (429/503 + Retry-After)
+plutôt que d'aller s'empiler jusqu'aux timeouts d'Ollama
+"""
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from metrics import ADMISSION_QUEUE_DEPTH, ADMISSION_QUEUE_WAIT, ADMISSION_REJECTIONS
+from ocr_batcher import OCR_BATCH_ENABLED, OCR_BATCH_MAX_SIZE
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+# Requêtes /extract en cours (téléchargement compris) avant refus immédiat
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+# PaddleOCR n'est pas thread-safe : une seule page à la fois par défaut ; avec le micro-batching,
+# le moteur reste sur un seul thread et plusieurs documents doivent être en cours pour remplir les lots
+ADMISSION_OCR_CONCURRENCY = int(
+    os.getenv("ADMISSION_OCR_CONCURRENCY") or (OCR_BATCH_MAX_SIZE if OCR_BATCH_ENABLED else 1)
+)
+# À aligner sur OLLAMA_NUM_PARALLEL
+ADMISSION_LLM_CONCURRENCY = int(os.getenv("ADMISSION_LLM_CONCURRENCY", os.getenv("OLLAMA_NUM_PARALLEL", "1")))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "32"))
+
+# Classes de priorité : rang le plus faible servi en premier
+PRIORITY_CLASSES = {'interactive': 0, 'bulk': 1}
+DEFAULT_PRIORITY = 'interactive'
+# Temps d'attente maximal en file, par classe (s)
+QUEUE_TIMEOUTS = {
+    'interactive': float(os.getenv("ADMISSION_QUEUE_TIMEOUT_INTERACTIVE", "30")),
+    'bulk': float(os.getenv("ADMISSION_QUEUE_TIMEOUT_BULK", "300")),
+}
+
+# Classe de la requête en cours (propagée aux étapes et aux threads)
+current_priority: ContextVar[str] = ContextVar('current_priority', default=DEFAULT_PRIORITY)
+
+
+class Overloaded(Exception):
+    """Request refused by admission control"""
+
+    def __init__(self, stage: str, reason: str, status_code: int, retry_after: int):
+        super().__init__(f"Service saturé ({stage}: {reason}), réessayer dans {retry_after}s")
+        self.stage = stage
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class Waiter:
+    __slots__ = ('rank', 'seq', 'priority', 'future', 'enqueued')
+
+    def __init__(self, rank: int, seq: int, priority: str, future: asyncio.Future):
+        self.rank = rank
+        self.seq = seq
+        self.priority = priority
+        self.future = future
+        self.enqueued = time.monotonic()
+
+    def __lt__(self, other: "Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class StageLimiter:
+    """
+    Concurrency limit + bounded priority queue for one pipeline stage
+    A released slot goes straight to the best waiter (lowest rank, then FIFO).
+    When the queue is full, a higher-priority arrival evicts the newest lowest-priority waiter
+    """
+
+    def __init__(self, stage: str, concurrency: int, queue_size: int):
+        self.stage = stage
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(0, queue_size)
+        self.active = 0
+        self.waiters: List[Waiter] = []
+        self.seq = itertools.count()
+        # Moyenne glissante du temps de service, pour Retry-After
+        self.service_seconds = 1.0
+        self.counters = {'admitted': 0, 'enqueued': 0, 'queue_full': 0, 'deadline': 0, 'preempted': 0}
+
+    def retry_after(self) -> int:
+        backlog = (len(self.waiters) + self.active) / self.concurrency
+        return max(1, math.ceil(backlog * self.service_seconds))
+
+    def reject(self, reason: str, status_code: int) -> Overloaded:
+        self.counters[reason] += 1
+        ADMISSION_REJECTIONS.labels(self.stage, reason).inc()
+        return Overloaded(self.stage, reason, status_code, self.retry_after())
+
+    def remove(self, waiter: Waiter):
+        self.waiters.remove(waiter)
+        heapq.heapify(self.waiters)
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(len(self.waiters))
+
+    async def acquire(self, priority: str, timeout: float):
+        if self.active < self.concurrency and not self.waiters:
+            self.active += 1
+            self.counters['admitted'] += 1
+            ADMISSION_QUEUE_WAIT.labels(self.stage, priority).observe(0)
+            return
+
+        rank = PRIORITY_CLASSES.get(priority, PRIORITY_CLASSES[DEFAULT_PRIORITY])
+        if len(self.waiters) >= self.queue_size:
+            victim = max(self.waiters, key=lambda w: (w.rank, w.seq), default=None)
+            if victim is None or victim.rank <= rank:
+                # File pleine : le client doit ralentir
+                raise self.reject('queue_full', 429)
+            self.remove(victim)
+            victim.future.set_exception(self.reject('preempted', 503))
+
+        waiter = Waiter(rank, next(self.seq), priority, asyncio.get_running_loop().create_future())
+        heapq.heappush(self.waiters, waiter)
+        self.counters['enqueued'] += 1
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(len(self.waiters))
+
+        try:
+            await asyncio.wait({waiter.future}, timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                self.release(0.0)
+            elif waiter in self.waiters:
+                self.remove(waiter)
+            raise
+
+        ADMISSION_QUEUE_WAIT.labels(self.stage, priority).observe(time.monotonic() - waiter.enqueued)
+        if not waiter.future.done():
+            # Délai d'attente dépassé : mieux vaut échouer vite que de finir en timeout LLM
+            self.remove(waiter)
+            raise self.reject('deadline', 503)
+        waiter.future.result()
+        self.counters['admitted'] += 1
+
+    def release(self, elapsed: Optional[float]):
+        if elapsed:
+            self.service_seconds = 0.8 * self.service_seconds + 0.2 * elapsed
+        while self.waiters:
+            waiter = heapq.heappop(self.waiters)
+            if not waiter.future.done():
+                # La place passe directement au suivant (active inchangé)
+                waiter.future.set_result(True)
+                ADMISSION_QUEUE_DEPTH.labels(self.stage).set(len(self.waiters))
+                return
+        ADMISSION_QUEUE_DEPTH.labels(self.stage).set(0)
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Optional[str] = None) -> AsyncIterator[None]:
+        priority = priority or current_priority.get()
+        await self.acquire(priority, QUEUE_TIMEOUTS.get(priority, QUEUE_TIMEOUTS[DEFAULT_PRIORITY]))
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'concurrency': self.concurrency,
+            'queue_size': self.queue_size,
+            'active': self.active,
+            'queued': len(self.waiters),
+            'queued_by_priority': {
+                name: sum(1 for w in self.waiters if w.priority == name) for name in PRIORITY_CLASSES
+            },
+            'avg_service_seconds': round(self.service_seconds, 3),
+            'retry_after': self.retry_after(),
+            **self.counters
+        }
+
+
+class AdmissionController:
+    """In-flight cap for whole requests + per-stage limiters"""
+
+    def __init__(self):
+        # Pas de file au niveau requête : refus immédiat au-delà du plafond
+        self.requests = StageLimiter('request', ADMISSION_MAX_IN_FLIGHT, 0)
+        self.stages = {
+            'ocr': StageLimiter('ocr', ADMISSION_OCR_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+            'llm': StageLimiter('llm', ADMISSION_LLM_CONCURRENCY, ADMISSION_QUEUE_SIZE),
+        }
+
+    @asynccontextmanager
+    async def admit(self, priority: str = DEFAULT_PRIORITY) -> AsyncIterator[None]:
+        """Wrap a whole /extract request; sets the priority class seen by the stages"""
+        token = current_priority.set(priority)
+        try:
+            if not ADMISSION_CONTROL_ENABLED:
+                yield
+                return
+            async with self.requests.slot(priority):
+                yield
+        finally:
+            current_priority.reset(token)
+
+    @asynccontextmanager
+    async def stage(self, name: str) -> AsyncIterator[None]:
+        if not ADMISSION_CONTROL_ENABLED:
+            yield
+            return
+        async with self.stages[name].slot():
+            yield
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'enabled': ADMISSION_CONTROL_ENABLED,
+            'queue_timeouts': QUEUE_TIMEOUTS,
+            'request': self.requests.report(),
+            **{name: limiter.report() for name, limiter in self.stages.items()}
+        }
+
+
+admission = AdmissionController()
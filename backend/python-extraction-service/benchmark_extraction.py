@@ -0,0 +1,379 @@
+"""
+Banc d'essai de bout en bout du pipeline /extract sur le corpus de référence
+
+Corpus : un dossier de factures (.pdf, .png, .jpg) avec, pour chacune, <nom>.json contenant
+les valeurs validées au format de `validations_factures` (colonnes à plat : conso_hp, tarif_hp_parkwh...).
+
+Supabase est toujours remplacé par un dépôt en mémoire et les fichiers sont lus sur place
+(stockage local). Le LLM est soit un faux Ollama (--llm stub : renvoie les valeurs attendues
+présentes dans le texte OCR, avec une latence modélisée en tokens/s), soit l'Ollama local (--llm ollama).
+
+Mesures : latence p50/p95 par étape, débit par niveau de concurrence, pic de RSS,
+précision/rappel par champ ; comparaison avec une référence enregistrée.
+
+Usage :
+  python benchmark_extraction.py corpus/ --concurrency 1 4 --output resultats.json
+  python benchmark_extraction.py corpus/ --baseline reference.json --save-baseline reference.json
+"""
+import argparse
+import asyncio
+import json
+import resource
+import statistics
+import sys
+import time
+from contextvars import ContextVar
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+from benchmark_ocr import INVOICE_EXTENSIONS, NON_OCR_FIELDS, _compact, field_variants, percentile
+from repository import Repository
+
+BENCH_SUPABASE_URL = "http://supabase.bench.local"
+
+current_document: ContextVar[Optional[Dict[str, Any]]] = ContextVar('current_document', default=None)
+
+
+def load_corpus(corpus_dir: Path) -> List[Dict[str, Any]]:
+    documents = []
+    for path in sorted(corpus_dir.iterdir()):
+        expected = path.with_suffix('.json')
+        if path.suffix.lower() not in INVOICE_EXTENSIONS or not expected.exists():
+            continue
+        documents.append({
+            'name': path.name,
+            'url': f"{BENCH_SUPABASE_URL}/storage/v1/object/public/{quote(corpus_dir.name)}/{quote(path.name)}",
+            'expected': json.loads(expected.read_text(encoding='utf-8'))
+        })
+    return documents
+
+
+def expected_fields(expected: Dict[str, Any], field_paths: Dict[str, Any]) -> Dict[str, Any]:
+    """validations_factures columns -> InvoiceData dotted paths (conso_hp -> conso.conso_hp)"""
+    return {
+        field_paths[key][0]: value
+        for key, value in expected.items()
+        if key in field_paths and key not in NON_OCR_FIELDS and value not in (None, '')
+    }
+
+
+def values_match(expected: Any, actual: Any) -> bool:
+    try:
+        expected_number, actual_number = float(expected), float(actual)
+        return abs(expected_number - actual_number) <= 1e-3 * max(1.0, abs(expected_number))
+    except (TypeError, ValueError):
+        return _compact(str(expected)) == _compact(str(actual))
+
+
+class MemoryRepository(Repository):
+    """In-memory stand-in for the Supabase tables used by /extract"""
+
+    def __init__(self, prompt: Optional[Dict[str, Any]] = None):
+        self.prompt = prompt
+        self.extractions: Dict[str, Dict[str, Any]] = {}
+        self.factures: Dict[str, Dict[str, Any]] = {}
+        self.ocr_blobs: Dict[str, Dict[str, Any]] = {}
+        self.corrections: List[Dict[str, Any]] = []
+
+    async def get_active_prompt(self):
+        return self.prompt
+
+    async def get_supplier_patterns(self, supplier):
+        return []
+
+    async def insert_extraction(self, row):
+        extraction_id = f"bench-{len(self.extractions) + 1}"
+        self.extractions[extraction_id] = row
+        return extraction_id
+
+    async def get_extraction(self, extraction_id):
+        return self.extractions.get(extraction_id)
+
+    async def insert_ocr_blob(self, row):
+        self.ocr_blobs.setdefault(row['hash'], row)
+
+    async def get_ocr_blobs(self, hashes):
+        return {h: self.ocr_blobs[h] for h in hashes if h in self.ocr_blobs}
+
+    async def update_facture(self, facture_id, data):
+        # Facture créée au premier passage, comme un dépôt du jour
+        facture = self.factures.setdefault(facture_id, {'id': facture_id, 'date_upload': date.today().isoformat()})
+        facture.update(data)
+
+    async def get_facture_suppliers(self, facture_ids):
+        return {i: self.factures[i].get('fournisseur') for i in facture_ids if i in self.factures}
+
+    async def get_recent_factures(self, fields, since):
+        rows = [f for f in self.factures.values() if f['date_upload'] >= since.isoformat()]
+        rows.sort(key=lambda facture: facture['date_upload'])
+        return [{field: facture.get(field) for field in fields} for facture in rows]
+
+    async def get_latest_extraction(self, facture_id):
+        # Dict ordonné par insertion : la dernière correspondance est la plus récente
+        rows = [row for row in self.extractions.values() if row.get('facture_id') == facture_id]
+        return rows[-1] if rows else None
+
+    async def insert_corrections(self, rows):
+        self.corrections.extend(rows)
+
+    async def increment_pattern_sample_counts(self, increments):
+        return 0
+
+
+def install_stubs(main, args):
+    """Point the service at the local corpus, the in-memory repository and (optionally) the fake LLM"""
+    from coherence_rules import RuleEngine
+
+    main.SUPABASE_URL = BENCH_SUPABASE_URL
+    main.SUPABASE_STORAGE_LOCAL_ROOT = str(args.corpus.resolve().parent)
+    main.repository = MemoryRepository(json.loads(args.prompt.read_text(encoding='utf-8')) if args.prompt else None)
+    rules = json.loads(args.rules.read_text(encoding='utf-8')) if args.rules else []
+    main.rule_engine = RuleEngine(rules, [])
+    main.LLM_CACHE_ENABLED = args.llm_cache
+
+    if args.llm != 'stub':
+        return
+
+    @main.timed_stage('call_llm_chat')
+    def stub_llm_chat(system_prompt: str, user_prompt: str, model: str, temperature: float):
+        # Valeurs attendues effectivement lues par l'OCR : mesure l'OCR et la plomberie, pas le LLM
+        document = current_document.get() or {}
+        compact_prompt = _compact(user_prompt)
+        data: Dict[str, Any] = {}
+        for path, value in expected_fields(document.get('expected', {}), main.INVOICE_FIELD_PATHS).items():
+            if any(variant in compact_prompt for variant in field_variants(value)):
+                main.set_path(data, path, value)
+        content = json.dumps(data, ensure_ascii=False)
+
+        prompt_tokens = len(user_prompt) // 4
+        completion_tokens = max(1, len(content) // 4)
+        prompt_seconds = prompt_tokens / args.stub_prompt_tokens_per_second
+        eval_seconds = completion_tokens / args.stub_tokens_per_second
+        time.sleep(prompt_seconds + eval_seconds)
+
+        response = {
+            'message': {'role': 'assistant', 'content': content},
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': completion_tokens,
+            'prompt_eval_duration': int(prompt_seconds * 1e9),
+            'eval_duration': int(eval_seconds * 1e9),
+            'total_duration': int((prompt_seconds + eval_seconds) * 1e9)
+        }
+        main.record_llm_stats(model, response)
+        return response
+
+    main.call_llm_chat = stub_llm_chat
+
+
+async def run_document(main, document: Dict[str, Any]) -> Dict[str, Any]:
+    from fastapi import BackgroundTasks
+
+    current_document.set(document)
+    background_tasks = BackgroundTasks()
+    response = await main.extract_facture(
+        main.ExtractionRequest(facture_id=f"bench-{document['name']}", file_url=document['url']),
+        background_tasks
+    )
+    await background_tasks()
+    return {'document': document, 'response': response}
+
+
+async def run_level(main, documents: List[Dict[str, Any]], concurrency: int, repeat: int) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def bounded(document):
+        async with semaphore:
+            return await run_document(main, document)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*[bounded(document) for _ in range(repeat) for document in documents])
+    wall_seconds = time.perf_counter() - start
+    return {'concurrency': concurrency, 'wall_seconds': wall_seconds, 'results': results}
+
+
+def stage_statistics(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    durations: Dict[str, List[float]] = {}
+    for result in results:
+        for stage, value in result['response'].ocr_metadata['timings_ms'].items():
+            if isinstance(value, (int, float)):
+                durations.setdefault(stage, []).append(value)
+    return {
+        stage: {
+            'p50': round(percentile(values, 0.5), 1),
+            'p95': round(percentile(values, 0.95), 1),
+            'mean': round(statistics.mean(values), 1)
+        }
+        for stage, values in sorted(durations.items())
+    }
+
+
+def field_accuracy(results: List[Dict[str, Any]], field_paths: Dict[str, Any]) -> Dict[str, Any]:
+    """Precision = correct / extracted, recall = correct / expected, over ground-truth fields"""
+    from cascade import flatten
+
+    per_field: Dict[str, Dict[str, int]] = {}
+    for result in results:
+        expected = expected_fields(result['document']['expected'], field_paths)
+        extracted = {
+            path: value for path, value in flatten(result['response'].extracted_data).items()
+            if value is not None
+        }
+        # Un champ extrait sans vérité terrain n'est pas comptabilisé comme faux positif
+        for path in expected:
+            counts = per_field.setdefault(path, {'expected': 0, 'extracted': 0, 'correct': 0})
+            counts['expected'] += 1
+            if path in extracted:
+                counts['extracted'] += 1
+                counts['correct'] += values_match(expected[path], extracted[path])
+
+    totals = {key: sum(counts[key] for counts in per_field.values()) for key in ('expected', 'extracted', 'correct')}
+
+    def ratio(numerator, denominator):
+        return round(numerator / denominator, 4) if denominator else None
+
+    return {
+        'precision': ratio(totals['correct'], totals['extracted']),
+        'recall': ratio(totals['correct'], totals['expected']),
+        'per_field': {
+            path: {
+                'precision': ratio(counts['correct'], counts['extracted']),
+                'recall': ratio(counts['correct'], counts['expected'])
+            }
+            for path, counts in sorted(per_field.items())
+        }
+    }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss : kilo-octets sous Linux, octets sous macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def compare_with_baseline(report: Dict[str, Any], baseline: Dict[str, Any], latency_tolerance: float, accuracy_tolerance: float) -> List[str]:
+    """Human-readable diff; regressions are prefixed with 'REGRESSION'"""
+    lines = []
+
+    def latency_line(label, current, previous):
+        if not previous:
+            return
+        change = (current - previous) / previous
+        prefix = 'REGRESSION ' if change > latency_tolerance else ''
+        lines.append(f"{prefix}{label}: {previous} -> {current} ms ({change:+.1%})")
+
+    for stage, stats in report['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous:
+            latency_line(f"{stage} p50", stats['p50'], previous['p50'])
+            latency_line(f"{stage} p95", stats['p95'], previous['p95'])
+
+    previous_levels = {level['concurrency']: level for level in baseline.get('throughput', [])}
+    for level in report['throughput']:
+        previous = previous_levels.get(level['concurrency'])
+        if previous and previous['docs_per_second']:
+            change = (level['docs_per_second'] - previous['docs_per_second']) / previous['docs_per_second']
+            prefix = 'REGRESSION ' if change < -latency_tolerance else ''
+            lines.append(
+                f"{prefix}débit c={level['concurrency']}: {previous['docs_per_second']} -> "
+                f"{level['docs_per_second']} factures/s ({change:+.1%})"
+            )
+
+    for metric in ('precision', 'recall'):
+        current, previous = report['fields'][metric], baseline.get('fields', {}).get(metric)
+        if current is not None and previous is not None:
+            prefix = 'REGRESSION ' if current < previous - accuracy_tolerance else ''
+            lines.append(f"{prefix}{metric}: {previous} -> {current}")
+
+    if baseline.get('peak_rss_mb'):
+        lines.append(f"pic RSS: {baseline['peak_rss_mb']} -> {report['peak_rss_mb']} Mo")
+    return lines
+
+
+async def run_benchmark(args) -> Dict[str, Any]:
+    import main
+
+    install_stubs(main, args)
+    documents = load_corpus(args.corpus)
+    if not documents:
+        raise SystemExit(f"Aucune facture avec vérité terrain (.json) dans {args.corpus}")
+
+    # Préchauffage (chargement des modèles OCR/LLM) exclu des mesures
+    for document in documents[:args.warmup]:
+        await run_document(main, document)
+
+    levels = [await run_level(main, documents, concurrency, args.repeat) for concurrency in args.concurrency]
+    reference = levels[0]['results']
+
+    return {
+        'config': {
+            'documents': len(documents),
+            'repeat': args.repeat,
+            'llm': args.llm,
+            'llm_cache': args.llm_cache,
+            'ocr_engine': main.get_ocr_engine().describe()
+        },
+        'stages': stage_statistics(reference),
+        'throughput': [
+            {
+                'concurrency': level['concurrency'],
+                'docs_per_second': round(len(level['results']) / level['wall_seconds'], 3),
+                'total_ms': stage_statistics(level['results']).get('total')
+            }
+            for level in levels
+        ],
+        'peak_rss_mb': peak_rss_mb(),
+        'fields': field_accuracy(reference, main.INVOICE_FIELD_PATHS)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end /extract benchmark on the ground-truth invoice corpus")
+    parser.add_argument('corpus', type=Path, help="Dossier des factures de référence (+ <nom>.json)")
+    parser.add_argument('--llm', choices=['stub', 'ollama'], default='stub')
+    parser.add_argument('--stub-tokens-per-second', type=float, default=20.0,
+                        help="Vitesse de génération du faux Ollama")
+    parser.add_argument('--stub-prompt-tokens-per-second', type=float, default=200.0)
+    parser.add_argument('--llm-cache', action='store_true', help="Garder le cache des réponses LLM actif")
+    parser.add_argument('--prompt', type=Path, default=None, help="Prompt actif (ligne llm_prompts en JSON)")
+    parser.add_argument('--rules', type=Path, default=None, help="Règles de cohérence (lignes regles_coherence_metier en JSON)")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1])
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--baseline', type=Path, default=None, help="Résultats de référence à comparer")
+    parser.add_argument('--save-baseline', type=Path, default=None)
+    parser.add_argument('--latency-tolerance', type=float, default=0.10,
+                        help="Hausse de latence (ou baisse de débit) relative tolérée")
+    parser.add_argument('--accuracy-tolerance', type=float, default=0.01)
+    parser.add_argument('--output', type=Path, default=None)
+    args = parser.parse_args()
+
+    report = asyncio.run(run_benchmark(args))
+
+    print(f"{'étape':<32} {'p50 ms':>10} {'p95 ms':>10}")
+    for stage, stats in report['stages'].items():
+        print(f"{stage:<32} {stats['p50']:>10.1f} {stats['p95']:>10.1f}")
+    for level in report['throughput']:
+        print(f"concurrence={level['concurrency']:<3} débit={level['docs_per_second']} factures/s")
+    print(f"pic RSS={report['peak_rss_mb']} Mo  précision={report['fields']['precision']}  rappel={report['fields']['recall']}")
+
+    regressions = []
+    if args.baseline and args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text(encoding='utf-8'))
+        diff = compare_with_baseline(report, baseline, args.latency_tolerance, args.accuracy_tolerance)
+        print("\nComparaison avec la référence :")
+        for line in diff:
+            print(f"  {line}")
+        regressions = [line for line in diff if line.startswith('REGRESSION')]
+
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(report, indent=2, ensure_ascii=False), encoding='utf-8')
+
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
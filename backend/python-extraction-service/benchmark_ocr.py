@@ -0,0 +1,214 @@
+"""
+Banc d'essai des moteurs OCR sur le corpus de factures de référence
+
+Corpus : un dossier de factures (.pdf, .png, .jpg) avec, pour chacune, au moins un fichier de référence :
+  - <nom>.txt  : transcription exacte (taux d'erreur caractère)
+  - <nom>.json : valeurs validées au format de `validations_factures` (taux de champs retrouvés)
+
+Usage :
+  python benchmark_ocr.py corpus/ --engines paddle onnx --threads 2 4 --output resultats.json
+"""
+import argparse
+import json
+import re
+import statistics
+import time
+from datetime import date
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from ocr_engines import OCR_ENGINES, OCREngine, create_ocr_engine
+from preprocessing import preprocess_image
+
+INVOICE_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg'}
+# Colonnes de validations_factures qui ne sont pas lisibles sur la facture
+NON_OCR_FIELDS = {
+    'id', 'facture_id', 'user_id', 'date_validation', 'temps_validation_secondes',
+    'utilise_pour_training', 'qualite_ground_truth', 'notes_validation', 'created_at',
+    'contient_arenh', 'contient_turpe'
+}
+
+
+def levenshtein(reference: str, hypothesis: str) -> int:
+    """Edit distance, O(len(reference) * len(hypothesis)) time and O(min) memory"""
+    if len(reference) < len(hypothesis):
+        reference, hypothesis = hypothesis, reference
+    previous = list(range(len(hypothesis) + 1))
+    for i, ref_char in enumerate(reference, 1):
+        current = [i]
+        for j, hyp_char in enumerate(hypothesis, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_char != hyp_char)
+            ))
+        previous = current
+    return previous[-1]
+
+
+def normalize_text(text: str) -> str:
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def character_error_rate(reference: str, hypothesis: str) -> float:
+    reference, hypothesis = normalize_text(reference), normalize_text(hypothesis)
+    if not reference:
+        return 0.0 if not hypothesis else 1.0
+    return levenshtein(reference, hypothesis) / len(reference)
+
+
+def _compact(value: str) -> str:
+    return re.sub(r'\s+', '', value.lower()).replace(',', '.')
+
+
+def field_variants(value: Any) -> List[str]:
+    """Textual forms under which a validated value may appear on the invoice"""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    text = str(value)
+    variants = [_compact(text)]
+    try:
+        parsed = date.fromisoformat(text)
+        variants.append(parsed.strftime('%d/%m/%Y'))
+    except ValueError:
+        pass
+    return variants
+
+
+def field_hit_rate(expected: Dict[str, Any], ocr_text: str) -> Optional[float]:
+    """Share of validated field values found verbatim in the OCR text"""
+    compact_text = _compact(ocr_text)
+    fields = [
+        value for key, value in expected.items()
+        if key not in NON_OCR_FIELDS and value not in (None, '')
+    ]
+    if not fields:
+        return None
+    hits = sum(
+        1 for value in fields
+        if any(variant in compact_text for variant in field_variants(value))
+    )
+    return hits / len(fields)
+
+
+def load_pages(path: Path) -> List[Image.Image]:
+    if path.suffix.lower() == '.pdf':
+        from pdf2image import convert_from_path
+        return convert_from_path(str(path), dpi=300)
+    with Image.open(path) as image:
+        image.load()
+        return [image]
+
+
+def load_corpus(corpus_dir: Path) -> List[Dict[str, Any]]:
+    documents = []
+    for path in sorted(corpus_dir.iterdir()):
+        if path.suffix.lower() not in INVOICE_EXTENSIONS:
+            continue
+        transcript = path.with_suffix('.txt')
+        fields = path.with_suffix('.json')
+        documents.append({
+            'name': path.name,
+            'pages': load_pages(path),
+            'is_pdf': path.suffix.lower() == '.pdf',
+            'transcript': transcript.read_text(encoding='utf-8') if transcript.exists() else None,
+            'fields': json.loads(fields.read_text(encoding='utf-8')) if fields.exists() else None
+        })
+    return documents
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_engine(engine: OCREngine, documents: List[Dict[str, Any]], warmup: int = 1) -> Dict[str, Any]:
+    # Les premiers appels chargent les modèles : exclus des mesures
+    first_pages = [page for doc in documents for page in doc['pages']][:warmup]
+    for page in first_pages:
+        engine.ocr(preprocess_image(page, orientation_known=True)[0])
+
+    page_latencies = []
+    cers = []
+    hit_rates = []
+
+    for doc in documents:
+        texts = []
+        for page in doc['pages']:
+            array, info = preprocess_image(page, orientation_known=doc['is_pdf'])
+            start = time.perf_counter()
+            lines = engine.ocr(array, use_cls=not info['orientation_known'])
+            page_latencies.append((time.perf_counter() - start) * 1000)
+            texts.append('\n'.join(text for _, text, _ in lines))
+
+        ocr_text = '\n'.join(texts)
+        if doc['transcript'] is not None:
+            cers.append(character_error_rate(doc['transcript'], ocr_text))
+        if doc['fields'] is not None:
+            rate = field_hit_rate(doc['fields'], ocr_text)
+            if rate is not None:
+                hit_rates.append(rate)
+
+    return {
+        **engine.describe(),
+        'pages': len(page_latencies),
+        'latency_ms_mean': round(statistics.mean(page_latencies), 1) if page_latencies else 0.0,
+        'latency_ms_p50': round(percentile(page_latencies, 0.5), 1),
+        'latency_ms_p95': round(percentile(page_latencies, 0.95), 1),
+        'char_accuracy': round(1 - statistics.mean(cers), 4) if cers else None,
+        'field_hit_rate': round(statistics.mean(hit_rates), 4) if hit_rates else None
+    }
+
+
+def engine_options(name: str, threads: int) -> Dict[str, Any]:
+    if name == 'onnx':
+        return {'intra_op_threads': threads}
+    return {'cpu_threads': threads}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare OCR engines on the ground-truth invoice corpus")
+    parser.add_argument('corpus', type=Path, help="Dossier des factures de référence")
+    parser.add_argument('--engines', nargs='+', default=list(OCR_ENGINES), choices=list(OCR_ENGINES))
+    parser.add_argument('--threads', nargs='+', type=int, default=[4])
+    parser.add_argument('--min-char-accuracy', type=float, default=None,
+                        help="Précision caractère minimale pour recommander un moteur")
+    parser.add_argument('--output', type=Path, default=None)
+    args = parser.parse_args()
+
+    documents = load_corpus(args.corpus)
+    if not documents:
+        parser.error(f"Aucune facture trouvée dans {args.corpus}")
+
+    results = []
+    for name in args.engines:
+        for threads in args.threads:
+            engine = create_ocr_engine(name, **engine_options(name, threads))
+            result = run_engine(engine, documents)
+            results.append(result)
+            print(
+                f"{name:<8} threads={threads:<3} pages={result['pages']:<4} "
+                f"p50={result['latency_ms_p50']:>8.1f} ms  p95={result['latency_ms_p95']:>8.1f} ms  "
+                f"char_acc={result['char_accuracy']}  fields={result['field_hit_rate']}"
+            )
+
+    eligible = [
+        r for r in results
+        if args.min_char_accuracy is None
+        or (r['char_accuracy'] is not None and r['char_accuracy'] >= args.min_char_accuracy)
+    ]
+    if eligible:
+        best = min(eligible, key=lambda r: r['latency_ms_p50'])
+        print(f"\nMoteur recommandé : {best}")
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding='utf-8')
+
+
+if __name__ == "__main__":
+    main()
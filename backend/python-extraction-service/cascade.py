@@ -0,0 +1,231 @@
+"""
+Cascade de modèles pour l'extraction
+Un premier niveau rapide (extracteur à base de règles ou petit modèle) traite la facture ;
+seuls les champs peu fiables ou incohérents sont redemandés au niveau suivant
+"""
+import os
+import re
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import CASCADE_FIELDS, CASCADE_TIERS
+
+LLM_CASCADE_ENABLED = os.getenv("LLM_CASCADE_ENABLED", "false").lower() == "true"
+# Niveaux dans l'ordre ; "rules" = regex apprises, le dernier niveau tranche sans contrôle
+LLM_CASCADE_TIERS = [t.strip() for t in os.getenv(
+    "LLM_CASCADE_TIERS", "rules,qwen2.5:1.5b-instruct,mistral:7b-instruct-q4_K_M"
+).split(',') if t.strip()]
+LLM_CASCADE_FIELD_THRESHOLD = float(os.getenv("LLM_CASCADE_FIELD_THRESHOLD", "0.6"))
+# Seuil sur la confiance globale : 40 % confiance OCR, 60 % confiance des champs
+LLM_CASCADE_GLOBAL_THRESHOLD = float(os.getenv("LLM_CASCADE_GLOBAL_THRESHOLD", "0.8"))
+OCR_CONFIDENCE_WEIGHT = 0.4
+LLM_CASCADE_REQUIRED_FIELDS = [f.strip() for f in os.getenv(
+    "LLM_CASCADE_REQUIRED_FIELDS",
+    "fournisseur,pdl,periode_debut,periode_fin,conso.conso_totale,prix_total_ttc"
+).split(',') if f.strip()]
+# Champs déduits (classification) : pas forcément écrits tels quels sur la facture
+INFERRED_FIELDS = {
+    'type', 'annee', 'classe_temporelle_tarifaire', 'distribution_tariff', 'offpeak_hours'
+}
+RULES_TIER = "rules"
+
+# run_tier(tier, fields) -> données extraites ; fields=None : tous les champs
+TierRunner = Callable[[str, Optional[List[str]]], Awaitable[Dict[str, Any]]]
+FieldScorer = Callable[[Dict[str, Any]], Dict[str, float]]
+CoherenceCheck = Callable[[Dict[str, Any]], Set[str]]
+
+
+def flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """{'conso': {'conso_hp': 1}} -> {'conso.conso_hp': 1}"""
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        else:
+            flat[path] = value
+    return flat
+
+
+def set_path(data: Dict[str, Any], path: str, value: Any):
+    keys = path.split('.')
+    target = data
+    for key in keys[:-1]:
+        if not isinstance(target.get(key), dict):
+            target[key] = {}
+        target = target[key]
+    target[keys[-1]] = value
+
+
+def delete_path(data: Dict[str, Any], path: str):
+    keys = path.split('.')
+    target = data
+    for key in keys[:-1]:
+        target = target.get(key)
+        if not isinstance(target, dict):
+            return
+    target.pop(keys[-1], None)
+
+
+def _compact(text: str) -> str:
+    return re.sub(r'\s+', '', str(text)).lower()
+
+
+def field_supported(value: Any, ocr_text: str) -> bool:
+    """True when the value (or a usual printed form of it) appears in the OCR text"""
+    compact_text = _compact(ocr_text)
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    variants = {_compact(value)}
+    if isinstance(value, (int, float)):
+        variants.add(_compact(value).replace('.', ','))
+    try:
+        variants.add(date.fromisoformat(str(value)).strftime('%d/%m/%Y'))
+    except ValueError:
+        pass
+    return any(variant and variant in compact_text for variant in variants)
+
+
+def basic_coherence_failures(data: Dict[str, Any]) -> Set[str]:
+    """Minimal structural checks used when no rule engine is provided"""
+    failures = set()
+    pdl = data.get('pdl')
+    if pdl is not None and not re.fullmatch(r'\d{14}', re.sub(r'\s+', '', str(pdl))):
+        failures.add('pdl')
+
+    try:
+        if data.get('periode_debut') and data.get('periode_fin') and \
+                date.fromisoformat(data['periode_debut']) > date.fromisoformat(data['periode_fin']):
+            failures.update({'periode_debut', 'periode_fin'})
+    except ValueError:
+        failures.update({'periode_debut', 'periode_fin'})
+
+    ht, ttc = data.get('prix_total_ht'), data.get('prix_total_ttc')
+    if isinstance(ht, (int, float)) and isinstance(ttc, (int, float)) and ht > ttc:
+        failures.update({'prix_total_ht', 'prix_total_ttc'})
+    return failures
+
+
+def blend_confidence(ocr_confidence: float, field_confidences: Dict[str, float]) -> float:
+    """Global confidence: 40 % OCR, 60 % mean of the non-zero field confidences"""
+    valid_confidences = [c for c in field_confidences.values() if c > 0]
+    field_confidence = sum(valid_confidences) / len(valid_confidences) if valid_confidences else 0.0
+    return ocr_confidence * OCR_CONFIDENCE_WEIGHT + field_confidence * (1 - OCR_CONFIDENCE_WEIGHT)
+
+
+def failing_fields(
+    data: Dict[str, Any],
+    ocr_text: str,
+    score_fields: FieldScorer,
+    check_coherence: CoherenceCheck,
+    ocr_confidence: float,
+    required: Iterable[str] = LLM_CASCADE_REQUIRED_FIELDS
+) -> Tuple[Set[str], float]:
+    """
+    Fields to escalate: missing required fields, values absent from the OCR text,
+    low OCR confidence, or coherence rule failures
+    Returns (failing field paths, global confidence blended with the OCR confidence)
+    """
+    flat = {path: value for path, value in flatten(data).items() if value is not None}
+    confidences = score_fields(data)
+
+    failing = {path for path in required if path not in flat}
+    for path, value in flat.items():
+        leaf = path.split('.')[-1]
+        if leaf not in INFERRED_FIELDS and not field_supported(value, ocr_text):
+            failing.add(path)
+        elif confidences.get(path, 1.0) < LLM_CASCADE_FIELD_THRESHOLD:
+            failing.add(path)
+    failing |= check_coherence(data)
+    return failing, blend_confidence(ocr_confidence, confidences)
+
+
+class CascadeStats:
+    """In-process per-tier counters, reported by /cascade/stats"""
+
+    def __init__(self):
+        self.tiers: Dict[str, Dict[str, int]] = {}
+
+    def record(self, tier: str, accepted: bool, escalated_fields: int):
+        stats = self.tiers.setdefault(tier, {'invocations': 0, 'accepted': 0, 'escalated_fields': 0})
+        stats['invocations'] += 1
+        stats['accepted'] += int(accepted)
+        stats['escalated_fields'] += escalated_fields
+        CASCADE_TIERS.labels(tier, 'accepted' if accepted else 'escalated').inc()
+        CASCADE_FIELDS.labels(tier).inc(escalated_fields)
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            tier: {**stats, 'hit_rate': round(stats['accepted'] / stats['invocations'], 4) if stats['invocations'] else None}
+            for tier, stats in self.tiers.items()
+        }
+
+
+cascade_stats = CascadeStats()
+
+
+async def run_cascade(
+    ocr_text: str,
+    run_tier: TierRunner,
+    score_fields: FieldScorer,
+    ocr_confidence: float,
+    check_coherence: CoherenceCheck = basic_coherence_failures,
+    tiers: List[str] = LLM_CASCADE_TIERS,
+    all_fields: Iterable[str] = ()
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Run the tiers in order; each tier after the first only re-extracts the
+    fields the previous result failed on. The rules tier is partial: every
+    field it did not extract is also passed on
+    Returns (merged data, report)
+    """
+    all_fields = set(all_fields)
+    data: Dict[str, Any] = {}
+    pending: Optional[List[str]] = None
+    report: Dict[str, Any] = {'tiers': []}
+
+    for index, tier in enumerate(tiers):
+        is_last = index == len(tiers) - 1
+        result = await run_tier(tier, pending)
+
+        if pending is None:
+            data = result
+        else:
+            # Les valeurs rejetées ne survivent pas à un null du niveau suivant
+            for path in pending:
+                delete_path(data, path)
+            for path, value in flatten(result).items():
+                if value is not None and (path in pending or path.split('.')[0] in pending):
+                    set_path(data, path, value)
+
+        if is_last:
+            cascade_stats.record(tier, True, 0)
+            report['tiers'].append({'tier': tier, 'requested': pending, 'accepted': True})
+            report['final_tier'] = tier
+            break
+
+        failing, global_confidence = failing_fields(data, ocr_text, score_fields, check_coherence, ocr_confidence)
+        accepted = not failing and global_confidence >= LLM_CASCADE_GLOBAL_THRESHOLD
+        cascade_stats.record(tier, accepted, len(failing))
+        report['tiers'].append({
+            'tier': tier,
+            'requested': pending,
+            'accepted': accepted,
+            'global_confidence': round(global_confidence, 2),
+            'failing_fields': sorted(failing)
+        })
+
+        if accepted:
+            report['final_tier'] = tier
+            break
+
+        if tier == RULES_TIER:
+            extracted = {path for path, value in flatten(data).items() if value is not None}
+            failing |= all_fields - extracted
+
+        # Sous le seuil global sans champ identifié : tout redemander
+        pending = sorted(failing) if failing else None
+        if pending is None:
+            data = {}
+
+    return data, report
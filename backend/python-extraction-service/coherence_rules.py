@@ -0,0 +1,447 @@
+"""
+Moteur de règles de cohérence métier
+Les règles actives de regles_coherence_metier sont chargées une fois et compilées
+en fonctions Python (pas d'eval par facture), puis évaluées sur une facture ou sur
+un lot de factures en une passe vectorisée (une colonne numpy par champ).
+Les plages de prix s'appuient sur un index d'intervalles de referentiel_tarifs_energie.
+
+Format de `formule` par type de règle :
+- calcul : {"check": "prix_total_ttc ≈ prix_total_ht + montant_TVA", "tolerance": 0.02}
+- logique : {"check": "periode_debut <= periode_fin"}
+- plage : {"champ": "puissance_souscrite_kva", "min": 3, "max": 36}
+          {"expression": "montant_fourniture_ht / conso.conso_totale",
+           "referentiel": "prix_kwh", "type_tarif": "bleu", "tolerance": 0.2}
+- obligatoire_si : {"champ": "conso.conso_hc", "si": "classe_temporelle_tarifaire in ['DT', 'HP/HC']"}
+  (`in` sur du texte ignore la casse ; "HP/HC (DT)" correspond à 'HP/HC (DT)', 'HP/HC' ou 'DT')
+- format : {"champ": "pdl", "regex": "^\\d{14}$"}
+Clés optionnelles : "champs" (champs mis en cause, par défaut ceux référencés),
+"flag" (colonne booléenne de factures, ex. "coherence_periode")
+"""
+import ast
+import logging
+import re
+from bisect import bisect_right
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from cascade import flatten
+
+logger = logging.getLogger("extraction-service")
+
+APPROX = '≈'
+SEVERITY_BLOCKING = 'erreur'
+
+
+class RuleCompileError(ValueError):
+    pass
+
+
+class Columns:
+    """
+    Column view of a batch of invoices: one array per dotted field path
+    Numeric fields are float64 (NaN when missing), others object arrays ('' when missing)
+    """
+
+    def __init__(self, invoices: List[Dict[str, Any]]):
+        self.rows = [flatten(invoice or {}) for invoice in invoices]
+        self.size = len(self.rows)
+        self.cache: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+
+    def get(self, path: str) -> Tuple[np.ndarray, np.ndarray]:
+        """(values, present mask) for a field path"""
+        if path not in self.cache:
+            raw = [row.get(path) for row in self.rows]
+            present = np.array([value is not None and value != '' for value in raw], dtype=bool)
+            numeric = all(
+                isinstance(value, (int, float)) and not isinstance(value, bool)
+                for value, ok in zip(raw, present) if ok
+            )
+            if numeric:
+                values = np.array([value if ok else np.nan for value, ok in zip(raw, present)], dtype=np.float64)
+            else:
+                values = np.array([str(value) if ok else '' for value, ok in zip(raw, present)], dtype=object)
+            self.cache[path] = (values, present)
+        return self.cache[path]
+
+
+# Expression compilée : Columns -> tableau (une valeur par facture)
+Compiled = Callable[[Columns], np.ndarray]
+
+LABEL_WITH_CODE = re.compile(r'^(.*?)\s*\(([^()]*)\)$')
+
+
+def label_forms(value: Any) -> Set[str]:
+    """'HP/HC (DT)' -> {'HP/HC (DT)', 'HP/HC', 'DT'}: LLM labels carry their code in parentheses"""
+    text = re.sub(r'\s+', ' ', str(value)).strip().upper()
+    forms = {text}
+    match = LABEL_WITH_CODE.match(text)
+    if match:
+        forms.update(part.strip() for part in match.groups() if part.strip())
+    return forms
+
+
+def is_in(values: Any, choices: Any) -> np.ndarray:
+    """np.isin, label-aware on text columns"""
+    if isinstance(values, np.ndarray) and values.dtype == object:
+        wanted = set().union(*(label_forms(choice) for choice in choices)) if len(choices) else set()
+        return np.array([value != '' and bool(label_forms(value) & wanted) for value in values], dtype=bool)
+    return np.isin(values, choices)
+
+
+BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.divide,
+}
+COMPARE_OPERATORS = {
+    ast.Eq: lambda a, b: a == b,
+    ast.NotEq: lambda a, b: a != b,
+    ast.Lt: lambda a, b: a < b,
+    ast.LtE: lambda a, b: a <= b,
+    ast.Gt: lambda a, b: a > b,
+    ast.GtE: lambda a, b: a >= b,
+    ast.In: is_in,
+    ast.NotIn: lambda a, b: ~is_in(a, b),
+}
+FUNCTIONS = {
+    'abs': np.abs,
+    'min': np.minimum,
+    'max': np.maximum,
+}
+
+
+def field_path(node: ast.AST) -> Optional[str]:
+    """conso.conso_hp (Attribute chain) -> 'conso.conso_hp'"""
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        parent = field_path(node.value)
+        return f"{parent}.{node.attr}" if parent else None
+    return None
+
+
+def compile_node(node: ast.AST, fields: Set[str]) -> Compiled:
+    """Translate an expression AST into a closure over Columns, collecting referenced fields"""
+    path = field_path(node)
+    if path is not None:
+        fields.add(path)
+        return lambda cols: cols.get(path)[0]
+
+    if isinstance(node, ast.Constant):
+        value = node.value
+        return lambda cols: value
+
+    if isinstance(node, (ast.List, ast.Tuple)):
+        if not all(isinstance(item, ast.Constant) for item in node.elts):
+            raise RuleCompileError("Seules les listes de constantes sont supportées")
+        values = [item.value for item in node.elts]
+        return lambda cols: values
+
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        operator = BINARY_OPERATORS[type(node.op)]
+        left, right = compile_node(node.left, fields), compile_node(node.right, fields)
+        return lambda cols: operator(left(cols), right(cols))
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        operand = compile_node(node.operand, fields)
+        return lambda cols: np.negative(operand(cols))
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        operand = compile_node(node.operand, fields)
+        return lambda cols: np.logical_not(operand(cols))
+
+    if isinstance(node, ast.BoolOp):
+        operands = [compile_node(value, fields) for value in node.values]
+        combine = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def bool_op(cols):
+            result = operands[0](cols)
+            for operand in operands[1:]:
+                result = combine(result, operand(cols))
+            return result
+        return bool_op
+
+    if isinstance(node, ast.Compare):
+        steps = []
+        for op, comparator in zip(node.ops, node.comparators):
+            if type(op) not in COMPARE_OPERATORS:
+                raise RuleCompileError(f"Comparaison non supportée: {type(op).__name__}")
+            steps.append((COMPARE_OPERATORS[type(op)], compile_node(comparator, fields)))
+        first = compile_node(node.left, fields)
+
+        # a <= b <= c  ->  (a <= b) & (b <= c)
+        def compare(cols):
+            left = first(cols)
+            result = True
+            for operator, right_fn in steps:
+                right = right_fn(cols)
+                result = np.logical_and(result, operator(left, right))
+                left = right
+            return result
+        return compare
+
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS and not node.keywords:
+        function = FUNCTIONS[node.func.id]
+        args = [compile_node(arg, fields) for arg in node.args]
+        return lambda cols: function(*[arg(cols) for arg in args])
+
+    raise RuleCompileError(f"Expression non supportée: {ast.dump(node)}")
+
+
+def compile_expression(expression: str) -> Tuple[Compiled, Set[str]]:
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError as e:
+        raise RuleCompileError(f"Expression invalide '{expression}': {e}")
+    fields: Set[str] = set()
+    return compile_node(tree.body, fields), fields
+
+
+def compile_check(check: str, tolerance: float) -> Tuple[Compiled, Set[str]]:
+    """'a ≈ b' -> |a - b| <= tolerance * |b| ; any other check is a boolean expression"""
+    if APPROX not in check:
+        return compile_expression(check)
+
+    left_text, right_text = check.split(APPROX, 1)
+    left, left_fields = compile_expression(left_text)
+    right, right_fields = compile_expression(right_text)
+
+    def approx(cols):
+        left_value, right_value = left(cols), right(cols)
+        return np.abs(np.subtract(left_value, right_value)) <= tolerance * np.abs(right_value) + 1e-9
+    return approx, left_fields | right_fields
+
+
+def applicable(cols: Columns, fields: Set[str]) -> np.ndarray:
+    """Rows where every referenced field is present"""
+    mask = np.ones(cols.size, dtype=bool)
+    for path in fields:
+        mask &= cols.get(path)[1]
+    return mask
+
+
+def as_mask(values: Any, size: int) -> np.ndarray:
+    return np.broadcast_to(np.asarray(values, dtype=bool), (size,))
+
+
+class TariffIndex:
+    """
+    In-memory interval index over referentiel_tarifs_energie
+    (annee, mois, type_tarif) -> power intervals sorted by puissance_min_kva
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        grouped: Dict[Tuple[int, int, str], List[Tuple[float, float, Dict[str, Any]]]] = {}
+        for row in rows:
+            low = float(row['puissance_min_kva']) if row.get('puissance_min_kva') is not None else float('-inf')
+            high = float(row['puissance_max_kva']) if row.get('puissance_max_kva') is not None else float('inf')
+            key = (int(row['annee']), int(row['mois']), str(row['type_tarif']).lower())
+            grouped.setdefault(key, []).append((low, high, row))
+
+        self.intervals: Dict[Tuple[int, int, str], Tuple[List[float], List[Tuple[float, float, Dict[str, Any]]]]] = {}
+        for key, entries in grouped.items():
+            entries.sort(key=lambda entry: entry[0])
+            self.intervals[key] = ([entry[0] for entry in entries], entries)
+
+    def __len__(self):
+        return sum(len(entries) for _, entries in self.intervals.values())
+
+    def lookup(self, annee: int, mois: int, type_tarif: str, puissance: Optional[float]) -> Optional[Dict[str, Any]]:
+        found = self.intervals.get((annee, mois, type_tarif.lower()))
+        if not found:
+            return None
+        starts, entries = found
+        if puissance is None:
+            return entries[0][2] if len(entries) == 1 else None
+        position = bisect_right(starts, puissance) - 1
+        if position < 0:
+            return None
+        low, high, row = entries[position]
+        return row if low <= puissance <= high else None
+
+
+def invoice_period(row: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    """(annee, mois) of the billing period start"""
+    try:
+        start = date.fromisoformat(str(row.get('periode_debut')))
+        return start.year, start.month
+    except ValueError:
+        return None
+
+
+class CompiledRule:
+    """One active rule; evaluate(cols) -> (failed mask, checked mask)"""
+
+    def __init__(self, row: Dict[str, Any], tariffs: TariffIndex):
+        self.id = row.get('id')
+        self.name = row['nom_regle']
+        self.description = row.get('description')
+        self.type = row['type']
+        self.severity = row.get('severite') or 'avertissement'
+        formule = row.get('formule') or {}
+        self.flag = formule.get('flag')
+        self.tariffs = tariffs
+        self.evaluate = self._compile(formule)
+        self.blamed = formule.get('champs') or sorted(self.fields)
+
+    def _compile(self, formule: Dict[str, Any]) -> Callable[[Columns], Tuple[np.ndarray, np.ndarray]]:
+        tolerance = float(formule.get('tolerance', 0.0))
+
+        if self.type in ('calcul', 'logique'):
+            check, self.fields = compile_check(formule['check'], tolerance)
+
+            def evaluate(cols):
+                checked = applicable(cols, self.fields)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    ok = as_mask(check(cols), cols.size)
+                return checked & ~ok, checked
+            return evaluate
+
+        if self.type == 'format':
+            path = formule['champ']
+            pattern = re.compile(formule['regex'])
+            self.fields = {path}
+
+            def evaluate(cols):
+                values, checked = cols.get(path)
+                ok = np.array([bool(pattern.search(str(value))) for value in values], dtype=bool)
+                return checked & ~ok, checked
+            return evaluate
+
+        if self.type == 'obligatoire_si':
+            path = formule['champ']
+            condition, condition_fields = compile_expression(formule['si']) if formule.get('si') else (None, set())
+            self.fields = {path}
+
+            def evaluate(cols):
+                checked = applicable(cols, condition_fields)
+                if condition is not None:
+                    checked = checked & as_mask(condition(cols), cols.size)
+                return checked & ~cols.get(path)[1], checked
+            return evaluate
+
+        if self.type == 'plage':
+            expression, self.fields = compile_expression(formule.get('expression') or formule['champ'])
+            if formule.get('referentiel'):
+                return self._compile_reference_range(formule, expression, tolerance)
+            low = float(formule['min']) if formule.get('min') is not None else -np.inf
+            high = float(formule['max']) if formule.get('max') is not None else np.inf
+
+            def evaluate(cols):
+                checked = applicable(cols, self.fields)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = np.asarray(expression(cols), dtype=np.float64)
+                checked = checked & np.isfinite(values)
+                return checked & ((values < low) | (values > high)), checked
+            return evaluate
+
+        raise RuleCompileError(f"Type de règle non supporté: {self.type}")
+
+    def _compile_reference_range(self, formule: Dict[str, Any], expression: Compiled, tolerance: float):
+        """Price per kWh within the reference range of the invoice period, tariff and power"""
+        type_tarif = formule.get('type_tarif')
+        type_tarif_field = formule.get('type_tarif_champ')
+        self.fields = self.fields | {'periode_debut'} | ({type_tarif_field} if type_tarif_field else set())
+
+        def evaluate(cols):
+            checked = applicable(cols, self.fields)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values = np.broadcast_to(np.asarray(expression(cols), dtype=np.float64), (cols.size,))
+            lows = np.full(cols.size, np.nan)
+            highs = np.full(cols.size, np.nan)
+            for index in np.flatnonzero(checked & np.isfinite(values)):
+                row = cols.rows[index]
+                period = invoice_period(row)
+                tariff = type_tarif or row.get(type_tarif_field)
+                if not period or not tariff:
+                    continue
+                reference = self.tariffs.lookup(period[0], period[1], str(tariff), row.get('puissance_souscrite_kva'))
+                if reference:
+                    lows[index] = float(reference['prix_min_kwh']) * (1 - tolerance)
+                    highs[index] = float(reference['prix_max_kwh']) * (1 + tolerance)
+            checked = checked & np.isfinite(lows)
+            with np.errstate(invalid='ignore'):
+                return checked & ((values < lows) | (values > highs)), checked
+        return evaluate
+
+
+class RuleEngine:
+    """Active coherence rules, compiled once and evaluated in execution order"""
+
+    def __init__(self, rule_rows: List[Dict[str, Any]], tariff_rows: List[Dict[str, Any]]):
+        self.tariffs = TariffIndex(tariff_rows)
+        self.rules: List[CompiledRule] = []
+        self.invalid: List[Dict[str, str]] = []
+        for row in sorted(rule_rows, key=lambda r: r.get('ordre_execution') or 100):
+            try:
+                self.rules.append(CompiledRule(row, self.tariffs))
+            except (RuleCompileError, KeyError, TypeError, ValueError, re.error) as e:
+                logger.warning(f"Règle de cohérence ignorée '{row.get('nom_regle')}': {e}")
+                self.invalid.append({'regle': row.get('nom_regle'), 'erreur': str(e)})
+
+    def evaluate_batch(self, invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Evaluate every rule over the whole batch at once
+        Returns one report per invoice: {'alertes': [...], 'flags': {flag: bool}}
+        """
+        cols = Columns(invoices)
+        reports = [{'alertes': [], 'flags': {}} for _ in invoices]
+        for rule in self.rules:
+            try:
+                failed, checked = rule.evaluate(cols)
+            except Exception as e:
+                logger.warning(f"Évaluation de la règle '{rule.name}' échouée: {e}")
+                continue
+
+            for index in np.flatnonzero(checked):
+                report = reports[index]
+                if rule.flag:
+                    report['flags'][rule.flag] = report['flags'].get(rule.flag, True) and not failed[index]
+                if failed[index]:
+                    report['alertes'].append({
+                        'regle': rule.name,
+                        'type': rule.type,
+                        'severite': rule.severity,
+                        'champs': rule.blamed,
+                        'message': rule.description
+                    })
+        return reports
+
+    def evaluate(self, invoice: Dict[str, Any]) -> Dict[str, Any]:
+        return self.evaluate_batch([invoice])[0]
+
+    def failing_fields(self, invoice: Dict[str, Any]) -> Set[str]:
+        """Fields blamed by failed rules (cascade escalation)"""
+        return {
+            field
+            for alert in self.evaluate(invoice)['alertes'] if alert['severite'] != 'info'
+            for field in alert['champs']
+        }
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'rules': [{'regle': rule.name, 'type': rule.type, 'severite': rule.severity} for rule in self.rules],
+            'invalid': self.invalid,
+            'tariff_intervals': len(self.tariffs)
+        }
+
+
+def needs_validation(report: Dict[str, Any], confidence: float, min_confidence: float) -> bool:
+    """Human validation only for blocking rule failures or low confidence"""
+    blocking = any(alert['severite'] == SEVERITY_BLOCKING for alert in report['alertes'])
+    return blocking or confidence < min_confidence
+
+
+def load_rule_engine(db) -> RuleEngine:
+    """Load the active rules and the tariff reference (one query each)"""
+    rules = db.table('regles_coherence_metier')\
+        .select('id, nom_regle, description, type, formule, severite, ordre_execution')\
+        .eq('actif', True)\
+        .execute()
+    tariffs = db.table('referentiel_tarifs_energie')\
+        .select('annee, mois, type_tarif, puissance_min_kva, puissance_max_kva, prix_moyen_kwh, prix_min_kwh, prix_max_kwh')\
+        .execute()
+    return RuleEngine(rules.data or [], tariffs.data or [])
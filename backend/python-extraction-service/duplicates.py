@@ -0,0 +1,288 @@
+"""
+Détection des factures en double avant extraction
+Index en mémoire des factures récentes (chargé depuis factures, complété à chaque extraction) :
+- empreinte SHA-256 du fichier, même calcul que fichier_hash à l'upload
+- PDL + période (+ fournisseur), lus dans la couche texte des PDF (pdftotext) ou dans le texte OCR
+- empreinte perceptuelle (dHash 64 bits) des photos
+Un doublon exact réutilise l'extraction de la facture d'origine (ni OCR ni LLM) ;
+les quasi-doublons (période chevauchante, autre fournisseur, image proche) sont signalés pour rapprochement
+"""
+import hashlib
+import os
+import re
+import subprocess
+import time
+import unicodedata
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+DUPLICATE_DETECTION_ENABLED = os.getenv("DUPLICATE_DETECTION_ENABLED", "true").lower() == "true"
+# Factures chargées dans l'index : uploads des N derniers jours
+DUPLICATE_INDEX_DAYS = int(os.getenv("DUPLICATE_INDEX_DAYS", "400"))
+DUPLICATE_INDEX_REFRESH_SECONDS = int(os.getenv("DUPLICATE_INDEX_REFRESH_SECONDS", "900"))
+# Distance de Hamming maximale entre deux dHash pour signaler une image similaire
+DUPLICATE_PHASH_MAX_DISTANCE = int(os.getenv("DUPLICATE_PHASH_MAX_DISTANCE", "4"))
+DUPLICATE_TEXT_LAYER_PAGES = int(os.getenv("DUPLICATE_TEXT_LAYER_PAGES", "2"))
+DUPLICATE_TEXT_LAYER_TIMEOUT = float(os.getenv("DUPLICATE_TEXT_LAYER_TIMEOUT", "5"))
+
+DUPLICATE_INDEX_FIELDS = (
+    'id', 'fichier_hash', 'fichier_phash', 'pdl', 'periode_debut', 'periode_fin', 'fournisseur',
+    'statut_extraction', 'confiance_globale', 'doublon_de', 'date_upload'
+)
+# Factures dont l'extraction peut être réutilisée
+EXTRACTED_STATUSES = {'extraite', 'validée', 'en_attente_validation'}
+
+PDL_RE = re.compile(
+    r"(?:\bPDL\b|\bPRM\b|point\s+de\s+livraison|point\s+de\s+r[ée]f[ée]rence\s+mesure)\D{0,40}?((?:\d[ \t]?){13}\d)",
+    re.IGNORECASE
+)
+MONTHS = {
+    'janvier': 1, 'fevrier': 2, 'mars': 3, 'avril': 4, 'mai': 5, 'juin': 6, 'juillet': 7,
+    'aout': 8, 'septembre': 9, 'octobre': 10, 'novembre': 11, 'decembre': 12,
+}
+DATE_PATTERN = r"\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{1,2}(?:er)?\s+[a-zéû]+\s+\d{4}"
+PERIOD_RE = re.compile(rf"\bdu\s+({DATE_PATTERN})\s+au\s+({DATE_PATTERN})", re.IGNORECASE)
+# Nom normalisé -> fournisseur canonique (comparaison seulement)
+SUPPLIER_ALIASES = (
+    ('electricite de france', 'edf'), ('edf', 'edf'), ('engie', 'engie'),
+    ('total direct energie', 'totalenergies'), ('totalenergies', 'totalenergies'),
+    ('total energies', 'totalenergies'), ('vattenfall', 'vattenfall'), ('ekwateur', 'ekwateur'),
+    ('enercoop', 'enercoop'), ('alpiq', 'alpiq'), ('mint energie', 'mint'), ('ohm energie', 'ohm'),
+    ('plum energie', 'plum'), ('ilek', 'ilek'), ('eni', 'eni'), ('gazel energie', 'gazel'),
+    ('electricite de strasbourg', 'es'), ('octopus energy', 'octopus'),
+)
+
+
+def normalize_text(text: Optional[str]) -> str:
+    text = unicodedata.normalize('NFKD', (text or '').lower())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r'\s+', ' ', re.sub(r'[^a-z0-9]+', ' ', text)).strip()
+
+
+def normalize_supplier(name: Optional[str]) -> Optional[str]:
+    """Supplier name (LLM output or invoice text) -> canonical key, None when unknown"""
+    normalized = normalize_text(name)
+    if not normalized:
+        return None
+    padded = f" {normalized} "
+    for alias, canonical in SUPPLIER_ALIASES:
+        if f" {alias} " in padded:
+            return canonical
+    return normalized
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """dd/mm/yyyy, dd.mm.yy, '1er janvier 2024' or ISO -> date"""
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return date.fromisoformat(value[:10])
+    except ValueError:
+        pass
+    match = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{2,4})", value)
+    if match:
+        day, month, year = (int(part) for part in match.groups())
+    else:
+        match = re.fullmatch(r"(\d{1,2})(?:er)?\s+([a-zéû]+)\s+(\d{4})", value, re.IGNORECASE)
+        if not match or normalize_text(match.group(2)) not in MONTHS:
+            return None
+        day, month, year = int(match.group(1)), MONTHS[normalize_text(match.group(2))], int(match.group(3))
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+
+def parse_invoice_key(text: str) -> Dict[str, Any]:
+    """
+    Cheap read of the duplicate key in raw text (PDF text layer or OCR):
+    {'pdl', 'periode_debut', 'periode_fin', 'fournisseur'}, None for what was not found
+    """
+    key: Dict[str, Any] = {'pdl': None, 'periode_debut': None, 'periode_fin': None, 'fournisseur': None}
+    match = PDL_RE.search(text)
+    if match:
+        key['pdl'] = re.sub(r'\s+', '', match.group(1))
+    for match in PERIOD_RE.finditer(text):
+        debut, fin = parse_date(match.group(1)), parse_date(match.group(2))
+        if debut and fin and debut <= fin:
+            key['periode_debut'], key['periode_fin'] = debut, fin
+            break
+    # Premier fournisseur cité dans l'en-tête (les autres noms viennent des mentions légales, du TURPE...)
+    padded = f" {normalize_text(text[:5000])} "
+    found = [(padded.find(f" {alias} "), canonical) for alias, canonical in SUPPLIER_ALIASES]
+    found = [(position, canonical) for position, canonical in found if position >= 0]
+    key['fournisseur'] = min(found)[1] if found else None
+    return key
+
+
+def invoice_key(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Same key from extracted data or a factures row"""
+    pdl = re.sub(r'\s+', '', str(data['pdl'])) if data.get('pdl') else None
+    return {
+        'pdl': pdl,
+        'periode_debut': parse_date(data.get('periode_debut')),
+        'periode_fin': parse_date(data.get('periode_fin')),
+        'fournisseur': normalize_supplier(data.get('fournisseur'))
+    }
+
+
+def is_complete(key: Dict[str, Any]) -> bool:
+    return bool(key['pdl'] and key['periode_debut'] and key['periode_fin'])
+
+
+def file_sha256(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_dhash(file_path: str) -> Optional[str]:
+    """64-bit difference hash of a photo (hex), robust to re-encoding and resizing"""
+    from PIL import Image, ImageOps
+
+    try:
+        with Image.open(file_path) as image:
+            small = ImageOps.exif_transpose(image).convert('L').resize((9, 8), Image.LANCZOS)
+    except Exception:
+        return None
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def pdf_text_layer(file_path: str, pages: int = DUPLICATE_TEXT_LAYER_PAGES) -> str:
+    """Text layer of the first pages (pdftotext, installed with poppler); '' for scanned PDFs"""
+    try:
+        result = subprocess.run(
+            ['pdftotext', '-l', str(pages), '-layout', file_path, '-'],
+            capture_output=True, timeout=DUPLICATE_TEXT_LAYER_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return ''
+    return result.stdout.decode('utf-8', errors='replace') if result.returncode == 0 else ''
+
+
+def fingerprint_file(file_path: str, is_pdf: bool) -> Dict[str, Any]:
+    """{'fichier_hash', 'fichier_phash', 'key'}: everything available before OCR"""
+    fingerprint = {'fichier_hash': file_sha256(file_path), 'fichier_phash': None, 'key': None}
+    if is_pdf:
+        text = pdf_text_layer(file_path)
+        if text.strip():
+            fingerprint['key'] = parse_invoice_key(text)
+    else:
+        fingerprint['fichier_phash'] = image_dhash(file_path)
+    return fingerprint
+
+
+class DuplicateIndex:
+    """Recent invoices by file hash, by PDL and by perceptual hash"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        started = time.perf_counter()
+        self.factures: Dict[str, Dict[str, Any]] = {}
+        self.by_hash: Dict[str, List[str]] = defaultdict(list)
+        self.by_pdl: Dict[str, List[str]] = defaultdict(list)
+        self.phashes: Dict[str, int] = {}
+        for row in rows:
+            self.record(str(row['id']), row)
+        self.loaded_at = time.monotonic()
+        self.build_seconds = time.perf_counter() - started
+
+    def record(self, facture_id: str, data: Dict[str, Any]):
+        """Add or update one invoice (factures row, or fields known after an extraction)"""
+        entry = self.factures.setdefault(facture_id, {'id': facture_id})
+        entry.update({field: data[field] for field in DUPLICATE_INDEX_FIELDS if field in data and field != 'id'})
+        entry['key'] = invoice_key(entry)
+
+        if entry.get('fichier_hash') and facture_id not in self.by_hash[entry['fichier_hash']]:
+            self.by_hash[entry['fichier_hash']].append(facture_id)
+        if entry['key']['pdl'] and facture_id not in self.by_pdl[entry['key']['pdl']]:
+            self.by_pdl[entry['key']['pdl']].append(facture_id)
+        if entry.get('fichier_phash'):
+            self.phashes[facture_id] = int(entry['fichier_phash'], 16)
+
+    def original_of(self, facture_id: str) -> Optional[str]:
+        """The invoice whose extraction can be reused: follows doublon_de, requires an extracted status"""
+        seen = set()
+        while facture_id in self.factures and facture_id not in seen:
+            seen.add(facture_id)
+            entry = self.factures[facture_id]
+            if entry.get('doublon_de') and str(entry['doublon_de']) in self.factures:
+                facture_id = str(entry['doublon_de'])
+                continue
+            return facture_id if entry.get('statut_extraction') in EXTRACTED_STATUSES else None
+        return None
+
+    def file_hash_of(self, facture_id: str) -> Optional[str]:
+        return self.factures.get(facture_id, {}).get('fichier_hash')
+
+    def match_file(self, facture_id: str, file_hash: Optional[str]) -> Optional[str]:
+        """Earliest other extracted invoice with the same file"""
+        for other in self.by_hash.get(file_hash or '', ()):
+            original = self.original_of(other) if other != facture_id else None
+            if original and original != facture_id:
+                return original
+        return None
+
+    def match_key(self, facture_id: str, key: Dict[str, Any]) -> Tuple[Optional[str], List[Dict[str, Any]]]:
+        """
+        (original, near-duplicates) for a PDL + period key
+        Same PDL and period with a compatible supplier (equal, or unknown on either side) is a duplicate;
+        same period with another supplier or an overlapping period is a near-duplicate
+        """
+        if not is_complete(key):
+            return None, []
+        original, near = None, []
+        for other in self.by_pdl.get(key['pdl'], ()):
+            if other == facture_id:
+                continue
+            other_key = self.factures[other]['key']
+            if not (other_key['periode_debut'] and other_key['periode_fin']):
+                continue
+            if other_key['periode_debut'] > key['periode_fin'] or other_key['periode_fin'] < key['periode_debut']:
+                continue
+            same_period = (other_key['periode_debut'], other_key['periode_fin']) == (key['periode_debut'], key['periode_fin'])
+            same_supplier = not key['fournisseur'] or not other_key['fournisseur'] or key['fournisseur'] == other_key['fournisseur']
+            if same_period and same_supplier:
+                candidate = self.original_of(other)
+                if candidate and candidate != facture_id:
+                    original = original or candidate
+                    continue
+                # Facture d'origine pas encore extraite : rapprochement seulement
+                motif = 'meme_periode'
+            else:
+                motif = 'fournisseur_different' if same_period else 'periode_chevauchante'
+            near.append({'facture_id': other, 'motif': motif})
+        return original, near
+
+    def match_image(self, facture_id: str, phash: Optional[str]) -> List[Dict[str, Any]]:
+        if not phash:
+            return []
+        value = int(phash, 16)
+        return [
+            {'facture_id': other, 'motif': 'image_similaire', 'distance': distance}
+            for other, other_value in self.phashes.items()
+            if other != facture_id and (distance := (value ^ other_value).bit_count()) <= DUPLICATE_PHASH_MAX_DISTANCE
+        ]
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self.loaded_at > DUPLICATE_INDEX_REFRESH_SECONDS
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'factures': len(self.factures),
+            'file_hashes': len(self.by_hash),
+            'pdl': len(self.by_pdl),
+            'images': len(self.phashes),
+            'age_seconds': round(time.monotonic() - self.loaded_at),
+            'build_seconds': round(self.build_seconds, 3)
+        }
@@ -0,0 +1,180 @@
+"""
+Cache des réponses LLM
+Clé : hash du texte OCR normalisé + version du prompt + modèle + température (+ contexte fournisseur)
+LRU en mémoire, stockage persistant SQLite local et regroupement des requêtes identiques simultanées
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from metrics import LLM_CACHE_REQUESTS
+
+logger = logging.getLogger("extraction-service")
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+# Par défaut à côté du module (/app/cache dans le conteneur), inscriptible aussi hors Docker
+LLM_CACHE_PATH = os.getenv(
+    "LLM_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "llm_cache.sqlite3")
+)
+LLM_CACHE_MAX_PERSISTENT_ENTRIES = int(os.getenv("LLM_CACHE_MAX_PERSISTENT_ENTRIES", "50000"))
+
+
+def normalize_ocr_text(text: str) -> str:
+    """Unicode NFC, collapsed whitespace: re-uploads of the same invoice hash identically"""
+    text = unicodedata.normalize('NFC', text)
+    return re.sub(r'\s+', ' ', text).strip()
+
+
+def make_cache_key(ocr_text: str, prompt_version: Optional[str], model: str, temperature: float, context: str = "") -> str:
+    payload = json.dumps(
+        [normalize_ocr_text(ocr_text), prompt_version, model, round(temperature, 4), context],
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PersistentStore:
+    """SQLite key/value store with least-recently-used eviction"""
+
+    def __init__(self, path: str, max_entries: int):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS llm_cache ('
+            ' key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)')
+        self.conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute('SELECT value FROM llm_cache WHERE key = ?', (key,)).fetchone()
+            if row:
+                self.conn.execute('UPDATE llm_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+                self.conn.commit()
+            return row[0] if row else None
+
+    def set(self, key: str, value: str):
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO llm_cache (key, value, last_access) VALUES (?, ?, ?)',
+                (key, value, time.time())
+            )
+            self.conn.execute(
+                'DELETE FROM llm_cache WHERE key IN ('
+                ' SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            self.conn.commit()
+
+
+class InFlight:
+    """One shared computation and the number of callers waiting for it"""
+    __slots__ = ('task', 'waiters')
+
+    def __init__(self, task: "asyncio.Task[str]"):
+        self.task = task
+        self.waiters = 0
+
+
+class LLMResponseCache:
+    """
+    Two-level cache of validated InvoiceData dicts
+    Values are stored as JSON so every hit returns a fresh copy.
+    SQLite reads and writes run in worker threads, never on the event loop
+    """
+
+    def __init__(
+        self,
+        max_entries: int = LLM_CACHE_MAX_ENTRIES,
+        path: Optional[str] = LLM_CACHE_PATH,
+        max_persistent_entries: int = LLM_CACHE_MAX_PERSISTENT_ENTRIES
+    ):
+        self.max_entries = max_entries
+        self.memory: "OrderedDict[str, str]" = OrderedDict()
+        self.store = None
+        if path:
+            try:
+                self.store = PersistentStore(path, max_persistent_entries)
+            except (OSError, sqlite3.Error) as e:
+                # Un cache inutilisable ne doit pas faire échouer les extractions
+                logger.warning(f"Cache LLM persistant indisponible ({path}), cache mémoire seul: {e}")
+        self.inflight: Dict[str, InFlight] = {}
+
+    def _remember(self, key: str, value: str):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory.move_to_end(key)
+            return json.loads(value)
+        if self.store:
+            value = await asyncio.to_thread(self.store.get, key)
+            if value is not None:
+                self._remember(key, value)
+                return json.loads(value)
+        return None
+
+    async def set(self, key: str, data: Dict[str, Any]):
+        value = json.dumps(data, ensure_ascii=False)
+        self._remember(key, value)
+        if self.store:
+            await asyncio.to_thread(self.store.set, key, value)
+
+    async def _compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> str:
+        try:
+            data = await compute()
+            if data:
+                await self.set(key, data)
+            return json.dumps(data, ensure_ascii=False)
+        finally:
+            flight = self.inflight.get(key)
+            if flight is not None and flight.task is asyncio.current_task():
+                del self.inflight[key]
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        """
+        Return the cached result, or run compute() once for all concurrent
+        callers with the same key. Empty results (LLM failures) are not cached.
+        The computation runs in its own task: a cancelled caller (the first one included)
+        does not cancel it for the others; it is only cancelled when nobody waits anymore
+        """
+        cached = await self.get(key)
+        if cached is not None:
+            LLM_CACHE_REQUESTS.labels('hit').inc()
+            return cached
+
+        flight = self.inflight.get(key)
+        if flight is not None:
+            LLM_CACHE_REQUESTS.labels('coalesced').inc()
+        else:
+            LLM_CACHE_REQUESTS.labels('miss').inc()
+            flight = self.inflight[key] = InFlight(asyncio.create_task(self._compute(key, compute)))
+
+        flight.waiters += 1
+        try:
+            return json.loads(await asyncio.shield(flight.task))
+        finally:
+            flight.waiters -= 1
+            if flight.waiters == 0 and not flight.task.done():
+                # Plus personne n'attend : la clé est libérée tout de suite pour un nouvel appel
+                if self.inflight.get(key) is flight:
+                    del self.inflight[key]
+                flight.task.cancel()
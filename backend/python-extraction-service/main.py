@@ -3,22 +3,55 @@ Service d'extraction intelligente de factures d'électricité
 OCR + LLM avec apprentissage continu
 """
 import os
+import re
 import requests
 import json
 import asyncio
-from typing import Dict, Any, Optional, List
-from datetime import datetime
-from io import BytesIO
+import logging
+import tempfile
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Dict, Any, Optional, List, AsyncIterator, Literal, Tuple, get_args
+from collections import Counter
+from datetime import date, datetime, timedelta
+from urllib.parse import urlparse, unquote
 
 from fastapi import FastAPI, HTTPException, UploadFile, File, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel, Field
-from paddleocr import PaddleOCR
-from pdf2image import convert_from_bytes
 import httpx
-from supabase import create_client, Client
-from PIL import Image
-import numpy as np
+
+from ocr_engines import OCREngine, OCRLine, create_ocr_engine
+from ocr_batcher import OCR_BATCH_ENABLED, OCR_BATCH_REC_BATCH_NUM, OCRBatcher, wait_result
+from pattern_learning import PatternAggregator
+from llm_cache import LLM_CACHE_ENABLED, LLMResponseCache, make_cache_key
+from repository import Repository, create_repository
+from ocr_store import OCR_BLOB_STORE_ENABLED, KnownHashes, build_ocr_blob, read_ocr_boxes
+from admission import DEFAULT_PRIORITY, Overloaded, admission
+from profiling import ProfilingMiddleware, create_profiling_router, install_profiling_hooks
+from duplicates import (
+    DUPLICATE_DETECTION_ENABLED, DUPLICATE_INDEX_DAYS, DUPLICATE_INDEX_FIELDS,
+    DuplicateIndex, fingerprint_file, invoice_key, parse_invoice_key
+)
+from cascade import (
+    LLM_CASCADE_ENABLED, LLM_CASCADE_TIERS, RULES_TIER,
+    basic_coherence_failures, blend_confidence, cascade_stats, run_cascade, set_path
+)
+from metrics import (
+    DUPLICATES, EXTRACTIONS, EXTRACTION_LATENCY, OCR_PAGES, STAGE_ERRORS,
+    annotate, record_llm_stats, record_stage, render_metrics, start_request_timings, timed_stage, track_stage
+)
+
+# Modules lourds (PaddleOCR, pdf2image, numpy, PIL, supabase) importés à la demande
+# pour que l'API soit prête immédiatement après le démarrage
+if TYPE_CHECKING:
+    import numpy as np
+    from PIL import Image
+    from supabase import Client
+    from coherence_rules import RuleEngine
+    from metrics import RequestTimings
 
 # Configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -26,7 +59,35 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OCR_CONFIDENCE_THRESHOLD = float(os.getenv("OCR_CONFIDENCE_THRESHOLD", "0.6"))
 LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", "0.1"))
-
+MAX_DOWNLOAD_SIZE_MB = float(os.getenv("MAX_DOWNLOAD_SIZE_MB", "20"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", "65536"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+# Racine locale du stockage Supabase (self-hosted : volume monté), optionnelle
+SUPABASE_STORAGE_LOCAL_ROOT = os.getenv("SUPABASE_STORAGE_LOCAL_ROOT")
+# Buckets lus directement sur disque (préfixes), les autres passent par une URL signée
+SUPABASE_STORAGE_LOCAL_BUCKET_PREFIXES = tuple(
+    p.strip() for p in os.getenv("SUPABASE_STORAGE_LOCAL_BUCKET_PREFIXES", "factures-").split(",") if p.strip()
+)
+SIGNED_URL_EXPIRES_IN = int(os.getenv("SIGNED_URL_EXPIRES_IN", "60"))
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+# Préchauffage en échec : nouvel essai après WARMUP_RETRY_BASE_SECONDS * 2^essais, plafonné
+WARMUP_RETRY_BASE_SECONDS = float(os.getenv("WARMUP_RETRY_BASE_SECONDS", "5"))
+WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", "300"))
+DEFAULT_LLM_MODEL = "mistral:7b-instruct-q4_K_M"
+LEARN_INSERT_CHUNK_SIZE = int(os.getenv("LEARN_INSERT_CHUNK_SIZE", "500"))
+# 0 = agrégateur de patterns désactivé sur cette instance (à activer sur une seule réplique)
+PATTERN_LEARNING_INTERVAL_SECONDS = int(os.getenv("PATTERN_LEARNING_INTERVAL_SECONDS", "0"))
+COHERENCE_RULES_ENABLED = os.getenv("COHERENCE_RULES_ENABLED", "true").lower() == "true"
+# Sans erreur de cohérence bloquante, validation automatique au-dessus de ce seuil
+COHERENCE_AUTO_APPROVE_CONFIDENCE = float(os.getenv("COHERENCE_AUTO_APPROVE_CONFIDENCE", "0.6"))
+# Seuil historique, utilisé quand aucune règle n'est active
+VALIDATION_CONFIDENCE_THRESHOLD = 0.8
+FACTURE_COHERENCE_FLAGS = ('coherence_prix_unitaire', 'coherence_periode', 'coherence_puissance')
+
+logger = logging.getLogger("extraction-service")
+
+@timed_stage('call_llm_chat')
 def call_llm_chat(system_prompt: str, user_prompt: str, model: str, temperature: float):
     """
     Appelle Ollama pour générer une réponse LLM.
@@ -41,15 +102,28 @@ def call_llm_chat(system_prompt: str, user_prompt: str, model: str, temperature:
             "temperature": temperature,
             "num_predict": 1000
         },
-        "stream": False
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE
     }
     r = requests.post(f"{OLLAMA_BASE_URL}/api/chat", json=payload, timeout=120)
     r.raise_for_status()
-    return r.json()
+    response = r.json()
+    record_llm_stats(model, response)
+    return response
 
 # Initialize services
 app = FastAPI(title="Facture Extraction Service", version="1.0.0")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+
+# Client Supabase (lazy loading)
+supabase_client: Optional["Client"] = None
+
+def get_supabase() -> "Client":
+    """Lazy initialization of the Supabase client"""
+    global supabase_client
+    if supabase_client is None:
+        from supabase import create_client
+        supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    return supabase_client
 
 @app.get("/extract/test")
 async def test_extract():
@@ -79,28 +153,86 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Profilage d'une requête à la demande (en-têtes X-Profile / X-Profiling-Token)
+app.add_middleware(ProfilingMiddleware, trace_paths=['/extract'])
 
-# Initialize PaddleOCR (lazy loading)
-ocr_engine = None
+# Initialize OCR engine (lazy loading, backend chosen by OCR_ENGINE)
+ocr_engine: Optional[OCREngine] = None
 
-def get_ocr_engine():
+def get_ocr_engine() -> OCREngine:
     """Lazy initialization of OCR engine"""
     global ocr_engine
     if ocr_engine is None:
-        ocr_engine = PaddleOCR(
-            use_angle_cls=True,
-            lang='fr',
-            use_gpu=False,  # Set to True if GPU available
-            show_log=False
-        )
+        # Avec le micro-batching, lots de reconnaissance dimensionnés pour plusieurs pages
+        ocr_engine = create_ocr_engine(rec_batch_num=OCR_BATCH_REC_BATCH_NUM) if OCR_BATCH_ENABLED else create_ocr_engine()
     return ocr_engine
 
 
+# Micro-batching des pages devant le moteur OCR (OCR_BATCH_ENABLED)
+ocr_batcher: Optional[OCRBatcher] = None
+ocr_batcher_lock = threading.Lock()
+
+def get_ocr_batcher() -> Optional[OCRBatcher]:
+    """Lazy initialization of the OCR batcher, None when batching is disabled"""
+    global ocr_batcher
+    if OCR_BATCH_ENABLED and ocr_batcher is None:
+        # Appelé depuis plusieurs threads OCR : un seul batcher (et un seul moteur)
+        with ocr_batcher_lock:
+            if ocr_batcher is None:
+                ocr_batcher = OCRBatcher(get_ocr_engine())
+    return ocr_batcher
+
+
+# Cache des réponses LLM (lazy loading)
+llm_cache: Optional[LLMResponseCache] = None
+
+def get_llm_cache() -> LLMResponseCache:
+    """Lazy initialization of the LLM response cache"""
+    global llm_cache
+    if llm_cache is None:
+        llm_cache = LLMResponseCache()
+    return llm_cache
+
+
+# Règles de cohérence compilées (chargées une fois, rechargées via /coherence/reload)
+rule_engine: Optional["RuleEngine"] = None
+rule_engine_lock = asyncio.Lock()
+
+async def get_rule_engine() -> "RuleEngine":
+    """Lazy loading of the compiled coherence rules and tariff index (Supabase reads in a worker thread)"""
+    global rule_engine
+    if rule_engine is None:
+        async with rule_engine_lock:
+            if rule_engine is None:
+                from coherence_rules import load_rule_engine
+                rule_engine = await asyncio.to_thread(load_rule_engine, get_supabase())
+                logger.info(f"Règles de cohérence chargées: {len(rule_engine.rules)} actives, {len(rule_engine.tariffs)} tarifs")
+    return rule_engine
+
+
+def coherence_failures(engine: Optional["RuleEngine"], data: Dict[str, Any]) -> set:
+    """Fields failing the coherence rules (cascade escalation)"""
+    if engine is None or not engine.rules:
+        return basic_coherence_failures(data)
+    return engine.failing_fields(data)
+
+
+@timed_stage('coherence_rules')
+async def evaluate_coherence(extracted_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Coherence report of one extraction, None when no rule applies"""
+    if not COHERENCE_RULES_ENABLED:
+        return None
+    engine = await get_rule_engine()
+    return engine.evaluate(extracted_data) if engine.rules else None
+
+
 # Pydantic models
 class ExtractionRequest(BaseModel):
     facture_id: str
     file_url: str
     supplier_hint: Optional[str] = None
+    # 'bulk' pour les reprises en masse : servies après les validations interactives
+    priority: Literal['interactive', 'bulk'] = DEFAULT_PRIORITY
 
 
 class CorrectionItem(BaseModel):
@@ -114,11 +246,22 @@ class LearningRequest(BaseModel):
     corrections: Dict[str, CorrectionItem]
 
 
+class BatchLearningRequest(BaseModel):
+    items: List[LearningRequest]
+
+
 class ExtractionResponse(BaseModel):
     extraction_id: str
     extracted_data: Dict[str, Any]
     confidence: Dict[str, Any]
     ocr_metadata: Dict[str, Any]
+    coherence: Optional[Dict[str, Any]] = None
+    # Doublon (doublon_de, match) ou quasi-doublons signalés (doublons_potentiels)
+    duplicate: Optional[Dict[str, Any]] = None
+
+
+class CoherenceBatchRequest(BaseModel):
+    invoices: List[Dict[str, Any]]
 
 # === NOUVELLES CLASSES PYDANTIC (à ajouter après les imports) ===
 class TarifFourniture(BaseModel):
@@ -178,32 +321,241 @@ class InvoiceData(BaseModel):
     accise: Optional[float] = Field(None, description="Montant accise en €")
     montant_accise: Optional[float] = Field(None, description="Montant accise en €")
 
-    @validator('temporalite')
-    def validate_temporalite(cls, v):
-        if v not in [None, 'base', 'hp_hc', 'tempo', 'ejp']:
-            raise ValueError("Temporalité invalide")
-        return v
+
+def _field_type(annotation: Any) -> Any:
+    """Optional[X] -> X"""
+    args = [arg for arg in get_args(annotation) if arg is not type(None)]
+    return args[0] if args else annotation
+
+
+def build_invoice_field_paths() -> Dict[str, Tuple[str, Any]]:
+    """
+    Leaf field name -> (dotted path in InvoiceData, python type)
+    e.g. 'conso_hp' -> ('conso.conso_hp', float)
+    """
+    paths = {}
+    for name, field in InvoiceData.model_fields.items():
+        field_type = _field_type(field.annotation)
+        if isinstance(field_type, type) and issubclass(field_type, BaseModel):
+            for sub_name, sub_field in field_type.model_fields.items():
+                paths[sub_name] = (f"{name}.{sub_name}", _field_type(sub_field.annotation))
+        else:
+            paths[name] = (name, field_type)
+    return paths
+
+
+INVOICE_FIELD_PATHS = build_invoice_field_paths()
+
+# Client HTTP partagé (pool de connexions keep-alive)
+http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Lazy initialization of the shared, pooled HTTP client"""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_CONNECTIONS // 2
+            ),
+            follow_redirects=True
+        )
+    return http_client
+
+
+@app.on_event("shutdown")
+async def close_http_client():
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+
+# Accès base (pool asyncpg ou PostgREST), créé au premier appel
+repository: Optional[Repository] = None
+repository_lock = asyncio.Lock()
+
+
+async def get_repository() -> Repository:
+    """Lazy initialization of the data access layer"""
+    global repository
+    if repository is None:
+        async with repository_lock:
+            if repository is None:
+                repository = await create_repository(get_supabase)
+    return repository
+
+
+# Index des factures récentes pour la détection des doublons (chargé au premier /extract)
+duplicate_index: Optional[DuplicateIndex] = None
+duplicate_index_lock = asyncio.Lock()
+
+async def load_duplicate_index() -> DuplicateIndex:
+    since = date.today() - timedelta(days=DUPLICATE_INDEX_DAYS)
+    rows = await (await get_repository()).get_recent_factures(list(DUPLICATE_INDEX_FIELDS), since)
+    index = DuplicateIndex(rows)
+    logger.info(f"Index des doublons chargé: {len(index.factures)} factures en {index.build_seconds:.2f}s")
+    return index
+
+
+async def get_duplicate_index() -> DuplicateIndex:
+    """Lazy loading of the duplicate index, reloaded once older than DUPLICATE_INDEX_REFRESH_SECONDS"""
+    global duplicate_index
+    # Pendant un rechargement, les requêtes continuent sur l'index courant
+    if duplicate_index is None or (duplicate_index.is_stale() and not duplicate_index_lock.locked()):
+        async with duplicate_index_lock:
+            if duplicate_index is None or duplicate_index.is_stale():
+                duplicate_index = await load_duplicate_index()
+    return duplicate_index
+
+
+@app.on_event("shutdown")
+async def close_repository():
+    global repository
+    if repository is not None:
+        await repository.close()
+        repository = None
+
+
+class FileTooLargeError(ValueError):
+    """Raised when a downloaded file exceeds MAX_DOWNLOAD_SIZE_MB"""
+
 
 # Helper functions
-async def download_file(url: str) -> bytes:
-    """Download file from URL"""
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        response = await client.get(url)
+def parse_storage_url(url: str) -> Optional[Dict[str, str]]:
+    """
+    Reconnaît une URL du stockage Supabase du projet.
+    Returns: {'access': 'sign'|'public'|'authenticated', 'bucket': str, 'path': str} ou None
+    """
+    if not SUPABASE_URL:
+        return None
+    parsed = urlparse(url)
+    if parsed.netloc != urlparse(SUPABASE_URL).netloc:
+        return None
+
+    prefix = '/storage/v1/object/'
+    if not parsed.path.startswith(prefix):
+        return None
+
+    parts = parsed.path[len(prefix):].split('/', 2)
+    if len(parts) != 3 or parts[0] not in ('sign', 'public', 'authenticated'):
+        return None
+
+    return {'access': parts[0], 'bucket': parts[1], 'path': unquote(parts[2])}
+
+
+def local_storage_path(bucket: str, object_path: str) -> Optional[str]:
+    """Chemin local d'un objet du stockage si le volume Supabase est monté"""
+    if not SUPABASE_STORAGE_LOCAL_ROOT or not bucket.startswith(SUPABASE_STORAGE_LOCAL_BUCKET_PREFIXES):
+        return None
+    root = os.path.realpath(SUPABASE_STORAGE_LOCAL_ROOT)
+    candidate = os.path.realpath(os.path.join(root, bucket, object_path))
+    if not candidate.startswith(root + os.sep) or not os.path.isfile(candidate):
+        return None
+    if os.path.getsize(candidate) > MAX_DOWNLOAD_SIZE_MB * 1024 * 1024:
+        raise FileTooLargeError(f"Fichier trop volumineux (> {MAX_DOWNLOAD_SIZE_MB} Mo)")
+    return candidate
+
+
+async def download_file(url: str, destination) -> int:
+    """
+    Stream file from URL into an open binary file object.
+    Returns the number of bytes written; aborts above MAX_DOWNLOAD_SIZE_MB.
+    """
+    max_bytes = int(MAX_DOWNLOAD_SIZE_MB * 1024 * 1024)
+    client = get_http_client()
+
+    async with client.stream('GET', url) as response:
         response.raise_for_status()
-        return response.content
 
+        content_length = response.headers.get('content-length')
+        if content_length and int(content_length) > max_bytes:
+            raise FileTooLargeError(f"Fichier trop volumineux (> {MAX_DOWNLOAD_SIZE_MB} Mo)")
+
+        total = 0
+        async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+            total += len(chunk)
+            if total > max_bytes:
+                raise FileTooLargeError(f"Fichier trop volumineux (> {MAX_DOWNLOAD_SIZE_MB} Mo)")
+            destination.write(chunk)
+
+    destination.flush()
+    return total
 
-def pdf_to_images(pdf_bytes: bytes) -> List[Image.Image]:
-    """Convert PDF to images"""
-    return convert_from_bytes(pdf_bytes, dpi=300)
 
+def create_signed_url(bucket: str, object_path: str) -> Optional[str]:
+    signed = get_supabase().storage.from_(bucket).create_signed_url(object_path, SIGNED_URL_EXPIRES_IN)
+    return signed.get('signedURL') or signed.get('signedUrl')
 
-def image_to_numpy(image: Image.Image) -> np.ndarray:
+
+@asynccontextmanager
+async def open_invoice_file(url: str) -> AsyncIterator[str]:
+    """
+    Yield a local file path for the invoice, without loading it in memory.
+    Storage objects are read in place when the bucket is mounted locally,
+    otherwise they are streamed (through a signed URL if needed) to a temp file.
+    """
+    storage_ref = parse_storage_url(url)
+    if storage_ref:
+        local_path = local_storage_path(storage_ref['bucket'], storage_ref['path'])
+        if local_path:
+            yield local_path
+            return
+        if storage_ref['access'] != 'sign':
+            # supabase-py est synchrone : hors de la boucle d'événements
+            url = await asyncio.to_thread(create_signed_url, storage_ref['bucket'], storage_ref['path']) or url
+
+    suffix = os.path.splitext(urlparse(url).path)[1]
+    tmp = tempfile.NamedTemporaryFile(suffix=suffix, delete=False)
+    try:
+        with tmp, track_stage('download_file'):
+            await download_file(url, tmp)
+        yield tmp.name
+    finally:
+        try:
+            os.unlink(tmp.name)
+        except FileNotFoundError:
+            pass
+
+
+def is_pdf_url(url: str) -> bool:
+    """Détecte un PDF d'après le chemin de l'URL (sans query string de signature)"""
+    return urlparse(url).path.lower().endswith('.pdf')
+
+
+@timed_stage('pdf_to_images')
+def pdf_to_images(pdf_path: str, dpi: int = 300) -> List["Image.Image"]:
+    """Convert PDF file to images"""
+    from pdf2image import convert_from_path
+    return convert_from_path(pdf_path, dpi=dpi)
+
+
+def image_to_numpy(image: "Image.Image") -> "np.ndarray":
     """Convert PIL Image to numpy array"""
+    import numpy as np
     return np.array(image)
 
 
-def extract_text_with_ocr(image: np.ndarray) -> Dict[str, Any]:
+def prepare_for_ocr(image: "Image.Image", orientation_known: bool = False) -> Dict[str, Any]:
+    """
+    Convert a PIL image to the OCR input array, with preprocessing if enabled
+    Returns: {'array': np.ndarray, 'use_cls': bool, 'preprocessing': Dict}
+    """
+    from preprocessing import OCR_PREPROCESS, preprocess_image
+
+    if not OCR_PREPROCESS:
+        return {'array': image_to_numpy(image), 'use_cls': True, 'preprocessing': {}}
+
+    with track_stage('preprocess_image'):
+        array, info = preprocess_image(image, orientation_known=orientation_known)
+    # Orientation connue (EXIF ou page PDF rendue) : classifieur d'angle inutile
+    return {'array': array, 'use_cls': not info['orientation_known'], 'preprocessing': info}
+
+
+@timed_stage('extract_text_with_ocr')
+def extract_text_with_ocr(image: "np.ndarray", use_cls: bool = True) -> Dict[str, Any]:
     """
     Extract text using PaddleOCR
     Returns: {
@@ -213,10 +565,48 @@ def extract_text_with_ocr(image: np.ndarray) -> Dict[str, Any]:
         'words': List[str]
     }
     """
-    ocr = get_ocr_engine()
-    result = ocr.ocr(image, cls=True)
+    batcher = get_ocr_batcher()
+    if batcher is not None:
+        lines = batcher.ocr(image, use_cls=use_cls)
+    else:
+        lines = get_ocr_engine().ocr(image, use_cls=use_cls)
+    OCR_PAGES.inc()
+    mark_warm('ocr')
+    return ocr_lines_to_data(lines)
+
 
-    if not result or not result[0]:
+def extract_pages_with_ocr(pages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    OCR of several prepared pages (prepare_for_ocr output)
+    With the batcher, every page is submitted at once so that they can share batches
+    """
+    batcher = get_ocr_batcher()
+    if batcher is None:
+        return [extract_text_with_ocr(page['array'], use_cls=page['use_cls']) for page in pages]
+
+    previous = time.perf_counter()
+    futures = [batcher.submit(page['array'], use_cls=page['use_cls']) for page in pages]
+    results = []
+    # Lots servis dans l'ordre d'arrivée : attendre les pages dans l'ordre donne la fin de chacune,
+    # enregistrée comme un appel par page (comme sans batcher) ; chaque page compte le temps écoulé
+    # depuis la fin de la précédente, la somme reste égale au temps réel
+    for future in futures:
+        try:
+            results.append(wait_result(future))
+        except Exception:
+            STAGE_ERRORS.labels('extract_text_with_ocr').inc()
+            raise
+        finished = time.perf_counter()
+        record_stage('extract_text_with_ocr', finished - previous)
+        previous = finished
+    OCR_PAGES.inc(len(pages))
+    mark_warm('ocr')
+    return [ocr_lines_to_data(lines) for lines in results]
+
+
+def ocr_lines_to_data(lines: List[OCRLine]) -> Dict[str, Any]:
+    """Engine lines -> {'text', 'confidence', 'boxes', 'words'}"""
+    if not lines:
         return {
             'text': '',
             'confidence': 0.0,
@@ -229,8 +619,7 @@ def extract_text_with_ocr(image: np.ndarray) -> Dict[str, Any]:
     words = []
     confidences = []
 
-    for line in result[0]:
-        box, (text, confidence) = line
+    for box, text, confidence in lines:
         text_lines.append(text)
         words.extend(text.split())
         boxes.append({
@@ -251,16 +640,61 @@ def extract_text_with_ocr(image: np.ndarray) -> Dict[str, Any]:
     }
 
 
+def ocr_document(file_path: str, is_pdf: bool) -> Dict[str, Any]:
+    """
+    Run OCR on every page of a local PDF or image file
+    Returns the merged OCR data plus 'total_pages'
+    """
+    if not is_pdf:
+        from PIL import Image
+
+        with Image.open(file_path) as image:
+            prepared = prepare_for_ocr(image)
+        ocr_data = extract_text_with_ocr(prepared['array'], use_cls=prepared['use_cls'])
+
+        if not ocr_data['text']:
+            raise HTTPException(status_code=400, detail="Aucun texte extrait du document")
+        return {**ocr_data, 'total_pages': 1}
+
+    images = pdf_to_images(file_path, dpi=300)
+    if not images:
+        raise HTTPException(status_code=400, detail="Aucune page trouvée dans le PDF")
+
+    full_text = ""
+    all_ocr_boxes = []
+    all_ocr_words = []
+    page_confidences = []
+
+    pages = [prepare_for_ocr(image, orientation_known=True) for image in images]
+    for page_num, ocr_data in enumerate(extract_pages_with_ocr(pages)):
+        if not ocr_data['text']:
+            logger.warning(f"Aucun texte extrait de la page {page_num + 1}")
+            continue
+
+        full_text += f"\n--- PAGE {page_num + 1} ---\n{ocr_data['text']}\n"
+        all_ocr_boxes.extend(ocr_data['boxes'])
+        all_ocr_words.extend(ocr_data['words'])
+        page_confidences.append(ocr_data['confidence'])
+
+    if not full_text.strip():
+        raise HTTPException(status_code=400, detail="Aucun texte extrait du document")
+
+    avg_ocr_confidence = sum(page_confidences) / len(page_confidences) if page_confidences else 0.0
+    return {
+        'text': full_text,
+        'confidence': avg_ocr_confidence,
+        'boxes': all_ocr_boxes,
+        'words': all_ocr_words,
+        'total_pages': len(page_confidences)
+    }
+
+
+@timed_stage('get_active_prompt')
 async def get_active_prompt() -> Dict[str, Any]:
     """Fetch active LLM prompt from database"""
-    result = supabase.table('llm_prompts')\
-        .select('*')\
-        .eq('is_active', True)\
-        .limit(1)\
-        .execute()
-
-    if result.data and len(result.data) > 0:
-        return result.data[0]
+    prompt = await (await get_repository()).get_active_prompt()
+    if prompt:
+        return prompt
 
     # Fallback default prompt
     return {
@@ -339,18 +773,13 @@ Règles supplémentaires :
 - Si "temporalite" est "hp_hc", alors les champs "hp" et "hc" sont attendus dans "conso" et "tarif_fourniture".
 - Utiliser null pour les valeurs manquantes ou non applicables.
 - Retourner UNIQUEMENT du JSON valide, sans texte supplémentaire.''',
-        'model_name': 'mistral:7b-instruct-q4_K_M'
+        'model_name': DEFAULT_LLM_MODEL
     }
 
 
 async def get_supplier_patterns(supplier: str) -> List[Dict[str, Any]]:
     """Fetch learned patterns for a supplier"""
-    result = supabase.table('patterns_fournisseurs')\
-        .select('*')\
-        .eq('nom_fournisseur', supplier)\
-        .execute()
-
-    return result.data if result.data else []
+    return await (await get_repository()).get_supplier_patterns(supplier)
 
 
 def build_few_shot_context(patterns: List[Dict[str, Any]], ocr_text: str) -> str:
@@ -360,8 +789,11 @@ def build_few_shot_context(patterns: List[Dict[str, Any]], ocr_text: str) -> str
 
     context = "\n\nExemples de patterns appris pour ce fournisseur :\n"
     for pattern in patterns[:3]:
-        if pattern.get('regex_specifiques'):
-            context += f"- {pattern.get('field_name', 'field')}: utiliser regex '{pattern.get('regex_specifiques')}'\n"
+        regex_specifiques = pattern.get('regex_specifiques')
+        if isinstance(regex_specifiques, dict):
+            regex_specifiques = regex_specifiques.get('regex')
+        if regex_specifiques:
+            context += f"- {pattern.get('field_name', 'field')}: utiliser regex '{regex_specifiques}'\n"
         if pattern.get('exemple_champs'):
             champ_exemple = pattern.get('exemple_champs')
             if isinstance(champ_exemple, dict):
@@ -372,7 +804,113 @@ def build_few_shot_context(patterns: List[Dict[str, Any]], ocr_text: str) -> str
     return context
 
 
-async def parse_with_llm(ocr_text: str, supplier_hint: Optional[str] = None) -> Dict[str, Any]:
+def coerce_field_value(raw: str, field_type: Any) -> Any:
+    """Convert a regex match to the InvoiceData field type ('1 520,50' -> 1520.5)"""
+    raw = raw.strip()
+    if field_type in (float, int):
+        number = float(re.sub(r'\s+', '', raw).replace(',', '.'))
+        return int(number) if field_type is int else number
+    date_match = re.fullmatch(r'(\d{2})[/.-](\d{2})[/.-](\d{4})', raw)
+    if date_match:
+        day, month, year = date_match.groups()
+        return f"{year}-{month}-{day}"
+    return raw
+
+
+@timed_stage('extract_with_rules')
+def extract_with_rules(ocr_text: str, patterns: List[Dict[str, Any]], fields: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Rule-based extractor: apply the supplier regexes published by the
+    pattern aggregator (patterns_fournisseurs.regex_specifiques)
+    """
+    data: Dict[str, Any] = {}
+    for pattern in patterns:
+        regex_specifiques = pattern.get('regex_specifiques')
+        field_name = pattern.get('field_name')
+        if not isinstance(regex_specifiques, dict) or field_name not in INVOICE_FIELD_PATHS:
+            continue
+        path, field_type = INVOICE_FIELD_PATHS[field_name]
+        if fields is not None and path not in fields:
+            continue
+        try:
+            match = re.search(regex_specifiques['regex'], ocr_text)
+            if match:
+                set_path(data, path, coerce_field_value(match.group(1), field_type))
+        except (re.error, ValueError, IndexError):
+            continue
+
+    try:
+        return InvoiceData(**data).dict(exclude_none=True) if data else {}
+    except Exception:
+        return {}
+
+
+def score_extracted_fields(extracted_data: Dict[str, Any], ocr_boxes: List[Dict]) -> Dict[str, float]:
+    """Per-field confidence, nested fields keyed as 'field.sub_field'"""
+    field_confidences = {}
+    for field, value in extracted_data.items():
+        if isinstance(value, dict):
+            for sub_field, sub_value in value.items():
+                field_confidences[f"{field}.{sub_field}"] = calculate_field_confidence(sub_field, sub_value, ocr_boxes)
+        else:
+            field_confidences[field] = calculate_field_confidence(field, value, ocr_boxes)
+    return field_confidences
+
+
+def restrict_prompt_to_fields(prompt: str, fields: Optional[List[str]]) -> str:
+    """Ask only for the escalated fields (full prompt when most fields are requested)"""
+    if not fields or len(fields) >= len(INVOICE_FIELD_PATHS) / 2:
+        return prompt
+    return prompt + (
+        "\n\nNe retourner QUE les champs suivants, avec la même structure JSON : "
+        + ", ".join(fields)
+    )
+
+
+async def run_llm_extraction(prompt: str, prompt_config: Dict[str, Any]) -> Dict[str, Any]:
+    """LLM call holding one of the 'llm' admission slots (cache hits never take one)"""
+    async with admission.stage('llm'):
+        data = await asyncio.to_thread(extract_invoice_data, prompt, prompt_config, LLM_TEMPERATURE)
+    if data:
+        mark_warm('llm')
+    return data
+
+
+async def extract_with_cascade(
+    ocr_text: str,
+    ocr_boxes: List[Dict],
+    ocr_confidence: float,
+    prompt: str,
+    prompt_config: Dict[str, Any],
+    patterns: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Run the configured model cascade (rules -> small model -> large model)"""
+    async def run_tier(tier: str, fields: Optional[List[str]]) -> Dict[str, Any]:
+        if tier == RULES_TIER:
+            return extract_with_rules(ocr_text, patterns, fields)
+        tier_config = {**prompt_config, 'model_name': tier}
+        return await run_llm_extraction(restrict_prompt_to_fields(prompt, fields), tier_config)
+
+    engine = await get_rule_engine() if COHERENCE_RULES_ENABLED else None
+    data, report = await run_cascade(
+        ocr_text,
+        run_tier,
+        lambda extracted: score_extracted_fields(extracted, ocr_boxes),
+        ocr_confidence,
+        lambda extracted: coherence_failures(engine, extracted),
+        LLM_CASCADE_TIERS,
+        [path for path, _ in INVOICE_FIELD_PATHS.values()]
+    )
+    annotate('cascade', report)
+    return data
+
+
+async def parse_with_llm(
+    ocr_text: str,
+    supplier_hint: Optional[str] = None,
+    ocr_boxes: Optional[List[Dict]] = None,
+    ocr_confidence: float = 0.0
+) -> Dict[str, Any]:
     """
     Parse OCR text using local LLM (Ollama + Mistral)
     Returns extracted structured data
@@ -382,6 +920,7 @@ async def parse_with_llm(ocr_text: str, supplier_hint: Optional[str] = None) ->
 
     # Get supplier patterns if hint provided
     few_shot_context = ""
+    patterns = []
     if supplier_hint:
         patterns = await get_supplier_patterns(supplier_hint)
         few_shot_context = build_few_shot_context(patterns, ocr_text)
@@ -390,7 +929,26 @@ async def parse_with_llm(ocr_text: str, supplier_hint: Optional[str] = None) ->
     prompt = prompt_config['prompt_template'].format(ocr_text=ocr_text)
     prompt += few_shot_context
 
-    return extract_invoice_data(prompt, prompt_config, LLM_TEMPERATURE)
+    if LLM_CASCADE_ENABLED:
+        model_key = "cascade:" + ",".join(LLM_CASCADE_TIERS)
+        compute = lambda: extract_with_cascade(
+            ocr_text, ocr_boxes or [], ocr_confidence, prompt, prompt_config, patterns
+        )
+    else:
+        model_key = prompt_config.get('model_name', DEFAULT_LLM_MODEL)
+        compute = lambda: run_llm_extraction(prompt, prompt_config)
+
+    if not LLM_CACHE_ENABLED:
+        return await compute()
+
+    cache_key = make_cache_key(
+        ocr_text,
+        prompt_config.get('version'),
+        model_key,
+        LLM_TEMPERATURE,
+        few_shot_context
+    )
+    return await get_llm_cache().get_or_compute(cache_key, compute)
 
     # Call Ollama
 def extract_invoice_data(prompt: str, prompt_config: dict, LLM_TEMPERATURE: float):
@@ -398,7 +956,7 @@ def extract_invoice_data(prompt: str, prompt_config: dict, LLM_TEMPERATURE: floa
         response = call_llm_chat(
             system_prompt="Tu es un expert en extraction de données de factures. Réponds UNIQUEMENT avec du JSON valide.",
             user_prompt=prompt,
-            model=prompt_config.get('model_name', 'mistral:7b-instruct-q4_K_M'),
+            model=prompt_config.get('model_name', DEFAULT_LLM_MODEL),
             temperature=LLM_TEMPERATURE
         )
 
@@ -447,38 +1005,74 @@ def calculate_field_confidence(field_name: str, value: Any, ocr_boxes: List[Dict
     return 0.7
 
 
+# Empreintes des blobs OCR déjà écrits par cette instance
+ocr_known_hashes = KnownHashes()
+
+async def store_ocr_blob(ocr_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compress the OCR text and boxes, write them once per distinct text"""
+    blob = await asyncio.to_thread(build_ocr_blob, ocr_data)
+    if blob['hash'] not in ocr_known_hashes:
+        await (await get_repository()).insert_ocr_blob(blob)
+        ocr_known_hashes.add(blob['hash'])
+    return blob
+
+
+@timed_stage('save_extraction_to_db')
 async def save_extraction_to_db(
     facture_id: str,
     ocr_data: Dict[str, Any],
     llm_output: Dict[str, Any],
     model_version: str
 ) -> str:
-    """Save raw extraction to database"""
-    result = supabase.table('extractions_brutes').insert({
+    """Save raw extraction to database (OCR text by reference to ocr_blobs)"""
+    row = {
         'facture_id': facture_id,
         'ocr_text': ocr_data['text'],
         'ocr_confidence': ocr_data['confidence'],
         'ocr_metadata': {
             'total_words': len(ocr_data['words']),
-            'total_boxes': len(ocr_data['boxes'])
+            'total_boxes': len(ocr_data['boxes']),
+            'total_pages': ocr_data.get('total_pages')
         },
         'llm_raw_output': llm_output,
         'llm_model_version': model_version
-    }).execute()
-
-    return result.data[0]['id']
+    }
+    if OCR_BLOB_STORE_ENABLED:
+        blob = await store_ocr_blob(ocr_data)
+        row['ocr_text'] = None
+        row['ocr_blob_hash'] = blob['hash']
+        row['ocr_metadata'].update({'raw_bytes': blob['raw_size'], 'stored_bytes': blob['stored_size']})
+    return await (await get_repository()).insert_extraction(row)
 
 
-async def update_facture_with_extraction(facture_id: str, extracted_data: Dict[str, Any], confidence: float):
-    """Update facture table with extracted data"""
+@timed_stage('update_facture_with_extraction')
+async def update_facture_with_extraction(
+    facture_id: str,
+    extracted_data: Dict[str, Any],
+    confidence: float,
+    coherence: Optional[Dict[str, Any]] = None,
+    duplicate_links: Optional[Dict[str, Any]] = None
+):
+    """Update facture table with extracted data (and duplicate links: doublon_de, doublons_potentiels)"""
     update_data = {
         **extracted_data,
+        **(duplicate_links or {}),
         'statut_extraction': 'en_attente_validation',
         'confiance_globale': confidence,
-        'necessite_validation': confidence < 0.8,
+        'necessite_validation': confidence < VALIDATION_CONFIDENCE_THRESHOLD,
         'date_extraction': datetime.utcnow().isoformat()
     }
 
+    # Avec des règles actives, seules les erreurs bloquantes (ou une confiance faible) vont en validation
+    if coherence is not None:
+        from coherence_rules import needs_validation
+
+        update_data['alertes_coherence'] = coherence['alertes']
+        update_data.update({
+            flag: value for flag, value in coherence['flags'].items() if flag in FACTURE_COHERENCE_FLAGS
+        })
+        update_data['necessite_validation'] = needs_validation(coherence, confidence, COHERENCE_AUTO_APPROVE_CONFIDENCE)
+
     numeric_fields = [
         'tarif_base_parkwh', 'tarif_hp_parkwh', 'tarif_hc_parkwh', 'tarif_hph_parkwh', 'tarif_hch_parkwh', 'tarif_hpb_parkwh', 'tarif_hcb_parkwh', 'tarif_pointe_parkwh',
         'tarif_cta_parkwh', 'montant_cta', 'tarif_cee', 'conso_cee',
@@ -501,7 +1095,193 @@ async def update_facture_with_extraction(facture_id: str, extracted_data: Dict[s
     if 'tarif_acheminement' in update_data:
         update_data['tarif_acheminement'] = json.dumps(update_data['tarif_acheminement'])    
 
-    supabase.table('factures').update(update_data).eq('id', facture_id).execute()
+    await (await get_repository()).update_facture(facture_id, update_data)
+
+
+# Détection des doublons
+def match_duplicate(index: DuplicateIndex, facture_id: str, fingerprint: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
+    """(original facture id, match) from the file hash, then the PDL + period of the PDF text layer"""
+    original = index.match_file(facture_id, fingerprint.get('fichier_hash'))
+    if original:
+        return original, 'fichier'
+    if fingerprint.get('key'):
+        original, _ = index.match_key(facture_id, fingerprint['key'])
+        if original:
+            return original, 'texte_pdf'
+    return None, None
+
+
+async def reuse_extraction(
+    facture_id: str,
+    original_id: str,
+    match: str,
+    background_tasks: BackgroundTasks,
+    timings: "RequestTimings",
+    fingerprint: Optional[Dict[str, Any]] = None
+) -> Optional[ExtractionResponse]:
+    """
+    Short-circuit for a duplicate: the original invoice's extraction is returned and copied to
+    this invoice with doublon_de set. None when the original has no stored extraction
+    """
+    extraction = await (await get_repository()).get_latest_extraction(original_id)
+    if not extraction or not extraction.get('llm_raw_output'):
+        return None
+
+    index = await get_duplicate_index()
+    extracted_data = extraction['llm_raw_output']
+    original = index.factures.get(original_id, {})
+    confidence = original.get('confiance_globale') or extraction.get('ocr_confidence') or 0.0
+    coherence = await evaluate_coherence(extracted_data)
+    links = {'doublon_de': original_id}
+    if fingerprint and fingerprint.get('fichier_phash'):
+        links['fichier_phash'] = fingerprint['fichier_phash']
+
+    background_tasks.add_task(update_facture_with_extraction, facture_id, extracted_data, confidence, coherence, links)
+    index.record(facture_id, {
+        **{field: extracted_data.get(field) for field in ('pdl', 'periode_debut', 'periode_fin', 'fournisseur')},
+        **(fingerprint or {}),
+        **links,
+        'statut_extraction': 'en_attente_validation'
+    })
+
+    breakdown = timings.breakdown()
+    DUPLICATES.labels(match).inc()
+    EXTRACTIONS.labels('duplicate').inc()
+    EXTRACTION_LATENCY.observe(breakdown['total'] / 1000)
+    stored_metadata = extraction.get('ocr_metadata') or {}
+    return ExtractionResponse(
+        extraction_id=str(extraction['id']),
+        extracted_data=extracted_data,
+        confidence={'global': round(confidence, 2), 'per_field': {}},
+        ocr_metadata={
+            'total_words': stored_metadata.get('total_words', 0),
+            'avg_confidence': round(extraction.get('ocr_confidence') or 0.0, 2),
+            'total_pages': stored_metadata.get('total_pages'),
+            'timings_ms': breakdown
+        },
+        coherence=coherence,
+        duplicate={**links, 'match': match}
+    )
+
+
+def link_duplicates(
+    index: DuplicateIndex,
+    facture_id: str,
+    extracted_data: Dict[str, Any],
+    fingerprint: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    After a full extraction: doublon_de / doublons_potentiels for the invoice (PDL + period of the
+    extracted data, similar images), and the invoice added to the index for the next uploads
+    """
+    original, near = index.match_key(facture_id, invoice_key(extracted_data))
+    near += index.match_image(facture_id, fingerprint.get('fichier_phash'))
+    links = {
+        'doublon_de': original,
+        'doublons_potentiels': near or None,
+        'fichier_hash': fingerprint.get('fichier_hash'),
+        'fichier_phash': fingerprint.get('fichier_phash')
+    }
+    links = {column: value for column, value in links.items() if value}
+    if original:
+        DUPLICATES.labels('extraction').inc()
+    if near:
+        DUPLICATES.labels('quasi').inc()
+
+    index.record(facture_id, {
+        **{field: extracted_data.get(field) for field in ('pdl', 'periode_debut', 'periode_fin', 'fournisseur')},
+        **links,
+        'statut_extraction': 'en_attente_validation'
+    })
+    return links
+
+
+# Préchauffage des modèles (OCR + LLM)
+# États possibles : pending, warming, ready, error, skipped
+warmup_state: Dict[str, str] = {'ocr': 'pending', 'llm': 'pending'}
+
+
+def mark_warm(component: str):
+    """A real request succeeded: the component is ready, even if its warmup failed"""
+    if warmup_state[component] != 'skipped':
+        warmup_state[component] = 'ready'
+
+
+def warmup_ocr():
+    """Load OCR models and run one inference on a blank image"""
+    import numpy as np
+
+    blank = np.full((64, 256), 255, dtype=np.uint8)
+    # Avec le micro-batching, par le batcher : son thread et le moteur configuré pour les lots
+    batcher = get_ocr_batcher()
+    if batcher is not None:
+        batcher.ocr(blank, use_cls=False)
+    else:
+        get_ocr_engine().ocr(blank, use_cls=False)
+
+
+async def warmup_llm(model: str):
+    """Load the model in Ollama and keep it resident for OLLAMA_KEEP_ALIVE"""
+    response = await get_http_client().post(
+        f"{OLLAMA_BASE_URL}/api/generate",
+        json={'model': model, 'keep_alive': OLLAMA_KEEP_ALIVE},
+        timeout=300.0
+    )
+    response.raise_for_status()
+
+
+async def warm_with_retry(component: str, warm):
+    """Run warm() until it succeeds, with exponential backoff; stops early once a request succeeded"""
+    attempt = 0
+    while warmup_state[component] != 'ready':
+        warmup_state[component] = 'warming'
+        try:
+            await warm()
+            warmup_state[component] = 'ready'
+        except Exception as e:
+            delay = min(WARMUP_RETRY_BASE_SECONDS * 2 ** attempt, WARMUP_RETRY_MAX_SECONDS)
+            attempt += 1
+            logger.error(f"Préchauffage {component} échoué (essai {attempt}), nouvel essai dans {delay:.0f}s: {e}")
+            if warmup_state[component] == 'warming':
+                warmup_state[component] = 'error'
+            await asyncio.sleep(delay)
+
+
+async def run_warmup():
+    """Warm OCR and LLM concurrently from scratch, recording progress in warmup_state"""
+    async def warm_llm():
+        try:
+            prompt_config = await get_active_prompt()
+            model = prompt_config.get('model_name') or DEFAULT_LLM_MODEL
+        except Exception as e:
+            logger.warning(f"Prompt actif indisponible, modèle par défaut: {e}")
+            model = DEFAULT_LLM_MODEL
+        await warmup_llm(model)
+
+    # Relance explicite (POST /warmup) : les composants déjà prêts sont préchauffés à nouveau
+    warmup_state.update({'ocr': 'pending', 'llm': 'pending'})
+    await asyncio.gather(
+        warm_with_retry('ocr', lambda: asyncio.to_thread(warmup_ocr)),
+        warm_with_retry('llm', warm_llm)
+    )
+
+
+@app.on_event("startup")
+async def load_coherence_rules():
+    """Compile the coherence rules before the first extraction; retried lazily on failure"""
+    if COHERENCE_RULES_ENABLED:
+        try:
+            await get_rule_engine()
+        except Exception as e:
+            logger.error(f"Chargement des règles de cohérence en échec: {e}")
+
+
+@app.on_event("startup")
+async def schedule_warmup():
+    if WARMUP_ON_STARTUP:
+        app.state.warmup_task = asyncio.create_task(run_warmup())
+    else:
+        warmup_state.update({'ocr': 'skipped', 'llm': 'skipped'})
 
 
 # API Endpoints
@@ -515,160 +1295,327 @@ async def root():
     }
 
 
+@app.get("/ready")
+async def readiness():
+    """Readiness probe: 200 once OCR and LLM models are warm, 503 before"""
+    ready = all(state in ('ready', 'skipped') for state in warmup_state.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={'ready': ready, **warmup_state}
+    )
+
+
+@app.get("/cascade/stats")
+async def cascade_statistics():
+    """Per-tier hit rates of the model cascade since startup"""
+    return {
+        'enabled': LLM_CASCADE_ENABLED,
+        'tiers': LLM_CASCADE_TIERS,
+        'stats': cascade_stats.report()
+    }
+
+
+@app.get("/admission/stats")
+async def admission_statistics():
+    """In-flight requests, queue depths and rejections per stage"""
+    return admission.report()
+
+
+@app.get("/ocr/batch/stats")
+async def ocr_batch_statistics():
+    """Micro-batching of OCR pages: batch sizes, fallbacks and engine settings (never loads the engine)"""
+    if ocr_batcher is not None:
+        return {'enabled': True, 'loaded': True, **ocr_batcher.report()}
+    engine = {'loaded': True, **ocr_engine.describe()} if ocr_engine is not None else {'loaded': False}
+    return {'enabled': OCR_BATCH_ENABLED, **engine}
+
+
+@app.get("/coherence/rules")
+async def coherence_rules():
+    """Compiled coherence rules, rules rejected at compile time and tariff index size"""
+    return (await get_rule_engine()).describe()
+
+
+@app.get("/duplicates/stats")
+async def duplicate_index_statistics():
+    """Size and age of the in-memory duplicate index"""
+    if not DUPLICATE_DETECTION_ENABLED:
+        return {'enabled': False}
+    return {'enabled': True, **(await get_duplicate_index()).stats()}
+
+
+@app.post("/duplicates/reload")
+async def reload_duplicate_index():
+    """Reload the duplicate index from factures (e.g. after a bulk import or deletion)"""
+    global duplicate_index
+    async with duplicate_index_lock:
+        duplicate_index = await load_duplicate_index()
+    return duplicate_index.stats()
+
+
+@app.post("/coherence/reload")
+async def reload_coherence_rules():
+    """Reload rules and tariffs after an edit of regles_coherence_metier or referentiel_tarifs_energie"""
+    from coherence_rules import load_rule_engine
+
+    global rule_engine
+    async with rule_engine_lock:
+        rule_engine = await asyncio.to_thread(load_rule_engine, get_supabase())
+    return rule_engine.describe()
+
+
+@app.post("/coherence/validate")
+async def validate_coherence(request: CoherenceBatchRequest):
+    """Evaluate the coherence rules over a batch of extracted invoices in one vectorized pass"""
+    engine = await get_rule_engine()
+    reports = await asyncio.to_thread(engine.evaluate_batch, request.invoices)
+    return {'count': len(reports), 'reports': reports}
+
+
+@app.on_event("startup")
+async def setup_profiling():
+    install_profiling_hooks()
+
+
+app.include_router(create_profiling_router())
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (stage latencies, extraction counts, Ollama tokens)"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.post("/warmup")
+async def trigger_warmup():
+    """Re-run the warmup (e.g. after an Ollama restart)"""
+    task = getattr(app.state, 'warmup_task', None)
+    if task is None or task.done():
+        app.state.warmup_task = asyncio.create_task(run_warmup())
+    return {'status': 'started', **warmup_state}
+
+
 @app.post("/extract", response_model=ExtractionResponse)
 async def extract_facture(request: ExtractionRequest, background_tasks: BackgroundTasks):
     """
     Extract data from a facture
     Main extraction endpoint
     """
+    timings = start_request_timings()
     try:
-        # Téléchargement du fichier
-        file_bytes = await download_file(request.file_url)
-
-        # Déterminer si c'est un PDF ou une image
-        is_pdf = request.file_url.lower().endswith('.pdf')
-        full_text = ""
-        all_ocr_boxes = []
-        all_ocr_words = []
-        page_confidences = []
-
-        # Conversion et traitement
-        if is_pdf:
-            images = pdf_to_images(file_bytes, dpi=300)
-            if not images:
-                raise HTTPException(status_code=400, detail="Aucune page trouvée dans le PDF")
-
-            for page_num, image in enumerate(images):
-                image_array = image_to_numpy(image)
-                ocr_data = extract_text_with_ocr(image_array)
-
-                if not ocr_data['text']:
-                    logger.warning(f"Aucun texte extrait de la page {page_num + 1}")
-                    continue
-
-                full_text += f"\n--- PAGE {page_num + 1} ---\n{ocr_data['text']}\n"
-                all_ocr_boxes.extend(ocr_data['boxes'])
-                all_ocr_words.extend(ocr_data['words'])
-                page_confidences.append(ocr_data['confidence'])
-
-            if not full_text.strip():
-                raise HTTPException(status_code=400, detail="Aucun texte extrait du document")
-
-            avg_ocr_confidence = sum(page_confidences) / len(page_confidences) if page_confidences else 0.0
-            ocr_metadata = {
-                'text': full_text,
-                'confidence': avg_ocr_confidence,
-                'boxes': all_ocr_boxes,
-                'words': all_ocr_words
-            }
-        else:
-            image = Image.open(BytesIO(file_bytes))
-            image_array = image_to_numpy(image)
-            ocr_metadata = extract_text_with_ocr(image_array)
-
-            if not ocr_metadata['text']:
-                raise HTTPException(status_code=400, detail="Aucun texte extrait du document")
-
-        # Extraction avec le LLM
-        extracted_data = await parse_with_llm(ocr_metadata['text'], request.supplier_hint)
-
-        # Calcul des confiances
-        field_confidences = {}
-        for field, value in extracted_data.items():
-            if isinstance(value, dict):
-                for sub_field, sub_value in value.items():
-                    field_confidences[f"{field}.{sub_field}"] = calculate_field_confidence(sub_field, sub_value, ocr_metadata['boxes'])
-            else:
-                field_confidences[field] = calculate_field_confidence(field, value, ocr_metadata['boxes'])
-
-        # Calcul de la confiance globale
-        valid_confidences = [c for c in field_confidences.values() if c > 0]
-        global_confidence = sum(valid_confidences) / len(valid_confidences) if valid_confidences else 0.0
-        blended_confidence = (ocr_metadata['confidence'] * 0.4 + global_confidence * 0.6)
-
-        # Récupération de la version du prompt
-        prompt_config = await get_active_prompt()
-
-        # Sauvegarde en base de données
-        extraction_id = await save_extraction_to_db(
-            request.facture_id,
-            ocr_metadata,
-            extracted_data,
-            prompt_config['version']
-        )
-
-        # Mise à jour de la facture en arrière-plan
-        background_tasks.add_task(
-            update_facture_with_extraction,
-            request.facture_id,
-            extracted_data,
-            blended_confidence
-        )
-
-        return ExtractionResponse(
-            extraction_id=extraction_id,
-            extracted_data=extracted_data,
-            confidence={
-                'global': round(blended_confidence, 2),
-                'per_field': {k: round(v, 2) for k, v in field_confidences.items()}
-            },
-            ocr_metadata={
-                'total_words': len(ocr_metadata['words']),
-                'avg_confidence': round(ocr_metadata['confidence'], 2),
-                'total_pages': len(page_confidences) if is_pdf else 1
-            }
-        )
-
+        async with admission.admit(request.priority):
+            index: Optional[DuplicateIndex] = None
+            fingerprint: Dict[str, Any] = {}
+            if DUPLICATE_DETECTION_ENABLED:
+                try:
+                    index = await get_duplicate_index()
+                except Exception as e:
+                    # La détection des doublons ne doit pas bloquer l'extraction
+                    logger.warning(f"Index des doublons indisponible: {e}")
+
+            # Fichier déjà connu à l'upload (fichier_hash) : ni téléchargement, ni OCR, ni LLM
+            if index is not None:
+                original = index.match_file(request.facture_id, index.file_hash_of(request.facture_id))
+                if original:
+                    reused = await reuse_extraction(request.facture_id, original, 'fichier', background_tasks, timings)
+                    if reused:
+                        return reused
+
+            # Téléchargement (streamé) et OCR du fichier
+            is_pdf = is_pdf_url(request.file_url)
+            async with open_invoice_file(request.file_url) as file_path:
+                if index is not None:
+                    # Empreintes et couche texte des PDF : quelques ms, avant de prendre une place OCR
+                    with track_stage('duplicate_check'):
+                        fingerprint = await asyncio.to_thread(fingerprint_file, file_path, is_pdf)
+                    original, match = match_duplicate(index, request.facture_id, fingerprint)
+                    if original:
+                        reused = await reuse_extraction(
+                            request.facture_id, original, match, background_tasks, timings, fingerprint
+                        )
+                        if reused:
+                            return reused
+
+                # Hors de la boucle d'événements : les refus restent possibles pendant l'OCR
+                async with admission.stage('ocr'):
+                    ocr_metadata = await asyncio.to_thread(ocr_document, file_path, is_pdf)
+
+            # Sans couche texte (photo, PDF scanné) : PDL + période lus dans le texte OCR, avant le LLM
+            if index is not None and not fingerprint.get('key'):
+                original, _ = index.match_key(request.facture_id, parse_invoice_key(ocr_metadata['text']))
+                if original:
+                    reused = await reuse_extraction(
+                        request.facture_id, original, 'texte_ocr', background_tasks, timings, fingerprint
+                    )
+                    if reused:
+                        return reused
+
+            # Extraction avec le LLM
+            extracted_data = await parse_with_llm(
+                ocr_metadata['text'], request.supplier_hint, ocr_metadata['boxes'], ocr_metadata['confidence']
+            )
+
+            # Calcul des confiances
+            with track_stage('confidence_scoring'):
+                field_confidences = score_extracted_fields(extracted_data, ocr_metadata['boxes'])
+                blended_confidence = blend_confidence(ocr_metadata['confidence'], field_confidences)
+
+            # Règles de cohérence métier
+            coherence = await evaluate_coherence(extracted_data)
+
+            # Récupération de la version du prompt
+            prompt_config = await get_active_prompt()
+
+            # Sauvegarde en base de données
+            extraction_id = await save_extraction_to_db(
+                request.facture_id,
+                ocr_metadata,
+                extracted_data,
+                prompt_config['version']
+            )
+
+            # Doublons et quasi-doublons d'après les données extraites
+            duplicate_links = link_duplicates(index, request.facture_id, extracted_data, fingerprint) if index is not None else {}
+
+            # Mise à jour de la facture en arrière-plan
+            background_tasks.add_task(
+                update_facture_with_extraction,
+                request.facture_id,
+                extracted_data,
+                blended_confidence,
+                coherence,
+                duplicate_links
+            )
+
+            breakdown = timings.breakdown()
+            EXTRACTIONS.labels('success').inc()
+            EXTRACTION_LATENCY.observe(breakdown['total'] / 1000)
+
+            return ExtractionResponse(
+                extraction_id=extraction_id,
+                extracted_data=extracted_data,
+                confidence={
+                    'global': round(blended_confidence, 2),
+                    'per_field': {k: round(v, 2) for k, v in field_confidences.items()}
+                },
+                ocr_metadata={
+                    'total_words': len(ocr_metadata['words']),
+                    'avg_confidence': round(ocr_metadata['confidence'], 2),
+                    'total_pages': ocr_metadata['total_pages'],
+                    'timings_ms': breakdown
+                },
+                coherence=coherence,
+                duplicate=duplicate_links or None
+            )
+
+    except HTTPException as e:
+        EXTRACTIONS.labels(f"http_{e.status_code}").inc()
+        raise
+    except Overloaded as e:
+        EXTRACTIONS.labels(f"http_{e.status_code}").inc()
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers={'Retry-After': str(e.retry_after)})
+    except FileTooLargeError as e:
+        EXTRACTIONS.labels('http_413').inc()
+        raise HTTPException(status_code=413, detail=str(e))
     except Exception as e:
+        EXTRACTIONS.labels('error').inc()
         logger.error(f"Erreur d'extraction: {e}")
         raise HTTPException(status_code=500, detail=f"Erreur lors de l'extraction: {str(e)}")
 
 
+@app.post("/extractions/{extraction_id}/rescore")
+async def rescore_extraction(extraction_id: str):
+    """Replay the confidence stage from the stored OCR boxes and raw LLM output"""
+    repository = await get_repository()
+    extraction = await repository.get_extraction(extraction_id)
+    if not extraction:
+        raise HTTPException(status_code=404, detail="Extraction introuvable")
+    blob_hash = extraction.get('ocr_blob_hash')
+    blob = (await repository.get_ocr_blobs([blob_hash])).get(blob_hash) if blob_hash else None
+    if blob is None:
+        raise HTTPException(status_code=409, detail="Boîtes OCR non conservées pour cette extraction")
+
+    boxes = await asyncio.to_thread(read_ocr_boxes, blob)
+    field_confidences = score_extracted_fields(extraction.get('llm_raw_output') or {}, boxes)
+    blended_confidence = blend_confidence(float(extraction.get('ocr_confidence') or 0.0), field_confidences)
+    return {
+        'extraction_id': extraction_id,
+        'confidence': {
+            'global': round(blended_confidence, 2),
+            'per_field': {k: round(v, 2) for k, v in field_confidences.items()}
+        },
+        'total_boxes': len(boxes)
+    }
+
+
+def build_correction_rows(items: List[LearningRequest], suppliers: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    """Flatten the corrections of many factures into historique_corrections rows"""
+    return [
+        {
+            'facture_id': item.facture_id,
+            'extraction_brute_id': item.extraction_id,
+            'field_name': field_name,
+            'valeur_initiale': str(correction.extracted),
+            'valeur_corrigee': str(correction.corrected),
+            'fournisseur_name': suppliers.get(item.facture_id)
+        }
+        for item in items
+        for field_name, correction in item.corrections.items()
+    ]
+
+
+def count_pattern_increments(items: List[LearningRequest], suppliers: Dict[str, Optional[str]]) -> List[Dict[str, Any]]:
+    """One increment per (supplier, field) pair, summed over all factures"""
+    counts = Counter(
+        (suppliers[item.facture_id], field_name)
+        for item in items
+        if suppliers.get(item.facture_id)
+        for field_name in item.corrections
+    )
+    return [
+        {'nom_fournisseur': supplier, 'field_name': field_name, 'count': count}
+        for (supplier, field_name), count in counts.items()
+    ]
+
+
+@timed_stage('learn_from_corrections')
+async def ingest_corrections(items: List[LearningRequest]) -> Dict[str, int]:
+    """
+    Bulk path for corrections: one supplier lookup, chunked multi-row inserts
+    and a single set-based increment of patterns_fournisseurs via RPC
+    """
+    db = await get_repository()
+
+    # Fournisseur de toutes les factures en une requête
+    facture_ids = list({item.facture_id for item in items})
+    suppliers = await db.get_facture_suppliers(facture_ids)
+
+    # Historique des corrections : insertions multi-lignes
+    rows = build_correction_rows(items, suppliers)
+    for start in range(0, len(rows), LEARN_INSERT_CHUNK_SIZE):
+        await db.insert_corrections(rows[start:start + LEARN_INSERT_CHUNK_SIZE])
+
+    # Incrément atomique côté base (pas de lecture-modification-écriture)
+    increments = count_pattern_increments(items, suppliers)
+    updated_patterns = 0
+    if increments:
+        updated_patterns = await db.increment_pattern_sample_counts(increments)
+
+    return {
+        'factures': len(facture_ids),
+        'corrections': len(rows),
+        'updated_patterns': updated_patterns
+    }
+
+
 @app.post("/learn")
 async def learn_from_corrections(request: LearningRequest):
     """
     Process user corrections and update learning system
     """
     try:
-        # Save corrections to history
-        for field_name, correction in request.corrections.items():
-            supabase.table('historique_corrections').insert({
-                'facture_id': request.facture_id,
-                'extraction_brute_id': request.extraction_id,
-                'field_name': field_name,
-                'valeur_initiale': str(correction.extracted),
-                'valeur_corrigee': str(correction.corrected)
-            }).execute()
-
-        # Get facture data to extract supplier
-        facture = supabase.table('factures')\
-            .select('fournisseur')\
-            .eq('id', request.facture_id)\
-            .single()\
-            .execute()
-
-        supplier = facture.data.get('fournisseur') if facture.data else None
-
-        # Update patterns (simple frequency-based learning)
-        if supplier:
-            for field_name in request.corrections.keys():
-                # Check if pattern exists
-                pattern_result = supabase.table('patterns_fournisseurs')\
-                    .select('*')\
-                    .eq('nom_fournisseur', supplier)\
-                    .eq('field_name', field_name)\
-                    .execute()
-
-                if pattern_result.data and len(pattern_result.data) > 0:
-                    # Update existing pattern
-                    pattern = pattern_result.data[0]
-                    supabase.table('patterns_fournisseurs')\
-                        .update({
-                            'sample_count': pattern['sample_count'] + 1,
-                            'last_updated': datetime.utcnow().isoformat()
-                        })\
-                        .eq('id', pattern['id'])\
-                        .execute()
+        await ingest_corrections([request])
 
         return {
             "status": "success",
@@ -676,7 +1623,77 @@ async def learn_from_corrections(request: LearningRequest):
         }
 
     except Exception as e:
-        print(f"Learning error: {e}")
+        logger.error(f"Learning error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/learn/batch")
+async def learn_from_corrections_batch(request: BatchLearningRequest):
+    """
+    Process the corrections of many factures at once (validation sessions)
+    """
+    if not request.items:
+        raise HTTPException(status_code=400, detail="No corrections provided")
+
+    try:
+        summary = await ingest_corrections(request.items)
+
+        return {
+            "status": "success",
+            "message": f"Learned from {summary['corrections']} corrections on {summary['factures']} factures",
+            **summary
+        }
+
+    except Exception as e:
+        logger.error(f"Learning error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Boucle de fond et POST /learn/aggregate partagent le filigrane : une seule agrégation à la fois
+pattern_learning_lock = asyncio.Lock()
+
+
+async def run_pattern_aggregation() -> Optional[Dict[str, Any]]:
+    """
+    Consume new corrections and publish the learned supplier regexes
+    Returns None without running when an aggregation is already in progress
+    """
+    if pattern_learning_lock.locked():
+        return None
+    async with pattern_learning_lock:
+        aggregator = PatternAggregator(get_supabase())
+        return await asyncio.to_thread(aggregator.run_until_caught_up)
+
+
+async def pattern_learning_loop():
+    while True:
+        try:
+            summary = await run_pattern_aggregation()
+            if summary and summary['corrections']:
+                logger.info(f"Patterns: {summary}")
+        except Exception as e:
+            logger.error(f"Pattern aggregation error: {e}")
+        await asyncio.sleep(PATTERN_LEARNING_INTERVAL_SECONDS)
+
+
+@app.on_event("startup")
+async def schedule_pattern_learning():
+    if PATTERN_LEARNING_INTERVAL_SECONDS > 0:
+        app.state.pattern_learning_task = asyncio.create_task(pattern_learning_loop())
+
+
+@app.post("/learn/aggregate")
+async def aggregate_patterns():
+    """
+    Run the incremental pattern aggregator now (new corrections since the watermark)
+    """
+    try:
+        summary = await run_pattern_aggregation()
+        if summary is None:
+            return {"status": "skipped", "message": "Aggregation already in progress"}
+        return {"status": "success", **summary}
+    except Exception as e:
+        logger.error(f"Pattern aggregation error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
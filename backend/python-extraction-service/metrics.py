@@ -0,0 +1,212 @@
+"""
+Instrumentation du pipeline d'extraction
+Histogrammes et compteurs Prometheus + détail des temps par requête
+"""
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120)
+
+STAGE_LATENCY = Histogram(
+    'extraction_stage_duration_seconds',
+    "Durée de chaque étape du pipeline d'extraction",
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+STAGE_ERRORS = Counter(
+    'extraction_stage_errors_total',
+    "Nombre d'étapes terminées en erreur",
+    ['stage']
+)
+EXTRACTIONS = Counter(
+    'extractions_total',
+    "Nombre d'extractions par statut",
+    ['status']
+)
+EXTRACTION_LATENCY = Histogram(
+    'extraction_duration_seconds',
+    "Durée totale d'une requête /extract",
+    buckets=STAGE_BUCKETS
+)
+OCR_PAGES = Counter(
+    'ocr_pages_total',
+    "Nombre de pages passées à l'OCR"
+)
+OCR_BATCH_SIZE = Histogram(
+    'ocr_batch_size',
+    "Pages par lot passé au moteur OCR (micro-batching)",
+    buckets=(1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+)
+OCR_BATCH_WAIT = Histogram(
+    'ocr_batch_wait_seconds',
+    "Attente d'une page avant le lancement de son lot OCR",
+    buckets=STAGE_BUCKETS
+)
+DUPLICATES = Counter(
+    'duplicate_invoices_total',
+    "Factures reconnues comme doublons (fichier, texte_pdf, texte_ocr, extraction) ou quasi-doublons",
+    ['match']
+)
+LLM_TOKENS = Counter(
+    'llm_tokens_total',
+    "Tokens traités par Ollama",
+    ['model', 'kind']
+)
+LLM_PHASE_LATENCY = Histogram(
+    'llm_phase_duration_seconds',
+    "Durées rapportées par Ollama (chargement, évaluation du prompt, génération)",
+    ['model', 'phase'],
+    buckets=STAGE_BUCKETS
+)
+LLM_CACHE_REQUESTS = Counter(
+    'llm_cache_requests_total',
+    "Consultations du cache LLM (hit, miss, coalesced)",
+    ['result']
+)
+CASCADE_TIERS = Counter(
+    'llm_cascade_tier_total',
+    "Passages par niveau de la cascade (accepted, escalated)",
+    ['tier', 'outcome']
+)
+CASCADE_FIELDS = Counter(
+    'llm_cascade_escalated_fields_total',
+    "Champs transmis au niveau suivant de la cascade",
+    ['tier']
+)
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections_total',
+    "Requêtes refusées par le contrôle d'admission (queue_full, deadline, preempted)",
+    ['stage', 'reason']
+)
+ADMISSION_QUEUE_WAIT = Histogram(
+    'admission_queue_wait_seconds',
+    "Temps d'attente avant d'obtenir une place, par étape et classe de priorité",
+    ['stage', 'priority'],
+    buckets=STAGE_BUCKETS
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    'admission_queue_depth',
+    "Requêtes en attente d'une place, par étape",
+    ['stage']
+)
+
+# Détail des temps de la requête en cours (propagé aux threads par asyncio.to_thread)
+request_timings: ContextVar[Optional["RequestTimings"]] = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Per-request timing breakdown attached to the extraction response"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, List[float]] = {}
+        self.llm: List[Dict[str, Any]] = []
+        self.annotations: Dict[str, Any] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages.setdefault(stage, []).append(seconds * 1000)
+
+    def breakdown(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {}
+        for stage, durations in self.stages.items():
+            result[stage] = round(sum(durations), 1)
+            if len(durations) > 1:
+                result[f"{stage}_calls"] = [round(d, 1) for d in durations]
+        if self.llm:
+            result['llm'] = self.llm
+        result.update(self.annotations)
+        result['total'] = round((time.perf_counter() - self.started) * 1000, 1)
+        return result
+
+
+def start_request_timings() -> RequestTimings:
+    timings = RequestTimings()
+    request_timings.set(timings)
+    return timings
+
+
+def record_stage(stage: str, seconds: float):
+    """Record one run of a stage measured by the caller (Prometheus + current request breakdown)"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Time a block: Prometheus histogram + current request breakdown"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(stage).inc()
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def timed_stage(stage: str):
+    """Decorator version of track_stage, for sync and async functions"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with track_stage(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with track_stage(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_llm_stats(model: str, response: Dict[str, Any]):
+    """Record Ollama's prompt_eval/eval counts and durations (nanoseconds)"""
+    prompt_tokens = response.get('prompt_eval_count') or 0
+    completion_tokens = response.get('eval_count') or 0
+    LLM_TOKENS.labels(model, 'prompt').inc(prompt_tokens)
+    LLM_TOKENS.labels(model, 'completion').inc(completion_tokens)
+
+    phases = {
+        'load': response.get('load_duration'),
+        'prompt_eval': response.get('prompt_eval_duration'),
+        'eval': response.get('eval_duration'),
+        'total': response.get('total_duration'),
+    }
+    for phase, nanoseconds in phases.items():
+        if nanoseconds:
+            LLM_PHASE_LATENCY.labels(model, phase).observe(nanoseconds / 1e9)
+
+    timings = request_timings.get()
+    if timings is not None:
+        eval_seconds = (phases['eval'] or 0) / 1e9
+        timings.llm.append({
+            'model': model,
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': completion_tokens,
+            **{f"{phase}_ms": round(ns / 1e6, 1) for phase, ns in phases.items() if ns},
+            'tokens_per_second': round(completion_tokens / eval_seconds, 1) if eval_seconds else None
+        })
+
+
+def annotate(key: str, value: Any):
+    """Attach extra information to the current request breakdown"""
+    timings = request_timings.get()
+    if timings is not None:
+        timings.annotations[key] = value
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Exposition body and its content type"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
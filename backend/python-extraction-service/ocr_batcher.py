@@ -0,0 +1,149 @@
+"""
+Micro-batching devant le moteur OCR
+Les pages des requêtes concurrentes sont regroupées pendant au plus OCR_BATCH_WINDOW_MS
+(ou jusqu'à OCR_BATCH_MAX_SIZE pages), passées ensemble au moteur (OCREngine.ocr_batch)
+puis rendues à chaque appelant. Un seul thread exécute le moteur : PaddleOCR n'est pas thread-safe
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FuturesTimeout
+from typing import TYPE_CHECKING, Any, Dict, List
+
+from metrics import OCR_BATCH_SIZE, OCR_BATCH_WAIT
+from ocr_engines import OCREngine, OCRLine
+
+if TYPE_CHECKING:
+    import numpy as np
+
+OCR_BATCH_ENABLED = os.getenv("OCR_BATCH_ENABLED", "false").lower() == "true"
+# Attente maximale d'autres pages avant de lancer un lot
+OCR_BATCH_WINDOW_MS = float(os.getenv("OCR_BATCH_WINDOW_MS", "5"))
+OCR_BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "8"))
+# Lots de reconnaissance plus gros : les lignes de toutes les pages du lot sont reconnues ensemble
+OCR_BATCH_REC_BATCH_NUM = int(os.getenv("OCR_BATCH_REC_BATCH_NUM", "24"))
+# Attente maximale du résultat d'une page par l'appelant (moteur bloqué, file saturée)
+OCR_BATCH_RESULT_TIMEOUT_SECONDS = float(os.getenv("OCR_BATCH_RESULT_TIMEOUT_SECONDS", "120"))
+
+logger = logging.getLogger("extraction-service")
+
+
+class PendingPage:
+    __slots__ = ('image', 'use_cls', 'future', 'enqueued')
+
+    def __init__(self, image: "np.ndarray", use_cls: bool):
+        self.image = image
+        self.use_cls = use_cls
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class OCRBatcher:
+    """
+    Collects pages submitted from any thread and runs them through the engine in batches
+    A batch starts as soon as a page arrives and closes after the window or at max_size pages
+    """
+
+    def __init__(
+        self,
+        engine: OCREngine,
+        window_ms: float = OCR_BATCH_WINDOW_MS,
+        max_size: int = OCR_BATCH_MAX_SIZE
+    ):
+        self.engine = engine
+        self.window = max(0.0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+        self.queue: "queue.Queue[PendingPage]" = queue.Queue()
+        self.counters = {'pages': 0, 'batches': 0, 'largest_batch': 0, 'fallbacks': 0}
+        self.thread = threading.Thread(target=self.run, name='ocr-batcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, image: "np.ndarray", use_cls: bool = True) -> Future:
+        page = PendingPage(image, use_cls)
+        self.queue.put(page)
+        return page.future
+
+    def ocr(self, image: "np.ndarray", use_cls: bool = True) -> List[OCRLine]:
+        """Same contract as OCREngine.ocr, blocking until the page's batch has run"""
+        return wait_result(self.submit(image, use_cls))
+
+    def collect(self) -> List[PendingPage]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            try:
+                # Fenêtre écoulée : on prend encore les pages déjà arrivées, sans attendre
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run_batch(self, batch: List[PendingPage]) -> List[Any]:
+        try:
+            results = self.engine.ocr_batch([page.image for page in batch], [page.use_cls for page in batch])
+            if len(results) != len(batch):
+                raise RuntimeError(f"Lot OCR incomplet: {len(results)} résultats pour {len(batch)} pages")
+            return results
+        except Exception as e:
+            if len(batch) == 1:
+                return [e]
+        # Une page fautive ne doit pas faire échouer les autres : reprise page par page
+        self.counters['fallbacks'] += 1
+        results: List[Any] = []
+        for page in batch:
+            try:
+                results.append(self.engine.ocr(page.image, use_cls=page.use_cls))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def run(self):
+        while True:
+            batch = self.collect()
+            try:
+                # Pages abandonnées par leur appelant (délai dépassé) : non traitées
+                batch = [page for page in batch if page.future.set_running_or_notify_cancel()]
+                if not batch:
+                    continue
+                started = time.monotonic()
+                for page in batch:
+                    OCR_BATCH_WAIT.observe(started - page.enqueued)
+                OCR_BATCH_SIZE.observe(len(batch))
+                self.counters['pages'] += len(batch)
+                self.counters['batches'] += 1
+                self.counters['largest_batch'] = max(self.counters['largest_batch'], len(batch))
+
+                for page, result in zip(batch, self.run_batch(batch)):
+                    if isinstance(result, Exception):
+                        page.future.set_exception(result)
+                    else:
+                        page.future.set_result(result)
+            except Exception as e:
+                # Le thread doit survivre : les pages du lot encore en attente échouent
+                logger.exception("Lot OCR en échec")
+                for page in batch:
+                    if not page.future.done():
+                        page.future.set_exception(e)
+
+    def report(self) -> Dict[str, Any]:
+        batches = self.counters['batches']
+        return {
+            'window_ms': self.window * 1000,
+            'max_size': self.max_size,
+            'queued': self.queue.qsize(),
+            'avg_batch_size': round(self.counters['pages'] / batches, 2) if batches else None,
+            **self.counters,
+            **self.engine.describe()
+        }
+
+
+def wait_result(future: Future, timeout: float = OCR_BATCH_RESULT_TIMEOUT_SECONDS) -> Any:
+    """future.result() with a deadline; a page not started yet is withdrawn from the queue"""
+    try:
+        return future.result(timeout=timeout)
+    except FuturesTimeout:
+        future.cancel()
+        raise TimeoutError(f"Page OCR sans résultat après {timeout:g}s")
@@ -0,0 +1,207 @@
+"""
+Moteurs OCR interchangeables
+PaddleOCR natif (Paddle Inference / MKL-DNN) ou modèles PaddleOCR exportés en ONNX (RapidOCR)
+"""
+import argparse
+import os
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import numpy as np
+
+OCR_ENGINE = os.getenv("OCR_ENGINE", "paddle")
+OCR_CPU_THREADS = int(os.getenv("OCR_CPU_THREADS", str(os.cpu_count() or 4)))
+OCR_ENABLE_MKLDNN = os.getenv("OCR_ENABLE_MKLDNN", "true").lower() == "true"
+OCR_REC_BATCH_NUM = int(os.getenv("OCR_REC_BATCH_NUM", "6"))
+OCR_ONNX_DET_MODEL = os.getenv("OCR_ONNX_DET_MODEL")
+OCR_ONNX_REC_MODEL = os.getenv("OCR_ONNX_REC_MODEL")
+OCR_ONNX_CLS_MODEL = os.getenv("OCR_ONNX_CLS_MODEL")
+OCR_ONNX_REC_KEYS = os.getenv("OCR_ONNX_REC_KEYS")
+OCR_ONNX_INTER_OP_THREADS = int(os.getenv("OCR_ONNX_INTER_OP_THREADS", "1"))
+
+# Ligne OCR normalisée : (box, texte, confiance)
+OCRLine = Tuple[List[List[float]], str, float]
+
+
+class OCREngine(ABC):
+    """Common interface of OCR backends"""
+    name = "base"
+
+    @abstractmethod
+    def ocr(self, image: "np.ndarray", use_cls: bool = True) -> List[OCRLine]:
+        """Text lines of one page"""
+
+    def ocr_batch(self, images: List["np.ndarray"], use_cls: List[bool]) -> List[List[OCRLine]]:
+        """Several pages in one call; backends without batched stages run them one by one"""
+        return [self.ocr(image, use_cls=cls) for image, cls in zip(images, use_cls)]
+
+    def describe(self) -> Dict[str, Any]:
+        return {'engine': self.name}
+
+
+class PaddleEngine(OCREngine):
+    """PaddleOCR with Paddle Inference on CPU"""
+    name = "paddle"
+
+    def __init__(
+        self,
+        cpu_threads: int = OCR_CPU_THREADS,
+        enable_mkldnn: bool = OCR_ENABLE_MKLDNN,
+        rec_batch_num: int = OCR_REC_BATCH_NUM
+    ):
+        from paddleocr import PaddleOCR
+
+        self.cpu_threads = cpu_threads
+        self.enable_mkldnn = enable_mkldnn
+        self.rec_batch_num = rec_batch_num
+        self.engine = PaddleOCR(
+            use_angle_cls=True,
+            lang='fr',
+            use_gpu=False,
+            enable_mkldnn=enable_mkldnn,
+            cpu_threads=cpu_threads,
+            rec_batch_num=rec_batch_num,
+            show_log=False
+        )
+
+    def ocr(self, image: "np.ndarray", use_cls: bool = True) -> List[OCRLine]:
+        result = self.engine.ocr(image, cls=use_cls)
+        if not result or not result[0]:
+            return []
+        return [(box, text, float(confidence)) for box, (text, confidence) in result[0]]
+
+    def ocr_batch(self, images: List["np.ndarray"], use_cls: List[bool]) -> List[List[OCRLine]]:
+        """
+        Detection page by page (input sizes differ), then angle classification and recognition
+        over the text lines of all pages at once, in rec_batch_num batches sorted by aspect ratio.
+        Same steps and filtering as PaddleOCR.ocr (TextSystem.__call__)
+        """
+        import copy
+
+        import cv2
+        from tools.infer.predict_system import sorted_boxes
+        from tools.infer.utility import get_rotate_crop_image
+
+        system = self.engine
+        crops, owners, boxes = [], [], []
+        for page, image in enumerate(images):
+            if image.ndim == 2:
+                image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            dt_boxes, _ = system.text_detector(image)
+            if dt_boxes is None:
+                continue
+            for box in sorted_boxes(dt_boxes):
+                crops.append(get_rotate_crop_image(image, copy.deepcopy(box)))
+                owners.append(page)
+                boxes.append(box)
+
+        # Classifieur d'angle uniquement pour les lignes des pages d'orientation inconnue
+        to_classify = [i for i, page in enumerate(owners) if use_cls[page]]
+        if system.use_angle_cls and to_classify:
+            rotated, _, _ = system.text_classifier([crops[i] for i in to_classify])
+            for i, crop in zip(to_classify, rotated):
+                crops[i] = crop
+
+        results: List[List[OCRLine]] = [[] for _ in images]
+        if not crops:
+            return results
+        recognized, _ = system.text_recognizer(crops)
+        for page, box, (text, confidence) in zip(owners, boxes, recognized):
+            if confidence >= system.drop_score:
+                results[page].append((box.tolist(), text, float(confidence)))
+        return results
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'engine': self.name,
+            'cpu_threads': self.cpu_threads,
+            'enable_mkldnn': self.enable_mkldnn,
+            'rec_batch_num': self.rec_batch_num
+        }
+
+
+class OnnxEngine(OCREngine):
+    """
+    PaddleOCR det/cls/rec models exported to ONNX, run with ONNX Runtime
+    Accepts int8-quantized models (see quantize_onnx_model)
+    """
+    name = "onnx"
+
+    def __init__(
+        self,
+        det_model_path: Optional[str] = OCR_ONNX_DET_MODEL,
+        rec_model_path: Optional[str] = OCR_ONNX_REC_MODEL,
+        cls_model_path: Optional[str] = OCR_ONNX_CLS_MODEL,
+        rec_keys_path: Optional[str] = OCR_ONNX_REC_KEYS,
+        intra_op_threads: int = OCR_CPU_THREADS,
+        inter_op_threads: int = OCR_ONNX_INTER_OP_THREADS,
+        rec_batch_num: int = OCR_REC_BATCH_NUM
+    ):
+        from rapidocr_onnxruntime import RapidOCR
+
+        options = {
+            'intra_op_num_threads': intra_op_threads,
+            'inter_op_num_threads': inter_op_threads,
+            'rec_batch_num': rec_batch_num
+        }
+        # Sans chemin explicite, RapidOCR utilise ses modèles embarqués
+        if det_model_path:
+            options['det_model_path'] = det_model_path
+        if rec_model_path:
+            options['rec_model_path'] = rec_model_path
+        if cls_model_path:
+            options['cls_model_path'] = cls_model_path
+        if rec_keys_path:
+            options['rec_keys_path'] = rec_keys_path
+
+        self.options = options
+        self.engine = RapidOCR(**options)
+
+    def ocr(self, image: "np.ndarray", use_cls: bool = True) -> List[OCRLine]:
+        result, _ = self.engine(image, use_cls=use_cls)
+        if not result:
+            return []
+        return [(box, text, float(confidence)) for box, text, confidence in result]
+
+    def describe(self) -> Dict[str, Any]:
+        return {'engine': self.name, **self.options}
+
+
+OCR_ENGINES = {
+    PaddleEngine.name: PaddleEngine,
+    OnnxEngine.name: OnnxEngine,
+}
+
+
+def create_ocr_engine(name: Optional[str] = None, **kwargs) -> OCREngine:
+    """Instantiate an OCR backend by name (OCR_ENGINE by default)"""
+    name = name or OCR_ENGINE
+    if name not in OCR_ENGINES:
+        raise ValueError(f"Moteur OCR inconnu: {name} (disponibles: {', '.join(OCR_ENGINES)})")
+    return OCR_ENGINES[name](**kwargs)
+
+
+def quantize_onnx_model(input_path: str, output_path: str) -> str:
+    """
+    Dynamic int8 quantization of an exported det/rec ONNX model
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    quantize_dynamic(input_path, output_path, weight_type=QuantType.QUInt8)
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dynamic int8 quantization of exported det/rec ONNX models")
+    parser.add_argument('models', nargs='+', help="Modèles ONNX à quantifier")
+    parser.add_argument('--suffix', default='_int8', help="Suffixe ajouté au nom des modèles quantifiés")
+    args = parser.parse_args()
+
+    for model in args.models:
+        root, ext = os.path.splitext(model)
+        print(quantize_onnx_model(model, f"{root}{args.suffix}{ext or '.onnx'}"))
+
+
+if __name__ == "__main__":
+    main()
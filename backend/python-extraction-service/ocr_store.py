@@ -0,0 +1,163 @@
+"""
+Stockage adressé par contenu du texte OCR
+Le texte et les boîtes OCR d'un document sont compressés (zstd, zlib à défaut) dans une ligne
+de ocr_blobs dont la clé est le SHA-256 du texte et des boîtes encodés : une ré-extraction
+du même document ne réécrit rien, extractions_brutes ne garde que la référence (ocr_blob_hash)
+"""
+import hashlib
+import os
+import struct
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+OCR_BLOB_STORE_ENABLED = os.getenv("OCR_BLOB_STORE_ENABLED", "true").lower() == "true"
+OCR_BLOB_ZSTD_LEVEL = int(os.getenv("OCR_BLOB_ZSTD_LEVEL", "9"))
+# Empreintes déjà écrites par cette instance (évite un aller-retour base par ré-extraction)
+OCR_BLOB_KNOWN_HASHES = int(os.getenv("OCR_BLOB_KNOWN_HASHES", "10000"))
+
+# En-tête des boîtes encodées : magic, version, nombre de boîtes
+BOXES_HEADER = struct.Struct('<4sBI')
+BOXES_MAGIC = b'OCRB'
+BOXES_VERSION = 1
+# Par boîte : 4 points (x, y) en pixels, confiance sur 16 bits, longueur du texte UTF-8
+BOX_RECORD = struct.Struct('<8HHH')
+UINT16_MAX = 0xFFFF
+
+
+# Préfixe de longueur du texte dans l'empreinte : la frontière texte / boîtes est sans ambiguïté
+TEXT_LENGTH = struct.Struct('<Q')
+
+
+def blob_hash(raw_text: bytes, raw_boxes: bytes) -> str:
+    """SHA-256 of the stored payload: the same text with different boxes is a different blob"""
+    return hashlib.sha256(TEXT_LENGTH.pack(len(raw_text)) + raw_text + raw_boxes).hexdigest()
+
+
+def compress(data: bytes) -> Tuple[str, bytes]:
+    """('zstd' | 'zlib', compressed bytes) depending on whether zstandard is installed"""
+    try:
+        import zstandard
+    except ImportError:
+        return 'zlib', zlib.compress(data, 9)
+    return 'zstd', zstandard.ZstdCompressor(level=OCR_BLOB_ZSTD_LEVEL).compress(data)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Codec inconnu: {codec}")
+
+
+def _clamp_coordinate(value: Any) -> int:
+    return min(UINT16_MAX, max(0, int(round(float(value)))))
+
+
+def encode_boxes(boxes: List[Dict[str, Any]]) -> bytes:
+    """
+    [{'box': [[x, y] * 4], 'text': str, 'confidence': float}] -> compact binary
+    Coordinates are rounded to the pixel, confidence quantized to 1/65535
+    """
+    parts = [BOXES_HEADER.pack(BOXES_MAGIC, BOXES_VERSION, len(boxes))]
+    for box in boxes:
+        points = list(box.get('box') or [])[:4]
+        points += [[0, 0]] * (4 - len(points))
+        coordinates = [_clamp_coordinate(c) for point in points for c in point[:2]]
+        text = (box.get('text') or '').encode('utf-8')[:UINT16_MAX]
+        confidence = min(UINT16_MAX, max(0, int(round(float(box.get('confidence') or 0.0) * UINT16_MAX))))
+        parts.append(BOX_RECORD.pack(*coordinates, confidence, len(text)))
+        parts.append(text)
+    return b''.join(parts)
+
+
+def decode_boxes(data: bytes) -> List[Dict[str, Any]]:
+    magic, version, count = BOXES_HEADER.unpack_from(data, 0)
+    if magic != BOXES_MAGIC or version != BOXES_VERSION:
+        raise ValueError("Encodage de boîtes OCR non reconnu")
+
+    boxes = []
+    offset = BOXES_HEADER.size
+    for _ in range(count):
+        *coordinates, confidence, length = BOX_RECORD.unpack_from(data, offset)
+        offset += BOX_RECORD.size
+        text = data[offset:offset + length].decode('utf-8', errors='replace')
+        offset += length
+        boxes.append({
+            'box': [[coordinates[i], coordinates[i + 1]] for i in range(0, 8, 2)],
+            'text': text,
+            'confidence': confidence / UINT16_MAX
+        })
+    return boxes
+
+
+def build_ocr_blob(ocr_data: Dict[str, Any]) -> Dict[str, Any]:
+    """ocr_blobs row for the merged OCR output of one document"""
+    text = ocr_data['text']
+    raw_text = text.encode('utf-8')
+    raw_boxes = encode_boxes(ocr_data.get('boxes') or [])
+    codec, text_data = compress(raw_text)
+    _, boxes_data = compress(raw_boxes)
+    return {
+        'hash': blob_hash(raw_text, raw_boxes),
+        'codec': codec,
+        'text_data': text_data,
+        'boxes_data': boxes_data,
+        'raw_size': len(raw_text) + len(raw_boxes),
+        'stored_size': len(text_data) + len(boxes_data)
+    }
+
+
+def to_bytes(value: Any) -> bytes:
+    """bytea as returned by asyncpg (bytes) or PostgREST ('\\x' + hex)"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value)
+    if isinstance(value, str) and value.startswith('\\x'):
+        return bytes.fromhex(value[2:])
+    raise ValueError("Valeur bytea inattendue")
+
+
+def to_bytea_literal(data: bytes) -> str:
+    """bytea in PostgREST JSON payloads"""
+    return '\\x' + data.hex()
+
+
+def read_ocr_text(blob: Dict[str, Any]) -> str:
+    return decompress(blob['codec'], to_bytes(blob['text_data'])).decode('utf-8')
+
+
+def read_ocr_boxes(blob: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if blob.get('boxes_data') is None:
+        return []
+    return decode_boxes(decompress(blob['codec'], to_bytes(blob['boxes_data'])))
+
+
+class KnownHashes:
+    """Bounded LRU set of blob hashes already stored"""
+
+    def __init__(self, max_entries: int = OCR_BLOB_KNOWN_HASHES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, digest: str) -> bool:
+        if digest in self.entries:
+            self.entries.move_to_end(digest)
+            return True
+        return False
+
+    def add(self, digest: str):
+        self.entries[digest] = None
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+def resolve_ocr_texts(rows: List[Dict[str, Any]], blobs: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """extractions_brutes rows (id, ocr_text, ocr_blob_hash) -> {id: text}, legacy rows keep ocr_text"""
+    texts = {}
+    for row in rows:
+        blob: Optional[Dict[str, Any]] = blobs.get(row.get('ocr_blob_hash'))
+        texts[row['id']] = read_ocr_text(blob) if blob else (row.get('ocr_text') or '')
+    return texts
@@ -0,0 +1,397 @@
+"""
+Apprentissage incrémental des patterns fournisseurs
+Consomme les nouvelles lignes de historique_corrections depuis un watermark,
+dérive des regex candidates par (fournisseur, champ), les évalue sur le texte OCR
+des autres corrections (jamais sur celle qui les a suggérées) et publie les gagnantes
+dans patterns_fournisseurs.regex_specifiques
+"""
+import logging
+import os
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from ocr_store import resolve_ocr_texts
+
+PATTERN_LEARNING_BATCH_SIZE = int(os.getenv("PATTERN_LEARNING_BATCH_SIZE", "500"))
+PATTERN_MIN_SUPPORT = int(os.getenv("PATTERN_MIN_SUPPORT", "3"))
+PATTERN_MIN_TRIALS = int(os.getenv("PATTERN_MIN_TRIALS", "3"))
+PATTERN_MIN_PRECISION = float(os.getenv("PATTERN_MIN_PRECISION", "0.9"))
+PATTERN_LABEL_MAX_CHARS = 40
+# created_at vaut le début de la transaction : une correction validée tard peut être plus ancienne
+# que le watermark, d'où une relecture de cette fenêtre (dédoublonnée par id)
+PATTERN_LEARNING_OVERLAP_SECONDS = int(os.getenv("PATTERN_LEARNING_OVERLAP_SECONDS", "600"))
+STATE_NAME = "patterns_fournisseurs"
+
+logger = logging.getLogger("extraction-service")
+
+TOKEN_RE = re.compile(r'\d+|[^\W\d_]+|\s+|.', re.UNICODE)
+NUMBER_RE = re.compile(r'-?\d[\d\s]*(?:[.,]\d+)?')
+GENERIC_NUMBER_TEMPLATE = r'-?\d[\d ]*(?:[.,]\d+)?'
+LABEL_SEPARATORS = ' \t:=-–'
+
+
+def normalize_value(value: Any) -> str:
+    """Comparable form of a field value (spaces removed, decimal comma, numbers canonical)"""
+    text = re.sub(r'\s+', '', str(value)).lower().replace(',', '.')
+    if NUMBER_RE.fullmatch(text):
+        try:
+            return repr(float(text))
+        except ValueError:
+            pass
+    return text
+
+
+def value_templates(value: str) -> List[str]:
+    """
+    Regex templates generalizing a corrected value
+    Exact shape (digit run lengths kept) and, for numbers, a generic amount shape
+    """
+    parts = []
+    for token in TOKEN_RE.findall(value.strip()):
+        if token.isdigit():
+            parts.append(rf'\d{{{len(token)}}}')
+        elif token.isspace():
+            parts.append(r'\s*')
+        elif token.isalpha():
+            parts.append(r'[^\W\d_]+')
+        else:
+            parts.append(re.escape(token))
+
+    templates = [''.join(parts)]
+    if NUMBER_RE.fullmatch(value.strip()) and GENERIC_NUMBER_TEMPLATE not in templates:
+        templates.append(GENERIC_NUMBER_TEMPLATE)
+    return templates
+
+
+def find_label(ocr_text: str, template: str, corrected: str) -> Optional[str]:
+    """
+    Locate the corrected value in the OCR text and return the label preceding it
+    on the same line (e.g. 'Consommation totale'), or None
+    """
+    target = normalize_value(corrected)
+    for match in re.finditer(template, ocr_text):
+        if normalize_value(match.group(0)) != target:
+            continue
+        line_start = ocr_text.rfind('\n', 0, match.start()) + 1
+        prefix = ocr_text[line_start:match.start()][-PATTERN_LABEL_MAX_CHARS:]
+        # Le libellé ne garde que les mots (pas les montants ou dates voisins)
+        label = re.sub(r'[\d.,]+', ' ', prefix)
+        label = re.sub(r'\s+', ' ', label).strip(LABEL_SEPARATORS)
+        if len(label) >= 3:
+            return label
+    return None
+
+
+def build_regex(label: str, template: str) -> str:
+    words = [re.escape(word) for word in label.split()]
+    return r'(?i)' + r'\s+'.join(words) + r'[\s:=\-–]*(' + template + r')'
+
+
+def derive_candidates(correction: Dict[str, Any], ocr_text: Optional[str]) -> List[Dict[str, str]]:
+    """Candidate (regex, template) pairs suggested by one correction"""
+    corrected = correction.get('valeur_corrigee')
+    if not corrected or corrected == 'None' or not ocr_text:
+        return []
+
+    candidates = []
+    for template in value_templates(corrected):
+        label = find_label(ocr_text, template, corrected)
+        if label:
+            candidates.append({'regex': build_regex(label, template), 'template': template})
+    return candidates
+
+
+def score_candidate(regex: str, ocr_text: str, corrected: str) -> bool:
+    """True when the regex extracts exactly the corrected value from the OCR text"""
+    try:
+        match = re.search(regex, ocr_text)
+    except re.error:
+        return False
+    return bool(match) and normalize_value(match.group(1)) == normalize_value(corrected)
+
+
+def precision(candidate: Dict[str, Any]) -> float:
+    return candidate['hits'] / candidate['trials'] if candidate['trials'] else 0.0
+
+
+def update_candidates(
+    candidates: Dict[str, Dict[str, Any]],
+    supplier: str,
+    field_name: str,
+    corrections: List[Dict[str, Any]],
+    ocr_texts: Dict[str, str]
+) -> set:
+    """
+    Fold corrections into the candidates of one (supplier, field) pair, in place; returns the changed regexes.
+    A candidate is only trialed on corrections other than the one that created it: its regex was
+    built from that text, so the trial would always hit
+    """
+    changed = set()
+    for correction in corrections:
+        ocr_text = ocr_texts.get(correction.get('extraction_brute_id'))
+        if not ocr_text:
+            continue
+
+        # Nouvelles candidates suggérées par cette correction
+        created = set()
+        for suggestion in derive_candidates(correction, ocr_text):
+            if suggestion['regex'] not in candidates:
+                candidates[suggestion['regex']] = {
+                    'nom_fournisseur': supplier,
+                    'field_name': field_name,
+                    'regex': suggestion['regex'],
+                    'template': suggestion['template'],
+                    'support': 0,
+                    'trials': 0,
+                    'hits': 0
+                }
+                created.add(suggestion['regex'])
+            candidate = candidates[suggestion['regex']]
+            candidate['support'] += 1
+            candidate['exemple'] = correction['valeur_corrigee']
+            changed.add(suggestion['regex'])
+
+        # Les candidates déjà connues sont évaluées sur ce texte OCR, hors échantillon
+        for regex, candidate in candidates.items():
+            if regex in created:
+                continue
+            candidate['trials'] += 1
+            if score_candidate(regex, ocr_text, correction['valeur_corrigee']):
+                candidate['hits'] += 1
+            changed.add(regex)
+    return changed
+
+
+def _timestamp(value: str) -> datetime:
+    """
+    created_at from PostgREST; Python 3.10 fromisoformat wants 'Z' spelled +00:00 and
+    3 or 6 fraction digits, Postgres trims trailing zeros
+    """
+    value = re.sub(r'\.(\d{1,6})', lambda m: '.' + m.group(1).ljust(6, '0'), value.replace('Z', '+00:00'), count=1)
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+
+def select_winner(candidates: Iterable[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Best candidate meeting support, trials and precision thresholds"""
+    eligible = [
+        c for c in candidates
+        if c['support'] >= PATTERN_MIN_SUPPORT
+        and c['trials'] >= PATTERN_MIN_TRIALS
+        and precision(c) >= PATTERN_MIN_PRECISION
+    ]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda c: (precision(c), c['support'], c['trials']))
+
+
+class PatternAggregator:
+    """
+    Incremental aggregator over historique_corrections
+    Each run only reads corrections newer than the stored watermark (minus the overlap window,
+    deduplicated by id), plus the candidates and OCR texts of the (supplier, field) pairs they touch
+    """
+
+    def __init__(self, db, batch_size: int = PATTERN_LEARNING_BATCH_SIZE,
+                 overlap_seconds: int = PATTERN_LEARNING_OVERLAP_SECONDS):
+        self.db = db
+        self.batch_size = batch_size
+        self.overlap = timedelta(seconds=overlap_seconds)
+
+    # --- Watermark ---
+    def load_watermark(self) -> Tuple[Optional[str], Dict[str, str], int]:
+        """(watermark created_at, {id: created_at} processed within the overlap window, processed count)"""
+        result = self.db.table('pattern_learning_state')\
+            .select('*')\
+            .eq('name', STATE_NAME)\
+            .limit(1)\
+            .execute()
+        if not result.data:
+            return None, {}, 0
+        state = result.data[0]
+        return (
+            state.get('watermark_created_at'),
+            state.get('recent_ids') or {},
+            state.get('corrections_processed') or 0
+        )
+
+    def save_watermark(self, created_at: str, recent_ids: Dict[str, str], last_id: str, processed: int):
+        # Seuls les ids encore dans la fenêtre de recouvrement servent au dédoublonnage
+        horizon = _timestamp(created_at) - self.overlap
+        self.db.table('pattern_learning_state').upsert({
+            'name': STATE_NAME,
+            'watermark_created_at': created_at,
+            'watermark_id': last_id,
+            'recent_ids': {
+                correction_id: seen_at for correction_id, seen_at in recent_ids.items()
+                if _timestamp(seen_at) >= horizon
+            },
+            'corrections_processed': processed,
+            'updated_at': datetime.utcnow().isoformat()
+        }).execute()
+
+    # --- Lectures delta ---
+    def fetch_new_corrections(self, created_at: Optional[str], processed_ids: Dict[str, str]) -> List[Dict[str, Any]]:
+        """
+        Up to batch_size unprocessed corrections, oldest first, from watermark - overlap
+        (keyset pages over (created_at, id), ids already processed skipped)
+        """
+        since = (_timestamp(created_at) - self.overlap).isoformat() if created_at else None
+        cursor: Optional[Tuple[str, str]] = None
+        corrections: List[Dict[str, Any]] = []
+        while len(corrections) < self.batch_size:
+            query = self.db.table('historique_corrections')\
+                .select('id, created_at, extraction_brute_id, field_name, valeur_corrigee, fournisseur_name')
+            if cursor:
+                query = query.or_(f"created_at.gt.{cursor[0]},and(created_at.eq.{cursor[0]},id.gt.{cursor[1]})")
+            elif since:
+                query = query.gte('created_at', since)
+            page = query.order('created_at').order('id').limit(self.batch_size).execute().data or []
+            corrections.extend(row for row in page if str(row['id']) not in processed_ids)
+            if len(page) < self.batch_size:
+                break
+            cursor = (page[-1]['created_at'], page[-1]['id'])
+        return corrections[:self.batch_size]
+
+    def fetch_ocr_texts(self, extraction_ids: List[str]) -> Dict[str, str]:
+        if not extraction_ids:
+            return {}
+        rows = self.db.table('extractions_brutes')\
+            .select('id, ocr_text, ocr_blob_hash')\
+            .in_('id', extraction_ids)\
+            .execute().data or []
+        # Plusieurs extractions d'un même document partagent un seul blob
+        hashes = list({row['ocr_blob_hash'] for row in rows if row.get('ocr_blob_hash')})
+        blobs = {}
+        if hashes:
+            result = self.db.table('ocr_blobs')\
+                .select('hash, codec, text_data')\
+                .in_('hash', hashes)\
+                .execute()
+            blobs = {blob['hash']: blob for blob in (result.data or [])}
+        return resolve_ocr_texts(rows, blobs)
+
+    def fetch_candidates(self, supplier: str, field_name: str) -> Dict[str, Dict[str, Any]]:
+        result = self.db.table('pattern_candidates')\
+            .select('*')\
+            .eq('nom_fournisseur', supplier)\
+            .eq('field_name', field_name)\
+            .execute()
+        return {row['regex']: row for row in (result.data or [])}
+
+    # --- Publication ---
+    def publish(self, supplier: str, field_name: str, winner: Dict[str, Any]):
+        regex_specifiques = {
+            'regex': winner['regex'],
+            'template': winner['template'],
+            'precision': round(precision(winner), 4),
+            'support': winner['support'],
+            'trials': winner['trials'],
+            'published_at': datetime.utcnow().isoformat()
+        }
+        existing = self.db.table('patterns_fournisseurs')\
+            .select('id, regex_specifiques')\
+            .eq('nom_fournisseur', supplier)\
+            .eq('field_name', field_name)\
+            .limit(1)\
+            .execute()
+
+        if existing.data:
+            current = existing.data[0].get('regex_specifiques') or {}
+            if isinstance(current, dict) and current.get('regex') == winner['regex']:
+                regex_specifiques['published_at'] = current.get('published_at', regex_specifiques['published_at'])
+            self.db.table('patterns_fournisseurs')\
+                .update({
+                    'regex_specifiques': regex_specifiques,
+                    'exemple_champs': winner.get('exemple'),
+                    'updated_at': datetime.utcnow().isoformat()
+                })\
+                .eq('id', existing.data[0]['id'])\
+                .execute()
+        else:
+            self.db.table('patterns_fournisseurs').insert({
+                'nom_fournisseur': supplier,
+                'alias_detection': [supplier],
+                'field_name': field_name,
+                'regex_specifiques': regex_specifiques,
+                'exemple_champs': winner.get('exemple'),
+                'sample_count': winner['support']
+            }).execute()
+
+    # --- Traitement ---
+    def process_group(self, supplier: str, field_name: str, corrections: List[Dict[str, Any]], ocr_texts: Dict[str, str]) -> bool:
+        """Update the candidates of one (supplier, field) pair; returns True if a winner was published"""
+        candidates = self.fetch_candidates(supplier, field_name)
+        changed = update_candidates(candidates, supplier, field_name, corrections, ocr_texts)
+
+        if changed:
+            now = datetime.utcnow().isoformat()
+            rows = [
+                {key: candidates[regex].get(key) for key in (
+                    'nom_fournisseur', 'field_name', 'regex', 'template',
+                    'support', 'trials', 'hits', 'exemple'
+                )} | {'updated_at': now}
+                for regex in changed
+            ]
+            self.db.table('pattern_candidates')\
+                .upsert(rows, on_conflict='nom_fournisseur,field_name,regex')\
+                .execute()
+
+        winner = select_winner(candidates.values())
+        if winner:
+            self.publish(supplier, field_name, winner)
+            return True
+        return False
+
+    def run_once(self) -> Dict[str, Any]:
+        """Process one batch of new corrections"""
+        created_at, recent_ids, processed = self.load_watermark()
+        corrections = self.fetch_new_corrections(created_at, recent_ids)
+        if not corrections:
+            return {'corrections': 0, 'groups': 0, 'published': 0}
+
+        ocr_texts = self.fetch_ocr_texts(list({
+            c['extraction_brute_id'] for c in corrections if c.get('extraction_brute_id')
+        }))
+
+        groups: Dict[Tuple[str, str], List[Dict[str, Any]]] = defaultdict(list)
+        for correction in corrections:
+            if correction.get('fournisseur_name') and correction.get('field_name'):
+                groups[(correction['fournisseur_name'], correction['field_name'])].append(correction)
+
+        published = 0
+        for (supplier, field_name), group in groups.items():
+            if self.process_group(supplier, field_name, group, ocr_texts):
+                published += 1
+
+        recent_ids = {**recent_ids, **{str(c['id']): c['created_at'] for c in corrections}}
+        last = max(corrections, key=lambda c: _timestamp(c['created_at']))
+        if created_at and _timestamp(created_at) > _timestamp(last['created_at']):
+            # Seules des corrections en retard : le watermark ne recule pas
+            last = {'created_at': created_at, 'id': last['id']}
+        self.save_watermark(last['created_at'], recent_ids, last['id'], processed + len(corrections))
+
+        return {'corrections': len(corrections), 'groups': len(groups), 'published': published}
+
+    def run_until_caught_up(self, max_batches: int = 100) -> Dict[str, Any]:
+        """Drain the backlog of new corrections, batch by batch"""
+        totals = {'corrections': 0, 'groups': 0, 'published': 0, 'batches': 0}
+        for _ in range(max_batches):
+            summary = self.run_once()
+            if not summary['corrections']:
+                break
+            totals['batches'] += 1
+            for key in ('corrections', 'groups', 'published'):
+                totals[key] += summary[key]
+            if summary['corrections'] < self.batch_size:
+                break
+        return totals
+
+
+if __name__ == "__main__":
+    from main import get_supabase
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"Agrégation des patterns: {PatternAggregator(get_supabase()).run_until_caught_up()}")
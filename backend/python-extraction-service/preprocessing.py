@@ -0,0 +1,148 @@
+"""
+Prétraitement des images avant OCR
+Réorientation EXIF, réduction de taille, niveaux de gris, redressement et binarisation
+"""
+import os
+from typing import Dict, Any, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "true").lower() == "true"
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "2400"))
+OCR_DESKEW = os.getenv("OCR_DESKEW", "true").lower() == "true"
+OCR_DESKEW_MAX_ANGLE = float(os.getenv("OCR_DESKEW_MAX_ANGLE", "5.0"))
+OCR_BINARIZE = os.getenv("OCR_BINARIZE", "false").lower() == "true"
+
+# Tag EXIF "Orientation"
+EXIF_ORIENTATION_TAG = 0x0112
+DESKEW_ANGLE_STEP = 0.25
+DESKEW_SAMPLE_POINTS = 20000
+DESKEW_MIN_ANGLE = 0.1
+
+
+def auto_orient(image: Image.Image) -> Tuple[Image.Image, bool]:
+    """
+    Apply the EXIF orientation tag
+    Returns (image, orientation_known)
+    """
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG)
+    if orientation is None:
+        return image, False
+    return ImageOps.exif_transpose(image), True
+
+
+def bound_size(image: Image.Image, max_side: int) -> Tuple[Image.Image, float]:
+    """Downscale so the long edge is at most max_side; returns (image, scale)"""
+    long_edge = max(image.size)
+    if long_edge <= max_side:
+        return image, 1.0
+
+    scale = max_side / long_edge
+    target = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+
+    # Décodage JPEG réduit directement par libjpeg quand c'est possible
+    if image.format == 'JPEG':
+        image.draft('RGB', target)
+
+    return image.resize(target, Image.LANCZOS), scale
+
+
+def to_grayscale(image: Image.Image) -> np.ndarray:
+    """Convert any PIL mode (RGB, RGBA, P, ...) to a 2D uint8 array"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        # Fond blanc sous la transparence plutôt que noir
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image.convert('RGBA'), mask=image.convert('RGBA').split()[-1])
+        image = background
+    return np.asarray(image.convert('L'), dtype=np.uint8)
+
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Otsu threshold computed from the 256-bin histogram"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    levels = np.arange(256, dtype=np.float64)
+
+    weight_bg = np.cumsum(hist)
+    weight_fg = weight_bg[-1] - weight_bg
+    cum_mean = np.cumsum(hist * levels)
+    total_mean = cum_mean[-1]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = cum_mean / weight_bg
+        mean_fg = (total_mean - cum_mean) / weight_fg
+        between_var = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+
+    # Image uniforme : aucune séparation possible
+    return int(np.argmax(np.nan_to_num(between_var)))
+
+
+def binarize(gray: np.ndarray) -> np.ndarray:
+    """Black text on white background (Otsu)"""
+    return np.where(gray > otsu_threshold(gray), 255, 0).astype(np.uint8)
+
+
+def estimate_skew(gray: np.ndarray, max_angle: float = OCR_DESKEW_MAX_ANGLE) -> float:
+    """
+    Estimate the text skew angle (degrees) by projection profiles
+    All candidate angles are scored at once on a sample of dark pixels
+    """
+    ys, xs = np.nonzero(gray <= otsu_threshold(gray))
+    if ys.size < 100:
+        return 0.0
+
+    if ys.size > DESKEW_SAMPLE_POINTS:
+        idx = np.random.default_rng(0).choice(ys.size, DESKEW_SAMPLE_POINTS, replace=False)
+        ys, xs = ys[idx], xs[idx]
+
+    angles = np.arange(-max_angle, max_angle + DESKEW_ANGLE_STEP, DESKEW_ANGLE_STEP)
+    radians = np.deg2rad(angles)[:, None]
+
+    # Ordonnée de chaque pixel après rotation, pour chaque angle candidat : (A, N)
+    projected = ys[None, :] * np.cos(radians) + xs[None, :] * np.sin(radians)
+    rows = np.round(projected - projected.min(axis=1, keepdims=True)).astype(np.int64)
+
+    n_bins = int(rows.max()) + 1
+    offsets = np.arange(len(angles))[:, None] * n_bins
+    profiles = np.bincount((rows + offsets).ravel(), minlength=len(angles) * n_bins)
+    profiles = profiles.reshape(len(angles), n_bins).astype(np.float64)
+
+    # Des lignes de texte bien alignées donnent un profil très contrasté
+    scores = np.sum(np.diff(profiles, axis=1) ** 2, axis=1)
+    return float(angles[int(np.argmax(scores))])
+
+
+def deskew(gray: np.ndarray) -> Tuple[np.ndarray, float]:
+    """Rotate the page so that text lines are horizontal"""
+    angle = estimate_skew(gray)
+    if abs(angle) < DESKEW_MIN_ANGLE:
+        return gray, 0.0
+
+    rotated = Image.fromarray(gray).rotate(
+        -angle, resample=Image.BILINEAR, expand=True, fillcolor=255
+    )
+    return np.asarray(rotated, dtype=np.uint8), angle
+
+
+def preprocess_image(image: Image.Image, orientation_known: bool = False) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    Prepare an uploaded image or a rasterized page for OCR
+    Returns: (grayscale array, {'orientation_known', 'scale', 'skew_angle', 'binarized'})
+    """
+    image, exif_oriented = auto_orient(image)
+    image, scale = bound_size(image, OCR_MAX_SIDE)
+    gray = to_grayscale(image)
+
+    skew_angle = 0.0
+    if OCR_DESKEW:
+        gray, skew_angle = deskew(gray)
+
+    if OCR_BINARIZE:
+        gray = binarize(gray)
+
+    return gray, {
+        'orientation_known': orientation_known or exif_oriented,
+        'scale': round(scale, 4),
+        'skew_angle': skew_angle,
+        'binarized': OCR_BINARIZE
+    }
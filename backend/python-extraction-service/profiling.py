@@ -0,0 +1,407 @@
+"""
+Profilage par échantillonnage à la demande, sans redéploiement
+Un thread lit la pile de tous les threads (boucle d'événements, threads de asyncio.to_thread,
+batcher OCR) toutes les PROFILING_INTERVAL_MS via sys._current_frames :
+- mode 'wall' : chaque échantillon compte le temps écoulé, thread actif ou en attente
+- mode 'cpu' : chaque échantillon compte le temps CPU consommé par le thread depuis le précédent
+  (/proc/self/task/<tid>/stat, Linux)
+Profil global de N secondes, ou d'une seule requête (en-tête X-Profile) : on ne garde alors que la tâche
+de la requête, les tâches qu'elle crée et les threads qui exécutent ses appels asyncio.to_thread.
+Sortie au format speedscope (https://www.speedscope.app) ou piles repliées (flamegraph.pl, inferno)
+Seul exemplaire du profileur : le backend de géocodage le charge par son chemin (utils/profiling.py)
+et monte les mêmes routes /debug via create_profiling_router
+"""
+import asyncio
+import hmac
+import os
+import sys
+import threading
+import time
+import uuid
+import weakref
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterable, List, Literal, Optional, Tuple
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+# Jeton exigé dans l'en-tête X-Profiling-Token (sans jeton, le profilage reste fermé)
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", "5"))
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+PROFILING_MAX_DEPTH = int(os.getenv("PROFILING_MAX_DEPTH", "128"))
+# Profils gardés en mémoire pour GET /debug/profiles/{id}
+PROFILING_KEEP = int(os.getenv("PROFILING_KEEP", "10"))
+# Chemins pouvant être profilés par requête (en-tête X-Profile: wall | cpu) ; sinon ceux donnés
+# par l'application au middleware
+PROFILING_TRACE_PATHS = {
+    path.strip() for path in os.getenv("PROFILING_TRACE_PATHS", "").split(",") if path.strip()
+}
+
+PROFILE_MODES = ('wall', 'cpu')
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+# Profil de la requête en cours (hérité par les tâches créées et les appels asyncio.to_thread)
+current_trace: ContextVar[Optional["Profile"]] = ContextVar('current_trace', default=None)
+
+
+class ProfilingBusy(Exception):
+    """Another profile is already running"""
+
+
+def token_is_valid(token: Optional[str]) -> bool:
+    return bool(PROFILING_ENABLED and PROFILING_TOKEN and token) and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def thread_cpu_seconds(native_id: Optional[int]) -> Optional[float]:
+    """user + system CPU time of one thread of this process (Linux only)"""
+    if native_id is None:
+        return None
+    try:
+        with open(f"/proc/self/task/{native_id}/stat", 'rb') as f:
+            fields = f.read().rsplit(b')', 1)[1].split()
+    except OSError:
+        return None
+    # Après le nom du thread : état (0) ... utime (11), stime (12)
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def cpu_mode_available() -> bool:
+    return thread_cpu_seconds(threading.get_native_id()) is not None
+
+
+class Profile:
+    """
+    One sampling session: stacks (root first) per thread name, weighted in seconds
+    accept(thread_ident) restricts the threads sampled (all threads when None)
+    """
+
+    def __init__(
+        self,
+        mode: str,
+        name: str,
+        max_seconds: float = PROFILING_MAX_SECONDS,
+        interval_ms: float = PROFILING_INTERVAL_MS,
+        accept: Optional[Callable[[int], bool]] = None
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.mode = mode
+        self.name = name
+        self.max_seconds = max_seconds
+        self.interval = max(0.001, interval_ms / 1000)
+        self.accept = accept
+        # Code objects -> indice dans frames
+        self.frame_ids: Dict[Any, int] = {}
+        self.frames: List[Dict[str, Any]] = []
+        self.stacks: Dict[str, Counter] = {}
+        self.sample_count = 0
+        self.started_at = time.time()
+        self.duration = 0.0
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name=f"profiler-{self.id}", daemon=True)
+
+    def start(self) -> "Profile":
+        self.thread.start()
+        return self
+
+    def stop(self) -> "Profile":
+        self.stop_event.set()
+        if self.thread.is_alive() and self.thread is not threading.current_thread():
+            self.thread.join()
+        return self
+
+    def frame_id(self, code) -> int:
+        frame_id = self.frame_ids.get(code)
+        if frame_id is None:
+            frame_id = self.frame_ids[code] = len(self.frames)
+            self.frames.append({
+                'name': getattr(code, 'co_qualname', code.co_name),
+                'file': code.co_filename,
+                'line': code.co_firstlineno
+            })
+        return frame_id
+
+    def stack_of(self, frame) -> Tuple[int, ...]:
+        stack = []
+        while frame is not None and len(stack) < PROFILING_MAX_DEPTH:
+            stack.append(self.frame_id(frame.f_code))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def run(self):
+        own = threading.get_ident()
+        started = last = time.perf_counter()
+        cpu_seen: Dict[int, float] = {}
+        while not self.stop_event.wait(self.interval):
+            now = time.perf_counter()
+            elapsed, last = now - last, now
+            threads = {thread.ident: thread for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident not in threads:
+                    continue
+                if self.mode == 'cpu':
+                    # Référence mise à jour même pour un thread ignoré : seul le CPU suivant compte
+                    cpu = thread_cpu_seconds(threads[ident].native_id)
+                    if cpu is None:
+                        continue
+                    weight, cpu_seen[ident] = cpu - cpu_seen.get(ident, cpu), cpu
+                else:
+                    weight = elapsed
+                if weight <= 0 or (self.accept is not None and not self.accept(ident)):
+                    continue
+                self.stacks.setdefault(threads[ident].name, Counter())[self.stack_of(frame)] += weight
+            self.sample_count += 1
+            self.duration = now - started
+            if self.duration >= self.max_seconds:
+                break
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            'id': self.id,
+            'name': self.name,
+            'mode': self.mode,
+            'started_at': self.started_at,
+            'duration_seconds': round(self.duration, 3),
+            'samples': self.sample_count,
+            'threads': sorted(self.stacks),
+            'running': self.thread.is_alive()
+        }
+
+    def speedscope(self) -> Dict[str, Any]:
+        """speedscope file: one sampled profile per thread, weights in seconds"""
+        profiles = []
+        for thread_name, stacks in sorted(self.stacks.items()):
+            total = sum(stacks.values())
+            profiles.append({
+                'type': 'sampled',
+                'name': f"{thread_name} ({self.mode})",
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': total,
+                'samples': [list(stack) for stack in stacks],
+                'weights': list(stacks.values())
+            })
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': f"{self.name} {self.mode}",
+            'exporter': 'profiling.py',
+            'activeProfileIndex': 0,
+            'shared': {'frames': self.frames},
+            'profiles': profiles
+        }
+
+    def collapsed(self) -> str:
+        """Collapsed stacks ('thread;frame;frame weight'), weights in microseconds, for flamegraph tools"""
+        lines = []
+        for thread_name, stacks in sorted(self.stacks.items()):
+            for stack, weight in stacks.items():
+                names = [thread_name] + [
+                    f"{self.frames[i]['name']} ({os.path.basename(self.frames[i]['file'])}:{self.frames[i]['line']})"
+                    for i in stack
+                ]
+                lines.append(f"{';'.join(name.replace(';', ':') for name in names)} {max(1, round(weight * 1e6))}")
+        return '\n'.join(lines) + '\n'
+
+
+class RequestTrace(Profile):
+    """Profile restricted to one request: its tasks on the event loop and the worker threads it uses"""
+
+    def __init__(self, mode: str, name: str, loop: asyncio.AbstractEventLoop):
+        super().__init__(mode, name, accept=self.accepts)
+        self.loop = loop
+        self.loop_thread = threading.get_ident()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        self.worker_threads: Counter = Counter()
+
+    def accepts(self, ident: int) -> bool:
+        if self.worker_threads.get(ident):
+            return True
+        if ident != self.loop_thread:
+            return False
+        # Tâche en cours sur la boucle de la requête, lue depuis le thread d'échantillonnage
+        task = asyncio.current_task(self.loop)
+        return task is not None and task in self.tasks
+
+
+class ProfileRegistry:
+    """At most one running profile; the last PROFILING_KEEP are kept"""
+
+    def __init__(self, keep: int = PROFILING_KEEP):
+        self.keep = keep
+        self.profiles: "OrderedDict[str, Profile]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.active: Optional[Profile] = None
+
+    def start(self, profile: Profile) -> Profile:
+        with self.lock:
+            if self.active is not None and self.active.thread.is_alive():
+                raise ProfilingBusy(f"Profil {self.active.id} déjà en cours")
+            self.active = profile.start()
+            self.profiles[profile.id] = profile
+            while len(self.profiles) > self.keep:
+                self.profiles.popitem(last=False)
+        return profile
+
+    def get(self, profile_id: str) -> Optional[Profile]:
+        return self.profiles.get(profile_id)
+
+    def list(self) -> List[Dict[str, Any]]:
+        return [profile.summary() for profile in reversed(self.profiles.values())]
+
+
+profiles = ProfileRegistry()
+
+
+async def profile_for(seconds: float, mode: str = 'wall') -> Profile:
+    """Whole-process profile of the next `seconds` seconds"""
+    profile = profiles.start(Profile(mode, 'process', max_seconds=min(seconds, PROFILING_MAX_SECONDS)))
+    try:
+        await asyncio.sleep(profile.max_seconds)
+    finally:
+        await asyncio.to_thread(profile.stop)
+    return profile
+
+
+class TracingExecutor(ThreadPoolExecutor):
+    """Default executor that attributes worker threads to the traced request that submitted the call"""
+
+    def submit(self, fn, /, *args, **kwargs):
+        trace = current_trace.get()
+        if trace is None:
+            return super().submit(fn, *args, **kwargs)
+
+        def traced():
+            ident = threading.get_ident()
+            trace.worker_threads[ident] += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                trace.worker_threads[ident] -= 1
+
+        return super().submit(traced)
+
+
+def install_profiling_hooks():
+    """
+    On the running loop: task factory registering the tasks created by a traced request,
+    and the tracing default executor (asyncio.to_thread). Only when PROFILING_ENABLED
+    """
+    if not PROFILING_ENABLED:
+        return
+    loop = asyncio.get_running_loop()
+    previous_factory = loop.get_task_factory()
+
+    def task_factory(loop, coro, **kwargs):
+        if previous_factory is not None:
+            task = previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.tasks.add(task)
+        return task
+
+    loop.set_task_factory(task_factory)
+    loop.set_default_executor(TracingExecutor(thread_name_prefix='asyncio'))
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware: a request on the trace paths (PROFILING_TRACE_PATHS, else trace_paths) carrying
+    X-Profile (wall | cpu) and a valid X-Profiling-Token is profiled on its own; the response carries X-Profile-Id
+    """
+
+    def __init__(self, app, trace_paths: Iterable[str] = ()):
+        self.app = app
+        self.trace_paths = PROFILING_TRACE_PATHS or set(trace_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not PROFILING_ENABLED or scope['path'] not in self.trace_paths:
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get('headers') or [])
+        mode = headers.get(b'x-profile', b'').decode('latin-1').lower()
+        if mode not in PROFILE_MODES or not token_is_valid(headers.get(b'x-profiling-token', b'').decode('latin-1')):
+            return await self.app(scope, receive, send)
+
+        try:
+            trace = profiles.start(RequestTrace(mode, f"{scope['method']} {scope['path']}", asyncio.get_running_loop()))
+        except ProfilingBusy:
+            return await self.app(scope, receive, self.with_header(send, b'x-profile-status', b'busy'))
+
+        trace.tasks.add(asyncio.current_task())
+        token = current_trace.set(trace)
+        try:
+            await self.app(scope, receive, self.with_header(send, b'x-profile-id', trace.id.encode()))
+        finally:
+            current_trace.reset(token)
+            # Tâches de fond comprises (exécutées par Starlette avant de rendre la main)
+            await asyncio.to_thread(trace.stop)
+
+    @staticmethod
+    def with_header(send, name: bytes, value: bytes):
+        async def send_with_header(message):
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': [*message.get('headers', []), (name, value)]}
+            await send(message)
+        return send_with_header
+
+
+# --- Routes /debug (service d'extraction et backend de géocodage) ---
+def require_profiling_token(x_profiling_token: Optional[str] = Header(None)):
+    """Profiling endpoints: hidden when disabled, X-Profiling-Token required otherwise"""
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not token_is_valid(x_profiling_token):
+        raise HTTPException(status_code=401, detail="Jeton de profilage invalide")
+
+
+def profile_response(profile: Profile, output_format: str) -> Response:
+    if output_format == 'collapsed':
+        return Response(content=profile.collapsed(), media_type='text/plain')
+    return JSONResponse(
+        content=profile.speedscope(),
+        headers={'Content-Disposition': f'attachment; filename="profile-{profile.id}.speedscope.json"'}
+    )
+
+
+def create_profiling_router() -> APIRouter:
+    """POST /debug/profile, GET /debug/profiles and GET /debug/profiles/{id}, token-protected"""
+    router = APIRouter(prefix="/debug", dependencies=[Depends(require_profiling_token)])
+
+    @router.post("/profile")
+    async def capture_profile(
+        seconds: float = 10.0,
+        mode: Literal['wall', 'cpu'] = 'wall',
+        format: Literal['speedscope', 'collapsed'] = 'speedscope'
+    ):
+        """
+        Sample every thread of the process for `seconds` (capped by PROFILING_MAX_SECONDS)
+        and return a speedscope file or collapsed stacks for a flamegraph
+        """
+        if mode == 'cpu' and not cpu_mode_available():
+            raise HTTPException(status_code=400, detail="Mode cpu indisponible (/proc absent)")
+        try:
+            profile = await profile_for(seconds, mode)
+        except ProfilingBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return profile_response(profile, format)
+
+    @router.get("/profiles")
+    async def list_profiles():
+        """Profiles kept in memory (latest first), including per-request traces (X-Profile)"""
+        return {'modes': PROFILE_MODES, 'profiles': profiles.list()}
+
+    @router.get("/profiles/{profile_id}")
+    async def get_profile(profile_id: str, format: Literal['speedscope', 'collapsed'] = 'speedscope'):
+        profile = profiles.get(profile_id)
+        if profile is None:
+            raise HTTPException(status_code=404, detail="Profil inconnu")
+        if profile.thread.is_alive():
+            raise HTTPException(status_code=409, detail="Profil en cours")
+        return profile_response(profile, format)
+
+    return router
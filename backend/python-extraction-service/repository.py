@@ -0,0 +1,342 @@
+"""
+Couche d'accès aux données du service d'extraction
+Implémentations asynchrones pour factures, extractions_brutes, ocr_blobs, llm_prompts et
+patterns_fournisseurs :
+- PostgresRepository : connexion directe Postgres (pool asyncpg, requêtes préparées)
+- PostgrestRepository : client supabase-py (PostgREST), exécuté hors de la boucle d'événements
+Sélection par REPOSITORY_BACKEND (auto, postgres, postgrest)
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+from abc import ABC, abstractmethod
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from ocr_store import to_bytea_literal
+
+REPOSITORY_BACKEND = os.getenv("REPOSITORY_BACKEND", "auto")
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+# Requêtes préparées gardées en cache par connexion (0 derrière PgBouncer en mode transaction)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+# Lignes par page PostgREST (plafond max-rows du serveur)
+POSTGREST_PAGE_SIZE = int(os.getenv("POSTGREST_PAGE_SIZE", "1000"))
+
+logger = logging.getLogger("extraction-service")
+
+IDENTIFIER_RE = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def quote_identifier(name: str) -> str:
+    """Column names come from dict keys: only plain identifiers are accepted"""
+    if not IDENTIFIER_RE.match(name):
+        raise ValueError(f"Nom de colonne invalide: {name}")
+    return f'"{name}"'
+
+
+def to_json_value(value: Any) -> Any:
+    """Same shapes as PostgREST JSON (uuid/date as strings, numeric as float)"""
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def record_to_dict(record) -> Dict[str, Any]:
+    return {key: to_json_value(value) for key, value in record.items()}
+
+
+class Repository(ABC):
+    """Data access used by the extraction endpoints"""
+
+    @abstractmethod
+    async def get_active_prompt(self) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def get_supplier_patterns(self, supplier: str) -> List[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_extraction(self, row: Dict[str, Any]) -> str:
+        """Insert into extractions_brutes, returns the new id"""
+
+    @abstractmethod
+    async def get_extraction(self, extraction_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def insert_ocr_blob(self, row: Dict[str, Any]):
+        """Insert into ocr_blobs, no-op when the hash already exists"""
+
+    @abstractmethod
+    async def get_ocr_blobs(self, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        """{hash: ocr_blobs row}, text_data/boxes_data as bytes"""
+
+    @abstractmethod
+    async def update_facture(self, facture_id: str, data: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    async def get_facture_suppliers(self, facture_ids: List[str]) -> Dict[str, Optional[str]]:
+        ...
+
+    @abstractmethod
+    async def get_recent_factures(self, fields: List[str], since: date) -> List[Dict[str, Any]]:
+        """factures uploaded since the given date, oldest first"""
+
+    @abstractmethod
+    async def get_latest_extraction(self, facture_id: str) -> Optional[Dict[str, Any]]:
+        """Most recent extractions_brutes row of an invoice"""
+
+    @abstractmethod
+    async def insert_corrections(self, rows: List[Dict[str, Any]]):
+        """Multi-row insert into historique_corrections"""
+
+    @abstractmethod
+    async def increment_pattern_sample_counts(self, increments: List[Dict[str, Any]]) -> int:
+        ...
+
+    async def close(self):
+        pass
+
+
+class PostgrestRepository(Repository):
+    """supabase-py (PostgREST over HTTP); blocking calls run in worker threads"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def get_active_prompt(self) -> Optional[Dict[str, Any]]:
+        result = await asyncio.to_thread(
+            self.client.table('llm_prompts').select('*').eq('is_active', True).limit(1).execute
+        )
+        return result.data[0] if result.data else None
+
+    async def get_supplier_patterns(self, supplier: str) -> List[Dict[str, Any]]:
+        result = await asyncio.to_thread(
+            self.client.table('patterns_fournisseurs').select('*').eq('nom_fournisseur', supplier).execute
+        )
+        return result.data or []
+
+    async def insert_extraction(self, row: Dict[str, Any]) -> str:
+        result = await asyncio.to_thread(self.client.table('extractions_brutes').insert(row).execute)
+        return result.data[0]['id']
+
+    async def get_extraction(self, extraction_id: str) -> Optional[Dict[str, Any]]:
+        result = await asyncio.to_thread(
+            self.client.table('extractions_brutes').select('*').eq('id', extraction_id).limit(1).execute
+        )
+        return result.data[0] if result.data else None
+
+    async def insert_ocr_blob(self, row: Dict[str, Any]):
+        payload = {
+            **row,
+            'text_data': to_bytea_literal(row['text_data']),
+            'boxes_data': to_bytea_literal(row['boxes_data'])
+        }
+        await asyncio.to_thread(
+            self.client.table('ocr_blobs').upsert(payload, on_conflict='hash', ignore_duplicates=True).execute
+        )
+
+    async def get_ocr_blobs(self, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not hashes:
+            return {}
+        result = await asyncio.to_thread(
+            self.client.table('ocr_blobs').select('hash, codec, text_data, boxes_data').in_('hash', hashes).execute
+        )
+        return {row['hash']: row for row in (result.data or [])}
+
+    async def update_facture(self, facture_id: str, data: Dict[str, Any]):
+        await asyncio.to_thread(self.client.table('factures').update(data).eq('id', facture_id).execute)
+
+    async def get_facture_suppliers(self, facture_ids: List[str]) -> Dict[str, Optional[str]]:
+        result = await asyncio.to_thread(
+            self.client.table('factures').select('id, fournisseur').in_('id', facture_ids).execute
+        )
+        return {row['id']: row.get('fournisseur') for row in (result.data or [])}
+
+    async def get_recent_factures(self, fields: List[str], since: date) -> List[Dict[str, Any]]:
+        def fetch_pages():
+            rows, offset = [], 0
+            while True:
+                page = (
+                    self.client.table('factures')
+                    .select(', '.join(fields))
+                    .gte('date_upload', since.isoformat())
+                    .order('date_upload')
+                    .range(offset, offset + POSTGREST_PAGE_SIZE - 1)
+                    .execute()
+                    .data
+                    or []
+                )
+                rows.extend(page)
+                if len(page) < POSTGREST_PAGE_SIZE:
+                    return rows
+                offset += POSTGREST_PAGE_SIZE
+
+        return await asyncio.to_thread(fetch_pages)
+
+    async def get_latest_extraction(self, facture_id: str) -> Optional[Dict[str, Any]]:
+        result = await asyncio.to_thread(
+            self.client.table('extractions_brutes').select('*').eq('facture_id', facture_id)
+            .order('created_at', desc=True).limit(1).execute
+        )
+        return result.data[0] if result.data else None
+
+    async def insert_corrections(self, rows: List[Dict[str, Any]]):
+        await asyncio.to_thread(self.client.table('historique_corrections').insert(rows).execute)
+
+    async def increment_pattern_sample_counts(self, increments: List[Dict[str, Any]]) -> int:
+        result = await asyncio.to_thread(
+            self.client.rpc('increment_pattern_sample_counts', {'p_increments': increments}).execute
+        )
+        return result.data or 0
+
+
+class PostgresRepository(Repository):
+    """
+    Direct Postgres access through an asyncpg pool
+    Statements use fixed SQL text with parameters, so asyncpg prepares them once per
+    connection and reuses them. Row payloads go through jsonb_populate_record(set):
+    Postgres casts each value to the column type, as PostgREST does
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls, dsn: str = DATABASE_URL) -> "PostgresRepository":
+        import asyncpg
+
+        async def init_connection(conn):
+            for type_name in ('json', 'jsonb'):
+                await conn.set_type_codec(type_name, encoder=json.dumps, decoder=json.loads, schema='pg_catalog')
+
+        pool = await asyncpg.create_pool(
+            dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            init=init_connection
+        )
+        return cls(pool)
+
+    async def get_active_prompt(self) -> Optional[Dict[str, Any]]:
+        record = await self.pool.fetchrow('SELECT * FROM llm_prompts WHERE is_active = true LIMIT 1')
+        return record_to_dict(record) if record else None
+
+    async def get_supplier_patterns(self, supplier: str) -> List[Dict[str, Any]]:
+        records = await self.pool.fetch('SELECT * FROM patterns_fournisseurs WHERE nom_fournisseur = $1', supplier)
+        return [record_to_dict(record) for record in records]
+
+    async def insert_extraction(self, row: Dict[str, Any]) -> str:
+        columns = ', '.join(quote_identifier(column) for column in row)
+        extraction_id = await self.pool.fetchval(
+            f'INSERT INTO extractions_brutes ({columns}) '
+            f'SELECT {columns} FROM jsonb_populate_record(NULL::extractions_brutes, $1) '
+            'RETURNING id',
+            row
+        )
+        return str(extraction_id)
+
+    async def get_extraction(self, extraction_id: str) -> Optional[Dict[str, Any]]:
+        record = await self.pool.fetchrow('SELECT * FROM extractions_brutes WHERE id = $1::uuid', extraction_id)
+        return record_to_dict(record) if record else None
+
+    async def insert_ocr_blob(self, row: Dict[str, Any]):
+        await self.pool.execute(
+            'INSERT INTO ocr_blobs (hash, codec, text_data, boxes_data, raw_size, stored_size) '
+            'VALUES ($1, $2, $3, $4, $5, $6) ON CONFLICT (hash) DO NOTHING',
+            row['hash'], row['codec'], row['text_data'], row['boxes_data'], row['raw_size'], row['stored_size']
+        )
+
+    async def get_ocr_blobs(self, hashes: List[str]) -> Dict[str, Dict[str, Any]]:
+        if not hashes:
+            return {}
+        records = await self.pool.fetch(
+            'SELECT hash, codec, text_data, boxes_data FROM ocr_blobs WHERE hash = ANY($1::text[])',
+            hashes
+        )
+        return {record['hash']: dict(record) for record in records}
+
+    async def update_facture(self, facture_id: str, data: Dict[str, Any]):
+        if not data:
+            return
+        assignments = ', '.join(
+            f'{column} = payload.{column}' for column in map(quote_identifier, data)
+        )
+        await self.pool.execute(
+            f'UPDATE factures SET {assignments} '
+            'FROM jsonb_populate_record(NULL::factures, $2) AS payload WHERE factures.id = $1::uuid',
+            facture_id,
+            data
+        )
+
+    async def get_facture_suppliers(self, facture_ids: List[str]) -> Dict[str, Optional[str]]:
+        records = await self.pool.fetch(
+            'SELECT id, fournisseur FROM factures WHERE id = ANY($1::uuid[])',
+            facture_ids
+        )
+        return {str(record['id']): record['fournisseur'] for record in records}
+
+    async def get_recent_factures(self, fields: List[str], since: date) -> List[Dict[str, Any]]:
+        columns = ', '.join(quote_identifier(field) for field in fields)
+        records = await self.pool.fetch(
+            f'SELECT {columns} FROM factures WHERE date_upload >= $1 ORDER BY date_upload',
+            since
+        )
+        return [record_to_dict(record) for record in records]
+
+    async def get_latest_extraction(self, facture_id: str) -> Optional[Dict[str, Any]]:
+        record = await self.pool.fetchrow(
+            'SELECT * FROM extractions_brutes WHERE facture_id = $1::uuid ORDER BY created_at DESC LIMIT 1',
+            facture_id
+        )
+        return record_to_dict(record) if record else None
+
+    async def insert_corrections(self, rows: List[Dict[str, Any]]):
+        if not rows:
+            return
+        columns = ', '.join(quote_identifier(column) for column in rows[0])
+        await self.pool.execute(
+            f'INSERT INTO historique_corrections ({columns}) '
+            f'SELECT {columns} FROM jsonb_populate_recordset(NULL::historique_corrections, $1)',
+            rows
+        )
+
+    async def increment_pattern_sample_counts(self, increments: List[Dict[str, Any]]) -> int:
+        return await self.pool.fetchval('SELECT increment_pattern_sample_counts($1::jsonb)', increments) or 0
+
+    async def close(self):
+        await self.pool.close()
+
+
+async def create_repository(postgrest_client_factory) -> Repository:
+    """
+    Postgres when DATABASE_URL is set (auto) or required (postgres),
+    PostgREST otherwise or if the pool cannot be opened in auto mode
+    """
+    if REPOSITORY_BACKEND == 'postgrest' or (REPOSITORY_BACKEND == 'auto' and not DATABASE_URL):
+        return PostgrestRepository(postgrest_client_factory())
+
+    try:
+        repository = await PostgresRepository.connect(DATABASE_URL)
+        logger.info("Accès base : pool asyncpg")
+        return repository
+    except Exception as e:
+        if REPOSITORY_BACKEND == 'postgres':
+            raise
+        logger.warning(f"Pool Postgres indisponible, repli sur PostgREST: {e}")
+        return PostgrestRepository(postgrest_client_factory())
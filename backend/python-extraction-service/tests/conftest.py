@@ -0,0 +1,5 @@
+# Les modules du service sont à plat : le dossier parent doit être importable
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,113 @@
+"""Contrôle d'admission : ordre de la file, refus et Retry-After"""
+import asyncio
+
+import pytest
+
+from admission import Overloaded, StageLimiter
+
+
+async def hold(limiter: StageLimiter, priority: str, order: list, release: asyncio.Event, timeout: float = 5):
+    await limiter.acquire(priority, timeout)
+    order.append(priority)
+    await release.wait()
+    limiter.release(1.0)
+
+
+def test_free_slot_is_admitted_immediately():
+    async def scenario():
+        limiter = StageLimiter('test', concurrency=2, queue_size=4)
+        await limiter.acquire('bulk', 1)
+        await limiter.acquire('interactive', 1)
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.active == 2
+    assert limiter.waiters == []
+    assert limiter.counters['admitted'] == 2
+
+
+def test_released_slot_goes_to_highest_priority_then_fifo():
+    async def scenario():
+        limiter = StageLimiter('test', concurrency=1, queue_size=4)
+        await limiter.acquire('interactive', 1)
+        order: list = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(hold(limiter, 'bulk', order, release))]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(hold(limiter, 'interactive', order, release)))
+        await asyncio.sleep(0)
+        assert len(limiter.waiters) == 2
+
+        limiter.release(1.0)
+        release.set()
+        await asyncio.gather(*tasks)
+        return limiter, order
+
+    limiter, order = asyncio.run(scenario())
+    assert order == ['interactive', 'bulk']
+    assert limiter.active == 0
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def scenario():
+        limiter = StageLimiter('test', concurrency=1, queue_size=1)
+        limiter.service_seconds = 4.0
+        await limiter.acquire('interactive', 1)
+        waiting = asyncio.create_task(limiter.acquire('interactive', 5))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire('interactive', 5)
+        waiting.cancel()
+        return excinfo.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.reason == 'queue_full'
+    # Une requête active + une en file, 4 s chacune sur une seule place
+    assert error.retry_after == 8
+
+
+def test_interactive_arrival_preempts_newest_bulk_waiter():
+    async def scenario():
+        limiter = StageLimiter('test', concurrency=1, queue_size=1)
+        await limiter.acquire('interactive', 1)
+        bulk = asyncio.create_task(limiter.acquire('bulk', 5))
+        await asyncio.sleep(0)
+        interactive = asyncio.create_task(limiter.acquire('interactive', 5))
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as excinfo:
+            await bulk
+        limiter.release(1.0)
+        await interactive
+        return limiter, excinfo.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert error.reason == 'preempted'
+    assert limiter.counters['preempted'] == 1
+    assert limiter.active == 1
+
+
+def test_queue_deadline_raises_and_leaves_queue():
+    async def scenario():
+        limiter = StageLimiter('test', concurrency=1, queue_size=2)
+        await limiter.acquire('interactive', 1)
+        with pytest.raises(Overloaded) as excinfo:
+            await limiter.acquire('interactive', 0.01)
+        return limiter, excinfo.value
+
+    limiter, error = asyncio.run(scenario())
+    assert error.reason == 'deadline'
+    assert error.status_code == 503
+    assert limiter.waiters == []
+    assert limiter.active == 1
+
+
+def test_retry_after_follows_service_time():
+    limiter = StageLimiter('test', concurrency=2, queue_size=4)
+    limiter.active = 2
+    assert limiter.retry_after() == 1
+    limiter.release(11.0)
+    # Moyenne glissante : 0.8 * 1 + 0.2 * 11 = 3 s, une place occupée sur deux
+    assert limiter.service_seconds == pytest.approx(3.0)
+    assert limiter.retry_after() == 2
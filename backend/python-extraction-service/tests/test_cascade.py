@@ -0,0 +1,47 @@
+"""Cascade de modèles : escalade des champs en échec et fusion des résultats"""
+import asyncio
+
+from cascade import flatten, run_cascade
+
+OCR_TEXT = "EDF\nPDL 12345678901234\ndu 01/01/2024 au 31/01/2024\nConsommation 1500 kWh\nTotal TTC 245,80"
+COMPLETE = {
+    'fournisseur': 'EDF', 'pdl': '12345678901234', 'periode_debut': '2024-01-01', 'periode_fin': '2024-01-31',
+    'conso': {'conso_totale': 1500}, 'prix_total_ttc': 245.8,
+}
+
+
+def run(results, tiers=("small", "large")):
+    calls = []
+
+    async def run_tier(tier, fields):
+        calls.append((tier, fields))
+        return results[tier]
+
+    data, report = asyncio.run(run_cascade(
+        OCR_TEXT, run_tier, lambda data: {path: 0.9 for path in flatten(data)}, ocr_confidence=1.0, tiers=list(tiers)
+    ))
+    return data, report, calls
+
+
+def test_first_tier_accepted():
+    data, report, calls = run({'small': COMPLETE})
+    assert data == COMPLETE
+    assert report['final_tier'] == 'small'
+    assert calls == [('small', None)]
+
+
+def test_only_failing_fields_are_escalated():
+    hallucinated = {**COMPLETE, 'pdl': '99999999999999', 'prix_total_ttc': None}
+    data, report, calls = run({'small': hallucinated, 'large': {'pdl': '12345678901234', 'prix_total_ttc': 245.8}})
+    assert calls[1] == ('large', ['pdl', 'prix_total_ttc'])
+    assert data == COMPLETE
+    assert report['final_tier'] == 'large'
+
+
+def test_rejected_value_does_not_survive_a_null():
+    hallucinated = {**COMPLETE, 'pdl': '99999999999999', 'conso': {'conso_totale': 7777}}
+    data, _, calls = run({'small': hallucinated, 'large': {'pdl': None, 'conso': {'conso_totale': None}}})
+    assert calls[1][1] == ['conso.conso_totale', 'pdl']
+    assert 'pdl' not in data
+    assert data['conso'] == {}
+    assert data['fournisseur'] == 'EDF'
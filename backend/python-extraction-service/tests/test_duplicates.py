@@ -0,0 +1,50 @@
+"""Clé de doublon lue dans le texte brut d'une facture"""
+from datetime import date
+
+from duplicates import invoice_key, parse_invoice_key
+
+INVOICE = """TotalEnergies
+Facture d'électricité n° 2024-001
+Point de livraison (PDL) : 1234 5678 9012 34
+Période de consommation du 01/01/2024 au 31/01/2024
+Acheminement assuré par Enedis, tarifs fixés par la CRE
+Offre indexée sur le tarif réglementé EDF
+"""
+
+
+def test_parse_full_key():
+    assert parse_invoice_key(INVOICE) == {
+        'pdl': '12345678901234',
+        'periode_debut': date(2024, 1, 1),
+        'periode_fin': date(2024, 1, 31),
+        'fournisseur': 'totalenergies',
+    }
+
+
+def test_text_and_extracted_data_give_the_same_key():
+    data = {'pdl': '12345678901234', 'periode_debut': '2024-01-01', 'periode_fin': '2024-01-31',
+            'fournisseur': 'TotalEnergies'}
+    assert invoice_key(data) == parse_invoice_key(INVOICE)
+
+
+def test_period_in_words_and_prm_label():
+    text = "PRM 98765432109876 - consommation du 1er février 2024 au 29 février 2024, Electricité de France"
+    key = parse_invoice_key(text)
+    assert key['pdl'] == '98765432109876'
+    assert (key['periode_debut'], key['periode_fin']) == (date(2024, 2, 1), date(2024, 2, 29))
+    assert key['fournisseur'] == 'edf'
+
+
+def test_reversed_period_is_skipped():
+    text = "du 31/03/24 au 01/03/24 puis du 01/03/24 au 31/03/24"
+    key = parse_invoice_key(text)
+    assert (key['periode_debut'], key['periode_fin']) == (date(2024, 3, 1), date(2024, 3, 31))
+
+
+def test_unknown_parts_are_none():
+    key = parse_invoice_key("Relevé n° 12 du compteur, montant 45,00 €")
+    assert key == {'pdl': None, 'periode_debut': None, 'periode_fin': None, 'fournisseur': None}
+
+
+def test_pdl_needs_fourteen_digits():
+    assert parse_invoice_key("PDL : 1234 5678 9012")['pdl'] is None
@@ -0,0 +1,38 @@
+"""Cache LLM : stockage SQLite et repli en mémoire"""
+import asyncio
+
+from llm_cache import LLMResponseCache, make_cache_key
+
+
+def test_key_ignores_whitespace_and_depends_on_prompt():
+    key = make_cache_key("Facture  EDF\n", "v1", "mistral", 0.1)
+    assert key == make_cache_key("Facture EDF", "v1", "mistral", 0.1)
+    assert key != make_cache_key("Facture EDF", "v2", "mistral", 0.1)
+
+
+def test_persistent_store_survives_a_new_instance(tmp_path):
+    path = str(tmp_path / "cache" / "llm_cache.sqlite3")
+    asyncio.run(LLMResponseCache(path=path).set("k", {"pdl": "12345678901234"}))
+    assert asyncio.run(LLMResponseCache(path=path).get("k")) == {"pdl": "12345678901234"}
+
+
+def test_unwritable_path_falls_back_to_memory(tmp_path):
+    blocker = tmp_path / "file"
+    blocker.write_text("")
+    cache = LLMResponseCache(path=str(blocker / "llm_cache.sqlite3"))
+    assert cache.store is None
+
+    async def scenario():
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return {"pdl": "12345678901234"}
+
+        first = await cache.get_or_compute("k", compute)
+        second = await cache.get_or_compute("k", compute)
+        return first, second, calls
+
+    first, second, calls = asyncio.run(scenario())
+    assert first == second == {"pdl": "12345678901234"}
+    assert len(calls) == 1
@@ -0,0 +1,65 @@
+"""Stockage OCR : encodage des boîtes, aller-retour compressé et empreinte"""
+import pytest
+
+from ocr_store import (
+    blob_hash, build_ocr_blob, decode_boxes, encode_boxes, read_ocr_boxes, read_ocr_text, to_bytea_literal
+)
+
+BOXES = [
+    {'box': [[10.4, 20.6], [110, 20], [110, 40], [10, 40]], 'text': 'Consommation', 'confidence': 0.9731},
+    {'box': [[120, 20], [200, 20], [200, 40], [120, 40]], 'text': '1 234,56 kWh', 'confidence': 1.0},
+    {'box': [[0, 50], [70000, 50], [-5, 70], [0, 70]], 'text': 'Échéance', 'confidence': 0.0},
+]
+
+
+def test_boxes_round_trip_is_quantized():
+    decoded = decode_boxes(encode_boxes(BOXES))
+
+    assert [box['text'] for box in decoded] == [box['text'] for box in BOXES]
+    # Coordonnées arrondies au pixel et bornées à [0, 65535]
+    assert decoded[0]['box'] == [[10, 21], [110, 20], [110, 40], [10, 40]]
+    assert decoded[2]['box'] == [[0, 50], [65535, 50], [0, 70], [0, 70]]
+    for original, box in zip(BOXES, decoded):
+        assert box['confidence'] == pytest.approx(original['confidence'], abs=1 / 65535)
+
+
+def test_missing_points_are_padded():
+    decoded = decode_boxes(encode_boxes([{'box': [[1, 2]], 'text': None}]))
+    assert decoded == [{'box': [[1, 2], [0, 0], [0, 0], [0, 0]], 'text': '', 'confidence': 0.0}]
+
+
+def test_decode_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        decode_boxes(b'XXXX' + encode_boxes([])[4:])
+
+
+def test_blob_round_trip_from_bytes_and_postgrest_literal():
+    ocr_data = {'text': 'Facture EDF\nConsommation 1 234,56 kWh', 'boxes': BOXES}
+    blob = build_ocr_blob(ocr_data)
+
+    assert read_ocr_text(blob) == ocr_data['text']
+    assert [box['text'] for box in read_ocr_boxes(blob)] == [box['text'] for box in BOXES]
+
+    # Même ligne relue via PostgREST (bytea en '\x' + hexadécimal)
+    row = {**blob, 'text_data': to_bytea_literal(blob['text_data']),
+           'boxes_data': to_bytea_literal(blob['boxes_data'])}
+    assert read_ocr_text(row) == ocr_data['text']
+    assert read_ocr_boxes(row) == read_ocr_boxes(blob)
+
+
+def test_blob_without_boxes_reads_empty():
+    blob = build_ocr_blob({'text': 'Facture'})
+    assert read_ocr_boxes({**blob, 'boxes_data': None}) == []
+    assert read_ocr_boxes(blob) == []
+
+
+def test_hash_covers_text_and_boxes():
+    text = 'Facture EDF'
+    same = build_ocr_blob({'text': text, 'boxes': BOXES})
+    assert build_ocr_blob({'text': text, 'boxes': BOXES})['hash'] == same['hash']
+    assert build_ocr_blob({'text': text, 'boxes': BOXES[:1]})['hash'] != same['hash']
+    assert build_ocr_blob({'text': text + ' ', 'boxes': BOXES})['hash'] != same['hash']
+
+
+def test_hash_boundary_between_text_and_boxes_is_unambiguous():
+    assert blob_hash(b'ab', b'c') != blob_hash(b'a', b'bc')
@@ -0,0 +1,74 @@
+"""Apprentissage de patterns : candidates dérivées des corrections et évaluation hors échantillon"""
+import re
+
+from pattern_learning import (
+    GENERIC_NUMBER_TEMPLATE, derive_candidates, normalize_value, score_candidate, update_candidates
+)
+
+OCR_TEXT = "Facture n° 2024-118\nConsommation totale : 1 234,56 kWh\nMontant TTC 312,40 €"
+
+
+def test_numbers_compare_regardless_of_format():
+    assert normalize_value('1 234,56') == normalize_value(1234.56)
+    assert normalize_value('12,0') == normalize_value('12')
+    assert normalize_value('HP/HC') == 'hp/hc'
+
+
+def test_derive_candidates_from_label_and_value():
+    candidates = derive_candidates({'valeur_corrigee': '1 234,56'}, OCR_TEXT)
+
+    templates = [candidate['template'] for candidate in candidates]
+    assert templates[-1] == GENERIC_NUMBER_TEMPLATE
+    assert len(candidates) == 2
+    for candidate in candidates:
+        assert candidate['regex'].startswith('(?i)Consommation\\s+totale')
+        match = re.search(candidate['regex'], OCR_TEXT)
+        assert match and normalize_value(match.group(1)) == normalize_value('1 234,56')
+
+
+def test_derived_regex_generalizes_to_other_values():
+    candidates = derive_candidates({'valeur_corrigee': '1 234,56'}, OCR_TEXT)
+    generic = next(c for c in candidates if c['template'] == GENERIC_NUMBER_TEMPLATE)
+    other = "CONSOMMATION TOTALE: 98,7 kWh"
+    assert score_candidate(generic['regex'], other, '98,7')
+    assert not score_candidate(generic['regex'], other, '98,8')
+
+
+def test_no_candidate_without_value_text_or_label():
+    assert derive_candidates({'valeur_corrigee': None}, OCR_TEXT) == []
+    assert derive_candidates({'valeur_corrigee': 'None'}, OCR_TEXT) == []
+    assert derive_candidates({'valeur_corrigee': '1 234,56'}, None) == []
+    # Valeur absente du texte OCR
+    assert derive_candidates({'valeur_corrigee': '999,99'}, OCR_TEXT) == []
+    # Valeur en début de ligne : pas de libellé
+    assert derive_candidates({'valeur_corrigee': '42'}, "42\nautre ligne") == []
+
+
+def test_invalid_regex_scores_as_miss():
+    assert not score_candidate('(', OCR_TEXT, '1')
+
+
+def test_candidate_is_not_trialed_on_its_own_correction():
+    texts = {
+        'a': "Consommation totale : 1 234,56 kWh",
+        'b': "Consommation totale : 845,10 kWh",
+        'c': "Total consommé : 77 kWh",
+    }
+    corrections = [
+        {'extraction_brute_id': 'a', 'valeur_corrigee': '1 234,56'},
+        {'extraction_brute_id': 'b', 'valeur_corrigee': '845,10'},
+        {'extraction_brute_id': 'c', 'valeur_corrigee': '77'},
+        {'extraction_brute_id': 'missing', 'valeur_corrigee': '1'},
+    ]
+    candidates = {}
+    changed = update_candidates(candidates, 'edf', 'consommation_kwh', corrections, texts)
+
+    assert changed == set(candidates)
+    generic = next(c for c in candidates.values()
+                   if c['template'] == GENERIC_NUMBER_TEMPLATE and 'Consommation' in c['regex'])
+    # Créée par 'a', retrouvée par 'b' : évaluée sur 'b' (succès) et 'c' (échec), jamais sur 'a'
+    assert generic['support'] == 2
+    assert generic['trials'] == 2
+    assert generic['hits'] == 1
+    assert generic['nom_fournisseur'] == 'edf'
+    assert generic['exemple'] == '845,10'
@@ -0,0 +1,56 @@
+# backend/routes/communes.py
+# Communes around an installation, answered from the in-memory spatial index
+
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from pydantic import BaseModel
+from utils.commune_index import get_commune_index, reload_commune_index
+
+router = APIRouter()
+
+class GeometriesRequest(BaseModel):
+    codes: list[str]
+
+@router.get("/communes/autour")
+async def communes_autour(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    rayon: Optional[float] = Query(None, gt=0, le=100000, description="Rayon en mètres (défaut : selon dens7)"),
+    geometrie: bool = False
+):
+    """Same result as rpc_communes_autour_installation; geometries only if geometrie=true"""
+    index = await get_commune_index()
+    return index.autour(lat, lon, rayon, geometrie)
+
+@router.get("/communes/contenant")
+async def commune_contenant(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    geometrie: bool = False
+):
+    index = await get_commune_index()
+    position = index.locate(lon, lat)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Aucune commune ne contient ce point")
+    return index.commune(position, geometrie)
+
+@router.post("/communes/geometries")
+async def communes_geometries(payload: GeometriesRequest):
+    """Simplified GeoJSON of the requested communes, for clients caching geometries by codgeo"""
+    index = await get_commune_index()
+    return {
+        code: index.geometry(index.by_code[code])
+        for code in payload.codes
+        if code in index.by_code
+    }
+
+@router.get("/communes/index")
+async def communes_index_stats():
+    index = await get_commune_index()
+    return index.stats()
+
+@router.post("/communes/index/reload")
+async def communes_index_reload():
+    index = await reload_commune_index()
+    return index.stats()
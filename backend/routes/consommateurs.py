@@ -0,0 +1,100 @@
+# backend/routes/consommateurs.py
+# Geocoded consommateurs around an installation, answered from the in-memory columnar index,
+# and consumer indicators per commune / EPCI / département from the precomputed rollups
+
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Query
+from utils.commune_index import get_commune_index, get_rayon_densite
+from utils.consumer_index import get_consumer_index, refresh_consumer_index, reload_consumer_index
+from utils.consumer_stats import get_consumer_stats, refresh_consumer_stats, reload_consumer_stats
+
+router = APIRouter()
+
+@router.get("/consommateurs/autour")
+async def consommateurs_autour(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    rayon: Optional[float] = Query(None, gt=0, le=100000, description="Rayon en mètres (défaut : selon dens7)"),
+    annee: Optional[int] = 2024,
+    tranches: Optional[list[str]] = Query(None),
+    categories: Optional[list[str]] = Query(None),
+    reglementaire: bool = Query(True, description="Rayon limité par la densité de la commune de chaque consommateur"),
+    marge: float = Query(200, ge=0, le=5000, description="Marge ajoutée au rayon réglementaire (m)"),
+    mode: Literal["aggregate", "points"] = "aggregate",
+    limit: int = Query(10000, gt=0, le=100000)
+):
+    """
+    Consumers within the radius of an installation, same rule as ConsumersLayer:
+    the radius of the installation's commune, restricted to the consumer's own commune radius
+    when its density category is more restrictive (reglementaire=true), plus the margin.
+    mode=aggregate returns totals per tranche_conso / categorie_activite, mode=points the consumers
+    """
+    index = await get_consumer_index()
+    commune_radius = None
+    if rayon is None or reglementaire:
+        communes = await get_commune_index()
+        position = communes.locate(lon, lat)
+        installation_radius = get_rayon_densite(int(communes.dens7[position]) if position is not None else 5)
+        rayon = rayon or installation_radius
+        if reglementaire:
+            commune_radius = index.commune_radius(communes, rayon, marge)
+    search_radius = rayon + marge if reglementaire else rayon
+
+    results = index.search(lat, lon, search_radius, annee, tranches, categories, commune_radius)
+    total = sum(len(positions) for _, positions, _ in results)
+    response = {"rayon": rayon, "marge": marge if reglementaire else 0, "nb_consommateurs": total}
+    if mode == "points":
+        return {**response, "consommateurs": index.points(results, limit)}
+    return {**response, "agregats": index.aggregate(results)}
+
+@router.get("/consommateurs/index")
+async def consommateurs_index_stats():
+    index = await get_consumer_index()
+    return index.stats()
+
+@router.post("/consommateurs/index/refresh")
+async def consommateurs_index_refresh():
+    """Pull consumers geocoded since the last refresh"""
+    index = await get_consumer_index()
+    changed = await refresh_consumer_index()
+    return {"changed": changed, **index.stats()}
+
+@router.post("/consommateurs/index/reload")
+async def consommateurs_index_reload():
+    index = await reload_consumer_index()
+    return index.stats()
+
+@router.get("/consommateurs/stats")
+async def consommateurs_stats(
+    niveau: Literal["commune", "epci", "departement"] = "commune",
+    codes: Optional[list[str]] = Query(None, description="Codes du niveau (défaut : tous)"),
+    annee: Optional[int] = 2024,
+    tranches: Optional[list[str]] = Query(None),
+    categories: Optional[list[str]] = Query(None),
+    geocodes: bool = Query(True, description="Seulement les consommateurs géocodés (ceux de la carte)"),
+    detail: bool = Query(False, description="Totaux par code en plus du total")
+):
+    """
+    ConsumersIndicators totals (nb_sites, conso_totale_mwh) for a set of communes, EPCI or
+    départements, read from the consommateurs_stats rollups instead of the raw rows
+    """
+    stats = await get_consumer_stats()
+    return {"niveau": niveau, **stats.query(niveau, codes, annee, tranches, categories, geocodes, detail)}
+
+@router.get("/consommateurs/stats/index")
+async def consommateurs_stats_index():
+    stats = await get_consumer_stats()
+    return stats.stats()
+
+@router.post("/consommateurs/stats/refresh")
+async def consommateurs_stats_refresh():
+    """Pull the rollups changed since the last refresh"""
+    stats = await get_consumer_stats()
+    changed = await refresh_consumer_stats()
+    return {"changed": changed, **stats.stats()}
+
+@router.post("/consommateurs/stats/reload")
+async def consommateurs_stats_reload():
+    stats = await reload_consumer_stats()
+    return stats.stats()
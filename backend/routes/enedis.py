@@ -0,0 +1,80 @@
+# backend/routes/enedis.py
+# Bulk import of the Enedis open-data consumers, followed by geocoding of the new rows
+
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+from utils.enedis_ingest import batched, ingest_consommateurs, resolve_csv_source
+from utils.geocode_batch import geocode_items
+
+ENEDIS_GEOCODE_BATCH_SIZE = int(os.getenv("ENEDIS_GEOCODE_BATCH_SIZE", "100"))
+
+router = APIRouter()
+
+class IngestRequest(BaseModel):
+    annee: int
+    communes: Optional[list[str]] = None
+    # Export CSV complet : URL https d'un hôte autorisé ou fichier de ENEDIS_IMPORT_DIR (sinon API paginée)
+    csv_source: Optional[str] = None
+    geocode: bool = True
+
+# Imports en cours ou terminés (mémoire du processus)
+jobs: dict[str, dict] = {}
+_tasks: set[asyncio.Task] = set()
+
+async def run_ingest(job, payload: IngestRequest):
+    try:
+        job["status"] = "loading"
+        _, inserted = await ingest_consommateurs(payload.annee, payload.communes, payload.csv_source, job)
+        if payload.geocode and inserted:
+            job["status"] = "geocoding"
+            for batch in batched(inserted, ENEDIS_GEOCODE_BATCH_SIZE):
+                results = await geocode_items([
+                    {"id": row["id"], "adresse": row["adresse"] or "", "code_commune": row["code_commune"]}
+                    for row in batch
+                ])
+                job["geocoded"] += sum(1 for result in results if result["status"] == "OK")
+                job["geocode_failed"] += sum(1 for result in results if result["status"] != "OK")
+        job["status"] = "done"
+    except Exception as e:
+        job["status"] = "error"
+        job["error"] = str(e)
+    finally:
+        job["finished_at"] = datetime.now(timezone.utc).isoformat()
+
+@router.post("/enedis/ingest", status_code=202)
+async def enedis_ingest(payload: IngestRequest):
+    """Start an import; progress at GET /enedis/ingest/{job_id}"""
+    if payload.csv_source:
+        try:
+            resolve_csv_source(payload.csv_source)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    job_id = uuid.uuid4().hex
+    job = jobs[job_id] = {
+        "id": job_id,
+        "annee": payload.annee,
+        "status": "queued",
+        "read": 0,
+        "inserted": 0,
+        "updated": 0,
+        "geocoded": 0,
+        "geocode_failed": 0,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "finished_at": None
+    }
+    task = asyncio.create_task(run_ingest(job, payload))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return job
+
+@router.get("/enedis/ingest/{job_id}")
+async def enedis_ingest_status(job_id: str):
+    if job_id not in jobs:
+        raise HTTPException(status_code=404, detail="Import inconnu")
+    return jobs[job_id]
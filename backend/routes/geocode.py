@@ -1,10 +1,13 @@
 # backend/routes/geocode.py
 # Geocoding route for consommateurs
 
+import asyncio
+from typing import Optional
+
 from fastapi import APIRouter
 from pydantic import BaseModel
-from utils.geocode_utils import geocode_adresse
-from utils.supabase_client import update_consommateur_geocode
+from utils.geocode_batch import geocode_items
+from utils.geocode_scheduler import run_geocode_scheduler, scheduler_status
 
 router = APIRouter()
 
@@ -12,19 +15,29 @@ class GeocodeRequest(BaseModel):
     id: int
     adresse: str
     code_commune: str
+    nom_commune: Optional[str] = None
 
 @router.post("/geocode_consommateurs")
-def geocode_consommateurs(payload: list[GeocodeRequest]):
-    results = []
-    for item in payload:
-        lat, lon, status, score = geocode_adresse(item.adresse, item.code_commune)
-        if status == "OK":
-            update_consommateur_geocode(item.id, lat, lon, status, score)
-        results.append({
-            "id": item.id,
-            "status": status,
-            "latitude": lat,
-            "longitude": lon,
-            "score": score
-        })
-    return {"results": results}
+async def geocode_consommateurs(payload: list[GeocodeRequest]):
+    items = [
+        {"id": item.id, "adresse": item.adresse, "code_commune": item.code_commune, "nom_commune": item.nom_commune}
+        for item in payload
+    ]
+    return {"results": await geocode_items(items)}
+
+_manual_runs: set[asyncio.Task] = set()
+
+@router.get("/geocode/scheduler")
+async def geocode_scheduler_status():
+    """Configuration and the latest passes of the re-geocoding scheduler"""
+    return scheduler_status()
+
+@router.post("/geocode/scheduler/run", status_code=202)
+async def geocode_scheduler_run(max_rows: Optional[int] = None):
+    """Start a pass now (no-op if one is already running)"""
+    status = scheduler_status()
+    if not status["running"]:
+        task = asyncio.create_task(run_geocode_scheduler("manuel", max_rows or status["max_rows"]))
+        _manual_runs.add(task)
+        task.add_done_callback(_manual_runs.discard)
+    return {"started": not status["running"]}
@@ -0,0 +1,6 @@
+# backend/routes/profiling.py
+# Profiling endpoints (opt-in with PROFILING_ENABLED, X-Profiling-Token required)
+
+from utils.profiling import create_profiling_router
+
+router = create_profiling_router()
@@ -0,0 +1,32 @@
+# backend/routes/stations.py
+# Treatment-station matching from the in-memory stations_traitement index
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+from utils.station_matcher import get_station_index, reload_station_index
+
+router = APIRouter()
+
+class StationMatchRequest(BaseModel):
+    id: int
+    adresse: str
+    code_commune: str
+
+@router.post("/stations/match")
+async def stations_match(payload: list[StationMatchRequest]):
+    """Known station (and match score) for each address detected as a treatment station"""
+    index = await get_station_index()
+    matches = index.match_batch([
+        {"id": item.id, "adresse": item.adresse, "code_commune": item.code_commune} for item in payload
+    ])
+    return {"matches": [{"id": id_, **match} for id_, match in matches.items()]}
+
+@router.get("/stations/index")
+async def stations_index_stats():
+    index = await get_station_index()
+    return index.stats()
+
+@router.post("/stations/index/reload")
+async def stations_index_reload():
+    index = await reload_station_index()
+    return index.stats()
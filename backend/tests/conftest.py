@@ -0,0 +1,7 @@
+# backend/tests/conftest.py
+# Les imports du backend partent de backend/ (from utils.x import ...), quel que soit le dossier de lancement
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
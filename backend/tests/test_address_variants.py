@@ -0,0 +1,51 @@
+# backend/tests/test_address_variants.py
+# Requêtes BAN construites à partir d'une adresse, dans l'ordre du frontend
+
+from utils.address_variants import build_strategies, is_lieu_dit, normalize_address, standardized_address
+
+
+def queries(strategies):
+    return [s["q"] for s in strategies]
+
+
+def test_street_address_order():
+    strategies = build_strategies("12 R DE LA PAIX", "75056", "Paris")
+    assert strategies[0] == {"q": "12 Rue DE LA Paix", "citycode": "75056", "type": "housenumber"}
+    assert strategies[1] == {"q": "12 Rue DE LA Paix, Paris", "citycode": "75056"}
+    assert {"q": "12 R DE LA PAIX", "citycode": "75056", "type": "housenumber"} in strategies
+    assert queries(strategies)[-1] == "12 R DE LA PAIX Paris"
+
+
+def test_no_duplicates_and_no_empty_keys():
+    strategies = build_strategies("Place du Marché")
+    keys = [tuple(sorted(s.items())) for s in strategies]
+    assert len(keys) == len(set(keys))
+    # Sans commune : ni citycode ni suffixe vide
+    assert all("citycode" not in s for s in strategies)
+    assert all(not q.endswith((",", " ")) for q in queries(strategies))
+
+
+def test_short_queries_are_dropped():
+    assert build_strategies("ab") == []
+
+
+def test_commercial_address_tries_brand_first():
+    strategies = build_strategies("CENTRE COMMERCIAL AUCHAN", "59350", "Lille")
+    assert strategies[0] == {"q": "AUCHAN", "citycode": "59350"}
+    assert "AUCHAN, Lille" in queries(strategies)
+
+
+def test_lieu_dit_tries_city_first():
+    assert is_lieu_dit("LES GRANDS CHAMPS")
+    strategies = build_strategies("LES GRANDS CHAMPS", "01001", "Ville")
+    assert strategies[0] == {"q": "LES GRANDS CHAMPS Ville", "citycode": "01001"}
+
+
+def test_zone_prefix_is_split_off():
+    assert standardized_address("ZI DES BRUYERES - 3 RUE DE L'INDUSTRIE") == "3 RUE DE L'INDUSTRIE"
+    assert standardized_address("STATION DE POMPAGE") == "STATION DE POMPAGE"
+
+
+def test_normalize_address():
+    # Comme addressNormalizer.ts : les mots de deux lettres restent en capitales
+    assert normalize_address("  3  AV  DEL'EUROPE ") == "3 Avenue DE L'Europe"
@@ -0,0 +1,78 @@
+# backend/tests/test_commune_index.py
+# Index des communes : point dans la commune (trous compris) et communes dans un rayon
+
+import pytest
+
+from utils.commune_index import CommuneIndex, get_rayon_densite
+
+
+def square(x0, y0, size):
+    return [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]
+
+
+ROWS = [
+    # Commune avec une enclave (trou) occupée par une autre commune
+    {"codgeo": "A", "nom_commune": "Alpha", "dens7": 2, "libdens7": "Dense", "code_epci": "E1",
+     "geometrie": {"type": "Polygon", "coordinates": [square(4.0, 45.0, 0.2), square(4.05, 45.05, 0.05)]}},
+    {"codgeo": "B", "nom_commune": "Bravo", "dens7": 6, "libdens7": "Rural", "code_epci": "E1",
+     "geometrie": {"type": "Polygon", "coordinates": [square(4.05, 45.05, 0.05)]}},
+    {"codgeo": "C", "nom_commune": "Charlie", "dens7": 4, "libdens7": "Intermédiaire", "code_epci": "E2",
+     "geometrie": {"type": "MultiPolygon", "coordinates": [[square(4.2, 45.0, 0.1)], [square(5.0, 45.0, 0.1)]]}},
+    # Sans géométrie : ignorée
+    {"codgeo": "D", "nom_commune": "Delta", "dens7": 1, "libdens7": None, "code_epci": None, "geometrie": None},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return CommuneIndex(ROWS)
+
+
+def code(index, i):
+    return None if i is None else index.communes[i]["codgeo"]
+
+
+def test_rows_without_geometry_are_skipped(index):
+    assert sorted(index.by_code) == ["A", "B", "C"]
+    assert index.stats()["rings"] == 5
+
+
+def test_locate_handles_holes_and_multipolygons(index):
+    assert code(index, index.locate(4.01, 45.01)) == "A"
+    assert code(index, index.locate(4.07, 45.07)) == "B"
+    assert code(index, index.locate(4.25, 45.05)) == "C"
+    assert code(index, index.locate(5.05, 45.05)) == "C"
+    assert index.locate(4.5, 45.05) is None
+    assert index.locate(-10, 10) is None
+
+
+def test_distance_to_polygon(index):
+    i = index.by_code["C"]
+    assert index.distance_m(i, 4.25, 45.05) == 0.0
+    # 0,1° de latitude au nord du bord : ~11,1 km
+    assert index.distance_m(i, 4.25, 45.2) == pytest.approx(11120, rel=0.01)
+
+
+def test_within_radius_nearest_first(index):
+    # Bord de l'enclave à ~1,6 km du point
+    found = [index.communes[i]["codgeo"] for i, _ in index.within(4.07, 45.07, 1000)]
+    assert found == ["B"]
+    found = [index.communes[i]["codgeo"] for i, _ in index.within(4.07, 45.07, 2000)]
+    assert found == ["B", "A"]
+    found = [index.communes[i]["codgeo"] for i, _ in index.within(4.07, 45.07, 20000)]
+    assert set(found) == {"A", "B", "C"}
+
+
+def test_autour_uses_density_radius(index):
+    result = index.autour(45.07, 4.07)
+    assert result["commune_installation"]["codgeo"] == "B"
+    assert result["rayon"] == get_rayon_densite(6) == 20000.0
+    distances = [c["distance_centre_m"] for c in result["communes_dans_rayon"]]
+    assert distances == sorted(distances)
+    assert index.autour(10, -10) == {"commune_installation": None, "rayon": None, "communes_dans_rayon": []}
+
+
+def test_geometry_round_trip(index):
+    geometry = index.geometry(index.by_code["A"])
+    assert geometry["type"] == "MultiPolygon"
+    assert len(geometry["coordinates"]) == 1 and len(geometry["coordinates"][0]) == 2
@@ -0,0 +1,203 @@
+# backend/tests/test_consommateur_repository_postgres.py
+# Requêtes du dépôt asyncpg contre un vrai Postgres (ignoré sans DATABASE_URL)
+#
+# DATABASE_URL doit pouvoir créer une base et des rôles : le test crée une base jetable, y crée
+# la table consommateurs d'origine (elle précède les migrations), les rôles Supabase s'ils manquent,
+# puis applique les migrations dont dépend le géocodage.
+
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+pytestmark = pytest.mark.skipif(not DATABASE_URL, reason="DATABASE_URL non défini")
+asyncpg = pytest.importorskip("asyncpg")
+
+from utils.consommateur_repository import PostgresConsommateurRepository  # noqa: E402
+
+MIGRATIONS_DIR = Path(__file__).resolve().parents[2] / "frontend" / "supabase" / "migrations"
+# Migrations lues ou écrites par utils/consommateur_repository.py, dans l'ordre
+GEOCODING_MIGRATIONS = (
+    "20260112151022_add_geocoding_columns_to_consommateurs.sql",
+    "20260119182956_add_source_column_to_consommateurs.sql",
+    "20260126140000_add_geocoded_at_to_consommateurs.sql",
+    "20260126160000_add_geocode_scheduler.sql",
+)
+# Table consommateurs telle qu'avant la première migration qui la modifie
+BASE_SCHEMA = """
+    CREATE TABLE consommateurs (
+        id bigserial PRIMARY KEY,
+        adresse text,
+        code_commune text,
+        nom_commune text,
+        annee integer,
+        tranche_conso text,
+        categorie_activite text,
+        nombre_sites integer,
+        consommation_annuelle_mwh numeric,
+        geocode_status text,
+        geocode_score numeric
+    )
+"""
+SUPABASE_ROLES = ("anon", "authenticated", "service_role")
+TEST_DATABASE = f"consommateurs_repository_test_{os.getpid()}"
+
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    async def create():
+        admin = await asyncpg.connect(DATABASE_URL)
+        try:
+            await admin.execute(f"DROP DATABASE IF EXISTS {TEST_DATABASE}")
+            await admin.execute(f"CREATE DATABASE {TEST_DATABASE}")
+            for role in SUPABASE_ROLES:
+                if not await admin.fetchval("SELECT 1 FROM pg_roles WHERE rolname = $1", role):
+                    await admin.execute(f"CREATE ROLE {role} NOLOGIN")
+        finally:
+            await admin.close()
+        conn = await asyncpg.connect(DATABASE_URL, database=TEST_DATABASE)
+        try:
+            await conn.execute(BASE_SCHEMA)
+            for migration in GEOCODING_MIGRATIONS:
+                await conn.execute((MIGRATIONS_DIR / migration).read_text())
+        finally:
+            await conn.close()
+
+    async def drop():
+        admin = await asyncpg.connect(DATABASE_URL)
+        try:
+            await admin.execute(f"DROP DATABASE IF EXISTS {TEST_DATABASE}")
+        finally:
+            await admin.close()
+
+    asyncio.run(create())
+    yield
+    asyncio.run(drop())
+
+
+def run(scenario):
+    """Run scenario(repository, pool) on an emptied database"""
+    async def main():
+        pool = await asyncpg.create_pool(DATABASE_URL, database=TEST_DATABASE, min_size=1, max_size=2)
+        repository = PostgresConsommateurRepository(pool)
+        try:
+            await pool.execute("TRUNCATE consommateurs, geocode_runs RESTART IDENTITY")
+            return await scenario(repository, pool)
+        finally:
+            await repository.close()
+    return asyncio.run(main())
+
+
+async def insert(pool, adresse, source="api", geocode_status=None):
+    return await pool.fetchval(
+        "INSERT INTO consommateurs (adresse, code_commune, nom_commune, annee, source, geocode_status) "
+        "VALUES ($1, '69123', 'Lyon', 2023, $2, $3) RETURNING id",
+        adresse, source, geocode_status
+    )
+
+
+async def backlog(repository, max_attempts=5):
+    return {row["id"]: row["motif"] for row in await repository.fetch_geocode_backlog(100, max_attempts)}
+
+
+def test_update_geocodes_clears_the_backlog():
+    async def scenario(repository, pool):
+        first = await insert(pool, "1 Place Bellecour")
+        second = await insert(pool, "2 Rue de la République")
+        assert await backlog(repository) == {first: "nouveau", second: "nouveau"}
+
+        await repository.update_geocodes([
+            {"id": first, "latitude": 45.757, "longitude": 4.832, "geocode_status": "OK", "geocode_score": 0.93}
+        ])
+        await repository.update_geocode(second, 45.76, 4.835, "OK", 0.88)
+        assert await backlog(repository) == {}
+        return await pool.fetchrow("SELECT * FROM consommateurs WHERE id = $1", first)
+
+    row = run(scenario)
+    assert (float(row["latitude"]), float(row["longitude"])) == (45.757, 4.832)
+    assert row["geocode_status"] == "OK"
+    assert float(row["geocode_score"]) == 0.93
+    assert row["geocoded_at"] is not None
+    assert row["geocode_attempts"] == 0
+    assert row["geocode_next_attempt_at"] is None
+
+
+def test_failures_back_off_until_max_attempts():
+    async def scenario(repository, pool):
+        consumer = await insert(pool, "Lieu-dit inconnu")
+        await repository.mark_geocode_failures([{"id": consumer, "geocode_status": "TO_VALIDATE"}], 3600, 604800)
+        row = await pool.fetchrow(
+            "SELECT geocode_status, geocode_attempts, geocode_next_attempt_at, now() AS now FROM consommateurs"
+        )
+        waiting = await backlog(repository)
+
+        # Attente écoulée : nouvel essai, tant que le nombre d'essais reste sous le plafond
+        await pool.execute("UPDATE consommateurs SET geocode_next_attempt_at = now() - interval '1 second'")
+        due = await backlog(repository)
+        exhausted = await backlog(repository, max_attempts=1)
+
+        await repository.mark_geocode_failures([{"id": consumer, "geocode_status": "ERROR"}], 3600, 5000)
+        second = await pool.fetchrow("SELECT geocode_attempts, geocode_next_attempt_at - now() AS delay FROM consommateurs")
+        return consumer, row, waiting, due, exhausted, second
+
+    consumer, row, waiting, due, exhausted, second = run(scenario)
+    assert row["geocode_status"] == "TO_VALIDATE"
+    assert row["geocode_attempts"] == 1
+    assert abs(row["geocode_next_attempt_at"] - row["now"] - timedelta(seconds=3600)) < timedelta(seconds=5)
+    assert waiting == {}
+    assert due == {consumer: "nouvel_essai"}
+    assert exhausted == {}
+    # Deuxième échec : 3600 * 2, plafonné à 5000 s
+    assert second["geocode_attempts"] == 2
+    assert timedelta(seconds=4990) < second["delay"] <= timedelta(seconds=5000)
+
+
+def test_address_change_is_regeocoded_except_manual_rows():
+    async def scenario(repository, pool):
+        api = await insert(pool, "3 Quai Perrache")
+        manual = await insert(pool, "4 Cours Charlemagne", source="manual")
+        await repository.update_geocodes([
+            {"id": consumer, "latitude": 45.74, "longitude": 4.82, "geocode_status": "OK", "geocode_score": 0.9}
+            for consumer in (api, manual)
+        ])
+        await pool.execute("UPDATE consommateurs SET adresse = adresse || ' bis'")
+        changed = await backlog(repository)
+        attempts = await pool.fetchval("SELECT max(geocode_attempts) FROM consommateurs")
+        return api, changed, attempts
+
+    api, changed, attempts = run(scenario)
+    assert changed == {api: "adresse_modifiee"}
+    assert attempts == 0
+
+
+def test_record_geocode_run():
+    started = datetime(2026, 1, 26, 12, 0, tzinfo=timezone.utc)
+    run_row = {
+        "declencheur": "manuel",
+        "started_at": started.isoformat(),
+        "finished_at": (started + timedelta(seconds=12)).isoformat(),
+        "selectionnes": 40,
+        "par_motif": {"nouveau": 30, "nouvel_essai": 10},
+        "geocodes": 35,
+        "a_valider": 4,
+        "erreurs": 1,
+        "duree_secondes": 12.0,
+        "lignes_par_seconde": 3.33,
+        "taux_succes": 0.875,
+    }
+
+    async def scenario(repository, pool):
+        await repository.record_geocode_run(run_row)
+        return await pool.fetchrow("SELECT * FROM geocode_runs")
+
+    row = run(scenario)
+    assert row["declencheur"] == "manuel"
+    assert row["started_at"] == started
+    assert row["finished_at"] - row["started_at"] == timedelta(seconds=12)
+    assert row["par_motif"] == '{"nouveau": 30, "nouvel_essai": 10}'
+    assert (row["geocodes"], row["a_valider"], row["erreurs"]) == (35, 4, 1)
+    assert float(row["taux_succes"]) == 0.875
+    assert row["erreur"] is None
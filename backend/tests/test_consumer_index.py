@@ -0,0 +1,104 @@
+# backend/tests/test_consumer_index.py
+# Index des consommateurs : recherche par rayon, mises à jour copy-on-write et relecture du recouvrement
+
+from datetime import datetime, timedelta, timezone
+
+from utils.consumer_index import ConsumerIndex
+
+LOADED_AT = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def consumer(id, lat, lon, tranche="T1", categorie="Industrie", geocoded_at=None, **extra):
+    return {"id": id, "latitude": lat, "longitude": lon, "annee": 2023, "tranche_conso": tranche,
+            "categorie_activite": categorie, "code_commune": "69123", "nom_commune": "Lyon",
+            "nombre_sites": 1, "consommation_annuelle_mwh": 10.0, "geocoded_at": geocoded_at, **extra}
+
+
+def found_ids(index, lat, lon, radius_m, **filters):
+    return sorted(int(block.id[p]) for block, positions, _ in index.search(lat, lon, radius_m, **filters)
+                  for p in positions.tolist())
+
+
+def make_index():
+    return ConsumerIndex([
+        consumer(1, 45.750, 4.850),
+        consumer(2, 45.760, 4.850, tranche="T2"),
+        consumer(3, 45.900, 4.850, categorie="Tertiaire"),
+        # De part et d'autre d'une frontière de cellule
+        consumer(4, 45.799, 4.899),
+        consumer(5, 45.801, 4.901),
+    ], loaded_at=LOADED_AT)
+
+
+def test_radius_search_and_filters():
+    index = make_index()
+    assert found_ids(index, 45.75, 4.85, 2000) == [1, 2]
+    assert found_ids(index, 45.75, 4.85, 2000, tranches=["T2"]) == [2]
+    assert found_ids(index, 45.75, 4.85, 50000, categories=["Tertiaire"]) == [3]
+    assert found_ids(index, 45.80, 4.90, 500) == [4, 5]
+    assert found_ids(index, 45.75, 4.85, 2000, annee=2020) == []
+
+
+def test_points_and_aggregate():
+    index = make_index()
+    results = index.search(45.75, 4.85, 2000)
+    points = index.points(results, limit=10)
+    assert [p["id"] for p in points] == [1, 2]
+    assert points[0]["distance_m"] == 0.0
+    totals = {(a["tranche_conso"], a["categorie_activite"]): a["nb_consommateurs"] for a in index.aggregate(results)}
+    assert totals == {("T1", "Industrie"): 1, ("T2", "Industrie"): 1}
+
+
+def test_apply_does_not_modify_published_blocks():
+    index = make_index()
+    main, delta = index.blocks
+    main_alive = main.alive.copy()
+    moved = LOADED_AT + timedelta(minutes=5)
+
+    changed = index.apply([
+        consumer(1, 45.900, 4.850, geocoded_at=moved),
+        consumer(2, None, None, geocoded_at=moved, geocode_status="TO_VALIDATE"),
+        consumer(6, 45.750, 4.851, geocoded_at=moved),
+    ])
+
+    assert changed == 3
+    # Un lecteur qui tient l'ancien couple de blocs voit toujours l'état d'avant
+    assert (main.alive == main_alive).all()
+    assert len(delta) == 0
+    assert found_ids(index, 45.75, 4.85, 2000) == [6]
+    assert found_ids(index, 45.90, 4.85, 500) == [1, 3]
+    assert index.stats()["consommateurs"] == 5
+
+
+def test_overlap_window_rereads_are_skipped():
+    index = make_index()
+    first = LOADED_AT + timedelta(minutes=5)
+    assert index.since() == (LOADED_AT - timedelta(seconds=60) - index.overlap, 0)
+
+    assert index.apply([consumer(7, 45.75, 4.85, geocoded_at=first.isoformat())]) == 1
+    assert index.watermark == (first, 7)
+    assert index.since() == (first - index.overlap, 0)
+
+    # Même ligne relue dans la fenêtre de recouvrement : rien ne change
+    blocks = index.blocks
+    assert index.apply([consumer(7, 45.75, 4.85, geocoded_at=first)]) == 0
+    assert index.blocks is blocks
+
+    # Géocodage validé tard, plus ancien que le filigrane : pris en compte
+    late = first - timedelta(minutes=2)
+    assert index.apply([consumer(8, 45.75, 4.85, geocoded_at=late)]) == 1
+    assert index.watermark == (first, 7)
+    assert 8 in found_ids(index, 45.75, 4.85, 100)
+
+
+def test_merge_past_threshold(monkeypatch):
+    import utils.consumer_index as consumer_index
+
+    monkeypatch.setattr(consumer_index, "CONSUMER_INDEX_MERGE_THRESHOLD", 2)
+    index = make_index()
+    at = LOADED_AT + timedelta(minutes=1)
+    index.apply([consumer(10, 45.75, 4.85, geocoded_at=at), consumer(11, 45.75, 4.85, geocoded_at=at)])
+    main, delta = index.blocks
+    assert index.merges == 1
+    assert len(delta) == 0 and len(main) == 7
+    assert found_ids(index, 45.75, 4.85, 2000) == [1, 2, 10, 11]
@@ -0,0 +1,103 @@
+# backend/tests/test_geocode_utils.py
+# Géocodage multi-variantes : ordre des variantes, arrêt à la première acceptée, limiteur de débit
+
+import asyncio
+import time
+
+import pytest
+
+import utils.geocode_utils as geocode_utils
+from utils.address_variants import build_strategies
+from utils.geocode_utils import TokenBucket, geocode_adresse_variants
+
+
+class FakeResponse:
+    def __init__(self, status_code, payload=None):
+        self.status_code = status_code
+        self.payload = payload
+        self.headers = {"Retry-After": "0"}
+
+    def json(self):
+        return self.payload
+
+
+class FakeBan:
+    """Score per query; the other queries find nothing"""
+
+    def __init__(self, scores, status_code=200):
+        self.scores = scores
+        self.status_code = status_code
+        self.queries = []
+
+    async def get(self, path, params):
+        self.queries.append(params["q"])
+        if self.status_code != 200:
+            return FakeResponse(self.status_code)
+        score = self.scores.get(params["q"])
+        if score is None:
+            return FakeResponse(200, {"features": []})
+        return FakeResponse(200, {"features": [
+            {"geometry": {"coordinates": [4.85, 45.75]}, "properties": {"score": score}}
+        ]})
+
+
+@pytest.fixture
+def ban(monkeypatch):
+    def install(scores, status_code=200):
+        fake = FakeBan(scores, status_code)
+        limiter = TokenBucket(0, 1)
+        monkeypatch.setattr(geocode_utils, "_ban_client", lambda: (fake, asyncio.Semaphore(4), limiter))
+        return fake
+    return install
+
+
+def geocode(adresse, code_commune="69123", nom_commune="Lyon"):
+    return asyncio.run(geocode_adresse_variants(adresse, code_commune, nom_commune))
+
+
+def test_stops_at_first_accepted_variant(ban):
+    fake = ban({"12 Rue DE LA Paix, Lyon": 0.9, "12 R DE LA PAIX": 0.95})
+    lat, lon, status, score, variant = geocode("12 R DE LA PAIX")
+    assert (lat, lon, status, score) == (45.75, 4.85, "OK", 0.9)
+    assert variant == "12 Rue DE LA Paix, Lyon"
+    assert fake.queries == ["12 Rue DE LA Paix", "12 Rue DE LA Paix, Lyon"]
+
+
+def test_best_score_below_accept_ties_to_earlier_variant(ban):
+    fake = ban({"12 Rue DE LA Paix, Lyon": 0.6, "12 R DE LA PAIX": 0.7, "12 R DE LA PAIX Lyon": 0.7})
+    *_, status, score, variant = geocode("12 R DE LA PAIX")
+    assert (status, score, variant) == ("OK", 0.7, "12 R DE LA PAIX")
+    # Aucune variante acceptée : toutes ont été essayées
+    assert len(fake.queries) == len(build_strategies("12 R DE LA PAIX", "69123", "Lyon"))
+
+
+def test_low_scores_and_errors(ban):
+    ban({"12 Rue DE LA Paix": 0.3})
+    assert geocode("12 R DE LA PAIX")[2] == "TO_VALIDATE"
+    ban({}, status_code=500)
+    assert geocode("12 R DE LA PAIX")[2] == "ERROR"
+
+
+def test_blank_address_does_not_query(ban):
+    fake = ban({})
+    assert geocode("  ") == (None, None, "TO_VALIDATE", 0, None)
+    assert fake.queries == []
+
+
+def test_rate_limited_retry_once(ban):
+    fake = ban({}, status_code=429)
+    assert geocode("Place Bellecour")[2] == "ERROR"
+    # Chaque variante : une requête + une seule nouvelle tentative
+    assert len(fake.queries) % 2 == 0
+    assert fake.queries[0] == fake.queries[1]
+
+
+def test_token_bucket_limits_the_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=100, burst=5)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(25)))
+        return time.monotonic() - started
+
+    # 5 jetons immédiats, puis 20 à 100/s
+    assert asyncio.run(scenario()) >= 0.19
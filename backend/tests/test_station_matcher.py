@@ -0,0 +1,81 @@
+# backend/tests/test_station_matcher.py
+# Rapprochement adresse -> station de traitement : pas de station retenue sans mot distinctif ni en cas d'ex aequo
+
+import pytest
+
+from utils.station_matcher import StationIndex, detect_treatment_station, significant_tokens
+
+LYON = "69123"
+BRON = "69029"
+STATIONS = [
+    {"id": 1, "nom": "STEP LYON NORD", "commune": "LYON", "code_commune": LYON, "latitude": 45.80, "longitude": 4.85},
+    {"id": 2, "nom": "STEP LYON SUD", "commune": "LYON", "code_commune": LYON, "latitude": 45.70, "longitude": 4.83},
+    {"id": 3, "nom": "STATION D'EPURATION", "commune": "BRON", "code_commune": BRON, "latitude": 45.73, "longitude": 4.91},
+    {"id": 4, "nom": "STEP BRON", "commune": "BRON", "code_commune": BRON, "latitude": 45.74, "longitude": 4.92},
+    {"id": 5, "nom": "STATION GRANDS CHAMPS", "commune": "VILLE", "code_commune": "01001",
+     "latitude": 46.0, "longitude": 5.0},
+    {"id": 6, "nom": "STATION GRANDS PRES", "commune": "VILLE", "code_commune": "01001",
+     "latitude": 46.1, "longitude": 5.1},
+]
+
+
+@pytest.fixture(scope="module")
+def index():
+    return StationIndex(STATIONS)
+
+
+def test_generic_names_have_no_significant_tokens():
+    assert significant_tokens("station d epuration") == []
+    assert significant_tokens("step lyon nord") == ["lyon", "nord"]
+
+
+def test_detect_treatment_station():
+    assert detect_treatment_station("STEP de Lyon")
+    assert detect_treatment_station("Station d'épuration")
+    assert not detect_treatment_station("12 rue de Lyon")
+    assert not detect_treatment_station(None)
+
+
+@pytest.mark.parametrize("address,code_commune", [
+    ("Station", BRON),
+    ("STATION D EPURATION", BRON),
+    ("step", LYON),
+    # Aucun mot-clé de station : adresse ordinaire
+    ("lyon", LYON),
+    # Seul le nom de la commune est en commun : deux stations à égalité
+    ("STEP LYON", LYON),
+    ("STEP LYON NORD", "00000"),
+])
+def test_no_match_without_distinctive_word(index, address, code_commune):
+    station, _ = index.match(address, code_commune)
+    assert station is None
+
+
+def test_distinctive_word_selects_the_station(index):
+    station, score = index.match("STEP LYON NORD", LYON)
+    assert station["id"] == 1
+    assert score == 1.0
+    station, _ = index.match("Station d'épuration Lyon - Sud", LYON)
+    assert station["id"] == 2
+
+
+def test_all_station_words_in_address(index):
+    station, score = index.match("STEP BRON", BRON)
+    assert station["id"] == 4
+    assert score == 1.0
+
+
+def test_tie_within_margin_is_rejected(index):
+    station, score = index.match("station grands", "01001")
+    assert station is None
+    assert score > 0
+
+
+def test_match_batch_skips_unmatched_and_missing_commune(index):
+    matches = index.match_batch([
+        {"id": "a", "adresse": "STEP LYON NORD", "code_commune": LYON},
+        {"id": "b", "adresse": "STEP LYON", "code_commune": LYON},
+        {"id": "c", "adresse": "STEP BRON", "code_commune": None},
+    ])
+    assert list(matches) == ["a"]
+    assert matches["a"]["station"]["id"] == 1
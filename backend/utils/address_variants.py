@@ -0,0 +1,183 @@
+# backend/utils/address_variants.py
+# Address variants tried against the BAN, ported from the frontend geocoding ladder
+#
+# Mêmes règles que geocoding.ts (extractCommercialInfo, isLieuDit), addressNormalizer.ts
+# (normalizeAddress) et addressParser.ts (parseAddress, pour l'adresse standardisée).
+
+import re
+
+COMMERCIAL_KEYWORDS = (
+    "MAIL ", "HYPERMARCHE ", "HYPER ", "SUPERMARCHE ", "SUPER ", "CENTRE COMMERCIAL ", "CC ", "GALERIE ",
+    "ZAC ", "ZONE ARTISANALE ", "ZI ", "ZONE INDUSTRIELLE ", "PARC D'ACTIVITES ", "PARC COMMERCIAL "
+)
+BRANDS = (
+    (re.compile(r"\bAUCHAN\b", re.I), "AUCHAN"),
+    (re.compile(r"\bLECLERC\b", re.I), "E.LECLERC"),
+    (re.compile(r"\bCARREFOUR\b", re.I), "CARREFOUR"),
+    (re.compile(r"\bINTERMARCHE\b", re.I), "INTERMARCHÉ"),
+    (re.compile(r"\bCASINO\b", re.I), "CASINO"),
+    (re.compile(r"\bLIDL\b", re.I), "LIDL"),
+    (re.compile(r"\bALDI\b", re.I), "ALDI"),
+    (re.compile(r"\b(SUPER U|HYPER U)\b", re.I), "SYSTÈME U"),
+    (re.compile(r"\bMONOPRIX\b", re.I), "MONOPRIX"),
+    (re.compile(r"\bFRANPRIX\b", re.I), "FRANPRIX"),
+    (re.compile(r"\bCORA\b", re.I), "CORA"),
+)
+
+LIEU_DIT_PATTERNS = (
+    re.compile(r"^(LE|LA|LES|L')\s+[A-Z]"),
+    re.compile(r"LIEU DIT", re.I),
+    re.compile(r"^CHATEAU ", re.I),
+    re.compile(r"^DOMAINE ", re.I),
+    re.compile(r"^FERME ", re.I),
+    re.compile(r"^MOULIN ", re.I),
+)
+STREET_INDICATOR = re.compile(r"\b(RUE|AVENUE|BOULEVARD|PLACE|CHEMIN|ROUTE|IMPASSE|ALLEE|COURS)\b", re.I)
+
+ABBREVIATIONS = {
+    "AV ": "Avenue ", "BD ": "Boulevard ", "CHE ": "Chemin ", "IMP ": "Impasse ", "PL ": "Place ",
+    "R ": "Rue ", "RTE ": "Route ", "ALL ": "Allée ", "CRS ": "Cours ", "QU ": "Quai ", "SQ ": "Square ",
+    "ALLEE ": "Allée ", "ST ": "Saint ", "STE ": "Sainte ",
+}
+
+ZONE_ACTIVITE = re.compile(
+    r"^(Z\.?I\.?|ZONE INDUSTRIELLE|ZAI|Z\.?A\.?I\.?|ZONE ARTISANALE|ZONE D'ACTIVITE|ZONE D ACTIVITE|"
+    r"PARC D'ACTIVITE|PARC D ACTIVITE|PARC D'ACTIVITES|PARC D ACTIVITES|Z\.?A\.?|ZONE COMMERCIALE|Z\.?C\.?|"
+    r"PARC INDUSTRIEL|PARC COMMERCIAL|TECHNOPOLE|TECHNOPARC)", re.I
+)
+LIEU_DIT_PREFIX = re.compile(r"^(LIEU DIT|LIEU-DIT|L\.?D\.?|LD)\s+", re.I)
+NAMED_PREFIXES = (
+    re.compile(r"^(STATION|STA\.?|POMP\.?|POMPAGE|TRAITEMENT DES EAUX|TRAITEMENT DE L'EAU|IRRG\.?|IRRIG\.?|"
+               r"IRRIGATION|ASSAINISSEMENT|EPURATION)", re.I),
+    re.compile(r"^(SA|SAS|SARL|EURL|SCI|SCEA|EARL|GAEC|GFA|SCM|SCP|SELARL|SELAFA|SELAS|SNC|SEP)\s+", re.I),
+    re.compile(r"^(SOCIETE|SOC\.?|ETS|ETABLISSEMENT|ETABLISSEMENTS|ENTREPRISE)\s+", re.I),
+    re.compile(r"^(HOTEL|RESTAURANT|SCIERIE|MENUISERIE|BOULANGERIE|PATISSERIE|BOUCHERIE|EPICERIE|"
+               r"SUPERMARCHE|HYPERMARCHE)\s+", re.I),
+)
+
+
+def extract_commercial_info(address):
+    """(brand name or None, variations without commercial keywords / brand)"""
+    brand_name = next((name for pattern, name in BRANDS if pattern.search(address)), None)
+    cleaned = address
+    for keyword in COMMERCIAL_KEYWORDS:
+        cleaned = re.sub(re.escape(keyword), "", cleaned, flags=re.I)
+    cleaned = cleaned.strip()
+
+    variations = [cleaned]
+    for pattern, _ in BRANDS:
+        without_brand = pattern.sub("", cleaned).strip()
+        if without_brand and without_brand != cleaned:
+            variations.append(without_brand)
+    if brand_name:
+        variations.append(brand_name)
+    return brand_name, [v for v in variations if v]
+
+
+def is_lieu_dit(address):
+    upper = address.upper()
+    if any(pattern.search(upper) for pattern in LIEU_DIT_PATTERNS):
+        return True
+    has_no_street_indicator = not STREET_INDICATOR.search(upper)
+    has_no_number = not re.match(r"^\d", upper.strip())
+    is_all_caps = upper == address and len(address) > 3
+    return has_no_street_indicator and has_no_number and is_all_caps
+
+
+def normalize_address(address):
+    if not address:
+        return address
+    normalized = re.sub(r"\s+", " ", address.strip())
+    normalized = re.sub(r"([A-ZÀ-Ý])([A-ZÀ-Ý]{2,})", lambda m: m.group(0)[0] + m.group(0)[1:].lower(), normalized)
+    normalized = re.sub(r"\bDEL'", "DE L'", normalized, flags=re.I)
+    normalized = re.sub(r"\bDEL\b", "DE L'", normalized, flags=re.I)
+    normalized = re.sub(r"\bDES'", "DES ", normalized, flags=re.I)
+    normalized = re.sub(r"\bAL'", "A L'", normalized, flags=re.I)
+    normalized = re.sub(r"\b([AÀÂÄ])\s*L'", "À L'", normalized, flags=re.I)
+    normalized = re.sub(r"(\w)(L')", r"\1 \2", normalized, flags=re.I)
+    normalized = re.sub(r"\s+,", ",", normalized)
+    normalized = re.sub(r",\s*", ", ", normalized)
+    for abbreviation, full in ABBREVIATIONS.items():
+        normalized = re.sub(rf"\b{abbreviation}\b", full, normalized, flags=re.I)
+    return re.sub(r"\s+", " ", normalized).strip()
+
+
+def standardized_address(address):
+    """adresseStandardisee of parseAddress: the street part once zone / lieu-dit / company prefixes are split off"""
+    trimmed = (address or "").strip()
+    if not trimmed:
+        return ""
+
+    complement = None
+    standardized = trimmed
+    match = ZONE_ACTIVITE.match(trimmed)
+    if match:
+        complement = match.group(1).strip()
+        parts = re.split(r"[-,]", trimmed[match.end():].strip())
+        if len(parts) > 1 and len(parts[0].strip()) > 3:
+            complement = f"{complement} {parts[0].strip()}"
+            standardized = ",".join(parts[1:]).strip()
+        else:
+            standardized = trimmed[match.end():].strip()
+    elif LIEU_DIT_PREFIX.match(trimmed):
+        match = LIEU_DIT_PREFIX.match(trimmed)
+        parts = re.split(r"[-,]", trimmed[match.end():].strip())
+        complement = f"{match.group(1).strip()} {parts[0].strip()}"
+        standardized = ",".join(parts[1:]).strip() if len(parts) > 1 else ""
+    elif any(pattern.match(trimmed) for pattern in NAMED_PREFIXES):
+        parts = re.split(r"[-,]", trimmed)
+        standardized = ",".join(parts[1:]).strip() if len(parts) > 1 else ""
+
+    if not standardized and complement:
+        standardized = complement
+    return standardized or trimmed
+
+
+def build_strategies(address, code_commune=None, nom_commune=None):
+    """
+    BAN queries [{"q", "citycode"?, "type"?}] in the frontend's order of preference,
+    duplicates removed (first occurrence kept)
+    """
+    city = nom_commune or ""
+    brand_name, variations = extract_commercial_info(address)
+    normalized = normalize_address(address)
+    standardized = standardized_address(normalized) or normalized
+
+    strategies = []
+    if len(variations) > 1 or brand_name:
+        for variation in reversed(variations):
+            strategies += [
+                {"q": variation, "citycode": code_commune},
+                {"q": f"{variation}, {city}", "citycode": code_commune},
+                {"q": f"{variation} {city}"},
+            ]
+    if is_lieu_dit(address):
+        strategies += [
+            {"q": f"{address} {city}", "citycode": code_commune},
+            {"q": f"{address}, {city}"},
+            {"q": f"{address} {city}"},
+        ]
+    strategies += [
+        {"q": standardized, "citycode": code_commune, "type": "housenumber"},
+        {"q": f"{standardized}, {city}", "citycode": code_commune},
+        {"q": standardized, "citycode": code_commune},
+        {"q": address, "citycode": code_commune, "type": "housenumber"},
+        {"q": f"{address}, {city}", "citycode": code_commune},
+        {"q": address, "citycode": code_commune},
+        {"q": standardized},
+        {"q": address},
+        {"q": f"{standardized} {city}"},
+        {"q": f"{address} {city}"},
+    ]
+
+    unique, seen = [], set()
+    for strategy in strategies:
+        strategy = {key: value.strip(" ,") for key, value in strategy.items() if value}
+        # La BAN refuse les requêtes de moins de 3 caractères
+        if len(strategy.get("q", "")) < 3:
+            continue
+        key = tuple(sorted(strategy.items()))
+        if key not in seen:
+            seen.add(key)
+            unique.append(strategy)
+    return unique
@@ -0,0 +1,332 @@
+# backend/utils/commune_index.py
+# In-memory spatial index of communes: point-in-commune and radius queries without PostGIS
+#
+# Polygones simplifiés (ST_SimplifyPreserveTopology) stockés dans un seul tableau numpy,
+# grille régulière de cellules -> communes dont l'emprise touche la cellule.
+# Distances en projection équirectangulaire locale autour du point (< 0,1 % d'erreur à 40 km).
+
+import asyncio
+import math
+import os
+import time
+
+import numpy as np
+
+# Tolérance de simplification des polygones (degrés, ~10 m)
+COMMUNE_INDEX_SIMPLIFY_TOLERANCE = float(os.getenv("COMMUNE_INDEX_SIMPLIFY_TOLERANCE", "0.0001"))
+# Taille d'une cellule de la grille (degrés)
+COMMUNE_INDEX_CELL_DEG = float(os.getenv("COMMUNE_INDEX_CELL_DEG", "0.1"))
+COMMUNE_INDEX_PAGE_SIZE = int(os.getenv("COMMUNE_INDEX_PAGE_SIZE", "1000"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180
+
+COMMUNE_FIELDS = ("codgeo", "nom_commune", "dens7", "libdens7", "code_epci")
+
+INDEX_QUERY = """
+    SELECT codgeo, nom_commune, dens7, libdens7, code_epci, geometrie::text AS geometrie
+    FROM rpc_communes_index($1)
+"""
+
+
+def get_rayon_densite(dens7):
+    """Same values as the get_rayon_densite SQL function (regulatory radius, metres)"""
+    if dens7 in (1, 2):
+        return 2000.0
+    if dens7 in (3, 4):
+        return 10000.0
+    if dens7 in (5, 6, 7):
+        return 20000.0
+    return 10000.0
+
+
+def _polygons(geometry):
+    if not geometry:
+        return []
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    if geometry["type"] == "MultiPolygon":
+        return geometry["coordinates"]
+    return []
+
+
+class CommuneIndex:
+    """
+    All ring vertices of all communes live in `coords` (M x 2, lon/lat).
+    Commune i owns rings ring_range[i]:ring_range[i + 1]; ring r spans
+    coords[ring_bounds[r]:ring_bounds[r + 1]] (closed ring, first point repeated)
+    """
+
+    def __init__(self, rows, cell_deg=COMMUNE_INDEX_CELL_DEG):
+        started = time.perf_counter()
+        self.cell_deg = cell_deg
+        self.communes = []
+        self.by_code = {}
+
+        vertices, ring_bounds, ring_exterior, ring_range = [], [0], [], [0]
+        for row in rows:
+            geometry = row.get("geometrie")
+            polygons = _polygons(geometry)
+            if not polygons:
+                continue
+            for polygon in polygons:
+                for ring_index, ring in enumerate(polygon):
+                    if len(ring) < 4:
+                        continue
+                    vertices.append(np.asarray(ring, dtype=np.float64)[:, :2])
+                    ring_bounds.append(ring_bounds[-1] + len(ring))
+                    ring_exterior.append(ring_index == 0)
+            if len(ring_exterior) == ring_range[-1]:
+                continue
+            ring_range.append(len(ring_exterior))
+            self.by_code[row["codgeo"]] = len(self.communes)
+            self.communes.append({field: row.get(field) for field in COMMUNE_FIELDS})
+
+        self.coords = np.concatenate(vertices) if vertices else np.zeros((0, 2))
+        self.ring_bounds = np.asarray(ring_bounds, dtype=np.int64)
+        self.ring_exterior = np.asarray(ring_exterior, dtype=bool)
+        self.ring_range = np.asarray(ring_range, dtype=np.int64)
+        # Arête k = coords[k] -> coords[k + 1], invalide entre deux anneaux
+        self.edge_valid = np.ones(len(self.coords), dtype=bool)
+        self.edge_valid[self.ring_bounds[1:] - 1] = False
+
+        count = len(self.communes)
+        self.vertex_start = self.ring_bounds[self.ring_range[:-1]]
+        self.vertex_end = self.ring_bounds[self.ring_range[1:]]
+        self.bbox = np.empty((count, 4))
+        self.centroid = np.empty((count, 2))
+        for i in range(count):
+            points = self.coords[self.vertex_start[i]:self.vertex_end[i]]
+            self.bbox[i] = (*points.min(axis=0), *points.max(axis=0))
+            self.centroid[i] = self._centroid(i)
+        self.dens7 = np.asarray([c["dens7"] or 0 for c in self.communes], dtype=np.int16)
+
+        self.cells = self._build_grid()
+        self.build_seconds = time.perf_counter() - started
+
+    # --- Construction ---
+    def _centroid(self, i):
+        """Area-weighted centroid of the exterior rings (bbox centre for degenerate shapes)"""
+        area_sum, cx_sum, cy_sum = 0.0, 0.0, 0.0
+        for r in range(self.ring_range[i], self.ring_range[i + 1]):
+            if not self.ring_exterior[r]:
+                continue
+            ring = self.coords[self.ring_bounds[r]:self.ring_bounds[r + 1]]
+            x, y = ring[:-1, 0], ring[:-1, 1]
+            x2, y2 = ring[1:, 0], ring[1:, 1]
+            cross = x * y2 - x2 * y
+            area = cross.sum() / 2
+            if area:
+                area_sum += area
+                cx_sum += ((x + x2) * cross).sum() / 6
+                cy_sum += ((y + y2) * cross).sum() / 6
+        if not area_sum:
+            minx, miny, maxx, maxy = self.bbox[i]
+            return (minx + maxx) / 2, (miny + maxy) / 2
+        return cx_sum / area_sum, cy_sum / area_sum
+
+    def _cell(self, lon, lat):
+        return int(math.floor(lon / self.cell_deg)), int(math.floor(lat / self.cell_deg))
+
+    def _build_grid(self):
+        cells = {}
+        for i, (minx, miny, maxx, maxy) in enumerate(self.bbox):
+            x0, y0 = self._cell(minx, miny)
+            x1, y1 = self._cell(maxx, maxy)
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    cells.setdefault((cx, cy), []).append(i)
+        return {cell: np.asarray(indices, dtype=np.int32) for cell, indices in cells.items()}
+
+    # --- Géométrie ---
+    def _edges(self, i):
+        start, end = self.vertex_start[i], self.vertex_end[i]
+        points = self.coords[start:end]
+        valid = self.edge_valid[start:end - 1]
+        return points[:-1][valid], points[1:][valid]
+
+    def contains(self, i, lon, lat):
+        """Even-odd ray casting over every ring (holes handled by the parity)"""
+        a, b = self._edges(i)
+        ya, yb = a[:, 1], b[:, 1]
+        straddles = (ya > lat) != (yb > lat)
+        if not straddles.any():
+            return False
+        a, b = a[straddles], b[straddles]
+        x_cross = a[:, 0] + (lat - a[:, 1]) * (b[:, 0] - a[:, 0]) / (b[:, 1] - a[:, 1])
+        return bool(np.count_nonzero(lon < x_cross) % 2)
+
+    def distance_m(self, i, lon, lat):
+        """Distance from the point to the commune polygon (0 inside)"""
+        if self.contains(i, lon, lat):
+            return 0.0
+        kx = METERS_PER_DEGREE * math.cos(math.radians(lat))
+        a, b = self._edges(i)
+        ax, ay = (a[:, 0] - lon) * kx, (a[:, 1] - lat) * METERS_PER_DEGREE
+        bx, by = (b[:, 0] - lon) * kx, (b[:, 1] - lat) * METERS_PER_DEGREE
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1), 0, 1)
+        px, py = ax + t * dx, ay + t * dy
+        return float(np.sqrt((px * px + py * py).min()))
+
+    def geometry(self, i, precision=6):
+        """GeoJSON MultiPolygon rebuilt from the stored (simplified) rings"""
+        polygons = []
+        for r in range(self.ring_range[i], self.ring_range[i + 1]):
+            ring = np.round(self.coords[self.ring_bounds[r]:self.ring_bounds[r + 1]], precision).tolist()
+            if self.ring_exterior[r] or not polygons:
+                polygons.append([ring])
+            else:
+                polygons[-1].append(ring)
+        return {"type": "MultiPolygon", "coordinates": polygons}
+
+    # --- Requêtes ---
+    def commune(self, i, with_geometry=False, distance=None):
+        result = {
+            **self.communes[i],
+            "longitude": round(float(self.centroid[i][0]), 6),
+            "latitude": round(float(self.centroid[i][1]), 6),
+            "geomgeo": self.geometry(i) if with_geometry else None
+        }
+        if distance is not None:
+            result["distance_centre_m"] = round(distance, 1)
+        return result
+
+    def locate(self, lon, lat):
+        """Index of the commune containing the point, None outside every commune"""
+        candidates = self.cells.get(self._cell(lon, lat))
+        if candidates is None:
+            return None
+        boxes = self.bbox[candidates]
+        inside = (boxes[:, 0] <= lon) & (lon <= boxes[:, 2]) & (boxes[:, 1] <= lat) & (lat <= boxes[:, 3])
+        for i in candidates[inside]:
+            if self.contains(i, lon, lat):
+                return int(i)
+        return None
+
+    def within(self, lon, lat, radius_m):
+        """[(index, distance to centroid in m)] of the communes intersecting the disc, nearest first"""
+        kx = METERS_PER_DEGREE * math.cos(math.radians(lat))
+        dlon, dlat = radius_m / kx, radius_m / METERS_PER_DEGREE
+        x0, y0 = self._cell(lon - dlon, lat - dlat)
+        x1, y1 = self._cell(lon + dlon, lat + dlat)
+        chunks = [
+            self.cells[(cx, cy)]
+            for cx in range(x0, x1 + 1)
+            for cy in range(y0, y1 + 1)
+            if (cx, cy) in self.cells
+        ]
+        if not chunks:
+            return []
+        candidates = np.unique(np.concatenate(chunks))
+        boxes = self.bbox[candidates]
+
+        # Distance minimale à l'emprise : borne inférieure de la distance au polygone
+        gap_x = np.maximum(np.maximum(boxes[:, 0] - lon, lon - boxes[:, 2]), 0) * kx
+        gap_y = np.maximum(np.maximum(boxes[:, 1] - lat, lat - boxes[:, 3]), 0) * METERS_PER_DEGREE
+        near = np.hypot(gap_x, gap_y) <= radius_m
+        candidates, boxes = candidates[near], boxes[near]
+
+        # Emprise entièrement dans le disque : le polygone l'est aussi, sinon calcul exact
+        far_x = np.maximum(np.abs(boxes[:, 0] - lon), np.abs(boxes[:, 2] - lon)) * kx
+        far_y = np.maximum(np.abs(boxes[:, 1] - lat), np.abs(boxes[:, 3] - lat)) * METERS_PER_DEGREE
+        enclosed = np.hypot(far_x, far_y) <= radius_m
+        keep = enclosed.copy()
+        for position in np.flatnonzero(~enclosed):
+            keep[position] = self.distance_m(int(candidates[position]), lon, lat) <= radius_m
+        candidates = candidates[keep]
+
+        centres = self.centroid[candidates]
+        distances = np.hypot((centres[:, 0] - lon) * kx, (centres[:, 1] - lat) * METERS_PER_DEGREE)
+        order = np.argsort(distances)
+        return list(zip(candidates[order].tolist(), distances[order].tolist()))
+
+    def autour(self, lat, lon, radius_m=None, with_geometry=False):
+        """Same shape as rpc_communes_autour_installation"""
+        index = self.locate(lon, lat)
+        if index is None:
+            return {"commune_installation": None, "rayon": None, "communes_dans_rayon": []}
+        rayon = radius_m or get_rayon_densite(int(self.dens7[index]))
+        return {
+            "commune_installation": self.commune(index, with_geometry),
+            "rayon": rayon,
+            "communes_dans_rayon": [
+                self.commune(i, with_geometry, distance) for i, distance in self.within(lon, lat, rayon)
+            ]
+        }
+
+    def stats(self):
+        return {
+            "communes": len(self.communes),
+            "rings": int(len(self.ring_exterior)),
+            "vertices": int(len(self.coords)),
+            "cells": len(self.cells),
+            "cell_deg": self.cell_deg,
+            "memory_mb": round((self.coords.nbytes + self.edge_valid.nbytes + self.ring_bounds.nbytes
+                                + self.bbox.nbytes + self.centroid.nbytes) / 1e6, 1),
+            "build_seconds": round(self.build_seconds, 2)
+        }
+
+
+# --- Chargement ---
+async def fetch_commune_rows(tolerance=COMMUNE_INDEX_SIMPLIFY_TOLERANCE):
+    """Simplified commune geometries from rpc_communes_index (asyncpg if DATABASE_URL, PostgREST otherwise)"""
+    import json
+
+    if DATABASE_URL:
+        import asyncpg
+
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            records = await conn.fetch(INDEX_QUERY, tolerance)
+        finally:
+            await conn.close()
+        return [{**dict(record), "geometrie": json.loads(record["geometrie"]) if record["geometrie"] else None}
+                for record in records]
+
+    from utils.supabase_client import supabase
+
+    def fetch_pages():
+        rows, offset = [], 0
+        while True:
+            # Pagination côté SQL : PostgREST plafonne le nombre de lignes par réponse
+            page = supabase.rpc("rpc_communes_index", {
+                "p_tolerance": tolerance,
+                "p_offset": offset,
+                "p_limit": COMMUNE_INDEX_PAGE_SIZE
+            }).execute().data or []
+            rows.extend(page)
+            if len(page) < COMMUNE_INDEX_PAGE_SIZE:
+                return rows
+            offset += COMMUNE_INDEX_PAGE_SIZE
+
+    return await asyncio.to_thread(fetch_pages)
+
+
+_index = None
+_index_lock = asyncio.Lock()
+
+
+async def load_commune_index():
+    rows = await fetch_commune_rows()
+    return await asyncio.to_thread(CommuneIndex, rows)
+
+
+async def get_commune_index() -> CommuneIndex:
+    """Built on first use (a few seconds for all French communes), then kept in memory"""
+    global _index
+    if _index is None:
+        async with _index_lock:
+            if _index is None:
+                _index = await load_commune_index()
+    return _index
+
+
+async def reload_commune_index() -> CommuneIndex:
+    """Rebuild after an update of the communes table; queries keep the old index meanwhile"""
+    global _index
+    index = await load_commune_index()
+    _index = index
+    return index
@@ -0,0 +1,173 @@
+# backend/utils/consommateur_repository.py
+# Async data access for consommateurs: pooled Postgres (asyncpg) or PostgREST fallback
+
+import asyncio
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+
+REPOSITORY_BACKEND = os.getenv("REPOSITORY_BACKEND", "auto")
+DATABASE_URL = os.getenv("DATABASE_URL")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+# 0 derrière PgBouncer en mode transaction
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))
+
+logger = logging.getLogger(__name__)
+
+
+class ConsommateurRepository(ABC):
+    @abstractmethod
+    async def update_geocode(self, consommateur_id: int, lat: float, lon: float, status: str, score: float):
+        ...
+
+    async def update_geocodes(self, rows: list[dict]):
+        """Bulk update, rows: [{"id", "latitude", "longitude", "geocode_status", "geocode_score"}]"""
+        for row in rows:
+            await self.update_geocode(
+                row["id"], row["latitude"], row["longitude"], row["geocode_status"], row["geocode_score"]
+            )
+
+    @abstractmethod
+    async def mark_geocode_failures(self, rows: list[dict], base_seconds: int, max_seconds: int):
+        """rows: [{"id", "geocode_status"}]; pushes the next attempt back exponentially"""
+
+    @abstractmethod
+    async def fetch_geocode_backlog(self, limit: int, max_attempts: int) -> list[dict]:
+        """Rows to (re)geocode: [{"id", "adresse", "code_commune", "nom_commune", "motif"}]"""
+
+    @abstractmethod
+    async def record_geocode_run(self, run: dict):
+        ...
+
+    async def close(self):
+        pass
+
+
+class PostgrestConsommateurRepository(ConsommateurRepository):
+    # supabase-py est synchrone : appels exécutés dans un thread
+    async def update_geocode(self, consommateur_id, lat, lon, status, score):
+        from utils.supabase_client import update_consommateur_geocode
+
+        await asyncio.to_thread(update_consommateur_geocode, consommateur_id, lat, lon, status, score)
+
+    async def mark_geocode_failures(self, rows, base_seconds, max_seconds):
+        if not rows:
+            return
+        from utils.supabase_client import supabase
+
+        await asyncio.to_thread(lambda: supabase.rpc("rpc_mark_geocode_failures", {
+            "p_rows": rows, "p_base_seconds": base_seconds, "p_max_seconds": max_seconds
+        }).execute())
+
+    async def fetch_geocode_backlog(self, limit, max_attempts):
+        from utils.supabase_client import supabase
+
+        result = await asyncio.to_thread(lambda: supabase.rpc("rpc_consommateurs_a_geocoder", {
+            "p_limit": limit, "p_max_attempts": max_attempts
+        }).execute())
+        return result.data or []
+
+    async def record_geocode_run(self, run):
+        from utils.supabase_client import supabase
+
+        await asyncio.to_thread(lambda: supabase.table("geocode_runs").insert(run).execute())
+
+
+class PostgresConsommateurRepository(ConsommateurRepository):
+    # Requêtes à texte fixe : préparées une fois par connexion du pool (cache asyncpg)
+    UPDATE_GEOCODE = """
+        UPDATE consommateurs
+        SET latitude = $2, longitude = $3, geocode_status = $4, geocode_score = $5,
+            geocoded_at = now(), geocode_attempts = 0, geocode_next_attempt_at = NULL
+        WHERE id = $1
+    """
+    MARK_GEOCODE_FAILURES = "SELECT rpc_mark_geocode_failures($1::jsonb, $2, $3)"
+    GEOCODE_BACKLOG = "SELECT * FROM rpc_consommateurs_a_geocoder($1, $2)"
+    INSERT_GEOCODE_RUN = """
+        INSERT INTO geocode_runs (
+            declencheur, started_at, finished_at, selectionnes, par_motif, geocodes, a_valider, erreurs,
+            duree_secondes, lignes_par_seconde, taux_succes, erreur
+        ) VALUES ($1, $2::timestamptz, $3::timestamptz, $4, $5::jsonb, $6, $7, $8, $9, $10, $11, $12)
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    @classmethod
+    async def connect(cls, dsn=DATABASE_URL):
+        import asyncpg
+
+        pool = await asyncpg.create_pool(
+            dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE
+        )
+        return cls(pool)
+
+    async def update_geocode(self, consommateur_id, lat, lon, status, score):
+        await self.pool.execute(self.UPDATE_GEOCODE, consommateur_id, lat, lon, status, score)
+
+    async def update_geocodes(self, rows):
+        if not rows:
+            return
+        async with self.pool.acquire() as conn:
+            await conn.executemany(self.UPDATE_GEOCODE, [
+                (row["id"], row["latitude"], row["longitude"], row["geocode_status"], row["geocode_score"])
+                for row in rows
+            ])
+
+    async def mark_geocode_failures(self, rows, base_seconds, max_seconds):
+        if not rows:
+            return
+        await self.pool.execute(self.MARK_GEOCODE_FAILURES, json.dumps(rows), base_seconds, max_seconds)
+
+    async def fetch_geocode_backlog(self, limit, max_attempts):
+        return [dict(record) for record in await self.pool.fetch(self.GEOCODE_BACKLOG, limit, max_attempts)]
+
+    async def record_geocode_run(self, run):
+        await self.pool.execute(
+            self.INSERT_GEOCODE_RUN,
+            run["declencheur"], datetime.fromisoformat(run["started_at"]), datetime.fromisoformat(run["finished_at"]),
+            run["selectionnes"], json.dumps(run["par_motif"]), run["geocodes"], run["a_valider"], run["erreurs"],
+            run["duree_secondes"], run["lignes_par_seconde"], run["taux_succes"], run.get("erreur")
+        )
+
+    async def close(self):
+        await self.pool.close()
+
+
+_repository = None
+_repository_lock = asyncio.Lock()
+
+
+async def get_consommateur_repository() -> ConsommateurRepository:
+    """Postgres pool when DATABASE_URL is set, PostgREST otherwise (or if the pool fails in auto mode)"""
+    global _repository
+    if _repository is None:
+        async with _repository_lock:
+            if _repository is None:
+                _repository = await _create_repository()
+    return _repository
+
+
+async def _create_repository():
+    if REPOSITORY_BACKEND == "postgrest" or (REPOSITORY_BACKEND == "auto" and not DATABASE_URL):
+        return PostgrestConsommateurRepository()
+    try:
+        return await PostgresConsommateurRepository.connect(DATABASE_URL)
+    except Exception as e:
+        if REPOSITORY_BACKEND == "postgres":
+            raise
+        logger.warning(f"Pool Postgres indisponible, repli sur PostgREST: {e}")
+        return PostgrestConsommateurRepository()
+
+
+async def close_consommateur_repository():
+    global _repository
+    if _repository is not None:
+        await _repository.close()
+        _repository = None
@@ -0,0 +1,524 @@
+# backend/utils/consumer_index.py
+# Geocoded consommateurs in NumPy columns, for radius searches and aggregates around an installation
+#
+# Colonnes triées par cellule de grille (ligne de latitude, puis longitude) : les cellules d'une
+# même ligne sont contiguës, une recherche par rayon ne lit que quelques tranches du tableau.
+# Les nouveaux géocodages arrivent dans un petit tampon (delta) parcouru en entier, fusionné
+# dans les colonnes principales au-delà de CONSUMER_INDEX_MERGE_THRESHOLD lignes.
+
+import asyncio
+import copy
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from utils.commune_index import get_rayon_densite
+
+CONSUMER_INDEX_CELL_DEG = float(os.getenv("CONSUMER_INDEX_CELL_DEG", "0.1"))
+CONSUMER_INDEX_MERGE_THRESHOLD = int(os.getenv("CONSUMER_INDEX_MERGE_THRESHOLD", "5000"))
+CONSUMER_INDEX_PAGE_SIZE = int(os.getenv("CONSUMER_INDEX_PAGE_SIZE", "1000"))
+# Rafraîchissement incrémental (0 = uniquement sur demande)
+CONSUMER_INDEX_REFRESH_SECONDS = int(os.getenv("CONSUMER_INDEX_REFRESH_SECONDS", "60"))
+# Statuts considérés comme géocodés ("success" côté frontend, "OK" côté backend)
+CONSUMER_INDEX_STATUSES = [s.strip() for s in os.getenv("CONSUMER_INDEX_STATUSES", "success,OK").split(",") if s.strip()]
+# Marge sur le filigrane initial (horloges backend / base non synchronisées, relire est sans effet)
+CONSUMER_INDEX_CLOCK_SKEW_SECONDS = int(os.getenv("CONSUMER_INDEX_CLOCK_SKEW_SECONDS", "60"))
+# geocoded_at vaut le début de la transaction : un géocodage validé tard peut être plus ancien que
+# le filigrane, d'où une relecture de cette fenêtre (dédoublonnée par id et geocoded_at)
+CONSUMER_INDEX_OVERLAP_SECONDS = int(os.getenv("CONSUMER_INDEX_OVERLAP_SECONDS", "600"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+EARTH_RADIUS_M = 6371000.0
+# Largeur d'une ligne de la grille dans la clé de cellule
+GRID_WIDTH = 1 << 20
+
+COLUMNS = (
+    "id", "latitude", "longitude", "annee", "tranche_conso", "categorie_activite",
+    "code_commune", "nom_commune", "nombre_sites", "consommation_annuelle_mwh", "geocoded_at"
+)
+CATEGORICAL = ("tranche_conso", "categorie_activite", "code_commune", "nom_commune")
+
+SELECT_COLUMNS = ", ".join(COLUMNS)
+FULL_QUERY = f"""
+    SELECT {SELECT_COLUMNS} FROM consommateurs
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND geocode_status = ANY($1::text[])
+"""
+DELTA_QUERY = f"""
+    SELECT {SELECT_COLUMNS}, geocode_status FROM consommateurs
+    WHERE geocoded_at > $1 OR (geocoded_at = $1 AND id > $2)
+    ORDER BY geocoded_at, id
+    LIMIT $3
+"""
+
+
+class Vocabulary:
+    """String <-> small int code, shared by the main columns and the delta"""
+
+    def __init__(self):
+        self.values = [None]
+        self.codes = {None: 0}
+
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def lookup(self, values):
+        """Codes of the requested values, unknown values ignored"""
+        return np.asarray([self.codes[v] for v in values if v in self.codes], dtype=np.int32)
+
+
+class Columns:
+    """One block of consumers as parallel NumPy arrays"""
+
+    def __init__(self, rows, vocabularies):
+        count = len(rows)
+        self.id = np.fromiter((int(r["id"]) for r in rows), dtype=np.int64, count=count)
+        self.lat = np.fromiter((float(r["latitude"]) for r in rows), dtype=np.float64, count=count)
+        self.lon = np.fromiter((float(r["longitude"]) for r in rows), dtype=np.float64, count=count)
+        self.annee = np.fromiter((int(r.get("annee") or 0) for r in rows), dtype=np.int16, count=count)
+        self.nb_sites = np.fromiter((float(r.get("nombre_sites") or 0) for r in rows), dtype=np.float64, count=count)
+        self.conso = np.fromiter(
+            (float(r.get("consommation_annuelle_mwh") or 0) for r in rows), dtype=np.float64, count=count
+        )
+        self.codes = {
+            name: np.fromiter((vocabularies[name].encode(r.get(name)) for r in rows), dtype=np.int32, count=count)
+            for name in CATEGORICAL
+        }
+        self.alive = np.ones(count, dtype=bool)
+        self._derive()
+
+    def _derive(self):
+        self.lat_rad = np.radians(self.lat)
+        self.lon_rad = np.radians(self.lon)
+        self.cos_lat = np.cos(self.lat_rad)
+
+    def __len__(self):
+        return len(self.id)
+
+    def with_alive(self, alive):
+        """Copy sharing every column but the alive mask (readers keep the previous block intact)"""
+        block = copy.copy(self)
+        block.alive = alive
+        return block
+
+    def take(self, order):
+        """Reorder (or filter) every column in place, only on a block not yet published"""
+        for name in ("id", "lat", "lon", "annee", "nb_sites", "conso", "alive"):
+            setattr(self, name, getattr(self, name)[order])
+        self.codes = {name: codes[order] for name, codes in self.codes.items()}
+        self._derive()
+
+    @classmethod
+    def concat(cls, blocks):
+        merged = cls.__new__(cls)
+        for name in ("id", "lat", "lon", "annee", "nb_sites", "conso", "alive"):
+            setattr(merged, name, np.concatenate([getattr(block, name) for block in blocks]))
+        merged.codes = {name: np.concatenate([block.codes[name] for block in blocks]) for name in CATEGORICAL}
+        merged._derive()
+        return merged
+
+
+def haversine_m(lat_rad, lon_rad, cos_lat, lat0, lon0):
+    phi0, lambda0 = math.radians(lat0), math.radians(lon0)
+    a = np.sin((lat_rad - phi0) / 2) ** 2 + math.cos(phi0) * cos_lat * np.sin((lon_rad - lambda0) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class ConsumerIndex:
+    """
+    Main block sorted by grid cell + delta block of recent geocodes.
+    Writers (apply/merge) run one at a time under the refresh lock and publish a new
+    (main, delta) pair in one assignment; queries read that pair once
+    """
+
+    def __init__(self, rows, loaded_at=None, cell_deg=CONSUMER_INDEX_CELL_DEG):
+        started = time.perf_counter()
+        self.cell_deg = cell_deg
+        self.vocabularies = {name: Vocabulary() for name in CATEGORICAL}
+        self.blocks = (self._sorted(Columns(rows, self.vocabularies)), Columns([], self.vocabularies))
+        # Filigrane (geocoded_at, id) de la lecture incrémentale ; les lignes sans geocoded_at
+        # (géocodées avant la migration) ne comptent pas, d'où le plancher à l'heure du chargement
+        self.watermark = (loaded_at - timedelta(seconds=CONSUMER_INDEX_CLOCK_SKEW_SECONDS), 0) if loaded_at else (None, 0)
+        self.overlap = timedelta(seconds=CONSUMER_INDEX_OVERLAP_SECONDS)
+        # id -> geocoded_at des lignes encore dans la fenêtre de recouvrement, déjà indexées
+        self.recent = {}
+        self.advance([r for r in rows if r.get("geocoded_at")])
+        self.build_seconds = time.perf_counter() - started
+        self.refreshed_at = None
+        self.merges = 0
+        self._commune_radius = None
+
+    # --- Grille ---
+    def _cell_keys(self, lat, lon):
+        rows = np.floor(lat / self.cell_deg).astype(np.int64)
+        cols = np.floor(lon / self.cell_deg).astype(np.int64)
+        return rows * GRID_WIDTH + (cols + GRID_WIDTH // 2)
+
+    def _sorted(self, block):
+        """Drop dead rows, sort by cell key, attach the key and id lookups to the block"""
+        block.take(block.alive)
+        keys = self._cell_keys(block.lat, block.lon)
+        order = np.argsort(keys, kind="stable")
+        block.take(order)
+        block.keys = keys[order]
+        # Recherche d'un id : tableau trié + searchsorted
+        block.id_order = np.argsort(block.id, kind="stable")
+        block.sorted_ids = block.id[block.id_order]
+        return block
+
+    def _main_candidates(self, main, lat, lon, radius_m):
+        """Row ranges of the main block covering the disc's bounding box"""
+        dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+        dlon = dlat / max(math.cos(math.radians(lat)), 1e-6)
+        row0, row1 = math.floor((lat - dlat) / self.cell_deg), math.floor((lat + dlat) / self.cell_deg)
+        col0 = math.floor((lon - dlon) / self.cell_deg) + GRID_WIDTH // 2
+        col1 = math.floor((lon + dlon) / self.cell_deg) + GRID_WIDTH // 2
+        rows = np.arange(row0, row1 + 1, dtype=np.int64) * GRID_WIDTH
+        starts = np.searchsorted(main.keys, rows + col0, side="left")
+        ends = np.searchsorted(main.keys, rows + col1, side="right")
+        ranges = [np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist()) if e > s]
+        return np.concatenate(ranges) if ranges else np.zeros(0, dtype=np.int64)
+
+    # --- Mises à jour ---
+    def since(self):
+        """Start of the incremental read: the watermark minus the overlap window"""
+        geocoded_at, last_id = self.watermark
+        return (geocoded_at - self.overlap, 0) if geocoded_at is not None else (None, last_id)
+
+    def apply(self, rows):
+        """
+        Upsert changed consumers; rows no longer geocoded are only removed.
+        Re-read rows of the overlap window are skipped. Published blocks are never
+        modified: new alive masks and blocks are built, then swapped in one assignment
+        """
+        rows = [r for r in rows if self.recent.get(int(r["id"])) != _timestamp(r.get("geocoded_at"))]
+        if not rows:
+            return 0
+        main, delta = self.blocks
+        ids = np.unique(np.asarray([int(r["id"]) for r in rows], dtype=np.int64))
+        # Les versions précédentes de ces consommateurs disparaissent des deux blocs
+        if len(main):
+            positions = np.minimum(np.searchsorted(main.sorted_ids, ids), len(main) - 1)
+            found = main.sorted_ids[positions] == ids
+            alive = main.alive.copy()
+            alive[main.id_order[positions[found]]] = False
+            main = main.with_alive(alive)
+        if len(delta):
+            delta = delta.with_alive(delta.alive & ~np.isin(delta.id, ids))
+
+        geocoded = [
+            r for r in rows
+            if r.get("latitude") is not None and r.get("longitude") is not None
+            and r.get("geocode_status", CONSUMER_INDEX_STATUSES[0]) in CONSUMER_INDEX_STATUSES
+        ]
+        if geocoded:
+            delta = Columns.concat([delta, Columns(geocoded, self.vocabularies)])
+        if len(delta) >= CONSUMER_INDEX_MERGE_THRESHOLD:
+            self.blocks = (self._sorted(Columns.concat([main, delta])), Columns([], self.vocabularies))
+            self.merges += 1
+        else:
+            self.blocks = (main, delta)
+        self.advance(rows)
+        return len(rows)
+
+    def advance(self, rows):
+        for row in rows:
+            watermark = (_timestamp(row.get("geocoded_at")), int(row["id"]))
+            if watermark[0] is None:
+                continue
+            self.recent[watermark[1]] = watermark[0]
+            if self.watermark[0] is None or watermark > self.watermark:
+                self.watermark = watermark
+        # Seuls les ids encore dans la fenêtre de recouvrement servent au dédoublonnage
+        if self.watermark[0] is not None:
+            horizon = self.watermark[0] - self.overlap
+            self.recent = {i: geocoded_at for i, geocoded_at in self.recent.items() if geocoded_at >= horizon}
+
+    # --- Requêtes ---
+    def _filter(self, block, positions, lat, lon, radius_m, annee, tranches, categories):
+        lat_rad, lon_rad, cos_lat = block.lat_rad[positions], block.lon_rad[positions], block.cos_lat[positions]
+        distances = haversine_m(lat_rad, lon_rad, cos_lat, lat, lon)
+        keep = block.alive[positions] & (distances <= radius_m)
+        if annee is not None:
+            keep &= block.annee[positions] == annee
+        if tranches is not None:
+            keep &= np.isin(block.codes["tranche_conso"][positions], tranches)
+        if categories is not None:
+            keep &= np.isin(block.codes["categorie_activite"][positions], categories)
+        return positions[keep], distances[keep]
+
+    def search(self, lat, lon, radius_m, annee=None, tranches=None, categories=None, commune_radius=None):
+        """
+        [(block, positions, distances)] of the consumers within radius_m of the point.
+        commune_radius: optional callable(code_commune codes) -> per-consumer max radius,
+        applied on top of radius_m (regulatory radius of the consumer's commune)
+        """
+        tranche_codes = self.vocabularies["tranche_conso"].lookup(tranches) if tranches is not None else None
+        category_codes = self.vocabularies["categorie_activite"].lookup(categories) if categories is not None else None
+        main, delta = self.blocks
+        results = []
+        for block, positions in ((main, self._main_candidates(main, lat, lon, radius_m)), (delta, np.arange(len(delta)))):
+            if not len(positions):
+                continue
+            positions, distances = self._filter(
+                block, positions, lat, lon, radius_m, annee, tranche_codes, category_codes
+            )
+            if commune_radius is not None and len(positions):
+                within = distances <= commune_radius(block.codes["code_commune"][positions])
+                positions, distances = positions[within], distances[within]
+            results.append((block, positions, distances))
+        return results
+
+    def commune_radius(self, commune_index, installation_radius_m, marge_m):
+        """
+        Per-consumer radius following the frontend rule: the consumer's commune radius when its
+        density category is more restrictive than the installation's, else the installation's
+        radius (i.e. the smaller of the two), plus the margin. Unknown communes count as dens7 5
+        """
+        def lookup(codes):
+            radius = self._commune_radii(commune_index, int(codes.max()) + 1 if len(codes) else 0)
+            return np.minimum(radius[codes], installation_radius_m) + marge_m
+        return lookup
+
+    def _commune_radii(self, commune_index, size):
+        """Regulatory radius per code_commune code, cached until the vocabulary grows"""
+        cached = self._commune_radius
+        if cached is None or cached[0] is not commune_index or len(cached[1]) < size:
+            radius = np.asarray([
+                get_rayon_densite(int(commune_index.dens7[commune_index.by_code[code]]) or 5)
+                if code in commune_index.by_code else get_rayon_densite(5)
+                for code in list(self.vocabularies["code_commune"].values)
+            ])
+            cached = self._commune_radius = (commune_index, radius)
+        return cached[1]
+
+    def points(self, results, limit):
+        flat = [
+            (block, position, distance)
+            for block, positions, distances in results
+            for position, distance in zip(positions.tolist(), distances.tolist())
+        ]
+        flat.sort(key=lambda item: item[2])
+        values = {name: self.vocabularies[name].values for name in CATEGORICAL}
+        return [
+            {
+                "id": int(block.id[p]),
+                "latitude": float(block.lat[p]),
+                "longitude": float(block.lon[p]),
+                "annee": int(block.annee[p]),
+                **{name: values[name][block.codes[name][p]] for name in CATEGORICAL},
+                "nb_sites": float(block.nb_sites[p]),
+                "conso_totale_mwh": float(block.conso[p]),
+                "distance_m": round(distance, 1)
+            }
+            for block, p, distance in flat[:limit]
+        ]
+
+    def aggregate(self, results):
+        """Totals per (tranche_conso, categorie_activite), one bincount per measure"""
+        n_categories = len(self.vocabularies["categorie_activite"].values)
+        size = len(self.vocabularies["tranche_conso"].values) * n_categories
+        counts, sites, conso = np.zeros(size), np.zeros(size), np.zeros(size)
+        for block, positions, _ in results:
+            groups = block.codes["tranche_conso"][positions] * n_categories + block.codes["categorie_activite"][positions]
+            counts += np.bincount(groups, minlength=size)
+            sites += np.bincount(groups, weights=block.nb_sites[positions], minlength=size)
+            conso += np.bincount(groups, weights=block.conso[positions], minlength=size)
+
+        tranches = self.vocabularies["tranche_conso"].values
+        categories = self.vocabularies["categorie_activite"].values
+        return [
+            {
+                "tranche_conso": tranches[group // n_categories],
+                "categorie_activite": categories[group % n_categories],
+                "nb_consommateurs": int(counts[group]),
+                "nb_sites": float(sites[group]),
+                "conso_totale_mwh": round(float(conso[group]), 3)
+            }
+            for group in np.flatnonzero(counts).tolist()
+        ]
+
+    def stats(self):
+        main, delta = self.blocks
+        return {
+            "consommateurs": int(main.alive.sum() + delta.alive.sum()),
+            "main": len(main),
+            "delta": len(delta),
+            "merges": self.merges,
+            "cell_deg": self.cell_deg,
+            "watermark": {"geocoded_at": _iso(self.watermark[0]), "id": self.watermark[1]},
+            "build_seconds": round(self.build_seconds, 2),
+            "refreshed_at": _iso(self.refreshed_at)
+        }
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _timestamp(value):
+    """timestamptz from asyncpg (datetime) or PostgREST (ISO string)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# --- Chargement ---
+async def fetch_all_rows():
+    if DATABASE_URL:
+        import asyncpg
+
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            return [dict(record) for record in await conn.fetch(FULL_QUERY, CONSUMER_INDEX_STATUSES)]
+        finally:
+            await conn.close()
+
+    from utils.supabase_client import supabase
+
+    def fetch_pages():
+        rows, last_id = [], None
+        while True:
+            query = (
+                supabase.table("consommateurs")
+                .select(SELECT_COLUMNS)
+                .not_.is_("latitude", "null")
+                .not_.is_("longitude", "null")
+                .in_("geocode_status", CONSUMER_INDEX_STATUSES)
+            )
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            page = query.order("id").limit(CONSUMER_INDEX_PAGE_SIZE).execute().data or []
+            rows.extend(page)
+            if len(page) < CONSUMER_INDEX_PAGE_SIZE:
+                return rows
+            last_id = page[-1]["id"]
+
+    return await asyncio.to_thread(fetch_pages)
+
+
+async def fetch_changed_rows(since):
+    """Rows geocoded (or un-geocoded) after the (geocoded_at, id) cursor"""
+    geocoded_at, last_id = since
+    if geocoded_at is None:
+        return []
+
+    if DATABASE_URL:
+        import asyncpg
+
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            rows = []
+            while True:
+                records = await conn.fetch(DELTA_QUERY, geocoded_at, last_id, CONSUMER_INDEX_PAGE_SIZE)
+                rows.extend(dict(record) for record in records)
+                if len(records) < CONSUMER_INDEX_PAGE_SIZE:
+                    return rows
+                geocoded_at, last_id = records[-1]["geocoded_at"], records[-1]["id"]
+        finally:
+            await conn.close()
+
+    from utils.supabase_client import supabase
+
+    def fetch_pages():
+        rows, cursor, cursor_id = [], _iso(geocoded_at), last_id
+        while True:
+            page = (
+                supabase.table("consommateurs")
+                .select(f"{SELECT_COLUMNS}, geocode_status")
+                .or_(f'geocoded_at.gt."{cursor}",and(geocoded_at.eq."{cursor}",id.gt.{cursor_id})')
+                .order("geocoded_at")
+                .order("id")
+                .limit(CONSUMER_INDEX_PAGE_SIZE)
+                .execute()
+                .data
+                or []
+            )
+            rows.extend(page)
+            if len(page) < CONSUMER_INDEX_PAGE_SIZE:
+                return rows
+            cursor, cursor_id = page[-1]["geocoded_at"], page[-1]["id"]
+
+    return await asyncio.to_thread(fetch_pages)
+
+
+_index = None
+_index_lock = asyncio.Lock()
+_refresh_lock = asyncio.Lock()
+
+
+async def get_consumer_index() -> ConsumerIndex:
+    global _index
+    if _index is None:
+        async with _index_lock:
+            if _index is None:
+                loaded_at = datetime.now(timezone.utc)
+                rows = await fetch_all_rows()
+                _index = await asyncio.to_thread(ConsumerIndex, rows, loaded_at)
+    return _index
+
+
+async def reload_consumer_index() -> ConsumerIndex:
+    global _index
+    async with _index_lock:
+        loaded_at = datetime.now(timezone.utc)
+        rows = await fetch_all_rows()
+        _index = await asyncio.to_thread(ConsumerIndex, rows, loaded_at)
+    return _index
+
+
+async def refresh_consumer_index():
+    """Pull consumers geocoded since the watermark into the delta (no-op before the first load)"""
+    if _index is None:
+        return None
+    async with _refresh_lock:
+        rows = await fetch_changed_rows(_index.since())
+        changed = await asyncio.to_thread(_index.apply, rows) if rows else 0
+        _index.refreshed_at = datetime.now(timezone.utc)
+        return changed
+
+
+async def _safe_refresh():
+    try:
+        await refresh_consumer_index()
+    except Exception as e:
+        print(f"Rafraîchissement de l'index consommateurs en échec: {e}")
+
+
+_pending_refreshes = set()
+
+
+def schedule_consumer_index_refresh():
+    """Fire-and-forget refresh, e.g. right after new geocodes were written"""
+    task = asyncio.create_task(_safe_refresh())
+    _pending_refreshes.add(task)
+    task.add_done_callback(_pending_refreshes.discard)
+
+
+async def consumer_index_refresh_loop():
+    while True:
+        await asyncio.sleep(CONSUMER_INDEX_REFRESH_SECONDS)
+        await _safe_refresh()
+
+
+_refresh_task = None
+
+
+async def start_consumer_index_refresh():
+    global _refresh_task
+    if CONSUMER_INDEX_REFRESH_SECONDS > 0 and _refresh_task is None:
+        _refresh_task = asyncio.create_task(consumer_index_refresh_loop())
+
+
+async def stop_consumer_index_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
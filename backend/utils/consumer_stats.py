@@ -0,0 +1,275 @@
+# backend/utils/consumer_stats.py
+# Consumer indicators served from the consommateurs_stats rollups, kept in memory per level
+#
+# Une ligne de consommateurs_stats = totaux d'une clé (code_commune, annee, tranche_conso,
+# categorie_activite), tenus à jour en base par trigger. Ici, pyramide commune -> EPCI -> département :
+# chaque niveau a ses cellules niveau / code / année / (tranche, catégorie), une requête filtrée ne
+# parcourt que les cellules des codes demandés, quel que soit le nombre de consommateurs.
+# Rafraîchissement incrémental : les clés modifiées depuis le filigrane updated_at remplacent
+# leur ancienne valeur, l'écart est reporté sur l'EPCI et le département.
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+CONSUMER_STATS_PAGE_SIZE = int(os.getenv("CONSUMER_STATS_PAGE_SIZE", "1000"))
+# Rafraîchissement incrémental (0 = uniquement sur demande)
+CONSUMER_STATS_REFRESH_SECONDS = int(os.getenv("CONSUMER_STATS_REFRESH_SECONDS", "60"))
+# updated_at vaut le début de la transaction : une transaction longue (import) valide des clés
+# plus anciennes que le filigrane, relues grâce à ce recouvrement (relire est sans effet)
+CONSUMER_STATS_OVERLAP_SECONDS = int(os.getenv("CONSUMER_STATS_OVERLAP_SECONDS", "600"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+LEVELS = ("commune", "epci", "departement")
+MEASURES = (
+    "nb_consommateurs", "nb_sites", "conso_totale_mwh",
+    "nb_consommateurs_geocodes", "nb_sites_geocodes", "conso_geocodee_mwh"
+)
+# Mesures renvoyées : tous les consommateurs, ou seulement les géocodés (ceux de la carte)
+ALL_MEASURES = (0, 1, 2)
+GEOCODED_MEASURES = (3, 4, 5)
+
+FIELDS = ("code_commune", "annee", "tranche_conso", "categorie_activite", "code_epci", "code_departement",
+          *MEASURES, "updated_at")
+SELECT_FIELDS = ", ".join(FIELDS)
+FULL_QUERY = f"SELECT {SELECT_FIELDS} FROM consommateurs_stats WHERE nb_consommateurs <> 0"
+DELTA_QUERY = f"SELECT {SELECT_FIELDS} FROM consommateurs_stats WHERE updated_at > $1"
+
+
+class ConsumerStats:
+    """
+    Rollup rows by key, plus one cell tree per level: level -> code -> annee -> (tranche, categorie)
+    -> measures. Writers run one at a time under the refresh lock
+    """
+
+    def __init__(self, rows, loaded_at=None):
+        started = time.perf_counter()
+        # clé -> (codes par niveau, mesures) tels qu'ajoutés à la pyramide
+        self.rows = {}
+        self.cells = {level: {} for level in LEVELS}
+        # Filigrane updated_at ; table vide au chargement : heure du chargement
+        self.watermark = loaded_at
+        self.apply(rows)
+        self.build_seconds = time.perf_counter() - started
+        self.refreshed_at = None
+        self.updates = 0
+
+    # --- Mises à jour ---
+    def apply(self, rows):
+        """Replace the rollup of each key; a key whose counts dropped to zero is removed"""
+        changed = 0
+        for row in rows:
+            key = (row["code_commune"], int(row["annee"]), row.get("tranche_conso") or "",
+                   row.get("categorie_activite") or "")
+            values = [float(row.get(measure) or 0) for measure in MEASURES]
+            codes = (row["code_commune"], row.get("code_epci"), row.get("code_departement"))
+
+            previous = self.rows.get(key)
+            if previous == (codes, values):
+                self._advance(row)
+                continue
+            if previous is not None:
+                del self.rows[key]
+                self._add(previous[0], key, previous[1], -1)
+            if values[0]:
+                self.rows[key] = (codes, values)
+                self._add(codes, key, values, 1)
+            changed += 1
+            self._advance(row)
+        return changed
+
+    def _add(self, codes, key, values, sign):
+        _, annee, tranche, categorie = key
+        for level, code in zip(LEVELS, codes):
+            if code is None:
+                continue
+            years = self.cells[level].setdefault(code, {})
+            groups = years.setdefault(annee, {})
+            cell = groups.setdefault((tranche, categorie), [0.0] * len(MEASURES))
+            for i, value in enumerate(values):
+                cell[i] += sign * value
+            # Cellule vidée (plus aucun consommateur) : retirée, les arrondis flottants avec
+            if round(cell[0]) == 0:
+                del groups[(tranche, categorie)]
+                if not groups:
+                    del years[annee]
+                    if not years:
+                        del self.cells[level][code]
+
+    def _advance(self, row):
+        updated_at = _timestamp(row.get("updated_at"))
+        if updated_at is not None and (self.watermark is None or updated_at > self.watermark):
+            self.watermark = updated_at
+
+    # --- Requêtes ---
+    def query(self, level, codes=None, annee=None, tranches=None, categories=None, geocodes=True, detail=False):
+        """
+        Totals over the codes of the level (all codes when None), for one year (all when None)
+        and the selected tranches / categories. detail adds the totals per code
+        """
+        measures = GEOCODED_MEASURES if geocodes else ALL_MEASURES
+        tranches = set(tranches) if tranches is not None else None
+        categories = set(categories) if categories is not None else None
+        cells = self.cells[level]
+
+        totals = [0.0, 0.0, 0.0]
+        by_code = []
+        for code in (codes if codes is not None else cells):
+            years = cells.get(code)
+            if not years:
+                continue
+            code_totals = [0.0, 0.0, 0.0]
+            for year, groups in years.items():
+                if annee is not None and year != annee:
+                    continue
+                for (tranche, categorie), cell in groups.items():
+                    if tranches is not None and tranche not in tranches:
+                        continue
+                    if categories is not None and categorie not in categories:
+                        continue
+                    for i, measure in enumerate(measures):
+                        code_totals[i] += cell[measure]
+            if detail and code_totals[0]:
+                by_code.append({"code": code, **_totals(code_totals)})
+            for i in range(3):
+                totals[i] += code_totals[i]
+
+        response = _totals(totals)
+        if detail:
+            response["par_code"] = by_code
+        return response
+
+    def stats(self):
+        return {
+            "cles": len(self.rows),
+            **{level: len(self.cells[level]) for level in LEVELS},
+            "consommateurs": int(sum(values[0] for _, values in self.rows.values())),
+            "updates": self.updates,
+            "watermark": _iso(self.watermark),
+            "build_seconds": round(self.build_seconds, 3),
+            "refreshed_at": _iso(self.refreshed_at)
+        }
+
+
+def _totals(values):
+    return {
+        "nb_consommateurs": int(round(values[0])),
+        "nb_sites": int(round(values[1])),
+        "conso_totale_mwh": round(values[2], 3)
+    }
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _timestamp(value):
+    """timestamptz from asyncpg (datetime) or PostgREST (ISO string)"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime) and value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+# --- Chargement ---
+async def fetch_stats_rows(since=None):
+    """Every non-empty rollup, or every rollup updated after since (emptied ones included)"""
+    if DATABASE_URL:
+        import asyncpg
+
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            records = await (conn.fetch(DELTA_QUERY, since) if since is not None else conn.fetch(FULL_QUERY))
+            return [dict(record) for record in records]
+        finally:
+            await conn.close()
+
+    from utils.supabase_client import supabase
+
+    def fetch_pages():
+        rows, offset = [], 0
+        while True:
+            query = supabase.table("consommateurs_stats").select(SELECT_FIELDS)
+            query = query.gt("updated_at", _iso(since)) if since is not None else query.neq("nb_consommateurs", 0)
+            page = (
+                query.order("code_commune")
+                .order("annee")
+                .order("tranche_conso")
+                .order("categorie_activite")
+                .range(offset, offset + CONSUMER_STATS_PAGE_SIZE - 1)
+                .execute()
+                .data
+                or []
+            )
+            rows.extend(page)
+            if len(page) < CONSUMER_STATS_PAGE_SIZE:
+                return rows
+            offset += CONSUMER_STATS_PAGE_SIZE
+
+    return await asyncio.to_thread(fetch_pages)
+
+
+_stats = None
+_stats_lock = asyncio.Lock()
+_refresh_lock = asyncio.Lock()
+
+
+async def get_consumer_stats() -> ConsumerStats:
+    global _stats
+    if _stats is None:
+        async with _stats_lock:
+            if _stats is None:
+                loaded_at = datetime.now(timezone.utc)
+                _stats = await asyncio.to_thread(ConsumerStats, await fetch_stats_rows(), loaded_at)
+    return _stats
+
+
+async def reload_consumer_stats() -> ConsumerStats:
+    global _stats
+    async with _stats_lock:
+        loaded_at = datetime.now(timezone.utc)
+        _stats = await asyncio.to_thread(ConsumerStats, await fetch_stats_rows(), loaded_at)
+    return _stats
+
+
+async def refresh_consumer_stats():
+    """Pull the rollups updated since the watermark (no-op before the first load)"""
+    if _stats is None:
+        return None
+    async with _refresh_lock:
+        rows = await fetch_stats_rows(_stats.watermark - timedelta(seconds=CONSUMER_STATS_OVERLAP_SECONDS))
+        changed = _stats.apply(rows) if rows else 0
+        _stats.updates += changed
+        _stats.refreshed_at = datetime.now(timezone.utc)
+        return changed
+
+
+async def _safe_refresh():
+    try:
+        await refresh_consumer_stats()
+    except Exception as e:
+        print(f"Rafraîchissement des agrégats consommateurs en échec: {e}")
+
+
+async def consumer_stats_refresh_loop():
+    while True:
+        await asyncio.sleep(CONSUMER_STATS_REFRESH_SECONDS)
+        await _safe_refresh()
+
+
+_refresh_task = None
+
+
+async def start_consumer_stats_refresh():
+    global _refresh_task
+    if CONSUMER_STATS_REFRESH_SECONDS > 0 and _refresh_task is None:
+        _refresh_task = asyncio.create_task(consumer_stats_refresh_loop())
+
+
+async def stop_consumer_stats_refresh():
+    global _refresh_task
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        _refresh_task = None
@@ -0,0 +1,273 @@
+# backend/utils/enedis_ingest.py
+# Streaming import of the Enedis "consommation annuelle entreprise par adresse" dataset
+#
+# Source paginée (API data-fair) ou export CSV complet, lue ligne à ligne comme un générateur ;
+# tranche_conso / categorie_activite calculées au vol (mêmes règles que externalConsumersAPI.ts).
+# Chargement par COPY dans la table temporaire consommateurs_import puis fusion ensembliste
+# (merge_consommateurs_import), ou par lots via rpc_merge_consommateurs sans accès Postgres direct.
+
+import asyncio
+import csv
+import os
+import re
+import unicodedata
+from itertools import islice
+from urllib.parse import urljoin, urlparse
+
+import requests
+
+ENEDIS_DATASET_URL = os.getenv(
+    "ENEDIS_DATASET_URL",
+    "https://opendata.enedis.fr/data-fair/api/v1/datasets/consommation-annuelle-entreprise-par-adresse"
+)
+ENEDIS_PAGE_SIZE = int(os.getenv("ENEDIS_PAGE_SIZE", "10000"))
+# Lignes par COPY (et par appel RPC en repli PostgREST)
+ENEDIS_COPY_BATCH_SIZE = int(os.getenv("ENEDIS_COPY_BATCH_SIZE", "20000"))
+ENEDIS_RPC_BATCH_SIZE = int(os.getenv("ENEDIS_RPC_BATCH_SIZE", "2000"))
+ENEDIS_TIMEOUT_SECONDS = float(os.getenv("ENEDIS_TIMEOUT_SECONDS", "60"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+# Sources CSV acceptées : URLs https de ces hôtes (et sous-domaines), ou fichiers sous ENEDIS_IMPORT_DIR
+ENEDIS_CSV_ALLOWED_HOSTS = [h.strip().lower() for h in os.getenv(
+    "ENEDIS_CSV_ALLOWED_HOSTS", "opendata.enedis.fr"
+).split(",") if h.strip()]
+ENEDIS_IMPORT_DIR = os.getenv("ENEDIS_IMPORT_DIR", "")
+ENEDIS_MAX_REDIRECTS = 5
+
+# Colonnes de consommateurs_import, dans l'ordre du COPY
+IMPORT_COLUMNS = (
+    "adresse", "code_commune", "nom_commune", "nombre_sites", "consommation_annuelle_mwh", "tranche_conso",
+    "categorie_activite", "annee", "code_grand_secteur", "code_secteur_naf2", "code_categorie_consommation",
+    "code_departement", "code_region", "code_epci", "code_iris", "nom_iris", "numero_voie", "indice_repetition",
+    "type_voie", "libelle_voie", "tri_adresses"
+)
+# Champ du jeu de données Enedis -> colonne de consommateurs (quand le nom diffère)
+SOURCE_FIELDS = {
+    "nombre_sites": "nombre_de_sites",
+    "consommation_annuelle_mwh": "consommation_annuelle_totale_de_ladresse_mwh",
+    "numero_voie": "numero_de_voie",
+    "indice_repetition": "indice_de_repetition",
+    "type_voie": "type_de_voie",
+    "libelle_voie": "libelle_de_voie",
+    "tri_adresses": "tri_des_adresses",
+}
+TEXT_COLUMNS = tuple(c for c in IMPORT_COLUMNS if c not in (
+    "adresse", "code_commune", "nombre_sites", "consommation_annuelle_mwh", "tranche_conso", "categorie_activite", "annee"
+))
+
+TRANCHES = ((10, "[0-10]"), (50, "]10-50]"), (100, "]50-100]"), (250, "]100-250]"),
+            (500, "]250-500]"), (1000, "]500-1000]"), (2000, "]1000-2000]"))
+NAF2_ETABLISSEMENT_PUBLIC = {"84", "85", "86", "87", "88"}
+GRAND_SECTEURS = {
+    "AGRICULTURE": "Agriculture",
+    "INDUSTRIE": "Industrie",
+    "TERTIAIRE": "Tertiaire",
+    "RESIDENTIEL": "Residentiel",
+}
+
+
+def calculate_tranche_conso(conso_mwh):
+    """Same thresholds as calculateTrancheConso (frontend/src/utils/trancheConso.ts)"""
+    for upper, tranche in TRANCHES:
+        if conso_mwh <= upper:
+            return tranche
+    return ">2000"
+
+
+def categorie_activite(code_grand_secteur, code_secteur_naf2):
+    # Priorité 1 : établissements publics par code NAF2, puis code_grand_secteur (Autres/NULL -> Tertiaire)
+    if code_secteur_naf2 in NAF2_ETABLISSEMENT_PUBLIC:
+        return "Etablissement public"
+    return GRAND_SECTEURS.get(code_grand_secteur or "", "Tertiaire")
+
+
+def _number(value, cast=float):
+    if value is None or value == "":
+        return cast(0)
+    if isinstance(value, str):
+        value = value.replace(" ", "").replace(",", ".")
+    return cast(float(value))
+
+
+def _text(value):
+    if value is None or value == "":
+        return None
+    return str(value)
+
+
+def to_consommateur(item, annee=None):
+    """Enedis record (API line or CSV row) -> consommateurs_import row"""
+    conso = _number(item.get(SOURCE_FIELDS["consommation_annuelle_mwh"]))
+    code_grand_secteur = _text(item.get("code_grand_secteur"))
+    code_secteur_naf2 = _text(item.get("code_secteur_naf2"))
+    row = {
+        "adresse": (item.get("adresse") or "").strip(),
+        "code_commune": str(item.get("code_commune") or ""),
+        "nombre_sites": _number(item.get(SOURCE_FIELDS["nombre_sites"]), int),
+        "consommation_annuelle_mwh": conso,
+        "tranche_conso": calculate_tranche_conso(conso),
+        "categorie_activite": categorie_activite(code_grand_secteur, code_secteur_naf2),
+        "annee": int(item.get("annee") or annee),
+    }
+    for column in TEXT_COLUMNS:
+        row[column] = _text(item.get(SOURCE_FIELDS.get(column, column)))
+    return row
+
+
+def slugify(label):
+    """CSV header -> data-fair field key ("Consommation annuelle totale de l'adresse (MWh)" -> ..._de_ladresse_mwh)"""
+    label = unicodedata.normalize("NFKD", label).encode("ascii", "ignore").decode()
+    label = re.sub(r"['’]", "", label.lower())
+    return re.sub(r"[^a-z0-9]+", "_", label).strip("_")
+
+
+# --- Sources (générateurs) ---
+def iter_api_lines(annee, communes=None, session=None):
+    """Lines of the paginated data-fair API, following the 'next' cursor"""
+    session = session or requests.Session()
+    filters = {"annee_eq": annee}
+    for code_commune in communes or [None]:
+        params = {**filters, "size": ENEDIS_PAGE_SIZE}
+        if code_commune:
+            params["code_commune_eq"] = code_commune
+        url = f"{ENEDIS_DATASET_URL}/lines"
+        while url:
+            resp = session.get(url, params=params, timeout=ENEDIS_TIMEOUT_SECONDS)
+            resp.raise_for_status()
+            data = resp.json()
+            yield from data.get("results", [])
+            # Le lien 'next' porte déjà tous les paramètres
+            url, params = data.get("next"), None
+
+
+def resolve_csv_source(source):
+    """
+    Validated CSV source: an https URL of an allowed host, or a file under ENEDIS_IMPORT_DIR
+    (relative paths are taken from there). Raises ValueError for anything else
+    """
+    if "://" in source:
+        url = urlparse(source)
+        host = (url.hostname or "").lower()
+        if url.scheme != "https" or not any(host == h or host.endswith(f".{h}") for h in ENEDIS_CSV_ALLOWED_HOSTS):
+            raise ValueError(f"Source CSV non autorisée: {source}")
+        return source
+
+    if not ENEDIS_IMPORT_DIR:
+        raise ValueError("Import de fichiers locaux désactivé (ENEDIS_IMPORT_DIR non défini)")
+    root = os.path.realpath(ENEDIS_IMPORT_DIR)
+    path = os.path.realpath(os.path.join(root, source))
+    if os.path.commonpath([root, path]) != root or not os.path.isfile(path):
+        raise ValueError(f"Fichier CSV introuvable dans le répertoire d'import: {source}")
+    return path
+
+
+def _open_csv_url(source, session):
+    """Streamed response; each redirect target is checked against the allowlist"""
+    url = resolve_csv_source(source)
+    for _ in range(ENEDIS_MAX_REDIRECTS + 1):
+        resp = session.get(url, stream=True, timeout=ENEDIS_TIMEOUT_SECONDS, allow_redirects=False)
+        if not resp.is_redirect:
+            resp.raise_for_status()
+            return resp
+        resp.close()
+        url = resolve_csv_source(urljoin(url, resp.headers["location"]))
+    raise ValueError(f"Trop de redirections: {source}")
+
+
+def iter_csv_rows(source, session=None):
+    """Rows of a full CSV export (allowed URL or file of the import directory), streamed; headers mapped to field keys"""
+    if "://" in source:
+        resp = _open_csv_url(source, session or requests.Session())
+        resp.encoding = resp.encoding or "utf-8"
+        lines = resp.iter_lines(decode_unicode=True)
+    else:
+        lines = open(resolve_csv_source(source), encoding="utf-8-sig", newline="")
+
+    try:
+        header = next(iter(lines), "")
+        header = header.lstrip("\ufeff").rstrip("\r\n")
+        delimiter = ";" if header.count(";") > header.count(",") else ","
+        fields = [slugify(name) for name in next(csv.reader([header], delimiter=delimiter))]
+        for row in csv.DictReader(lines, fieldnames=fields, delimiter=delimiter):
+            yield row
+    finally:
+        if hasattr(lines, "close"):
+            lines.close()
+
+
+def iter_consommateurs(annee, communes=None, csv_source=None):
+    """consommateurs_import rows for one year, from the CSV export if given, else the API"""
+    if csv_source:
+        communes = set(communes or [])
+        for item in iter_csv_rows(csv_source):
+            if str(item.get("annee")) != str(annee):
+                continue
+            if communes and item.get("code_commune") not in communes:
+                continue
+            yield to_consommateur(item, annee)
+    else:
+        for item in iter_api_lines(annee, communes):
+            yield to_consommateur(item, annee)
+
+
+def batched(iterator, size):
+    iterator = iter(iterator)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+# --- Chargement ---
+async def _next_batch(batches):
+    # Lecture réseau / fichier bloquante : hors de la boucle d'événements
+    return await asyncio.to_thread(next, batches, None)
+
+
+async def merge_with_copy(rows, stats):
+    """COPY batches into consommateurs_import, then one set-based merge, in a single transaction"""
+    import asyncpg
+
+    conn = await asyncpg.connect(DATABASE_URL)
+    try:
+        async with conn.transaction():
+            await conn.execute("SELECT prepare_consommateurs_import()")
+            batches = batched(rows, ENEDIS_COPY_BATCH_SIZE)
+            while (batch := await _next_batch(batches)) is not None:
+                await conn.copy_records_to_table(
+                    "consommateurs_import",
+                    records=[tuple(row[c] for c in IMPORT_COLUMNS) for row in batch],
+                    columns=IMPORT_COLUMNS
+                )
+                stats["read"] += len(batch)
+            records = await conn.fetch("SELECT id, adresse, code_commune, action FROM merge_consommateurs_import()")
+        return [dict(record) for record in records]
+    finally:
+        await conn.close()
+
+
+async def merge_with_rpc(rows, stats):
+    """Fallback without DATABASE_URL: rpc_merge_consommateurs per batch (dedup within a batch and with the table)"""
+    from utils.supabase_client import supabase
+
+    merged = []
+    batches = batched(rows, ENEDIS_RPC_BATCH_SIZE)
+    while (batch := await _next_batch(batches)) is not None:
+        result = await asyncio.to_thread(
+            lambda: supabase.rpc("rpc_merge_consommateurs", {"p_rows": batch}).execute()
+        )
+        merged.extend(result.data or [])
+        stats["read"] += len(batch)
+    return merged
+
+
+async def ingest_consommateurs(annee, communes=None, csv_source=None, stats=None):
+    """
+    Stream the dataset into consommateurs; stats (read/inserted/updated) is updated as batches load.
+    Returns (stats, inserted rows [{"id", "adresse", "code_commune"}]) ; inserted rows still need geocoding
+    """
+    stats = stats if stats is not None else {}
+    stats.update({"read": 0, "inserted": 0, "updated": 0})
+    rows = iter_consommateurs(annee, communes, csv_source)
+    merged = await (merge_with_copy(rows, stats) if DATABASE_URL else merge_with_rpc(rows, stats))
+    inserted = [row for row in merged if row["action"] == "insert"]
+    stats["inserted"] = len(inserted)
+    stats["updated"] = len(merged) - len(inserted)
+    return stats, inserted
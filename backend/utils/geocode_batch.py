@@ -0,0 +1,64 @@
+# backend/utils/geocode_batch.py
+# Geocode a batch of consommateurs and store the outcome (used by the route, the Enedis import and the scheduler)
+
+import asyncio
+import os
+
+from utils.consommateur_repository import get_consommateur_repository
+from utils.consumer_index import schedule_consumer_index_refresh
+from utils.geocode_utils import geocode_adresse_variants
+from utils.station_matcher import STATION_MATCHING_ENABLED, get_station_index
+
+# Attente avant un nouvel essai après un échec : base * 2^essais, plafonnée
+GEOCODE_RETRY_BASE_SECONDS = int(os.getenv("GEOCODE_RETRY_BASE_SECONDS", "3600"))
+GEOCODE_RETRY_MAX_SECONDS = int(os.getenv("GEOCODE_RETRY_MAX_SECONDS", "604800"))
+
+
+async def geocode_items(items: list[dict]):
+    """
+    items: [{"id", "adresse", "code_commune", "nom_commune"?}]
+    Treatment stations known in stations_traitement take the station's coordinates; the other
+    items run concurrently, each one trying its address variants in order (utils/address_variants.py).
+    Successes are stored, failures recorded with their retry backoff
+    """
+    repository = await get_consommateur_repository()
+    stations = {}
+    if STATION_MATCHING_ENABLED:
+        stations = (await get_station_index()).match_batch(items)
+
+    async def geocode(item):
+        match = stations.get(item["id"])
+        if match:
+            station = match["station"]
+            return station["latitude"], station["longitude"], "OK", match["score"], f"station: {station['nom']}"
+        return await geocode_adresse_variants(item["adresse"], item["code_commune"], item.get("nom_commune"))
+
+    geocoded = await asyncio.gather(*(geocode(item) for item in items))
+    results = []
+    updates = []
+    failures = []
+    for item, (lat, lon, status, score, variant) in zip(items, geocoded):
+        if status == "OK":
+            updates.append({
+                "id": item["id"],
+                "latitude": lat,
+                "longitude": lon,
+                "geocode_status": status,
+                "geocode_score": score
+            })
+        else:
+            failures.append({"id": item["id"], "geocode_status": status})
+        results.append({
+            "id": item["id"],
+            "status": status,
+            "latitude": lat,
+            "longitude": lon,
+            "score": score,
+            "variante": variant
+        })
+    await repository.update_geocodes(updates)
+    await repository.mark_geocode_failures(failures, GEOCODE_RETRY_BASE_SECONDS, GEOCODE_RETRY_MAX_SECONDS)
+    if updates:
+        # Les nouveaux géocodages rejoignent l'index consommateurs sans attendre le prochain cycle
+        schedule_consumer_index_refresh()
+    return results
@@ -0,0 +1,119 @@
+# backend/utils/geocode_scheduler.py
+# Incremental re-geocode pass over new, address-modified and due failed rows, within a rate budget
+#
+# La sélection (rpc_consommateurs_a_geocoder) s'appuie sur address_updated_at / geocoded_at et sur
+# l'attente exponentielle des échecs : aucun passage ne relit toute la table.
+
+import asyncio
+import os
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+
+from utils.consommateur_repository import get_consommateur_repository
+from utils.geocode_batch import geocode_items
+
+# Intervalle entre deux passages (0 = uniquement sur demande)
+GEOCODE_SCHEDULER_INTERVAL_SECONDS = int(os.getenv("GEOCODE_SCHEDULER_INTERVAL_SECONDS", "600"))
+# Lignes lues par passage et par lot envoyé au géocodeur
+GEOCODE_SCHEDULER_MAX_ROWS = int(os.getenv("GEOCODE_SCHEDULER_MAX_ROWS", "2000"))
+GEOCODE_SCHEDULER_BATCH_SIZE = int(os.getenv("GEOCODE_SCHEDULER_BATCH_SIZE", "50"))
+# Budget de débit : adresses par seconde (chaque adresse peut coûter plusieurs requêtes BAN)
+GEOCODE_SCHEDULER_ROWS_PER_SECOND = float(os.getenv("GEOCODE_SCHEDULER_ROWS_PER_SECOND", "4"))
+GEOCODE_MAX_ATTEMPTS = int(os.getenv("GEOCODE_MAX_ATTEMPTS", "5"))
+GEOCODE_SCHEDULER_HISTORY = int(os.getenv("GEOCODE_SCHEDULER_HISTORY", "20"))
+
+# Derniers passages de ce processus (l'historique complet est dans geocode_runs)
+recent_runs = deque(maxlen=GEOCODE_SCHEDULER_HISTORY)
+_run_lock = asyncio.Lock()
+_task = None
+
+
+async def run_geocode_scheduler(declencheur="planifie", max_rows=GEOCODE_SCHEDULER_MAX_ROWS):
+    """One pass over the backlog; returns the run record (also stored in geocode_runs)"""
+    if _run_lock.locked():
+        return None
+    async with _run_lock:
+        repository = await get_consommateur_repository()
+        started_at = datetime.now(timezone.utc)
+        started = time.monotonic()
+        run = {"declencheur": declencheur, "started_at": started_at.isoformat(), "selectionnes": 0,
+               "par_motif": {}, "geocodes": 0, "a_valider": 0, "erreurs": 0}
+        try:
+            rows = await repository.fetch_geocode_backlog(max_rows, GEOCODE_MAX_ATTEMPTS)
+            run["selectionnes"] = len(rows)
+            run["par_motif"] = dict(Counter(row["motif"] for row in rows))
+
+            for offset in range(0, len(rows), GEOCODE_SCHEDULER_BATCH_SIZE):
+                batch = rows[offset:offset + GEOCODE_SCHEDULER_BATCH_SIZE]
+                results = await geocode_items([
+                    {
+                        "id": row["id"],
+                        "adresse": row["adresse"] or "",
+                        "code_commune": row["code_commune"],
+                        "nom_commune": row["nom_commune"]
+                    }
+                    for row in batch
+                ])
+                statuses = Counter(result["status"] for result in results)
+                run["geocodes"] += statuses["OK"]
+                run["a_valider"] += statuses["TO_VALIDATE"]
+                run["erreurs"] += statuses["ERROR"]
+
+                # Respect du budget : pas plus de GEOCODE_SCHEDULER_ROWS_PER_SECOND en moyenne
+                if GEOCODE_SCHEDULER_ROWS_PER_SECOND > 0:
+                    ahead = (offset + len(batch)) / GEOCODE_SCHEDULER_ROWS_PER_SECOND - (time.monotonic() - started)
+                    if ahead > 0:
+                        await asyncio.sleep(ahead)
+        except Exception as e:
+            run["erreur"] = str(e)
+
+        elapsed = time.monotonic() - started
+        processed = run["geocodes"] + run["a_valider"] + run["erreurs"]
+        run.update({
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "duree_secondes": round(elapsed, 2),
+            "lignes_par_seconde": round(processed / elapsed, 2) if elapsed > 0 else None,
+            "taux_succes": round(run["geocodes"] / processed, 4) if processed else None
+        })
+        recent_runs.appendleft(run)
+        if run["selectionnes"] or run.get("erreur"):
+            try:
+                await repository.record_geocode_run(run)
+            except Exception as e:
+                print(f"Enregistrement du passage de géocodage en échec: {e}")
+        return run
+
+
+async def geocode_scheduler_loop():
+    while True:
+        await asyncio.sleep(GEOCODE_SCHEDULER_INTERVAL_SECONDS)
+        try:
+            await run_geocode_scheduler()
+        except Exception as e:
+            print(f"Planificateur de géocodage en échec: {e}")
+
+
+async def start_geocode_scheduler():
+    global _task
+    if GEOCODE_SCHEDULER_INTERVAL_SECONDS > 0 and _task is None:
+        _task = asyncio.create_task(geocode_scheduler_loop())
+
+
+async def stop_geocode_scheduler():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+def scheduler_status():
+    return {
+        "interval_seconds": GEOCODE_SCHEDULER_INTERVAL_SECONDS,
+        "max_rows": GEOCODE_SCHEDULER_MAX_ROWS,
+        "batch_size": GEOCODE_SCHEDULER_BATCH_SIZE,
+        "rows_per_second": GEOCODE_SCHEDULER_ROWS_PER_SECOND,
+        "max_attempts": GEOCODE_MAX_ATTEMPTS,
+        "running": _run_lock.locked(),
+        "recent_runs": list(recent_runs)
+    }
@@ -1,18 +1,133 @@
 # backend/utils/geocode_utils.py
 # Geocoding utility functions
 
-import requests
+import asyncio
+import os
+import time
 
-def geocode_adresse(adresse, code_commune):
-    url = "https://api-adresse.data.gouv.fr/search/"
-    params = {"q": adresse, "citycode": code_commune, "limit": 1}
-    resp = requests.get(url, params=params)
+from utils.address_variants import build_strategies
+
+# Surchargeable pour les tests de charge (loadtest/fake_ban.py)
+BAN_API_URL = os.getenv("BAN_API_URL", "https://api-adresse.data.gouv.fr")
+
+
+# --- Géocodage multi-variantes ---
+# Les variantes d'une adresse sont essayées dans l'ordre de préférence : la première avec un score
+# >= GEOCODE_ACCEPT_SCORE l'emporte et arrête la recherche. Sinon le meilleur score >= GEOCODE_CONFIDENCE_THRESHOLD.
+# Le parallélisme vient des adresses d'un lot (geocode_items), toutes soumises au même limiteur de débit.
+GEOCODE_CONFIDENCE_THRESHOLD = float(os.getenv("GEOCODE_CONFIDENCE_THRESHOLD", "0.5"))
+GEOCODE_ACCEPT_SCORE = float(os.getenv("GEOCODE_ACCEPT_SCORE", "0.8"))
+GEOCODE_MAX_VARIANTS = int(os.getenv("GEOCODE_MAX_VARIANTS", "12"))
+# Requêtes BAN simultanées pour tout le processus
+GEOCODE_MAX_CONCURRENCY = int(os.getenv("GEOCODE_MAX_CONCURRENCY", "20"))
+# Débit BAN pour tout le processus (limite BAN : 50 req/s par IP ; 0 = pas de limite)
+GEOCODE_RATE_LIMIT_PER_SECOND = float(os.getenv("GEOCODE_RATE_LIMIT_PER_SECOND", "40"))
+GEOCODE_RATE_LIMIT_BURST = int(os.getenv("GEOCODE_RATE_LIMIT_BURST", "10"))
+GEOCODE_TIMEOUT_SECONDS = float(os.getenv("GEOCODE_TIMEOUT_SECONDS", "10"))
+
+
+class TokenBucket:
+    """Shared rate limiter: `rate` requests per second on average, at most `burst` at once"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # Attente sous le verrou : les requêtes partent dans l'ordre d'arrivée
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_client = None
+_slots = None
+_rate_limiter = None
+
+
+def _ban_client():
+    global _client, _slots, _rate_limiter
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(
+            base_url=BAN_API_URL,
+            timeout=GEOCODE_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_connections=GEOCODE_MAX_CONCURRENCY)
+        )
+        _slots = asyncio.Semaphore(GEOCODE_MAX_CONCURRENCY)
+        _rate_limiter = TokenBucket(GEOCODE_RATE_LIMIT_PER_SECOND, GEOCODE_RATE_LIMIT_BURST)
+    return _client, _slots, _rate_limiter
+
+
+async def close_geocode_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def _search(strategy):
+    """(first BAN feature or None, error)"""
+    client, slots, rate_limiter = _ban_client()
+    for attempt in range(2):
+        await rate_limiter.acquire()
+        async with slots:
+            try:
+                resp = await client.get("/search/", params={**strategy, "limit": 1})
+            except Exception as e:
+                return None, str(e)
+        if resp.status_code != 429 or attempt:
+            break
+        # Limite de débit BAN dépassée malgré le limiteur : une seule nouvelle tentative, après le délai indiqué
+        await asyncio.sleep(float(resp.headers.get("Retry-After", "1")))
     if resp.status_code != 200:
-        return None, None, "ERROR", 0
-    data = resp.json()
-    if data["features"]:
-        coords = data["features"][0]["geometry"]["coordinates"]  # [lon, lat]
-        score = data["features"][0]["properties"].get("score", 0)
-        return coords[1], coords[0], "OK", score
-    else:
-        return None, None, "TO_VALIDATE", 0
+        return None, f"HTTP {resp.status_code}"
+    try:
+        features = resp.json().get("features") or []
+    except ValueError:
+        return None, "Réponse BAN illisible"
+    return features[0] if features else None, None
+
+
+async def geocode_adresse_variants(adresse, code_commune, nom_commune=None):
+    """
+    (lat, lon, status, score, winning BAN query): the first variant scoring >= GEOCODE_ACCEPT_SCORE,
+    else the best score (ties to the earlier variant). No address: TO_VALIDATE without querying
+    the BAN (a commune alone is not a location)
+    """
+    if not (adresse or "").strip():
+        return None, None, "TO_VALIDATE", 0, None
+    strategies = build_strategies(adresse, code_commune, nom_commune)[:GEOCODE_MAX_VARIANTS]
+    if not strategies:
+        return None, None, "TO_VALIDATE", 0, None
+
+    best = None
+    errors = 0
+    for strategy in strategies:
+        feature, error = await _search(strategy)
+        errors += bool(error)
+        if feature is None:
+            continue
+        score = feature["properties"].get("score", 0)
+        if score >= GEOCODE_CONFIDENCE_THRESHOLD and (best is None or score > best[0]):
+            best = (score, strategy, feature)
+        if score >= GEOCODE_ACCEPT_SCORE:
+            break
+
+    if best is None:
+        return None, None, "ERROR" if errors == len(strategies) else "TO_VALIDATE", 0, None
+    score, strategy, feature = best
+    lon, lat = feature["geometry"]["coordinates"]
+    return lat, lon, "OK", score, strategy["q"]
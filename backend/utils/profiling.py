@@ -0,0 +1,29 @@
+# backend/utils/profiling.py
+# On-demand sampling profiler, shared with the extraction service
+#
+# Un seul exemplaire du profileur : python-extraction-service/profiling.py (construit à plat dans
+# l'image du service), chargé ici par son chemin. Mêmes réglages PROFILING_*, mêmes routes /debug.
+
+import importlib.util
+import os
+import sys
+
+PROFILING_SOURCE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "python-extraction-service", "profiling.py"
+)
+
+
+def _load_shared_profiler():
+    spec = importlib.util.spec_from_file_location("shared_profiling", PROFILING_SOURCE)
+    module = importlib.util.module_from_spec(spec)
+    # Enregistré avant exécution : un seul module (registre de profils, ContextVar) par processus
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+_profiling = sys.modules.get("shared_profiling") or _load_shared_profiler()
+
+ProfilingMiddleware = _profiling.ProfilingMiddleware
+create_profiling_router = _profiling.create_profiling_router
+install_profiling_hooks = _profiling.install_profiling_hooks
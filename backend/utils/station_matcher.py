@@ -0,0 +1,207 @@
+# backend/utils/station_matcher.py
+# Treatment-station addresses matched against stations_traitement, in memory and by batch
+#
+# Stations chargées une fois, index inversé trigramme -> stations par code_commune ; score de Dice
+# sur les trigrammes des mots significatifs (les mots génériques « station », « epuration »... sont
+# ignorés), seulement pour les stations partageant avec l'adresse un mot significatif autre que le nom
+# de la commune (ou dont tous les mots significatifs figurent dans l'adresse).
+# Une adresse reconnue sans ambiguïté reprend les coordonnées connues de la station, sans appel BAN ;
+# sinon (aucun mot significatif, ex aequo) elle part au géocodage BAN.
+
+import asyncio
+import os
+import re
+import time
+import unicodedata
+from collections import Counter, defaultdict
+
+STATION_MATCHING_ENABLED = os.getenv("STATION_MATCHING_ENABLED", "true").lower() == "true"
+# Score minimal pour retenir une station
+STATION_MATCH_THRESHOLD = float(os.getenv("STATION_MATCH_THRESHOLD", "0.5"))
+# Écart minimal avec la deuxième station : en deçà, ex aequo (aucune station retenue)
+STATION_MATCH_MARGIN = float(os.getenv("STATION_MATCH_MARGIN", "0.1"))
+STATION_INDEX_PAGE_SIZE = int(os.getenv("STATION_INDEX_PAGE_SIZE", "1000"))
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Mêmes mots-clés que detectTreatmentStation (treatmentStations.ts)
+STATION_KEYWORDS = (
+    "station", "step", "steu", "epuration", "épuration", "assainissement", "pompage", "traitement",
+    "eaux usees", "eaux usées", "relevage", "lagunage", "assainisseur",
+)
+# Mots présents dans presque tous les noms : ne discriminent pas deux stations
+GENERIC_TOKENS = {
+    "station", "stations", "step", "steu", "epuration", "assainissement", "assainisseur", "pompage",
+    "traitement", "eaux", "eau", "usees", "relevage", "lagunage", "de", "des", "du", "d", "la", "le",
+    "les", "l", "et", "en", "sur", "a", "au", "aux",
+}
+
+STATION_FIELDS = ("id", "code_station", "nom", "nom_normalise", "commune", "code_commune", "type_station",
+                  "latitude", "longitude")
+STATIONS_QUERY = f"SELECT {', '.join(STATION_FIELDS)} FROM stations_traitement"
+
+
+def detect_treatment_station(address):
+    lowered = (address or "").lower()
+    return any(keyword in lowered for keyword in STATION_KEYWORDS)
+
+
+def normalize_name(name):
+    """Same as normalizeName (treatmentStations.ts): lower case, no accents, punctuation -> spaces"""
+    name = unicodedata.normalize("NFD", (name or "").lower())
+    name = "".join(c for c in name if not unicodedata.combining(c))
+    name = re.sub(r"[^\w\s]", " ", name)
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def significant_tokens(normalized):
+    """Words that tell two stations apart; empty for a purely generic name (« STATION D'EPURATION »)"""
+    return [t for t in normalized.split() if t not in GENERIC_TOKENS]
+
+
+def trigrams(tokens):
+    grams = set()
+    for token in tokens:
+        padded = f"  {token} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class StationIndex:
+    def __init__(self, rows):
+        started = time.perf_counter()
+        self.stations = []
+        self.trigram_counts = []
+        self.tokens = []
+        # code_commune -> trigramme -> positions des stations
+        self.postings = defaultdict(lambda: defaultdict(list))
+        self.by_commune = defaultdict(list)
+        # code_commune -> mots du nom de la commune : ne distinguent pas deux stations de la commune
+        self.commune_tokens = defaultdict(set)
+        for row in rows:
+            position = len(self.stations)
+            tokens = significant_tokens(row.get("nom_normalise") or normalize_name(row["nom"]))
+            grams = trigrams(tokens)
+            self.stations.append({field: row.get(field) for field in STATION_FIELDS})
+            self.tokens.append(set(tokens))
+            self.trigram_counts.append(len(grams))
+            commune = self.postings[row["code_commune"]]
+            for gram in grams:
+                commune[gram].append(position)
+            self.by_commune[row["code_commune"]].append(position)
+            self.commune_tokens[row["code_commune"]].update(significant_tokens(normalize_name(row.get("commune"))))
+        self.build_seconds = time.perf_counter() - started
+
+    def match(self, address, code_commune):
+        """
+        (station, score) of the best station of the commune, or (None, best score) when the
+        address names no treatment station, has no significant word, or two stations tie
+        """
+        postings = self.postings.get(code_commune)
+        if not postings or not detect_treatment_station(address):
+            return None, 0.0
+        tokens = significant_tokens(normalize_name(address))
+        if not tokens:
+            return None, 0.0
+        grams = trigrams(tokens)
+        address_tokens = set(tokens)
+        distinctive = address_tokens - self.commune_tokens[code_commune]
+
+        # Trigrammes partagés par candidat, en un passage sur les listes de la commune
+        shared = Counter()
+        for gram in grams:
+            shared.update(postings.get(gram, ()))
+
+        best, best_score, runner_up = None, 0.0, 0.0
+        for position in shared:
+            station_tokens = self.tokens[position]
+            # Tous les mots significatifs du nom dans l'adresse : équivalent du ilike du frontend
+            if station_tokens and station_tokens <= address_tokens:
+                score = 1.0
+            elif not station_tokens & distinctive:
+                continue
+            else:
+                score = 2 * shared[position] / (len(grams) + self.trigram_counts[position])
+            if score > best_score:
+                best, best_score, runner_up = position, score, best_score
+            elif score > runner_up:
+                runner_up = score
+        # Ex aequo : aucune station n'est retenue, l'adresse part au géocodage BAN
+        if best is None or best_score < STATION_MATCH_THRESHOLD or best_score - runner_up < STATION_MATCH_MARGIN:
+            return None, best_score
+        return self.stations[best], best_score
+
+    def match_batch(self, items):
+        """
+        items: [{"id", "adresse", "code_commune"}] -> {id: {"station", "score"}} for the items
+        detected as treatment stations and matched
+        """
+        matches = {}
+        for item in items:
+            if not item.get("code_commune"):
+                continue
+            station, score = self.match(item["adresse"], item["code_commune"])
+            if station is not None:
+                matches[item["id"]] = {"station": station, "score": round(score, 4)}
+        return matches
+
+    def stats(self):
+        return {
+            "stations": len(self.stations),
+            "communes": len(self.by_commune),
+            "trigrams": sum(len(postings) for postings in self.postings.values()),
+            "threshold": STATION_MATCH_THRESHOLD,
+            "margin": STATION_MATCH_MARGIN,
+            "build_seconds": round(self.build_seconds, 3)
+        }
+
+
+async def fetch_station_rows():
+    if DATABASE_URL:
+        import asyncpg
+
+        conn = await asyncpg.connect(DATABASE_URL)
+        try:
+            return [dict(record) for record in await conn.fetch(STATIONS_QUERY)]
+        finally:
+            await conn.close()
+
+    from utils.supabase_client import supabase
+
+    def fetch_pages():
+        rows, offset = [], 0
+        while True:
+            page = (
+                supabase.table("stations_traitement")
+                .select(",".join(STATION_FIELDS))
+                .order("id")
+                .range(offset, offset + STATION_INDEX_PAGE_SIZE - 1)
+                .execute()
+                .data
+                or []
+            )
+            rows.extend(page)
+            if len(page) < STATION_INDEX_PAGE_SIZE:
+                return rows
+            offset += STATION_INDEX_PAGE_SIZE
+
+    return await asyncio.to_thread(fetch_pages)
+
+
+_index = None
+_index_lock = asyncio.Lock()
+
+
+async def get_station_index() -> StationIndex:
+    global _index
+    if _index is None:
+        async with _index_lock:
+            if _index is None:
+                _index = StationIndex(await fetch_station_rows())
+    return _index
+
+
+async def reload_station_index() -> StationIndex:
+    global _index
+    async with _index_lock:
+        _index = StationIndex(await fetch_station_rows())
+    return _index
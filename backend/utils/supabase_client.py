@@ -2,6 +2,8 @@
 # Supabase client configuration and utility functions
 
 import os
+from datetime import datetime, timezone
+
 from supabase import create_client, Client
 
 SUPABASE_URL = os.getenv("SUPABASE_URL")
@@ -21,14 +23,19 @@ supabase: Client = create_client(
     supabase_key=SUPABASE_KEY
 )
 
-def update_consommateur_geocode(consommateur_id: int, lat: float, lon: float):
+def update_consommateur_geocode(consommateur_id: int, lat: float, lon: float, status: str = "OK", score: float = None):
     return (
         supabase
         .table("consommateurs")
         .update({
             "latitude": lat,
             "longitude": lon,
-            "geocode_status": "OK"
+            "geocode_status": status,
+            "geocode_score": score,
+            # Valeur remplacée par l'horloge de la base (trigger), fixée pour marquer le géocodage
+            "geocoded_at": datetime.now(timezone.utc).isoformat(),
+            "geocode_attempts": 0,
+            "geocode_next_attempt_at": None
         })
         .eq("id", consommateur_id)
         .execute()
@@ -24,7 +24,7 @@ Deno.serve(async (req: Request) => {
     const supabase = createClient(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY);
 
     // Parse request body
-    const { factureId, supplierHint } = await req.json();
+    const { factureId, supplierHint, priority } = await req.json();
 
     if (!factureId) {
       throw new Error('factureId is required');
@@ -60,9 +60,29 @@ Deno.serve(async (req: Request) => {
         facture_id: factureId,
         file_url: signedUrlData.signedUrl,
         supplier_hint: supplierHint || facture.fournisseur,
+        priority: priority === 'bulk' ? 'bulk' : 'interactive',
       }),
     });
 
+    // Service saturé : transmettre le refus et son Retry-After pour que l'appelant réessaie plus tard
+    if (extractionResponse.status === 429 || extractionResponse.status === 503) {
+      const retryAfter = extractionResponse.headers.get('Retry-After');
+      return new Response(
+        JSON.stringify({
+          success: false,
+          error: await extractionResponse.text(),
+        }),
+        {
+          status: extractionResponse.status,
+          headers: {
+            ...corsHeaders,
+            'Content-Type': 'application/json',
+            ...(retryAfter ? { 'Retry-After': retryAfter } : {}),
+          },
+        },
+      );
+    }
+
     if (!extractionResponse.ok) {
       const errorText = await extractionResponse.text();
       throw new Error(`Extraction service error: ${errorText}`);
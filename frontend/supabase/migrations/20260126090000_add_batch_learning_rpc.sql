@@ -0,0 +1,62 @@
+/*
+  # Batch learning from corrections
+
+  1. Changes to `patterns_fournisseurs`
+    - Add `field_name`, `sample_count`, `last_updated` and `exemple_champs` columns,
+      already read and written by the extraction service (`/learn`, few-shot context)
+    - Add index on (nom_fournisseur, field_name)
+
+  2. New Functions
+    - `increment_pattern_sample_counts(p_increments jsonb)` - Set-based atomic increment
+      of `sample_count` for many (nom_fournisseur, field_name) pairs in one statement
+      Input: [{"nom_fournisseur": "EDF", "field_name": "conso_totale", "count": 3}, ...]
+      Returns the number of updated patterns
+
+  3. Notes
+    - The increment is done in SQL (sample_count = sample_count + n), so concurrent
+      /learn calls no longer lose updates (previous select + update from the client)
+    - Only existing patterns are updated, as before
+
+  4. Security
+    - increment_pattern_sample_counts (SECURITY DEFINER) executable by service_role only:
+      the extraction service calls it with the service key, API callers cannot inflate sample_count
+*/
+
+ALTER TABLE patterns_fournisseurs
+  ADD COLUMN IF NOT EXISTS field_name text,
+  ADD COLUMN IF NOT EXISTS sample_count int DEFAULT 0,
+  ADD COLUMN IF NOT EXISTS last_updated timestamptz,
+  ADD COLUMN IF NOT EXISTS exemple_champs jsonb;
+
+CREATE INDEX IF NOT EXISTS idx_patterns_fournisseurs_nom_field
+  ON patterns_fournisseurs(nom_fournisseur, field_name);
+
+CREATE OR REPLACE FUNCTION increment_pattern_sample_counts(p_increments jsonb)
+RETURNS integer
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+  v_updated integer;
+BEGIN
+  WITH increments AS (
+    SELECT nom_fournisseur, field_name, sum(count)::int AS count
+    FROM jsonb_to_recordset(p_increments) AS x(nom_fournisseur text, field_name text, count int)
+    GROUP BY nom_fournisseur, field_name
+  )
+  UPDATE patterns_fournisseurs p
+  SET
+    sample_count = COALESCE(p.sample_count, 0) + i.count,
+    last_updated = now()
+  FROM increments i
+  WHERE p.nom_fournisseur = i.nom_fournisseur
+    AND p.field_name = i.field_name;
+
+  GET DIAGNOSTICS v_updated = ROW_COUNT;
+  RETURN v_updated;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION increment_pattern_sample_counts(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION increment_pattern_sample_counts(jsonb) TO service_role;
@@ -0,0 +1,60 @@
+/*
+  # Incremental pattern learning state
+
+  1. New Tables
+    - `pattern_learning_state` - Watermark of the last processed `historique_corrections` row
+      per aggregator, plus the ids processed inside the overlap window (`recent_ids`, id -> created_at):
+      corrections committed late with an earlier created_at are re-read and deduplicated by id
+    - `pattern_candidates` - Candidate regexes per (nom_fournisseur, field_name), with running
+      support (corrections sharing the value template) and trials/hits against OCR text
+
+  2. Changes
+    - Index on historique_corrections(created_at, id) for the watermark scan
+
+  3. Security
+    - RLS enabled, read access for authenticated users
+    - Writes are done by the extraction service (service role)
+*/
+
+CREATE TABLE IF NOT EXISTS pattern_learning_state (
+  name text PRIMARY KEY,
+  watermark_created_at timestamptz,
+  watermark_id uuid,
+  corrections_processed bigint DEFAULT 0,
+  recent_ids jsonb NOT NULL DEFAULT '{}'::jsonb,
+  updated_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS pattern_candidates (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  nom_fournisseur text NOT NULL,
+  field_name text NOT NULL,
+  regex text NOT NULL,
+  template text NOT NULL,
+  support int DEFAULT 0,
+  trials int DEFAULT 0,
+  hits int DEFAULT 0,
+  exemple text,
+  created_at timestamptz DEFAULT now(),
+  updated_at timestamptz DEFAULT now(),
+  UNIQUE (nom_fournisseur, field_name, regex)
+);
+
+CREATE INDEX IF NOT EXISTS idx_pattern_candidates_fournisseur_field
+  ON pattern_candidates(nom_fournisseur, field_name);
+
+CREATE INDEX IF NOT EXISTS idx_historique_corrections_created
+  ON historique_corrections(created_at, id);
+
+ALTER TABLE pattern_learning_state ENABLE ROW LEVEL SECURITY;
+ALTER TABLE pattern_candidates ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Authenticated users can view pattern learning state"
+  ON pattern_learning_state FOR SELECT
+  TO authenticated
+  USING (true);
+
+CREATE POLICY "Authenticated users can view pattern candidates"
+  ON pattern_candidates FOR SELECT
+  TO authenticated
+  USING (true);
@@ -0,0 +1,92 @@
+/*
+  # Default coherence rules for the extraction rule engine
+
+  1. Data
+    - Seed `regles_coherence_metier` with the checks evaluated by the extraction service
+      after each extraction (rules are compiled once, see coherence_rules.py)
+    - Formula format per rule type:
+      - calcul / logique: {"check": "<expression>", "tolerance": <relative>}, `≈` for approximate equality
+      - plage: {"champ" | "expression", "min", "max"} or {"expression", "referentiel": "prix_kwh",
+        "type_tarif" | "type_tarif_champ", "tolerance"} (range from `referentiel_tarifs_energie`)
+      - obligatoire_si: {"champ", "si": "<condition>"}
+      - format: {"champ", "regex"}
+      - optional "champs" (blamed fields) and "flag" (factures.coherence_* column)
+
+  2. Indexes
+    - Unique index on nom_regle so the seed is idempotent
+
+  3. Notes
+    - Only `erreur` severities send an invoice to human validation when the
+      extraction confidence is above COHERENCE_AUTO_APPROVE_CONFIDENCE
+    - The extraction service reloads rules on POST /coherence/reload
+*/
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_regles_coherence_nom ON regles_coherence_metier(nom_regle);
+
+INSERT INTO regles_coherence_metier (nom_regle, description, type, formule, severite, ordre_execution)
+VALUES
+  (
+    'pdl_format',
+    'Le PDL doit comporter 14 chiffres',
+    'format',
+    '{"champ": "pdl", "regex": "^\\d{14}$"}',
+    'erreur',
+    10
+  ),
+  (
+    'periode_ordonnee',
+    'La date de début de période doit précéder la date de fin',
+    'logique',
+    '{"check": "periode_debut <= periode_fin", "flag": "coherence_periode"}',
+    'erreur',
+    20
+  ),
+  (
+    'ttc_egal_ht_plus_tva',
+    'Le total TTC doit être égal au total HT plus la TVA (2 %)',
+    'calcul',
+    '{"check": "prix_total_ttc ≈ prix_total_ht + montant_TVA", "tolerance": 0.02}',
+    'erreur',
+    30
+  ),
+  (
+    'ht_inferieur_ttc',
+    'Le total HT ne peut pas dépasser le total TTC',
+    'logique',
+    '{"check": "prix_total_ht <= prix_total_ttc"}',
+    'erreur',
+    40
+  ),
+  (
+    'conso_totale_hp_hc',
+    'La consommation totale doit être la somme HP + HC (1 %)',
+    'calcul',
+    '{"check": "conso.conso_totale ≈ conso.conso_hp + conso.conso_hc", "tolerance": 0.01}',
+    'avertissement',
+    50
+  ),
+  (
+    'puissance_souscrite_plage',
+    'Puissance souscrite entre 3 et 250 kVA',
+    'plage',
+    '{"champ": "puissance_souscrite_kva", "min": 3, "max": 250, "flag": "coherence_puissance"}',
+    'avertissement',
+    60
+  ),
+  (
+    'conso_hc_si_hphc',
+    'Consommation heures creuses attendue pour une option HP/HC',
+    'obligatoire_si',
+    '{"champ": "conso.conso_hc", "si": "classe_temporelle_tarifaire in [''DT'', ''HP/HC'', ''HPHC'']"}',
+    'avertissement',
+    70
+  ),
+  (
+    'prix_unitaire_referentiel',
+    'Prix moyen de fourniture dans la plage du référentiel tarifaire (20 %)',
+    'plage',
+    '{"expression": "montant_fourniture_ht / conso.conso_totale", "referentiel": "prix_kwh", "type_tarif": "bleu", "tolerance": 0.2, "champs": ["montant_fourniture_ht", "conso.conso_totale"], "flag": "coherence_prix_unitaire"}',
+    'avertissement',
+    80
+  )
+ON CONFLICT (nom_regle) DO NOTHING;
@@ -0,0 +1,42 @@
+/*
+  # Content-addressed storage of OCR output
+
+  1. New Tables
+    - `ocr_blobs` - OCR text and boxes of one document, compressed (`codec`: zstd or zlib),
+      keyed by the SHA-256 of the text and encoded boxes; re-extractions of the same document share one row
+      - `text_data` - compressed UTF-8 text
+      - `boxes_data` - compressed binary encoding of the OCR boxes (coordinates, confidence, text)
+      - `raw_size` / `stored_size` - bytes before and after compression
+
+  2. Changes
+    - `extractions_brutes.ocr_blob_hash` references `ocr_blobs`
+    - `extractions_brutes.ocr_text` becomes nullable: empty for rows stored by reference,
+      kept as is for existing rows
+
+  3. Security
+    - RLS enabled, read access for authenticated users
+    - Writes are done by the extraction service (service role)
+*/
+
+CREATE TABLE IF NOT EXISTS ocr_blobs (
+  hash text PRIMARY KEY,
+  codec text NOT NULL CHECK (codec IN ('zstd', 'zlib')),
+  text_data bytea NOT NULL,
+  boxes_data bytea,
+  raw_size int,
+  stored_size int,
+  created_at timestamptz DEFAULT now()
+);
+
+ALTER TABLE extractions_brutes ALTER COLUMN ocr_text DROP NOT NULL;
+ALTER TABLE extractions_brutes ADD COLUMN IF NOT EXISTS ocr_blob_hash text REFERENCES ocr_blobs(hash);
+
+CREATE INDEX IF NOT EXISTS idx_extractions_brutes_ocr_blob
+  ON extractions_brutes(ocr_blob_hash);
+
+ALTER TABLE ocr_blobs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Authenticated users can view OCR blobs"
+  ON ocr_blobs FOR SELECT
+  TO authenticated
+  USING (true);
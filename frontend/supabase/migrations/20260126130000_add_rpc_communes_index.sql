@@ -0,0 +1,50 @@
+/*
+  # Export des communes pour l'index spatial du backend
+
+  1. Nouvelle Fonction
+    - `rpc_communes_index(p_tolerance, p_offset, p_limit)` : attributs des communes et géométrie
+      simplifiée (ST_SimplifyPreserveTopology, GeoJSON à 6 décimales), triées par codgeo
+      - chargée une fois par le backend (`utils/commune_index.py`) qui répond ensuite aux
+        recherches point-dans-commune et par rayon sans PostGIS
+      - pagination par p_offset / p_limit (PostgREST limite le nombre de lignes par réponse)
+
+  2. Sécurité
+    - SECURITY DEFINER, search_path fixé (public, pg_temp)
+    - exécutable par service_role uniquement : anon et authenticated ne peuvent pas exporter
+      toutes les géométries via PostgREST
+*/
+
+CREATE OR REPLACE FUNCTION rpc_communes_index(
+  p_tolerance double precision DEFAULT 0.0001,
+  p_offset integer DEFAULT 0,
+  p_limit integer DEFAULT NULL
+)
+RETURNS TABLE (
+  codgeo text,
+  nom_commune text,
+  dens7 integer,
+  libdens7 text,
+  code_epci text,
+  geometrie json
+)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+  SELECT
+    c.codgeo::text,
+    c.nom_commune::text,
+    c.dens7::integer,
+    c.libdens7::text,
+    c.code_epci::text,
+    ST_AsGeoJSON(ST_SimplifyPreserveTopology(c.geomgeo, p_tolerance), 6)::json
+  FROM communes c
+  WHERE c.geomgeo IS NOT NULL
+  ORDER BY c.codgeo
+  OFFSET p_offset
+  LIMIT p_limit;
+$$;
+
+REVOKE EXECUTE ON FUNCTION rpc_communes_index(double precision, integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rpc_communes_index(double precision, integer, integer) TO service_role;
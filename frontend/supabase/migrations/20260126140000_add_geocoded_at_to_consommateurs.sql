@@ -0,0 +1,50 @@
+/*
+  # Horodatage des géocodages des consommateurs
+
+  1. Changes
+    - Add `geocoded_at` column (timestamptz) to consommateurs
+    - Trigger `trg_consommateurs_geocoded_at` : mis à now() à chaque changement de
+      latitude, longitude ou geocode_status, quel que soit l'écrivain (backend, frontend, imports)
+    - Index (geocoded_at, id) pour la lecture incrémentale
+
+  2. Purpose
+    - L'index en mémoire des consommateurs du backend (`utils/consumer_index.py`) ne relit que
+      les lignes géocodées après son dernier filigrane (geocoded_at, id)
+
+  3. Notes
+    - Les lignes déjà géocodées gardent geocoded_at NULL : elles sont lues au chargement complet
+*/
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'consommateurs' AND column_name = 'geocoded_at'
+  ) THEN
+    ALTER TABLE consommateurs ADD COLUMN geocoded_at timestamptz;
+  END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION set_consommateurs_geocoded_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT'
+     OR NEW.latitude IS DISTINCT FROM OLD.latitude
+     OR NEW.longitude IS DISTINCT FROM OLD.longitude
+     OR NEW.geocode_status IS DISTINCT FROM OLD.geocode_status THEN
+    NEW.geocoded_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_consommateurs_geocoded_at ON consommateurs;
+CREATE TRIGGER trg_consommateurs_geocoded_at
+  BEFORE INSERT OR UPDATE OF latitude, longitude, geocode_status ON consommateurs
+  FOR EACH ROW
+  EXECUTE FUNCTION set_consommateurs_geocoded_at();
+
+CREATE INDEX IF NOT EXISTS idx_consommateurs_geocoded_at ON consommateurs(geocoded_at, id)
+  WHERE geocoded_at IS NOT NULL;
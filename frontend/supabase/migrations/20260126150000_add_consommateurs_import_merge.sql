@@ -0,0 +1,128 @@
+/*
+  # Import en masse des consommateurs Enedis
+
+  1. Nouvelles Fonctions
+    - `prepare_consommateurs_import()` : crée la table temporaire `consommateurs_import`
+      (ON COMMIT DROP) remplie par COPY depuis le backend (`utils/enedis_ingest.py`)
+    - `merge_consommateurs_import()` : fusion ensembliste de la table temporaire dans consommateurs
+      - dédoublonnage sur (adresse, code_commune, annee), dans l'import comme avec l'existant
+      - lignes existantes de source 'api' mises à jour si la consommation a changé,
+        lignes 'manual' jamais modifiées
+      - renvoie les lignes insérées ou mises à jour (id, adresse, code_commune, action) :
+        les insertions partent au géocodage
+    - `rpc_merge_consommateurs(p_rows jsonb)` : même fusion par lots, pour le backend sans
+      accès Postgres direct (PostgREST)
+
+  2. Index
+    - (code_commune, annee, adresse) pour la jointure de fusion
+
+  3. Sécurité
+    - rpc_merge_consommateurs en SECURITY DEFINER, search_path fixé
+    - Exécution réservée à service_role (clé du backend) : retirée à PUBLIC, anon et authenticated
+*/
+
+CREATE INDEX IF NOT EXISTS idx_consommateurs_adresse_commune_annee
+  ON consommateurs(code_commune, annee, adresse);
+
+CREATE OR REPLACE FUNCTION prepare_consommateurs_import()
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  CREATE TEMP TABLE IF NOT EXISTS consommateurs_import (
+    adresse text NOT NULL DEFAULT '',
+    code_commune text NOT NULL,
+    nom_commune text,
+    nombre_sites integer,
+    consommation_annuelle_mwh numeric,
+    tranche_conso text,
+    categorie_activite text,
+    annee integer NOT NULL,
+    code_grand_secteur text,
+    code_secteur_naf2 text,
+    code_categorie_consommation text,
+    code_departement text,
+    code_region text,
+    code_epci text,
+    code_iris text,
+    nom_iris text,
+    numero_voie text,
+    indice_repetition text,
+    type_voie text,
+    libelle_voie text,
+    tri_adresses text
+  ) ON COMMIT DROP;
+  TRUNCATE consommateurs_import;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION merge_consommateurs_import()
+RETURNS TABLE (id bigint, adresse text, code_commune text, action text)
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  RETURN QUERY
+  WITH source AS (
+    SELECT DISTINCT ON (i.code_commune, i.annee, i.adresse) i.*
+    FROM consommateurs_import i
+    ORDER BY i.code_commune, i.annee, i.adresse, i.consommation_annuelle_mwh DESC NULLS LAST
+  ),
+  updated AS (
+    UPDATE consommateurs c
+    SET nombre_sites = s.nombre_sites,
+        consommation_annuelle_mwh = s.consommation_annuelle_mwh,
+        tranche_conso = s.tranche_conso,
+        categorie_activite = s.categorie_activite,
+        code_grand_secteur = s.code_grand_secteur,
+        code_secteur_naf2 = s.code_secteur_naf2,
+        code_categorie_consommation = s.code_categorie_consommation
+    FROM source s
+    WHERE c.code_commune = s.code_commune
+      AND c.annee = s.annee
+      AND c.adresse = s.adresse
+      AND c.source = 'api'
+      AND (c.nombre_sites, c.consommation_annuelle_mwh, c.categorie_activite)
+          IS DISTINCT FROM (s.nombre_sites, s.consommation_annuelle_mwh, s.categorie_activite)
+    RETURNING c.id, c.adresse, c.code_commune
+  ),
+  inserted AS (
+    INSERT INTO consommateurs (
+      adresse, code_commune, nom_commune, nombre_sites, consommation_annuelle_mwh, tranche_conso,
+      categorie_activite, annee, code_grand_secteur, code_secteur_naf2, code_categorie_consommation,
+      code_departement, code_region, code_epci, code_iris, nom_iris, numero_voie, indice_repetition,
+      type_voie, libelle_voie, tri_adresses, source
+    )
+    SELECT
+      s.adresse, s.code_commune, s.nom_commune, s.nombre_sites, s.consommation_annuelle_mwh, s.tranche_conso,
+      s.categorie_activite, s.annee, s.code_grand_secteur, s.code_secteur_naf2, s.code_categorie_consommation,
+      s.code_departement, s.code_region, s.code_epci, s.code_iris, s.nom_iris, s.numero_voie, s.indice_repetition,
+      s.type_voie, s.libelle_voie, s.tri_adresses, 'api'
+    FROM source s
+    WHERE NOT EXISTS (
+      SELECT 1 FROM consommateurs c
+      WHERE c.code_commune = s.code_commune AND c.annee = s.annee AND c.adresse = s.adresse
+    )
+    RETURNING consommateurs.id, consommateurs.adresse, consommateurs.code_commune
+  )
+  SELECT ins.id::bigint, ins.adresse::text, ins.code_commune::text, 'insert'::text FROM inserted ins
+  UNION ALL
+  SELECT upd.id::bigint, upd.adresse::text, upd.code_commune::text, 'update'::text FROM updated upd;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION rpc_merge_consommateurs(p_rows jsonb)
+RETURNS TABLE (id bigint, adresse text, code_commune text, action text)
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+BEGIN
+  PERFORM prepare_consommateurs_import();
+  INSERT INTO consommateurs_import
+  SELECT * FROM jsonb_populate_recordset(NULL::consommateurs_import, p_rows);
+  RETURN QUERY SELECT * FROM merge_consommateurs_import();
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION rpc_merge_consommateurs(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rpc_merge_consommateurs(jsonb) TO service_role;
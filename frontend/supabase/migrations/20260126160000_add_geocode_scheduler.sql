@@ -0,0 +1,189 @@
+/*
+  # Re-géocodage incrémental des consommateurs
+
+  1. Changes
+    - `consommateurs.address_updated_at` (timestamptz) : mis à now() par trigger quand adresse ou
+      code_commune change ; le compteur d'essais est alors remis à zéro
+    - `consommateurs.geocode_attempts` (integer) / `geocode_next_attempt_at` (timestamptz) :
+      essais en échec consécutifs et date du prochain essai (attente exponentielle)
+    - Index partiels sur chaque catégorie de lignes à géocoder
+    - `set_consommateurs_geocoded_at()` : geocoded_at avance aussi quand l'écrivain le fixe
+      explicitement (nouveau géocodage aux mêmes coordonnées)
+
+  2. Nouvelles Fonctions
+    - `rpc_consommateurs_a_geocoder(p_limit, p_max_attempts)` : lignes à (re)géocoder, par motif
+      - 'nouveau' : jamais géocodées (geocode_status NULL)
+      - 'adresse_modifiee' : adresse modifiée après le dernier géocodage
+        (address_updated_at > geocoded_at), hors corrections manuelles
+      - 'nouvel_essai' : TO_VALIDATE / ERROR / failed dont l'attente est écoulée
+    - `rpc_mark_geocode_failures(p_rows, p_base_seconds, p_max_seconds)` : enregistre les échecs
+      et repousse le prochain essai (p_base_seconds * 2^essais, plafonné à p_max_seconds)
+
+  3. New Tables
+    - `geocode_runs` : une ligne par passage du planificateur (lignes sélectionnées par motif,
+      résultats, débit, taux de succès)
+
+  4. Security
+    - RLS enabled on geocode_runs, read access for authenticated users
+    - Writes are done by the backend (service role)
+    - rpc_consommateurs_a_geocoder / rpc_mark_geocode_failures (SECURITY DEFINER) executable
+      by service_role only
+*/
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'consommateurs' AND column_name = 'address_updated_at'
+  ) THEN
+    ALTER TABLE consommateurs ADD COLUMN address_updated_at timestamptz;
+  END IF;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'consommateurs' AND column_name = 'geocode_attempts'
+  ) THEN
+    ALTER TABLE consommateurs ADD COLUMN geocode_attempts integer NOT NULL DEFAULT 0;
+  END IF;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'consommateurs' AND column_name = 'geocode_next_attempt_at'
+  ) THEN
+    ALTER TABLE consommateurs ADD COLUMN geocode_next_attempt_at timestamptz;
+  END IF;
+END $$;
+
+CREATE OR REPLACE FUNCTION set_consommateurs_address_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.adresse IS DISTINCT FROM OLD.adresse OR NEW.code_commune IS DISTINCT FROM OLD.code_commune THEN
+    NEW.address_updated_at := now();
+    NEW.geocode_attempts := 0;
+    NEW.geocode_next_attempt_at := NULL;
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_consommateurs_address_updated_at ON consommateurs;
+CREATE TRIGGER trg_consommateurs_address_updated_at
+  BEFORE UPDATE OF adresse, code_commune ON consommateurs
+  FOR EACH ROW
+  EXECUTE FUNCTION set_consommateurs_address_updated_at();
+
+-- Un géocodage qui retrouve les mêmes coordonnées doit aussi avancer geocoded_at (sinon une
+-- adresse modifiée resterait « à géocoder ») : l'écrivain le demande en fixant geocoded_at,
+-- la valeur retenue est toujours l'horloge de la base
+CREATE OR REPLACE FUNCTION set_consommateurs_geocoded_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT'
+     OR NEW.latitude IS DISTINCT FROM OLD.latitude
+     OR NEW.longitude IS DISTINCT FROM OLD.longitude
+     OR NEW.geocode_status IS DISTINCT FROM OLD.geocode_status
+     OR NEW.geocoded_at IS DISTINCT FROM OLD.geocoded_at THEN
+    NEW.geocoded_at := now();
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_consommateurs_geocode_nouveau
+  ON consommateurs(id) WHERE geocode_status IS NULL;
+CREATE INDEX IF NOT EXISTS idx_consommateurs_geocode_adresse_modifiee
+  ON consommateurs(address_updated_at)
+  WHERE address_updated_at > coalesce(geocoded_at, '-infinity'::timestamptz) AND source <> 'manual';
+CREATE INDEX IF NOT EXISTS idx_consommateurs_geocode_nouvel_essai
+  ON consommateurs(geocode_next_attempt_at)
+  WHERE geocode_status IN ('TO_VALIDATE', 'ERROR', 'failed');
+
+CREATE OR REPLACE FUNCTION rpc_consommateurs_a_geocoder(
+  p_limit integer DEFAULT 500,
+  p_max_attempts integer DEFAULT 5
+)
+RETURNS TABLE (id bigint, adresse text, code_commune text, nom_commune text, motif text)
+LANGUAGE sql
+STABLE
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+  SELECT * FROM (
+    (SELECT c.id::bigint, c.adresse::text, c.code_commune::text, c.nom_commune::text, 'nouveau'::text
+     FROM consommateurs c
+     WHERE c.geocode_status IS NULL
+     ORDER BY c.id
+     LIMIT p_limit)
+    UNION ALL
+    (SELECT c.id::bigint, c.adresse::text, c.code_commune::text, c.nom_commune::text, 'adresse_modifiee'::text
+     FROM consommateurs c
+     WHERE c.address_updated_at > coalesce(c.geocoded_at, '-infinity'::timestamptz)
+       AND c.source <> 'manual'
+       AND c.geocode_status NOT IN ('TO_VALIDATE', 'ERROR', 'failed')
+     ORDER BY c.address_updated_at
+     LIMIT p_limit)
+    UNION ALL
+    (SELECT c.id::bigint, c.adresse::text, c.code_commune::text, c.nom_commune::text, 'nouvel_essai'::text
+     FROM consommateurs c
+     WHERE c.geocode_status IN ('TO_VALIDATE', 'ERROR', 'failed')
+       AND c.geocode_attempts < p_max_attempts
+       AND coalesce(c.geocode_next_attempt_at, '-infinity'::timestamptz) <= now()
+     ORDER BY c.geocode_next_attempt_at NULLS FIRST
+     LIMIT p_limit)
+  ) dirty
+  LIMIT p_limit;
+$$;
+
+CREATE OR REPLACE FUNCTION rpc_mark_geocode_failures(
+  p_rows jsonb,
+  p_base_seconds integer DEFAULT 3600,
+  p_max_seconds integer DEFAULT 604800
+)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+  UPDATE consommateurs c
+  SET geocode_status = r.geocode_status,
+      geocode_attempts = c.geocode_attempts + 1,
+      geocode_next_attempt_at = now() + make_interval(
+        secs => least(p_max_seconds::double precision, p_base_seconds * power(2, least(c.geocode_attempts, 30)))
+      )
+  FROM jsonb_to_recordset(p_rows) AS r(id bigint, geocode_status text)
+  WHERE c.id = r.id;
+$$;
+
+REVOKE EXECUTE ON FUNCTION rpc_consommateurs_a_geocoder(integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rpc_consommateurs_a_geocoder(integer, integer) TO service_role;
+REVOKE EXECUTE ON FUNCTION rpc_mark_geocode_failures(jsonb, integer, integer) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rpc_mark_geocode_failures(jsonb, integer, integer) TO service_role;
+
+CREATE TABLE IF NOT EXISTS geocode_runs (
+  id bigserial PRIMARY KEY,
+  declencheur text NOT NULL,
+  started_at timestamptz NOT NULL,
+  finished_at timestamptz,
+  selectionnes integer NOT NULL DEFAULT 0,
+  par_motif jsonb NOT NULL DEFAULT '{}'::jsonb,
+  geocodes integer NOT NULL DEFAULT 0,
+  a_valider integer NOT NULL DEFAULT 0,
+  erreurs integer NOT NULL DEFAULT 0,
+  duree_secondes numeric,
+  lignes_par_seconde numeric,
+  taux_succes numeric,
+  erreur text
+);
+
+CREATE INDEX IF NOT EXISTS idx_geocode_runs_started_at ON geocode_runs(started_at DESC);
+
+ALTER TABLE geocode_runs ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Authenticated users can view geocode runs"
+  ON geocode_runs FOR SELECT
+  TO authenticated
+  USING (true);
@@ -0,0 +1,50 @@
+/*
+  # Duplicate invoice detection
+
+  1. Changes
+    - `factures.doublon_de` - invoice already extracted that this upload duplicates
+      (same file, or same PDL, billing period and supplier); its extraction is reused
+    - `factures.doublons_potentiels` - near-duplicates flagged for linking
+      ([{facture_id, motif}], motif: meme_periode (original not extracted yet), periode_chevauchante,
+      fournisseur_different, image_similaire)
+    - `factures.fichier_phash` - perceptual hash (dHash 64 bits, hex) of uploaded images
+
+  2. Indexes
+    - `(pdl, periode_debut, periode_fin)` and `date_upload` for warming the extraction
+      service's in-memory index with recent invoices
+*/
+
+DO $$
+BEGIN
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'factures' AND column_name = 'doublon_de'
+  ) THEN
+    ALTER TABLE factures ADD COLUMN doublon_de uuid REFERENCES factures(id) ON DELETE SET NULL;
+  END IF;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'factures' AND column_name = 'doublons_potentiels'
+  ) THEN
+    ALTER TABLE factures ADD COLUMN doublons_potentiels jsonb;
+  END IF;
+
+  IF NOT EXISTS (
+    SELECT 1 FROM information_schema.columns
+    WHERE table_name = 'factures' AND column_name = 'fichier_phash'
+  ) THEN
+    ALTER TABLE factures ADD COLUMN fichier_phash text;
+  END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_factures_pdl_periode
+  ON factures(pdl, periode_debut, periode_fin)
+  WHERE pdl IS NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_factures_date_upload
+  ON factures(date_upload);
+
+CREATE INDEX IF NOT EXISTS idx_factures_doublon_de
+  ON factures(doublon_de)
+  WHERE doublon_de IS NOT NULL;
@@ -0,0 +1,214 @@
+/*
+  # Agrégats de consommation précalculés
+
+  1. New Tables
+    - `consommateurs_stats` : une ligne par (code_commune, annee, tranche_conso, categorie_activite)
+      - nb_consommateurs, nb_sites, conso_totale_mwh : tous les consommateurs
+      - nb_consommateurs_geocodes, nb_sites_geocodes, conso_geocodee_mwh : géocodés seulement
+        (geocode_status 'success' ou 'OK', ceux affichés sur la carte)
+      - code_epci, code_departement : rattachement de la commune, pour les niveaux EPCI et département
+      - updated_at : lu par le backend pour ne recharger que les agrégats modifiés depuis son
+        dernier passage ; une clé vidée reste avec des zéros pour que ce passage la voie
+
+  2. Maintenance
+    - Triggers par instruction (tables de transition) sur consommateurs : chaque INSERT / UPDATE /
+      DELETE ajoute ses écarts par clé en un seul upsert, y compris les imports en masse
+    - `rebuild_consommateurs_stats()` : recalcul complet (après un chargement triggers désactivés)
+
+  3. Security
+    - RLS enabled on consommateurs_stats, read access for authenticated users; no write policy,
+      so API roles (anon, authenticated) cannot write the table directly
+    - The table is written by SECURITY DEFINER functions: the triggers, and
+      apply_consommateurs_stats_delta / rebuild_consommateurs_stats, whose EXECUTE is revoked
+      from PUBLIC, anon and authenticated (service_role and the table owner keep it)
+*/
+
+CREATE TABLE IF NOT EXISTS consommateurs_stats (
+  code_commune text NOT NULL,
+  annee integer NOT NULL,
+  tranche_conso text NOT NULL DEFAULT '',
+  categorie_activite text NOT NULL DEFAULT '',
+  code_epci text,
+  code_departement text,
+  nb_consommateurs bigint NOT NULL DEFAULT 0,
+  nb_sites bigint NOT NULL DEFAULT 0,
+  conso_totale_mwh numeric NOT NULL DEFAULT 0,
+  nb_consommateurs_geocodes bigint NOT NULL DEFAULT 0,
+  nb_sites_geocodes bigint NOT NULL DEFAULT 0,
+  conso_geocodee_mwh numeric NOT NULL DEFAULT 0,
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (code_commune, annee, tranche_conso, categorie_activite)
+);
+
+CREATE INDEX IF NOT EXISTS idx_consommateurs_stats_updated_at
+  ON consommateurs_stats(updated_at);
+
+ALTER TABLE consommateurs_stats ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Authenticated users can view consumer stats"
+  ON consommateurs_stats FOR SELECT
+  TO authenticated
+  USING (true);
+
+-- Écarts signés d'un ensemble de lignes (+1 pour les nouvelles, -1 pour les anciennes), par clé
+CREATE OR REPLACE FUNCTION apply_consommateurs_stats_delta(p_rows jsonb)
+RETURNS void
+LANGUAGE sql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+  INSERT INTO consommateurs_stats AS s (
+    code_commune, annee, tranche_conso, categorie_activite, code_epci, code_departement,
+    nb_consommateurs, nb_sites, conso_totale_mwh,
+    nb_consommateurs_geocodes, nb_sites_geocodes, conso_geocodee_mwh
+  )
+  SELECT
+    d.code_commune, d.annee, coalesce(d.tranche_conso, ''), coalesce(d.categorie_activite, ''),
+    max(d.code_epci), max(d.code_departement),
+    sum(d.signe),
+    sum(d.signe * coalesce(d.nombre_sites, 0)),
+    sum(d.signe * coalesce(d.consommation_annuelle_mwh, 0)),
+    coalesce(sum(d.signe) FILTER (WHERE d.geocode_status IN ('success', 'OK')), 0),
+    coalesce(sum(d.signe * coalesce(d.nombre_sites, 0)) FILTER (WHERE d.geocode_status IN ('success', 'OK')), 0),
+    coalesce(sum(d.signe * coalesce(d.consommation_annuelle_mwh, 0)) FILTER (WHERE d.geocode_status IN ('success', 'OK')), 0)
+  FROM jsonb_to_recordset(p_rows) AS d(
+    signe integer, code_commune text, annee integer, tranche_conso text, categorie_activite text,
+    code_epci text, code_departement text, nombre_sites bigint, consommation_annuelle_mwh numeric,
+    geocode_status text
+  )
+  WHERE d.code_commune IS NOT NULL AND d.annee IS NOT NULL
+  GROUP BY d.code_commune, d.annee, coalesce(d.tranche_conso, ''), coalesce(d.categorie_activite, '')
+  ON CONFLICT (code_commune, annee, tranche_conso, categorie_activite) DO UPDATE SET
+    code_epci = coalesce(EXCLUDED.code_epci, s.code_epci),
+    code_departement = coalesce(EXCLUDED.code_departement, s.code_departement),
+    nb_consommateurs = s.nb_consommateurs + EXCLUDED.nb_consommateurs,
+    nb_sites = s.nb_sites + EXCLUDED.nb_sites,
+    conso_totale_mwh = s.conso_totale_mwh + EXCLUDED.conso_totale_mwh,
+    nb_consommateurs_geocodes = s.nb_consommateurs_geocodes + EXCLUDED.nb_consommateurs_geocodes,
+    nb_sites_geocodes = s.nb_sites_geocodes + EXCLUDED.nb_sites_geocodes,
+    conso_geocodee_mwh = s.conso_geocodee_mwh + EXCLUDED.conso_geocodee_mwh,
+    updated_at = now();
+$$;
+
+REVOKE EXECUTE ON FUNCTION apply_consommateurs_stats_delta(jsonb) FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION apply_consommateurs_stats_delta(jsonb) TO service_role;
+
+CREATE OR REPLACE FUNCTION sync_consommateurs_stats()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+  v_rows jsonb;
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    SELECT jsonb_agg(to_jsonb(n) || '{"signe": 1}') INTO v_rows FROM new_rows n;
+  ELSIF TG_OP = 'DELETE' THEN
+    SELECT jsonb_agg(to_jsonb(o) || '{"signe": -1}') INTO v_rows FROM old_rows o;
+  ELSE
+    -- Seules les lignes dont un champ agrégé a changé (un géocodage ne change souvent que lat/lon)
+    SELECT jsonb_agg(r) INTO v_rows FROM (
+      SELECT to_jsonb(o) || '{"signe": -1}' AS r
+      FROM old_rows o JOIN new_rows n ON n.id = o.id
+      WHERE (o.code_commune, o.annee, o.tranche_conso, o.categorie_activite, o.nombre_sites,
+             o.consommation_annuelle_mwh, o.geocode_status IN ('success', 'OK'))
+        IS DISTINCT FROM
+            (n.code_commune, n.annee, n.tranche_conso, n.categorie_activite, n.nombre_sites,
+             n.consommation_annuelle_mwh, n.geocode_status IN ('success', 'OK'))
+      UNION ALL
+      SELECT to_jsonb(n) || '{"signe": 1}'
+      FROM old_rows o JOIN new_rows n ON n.id = o.id
+      WHERE (o.code_commune, o.annee, o.tranche_conso, o.categorie_activite, o.nombre_sites,
+             o.consommation_annuelle_mwh, o.geocode_status IN ('success', 'OK'))
+        IS DISTINCT FROM
+            (n.code_commune, n.annee, n.tranche_conso, n.categorie_activite, n.nombre_sites,
+             n.consommation_annuelle_mwh, n.geocode_status IN ('success', 'OK'))
+    ) changes;
+  END IF;
+
+  IF v_rows IS NOT NULL THEN
+    PERFORM apply_consommateurs_stats_delta(v_rows);
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_consommateurs_stats_insert ON consommateurs;
+CREATE TRIGGER trg_consommateurs_stats_insert
+  AFTER INSERT ON consommateurs
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION sync_consommateurs_stats();
+
+DROP TRIGGER IF EXISTS trg_consommateurs_stats_update ON consommateurs;
+CREATE TRIGGER trg_consommateurs_stats_update
+  AFTER UPDATE ON consommateurs
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION sync_consommateurs_stats();
+
+DROP TRIGGER IF EXISTS trg_consommateurs_stats_delete ON consommateurs;
+CREATE TRIGGER trg_consommateurs_stats_delete
+  AFTER DELETE ON consommateurs
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION sync_consommateurs_stats();
+
+-- Recalcul complet ; les clés disparues restent à zéro (updated_at avancé) pour que
+-- le rafraîchissement incrémental du backend les voie
+CREATE OR REPLACE FUNCTION rebuild_consommateurs_stats()
+RETURNS bigint
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp
+AS $$
+DECLARE
+  v_count bigint;
+BEGIN
+  LOCK TABLE consommateurs_stats IN EXCLUSIVE MODE;
+
+  UPDATE consommateurs_stats
+  SET nb_consommateurs = 0, nb_sites = 0, conso_totale_mwh = 0,
+      nb_consommateurs_geocodes = 0, nb_sites_geocodes = 0, conso_geocodee_mwh = 0,
+      updated_at = now()
+  WHERE nb_consommateurs <> 0;
+
+  INSERT INTO consommateurs_stats AS s (
+    code_commune, annee, tranche_conso, categorie_activite, code_epci, code_departement,
+    nb_consommateurs, nb_sites, conso_totale_mwh,
+    nb_consommateurs_geocodes, nb_sites_geocodes, conso_geocodee_mwh
+  )
+  SELECT
+    c.code_commune, c.annee, coalesce(c.tranche_conso, ''), coalesce(c.categorie_activite, ''),
+    max(c.code_epci), max(c.code_departement),
+    count(*),
+    coalesce(sum(c.nombre_sites), 0),
+    coalesce(sum(c.consommation_annuelle_mwh), 0),
+    count(*) FILTER (WHERE c.geocode_status IN ('success', 'OK')),
+    coalesce(sum(c.nombre_sites) FILTER (WHERE c.geocode_status IN ('success', 'OK')), 0),
+    coalesce(sum(c.consommation_annuelle_mwh) FILTER (WHERE c.geocode_status IN ('success', 'OK')), 0)
+  FROM consommateurs c
+  WHERE c.code_commune IS NOT NULL AND c.annee IS NOT NULL
+  GROUP BY c.code_commune, c.annee, coalesce(c.tranche_conso, ''), coalesce(c.categorie_activite, '')
+  ON CONFLICT (code_commune, annee, tranche_conso, categorie_activite) DO UPDATE SET
+    code_epci = EXCLUDED.code_epci,
+    code_departement = EXCLUDED.code_departement,
+    nb_consommateurs = EXCLUDED.nb_consommateurs,
+    nb_sites = EXCLUDED.nb_sites,
+    conso_totale_mwh = EXCLUDED.conso_totale_mwh,
+    nb_consommateurs_geocodes = EXCLUDED.nb_consommateurs_geocodes,
+    nb_sites_geocodes = EXCLUDED.nb_sites_geocodes,
+    conso_geocodee_mwh = EXCLUDED.conso_geocodee_mwh,
+    updated_at = now();
+
+  GET DIAGNOSTICS v_count = ROW_COUNT;
+  RETURN v_count;
+END;
+$$;
+
+REVOKE EXECUTE ON FUNCTION rebuild_consommateurs_stats() FROM PUBLIC, anon, authenticated;
+GRANT EXECUTE ON FUNCTION rebuild_consommateurs_stats() TO service_role;
+
+-- Remplissage initial
+SELECT rebuild_consommateurs_stats();